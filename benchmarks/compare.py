@@ -0,0 +1,57 @@
+"""Compares two benchmark result files written with `--output`, usually from two commits, and prints how each
+operation's throughput and latency changed. Operations only in one of the files are skipped.
+
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any
+
+METRICS = ("ops_per_second", "p50_us", "p99_us")
+"""The result fields to compare"""
+
+
+def load(path: Path) -> dict[str, Any]:
+    """Loads a result file, refusing files that aren't benchmark results"""
+    document = json.loads(path.read_text())
+    if "results" not in document:
+        raise SystemExit(f"{path} is not a benchmark result file")
+    return document
+
+
+def change(before: float, after: float) -> str:
+    """Formats the change between two values as a percentage"""
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before:+.1%}"
+
+
+def compare(before: dict[str, Any], after: dict[str, Any]) -> None:
+    """Prints the change in each metric for every operation in both result files"""
+    for label, document in (("before", before), ("after", after)):
+        environment = document["environment"]
+        dirty = " (dirty)" if environment["dirty"] else ""
+        print(f"{label}: {document['suite']} at {environment['commit']}{dirty}, {environment['timestamp']}")
+    if before["parameters"] != after["parameters"]:
+        print("warning: the benchmarks were run with different parameters")
+
+    after_results = {result["name"]: result for result in after["results"]}
+    print(f"\n{'operation':<32}" + "".join(f"{metric:>28}" for metric in METRICS))
+    for result in before["results"]:
+        other = after_results.get(result["name"])
+        if other is None:
+            continue
+        cells = (
+            f"{result[metric]:.0f} -> {other[metric]:.0f} {change(result[metric], other[metric])}" for metric in METRICS
+        )
+        print(f"{result['name']:<32}" + "".join(f"{cell:>28}" for cell in cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", type=Path, help="The results to compare against")
+    parser.add_argument("after", type=Path, help="The results to compare")
+    args = parser.parse_args()
+    compare(load(args.before), load(args.after))
@@ -0,0 +1,79 @@
+"""Measures the overhead the request and query instrumentation adds, in microseconds.
+
+Requests are sent straight to the ASGI middleware around an app that returns a redirect, and the query hooks are
+called directly, so neither is measured against network or database noise. Set `PROMETHEUS_MULTIPROC_DIR` to an
+empty directory to measure the overhead of the multiprocess mode used under gunicorn.
+
+    python -m benchmarks.instrumentation_overhead --requests 100000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Any
+
+from starlette.types import Message, Receive, Scope, Send
+
+from core import instrumentation
+from core.instrumentation import RequestMetricsMiddleware
+
+
+async def redirect_app(scope: Scope, receive: Receive, send: Send) -> None:
+    """A minimal ASGI app that redirects every request"""
+    await send({"type": "http.response.start", "status": 307, "headers": [(b"location", b"https://example.com")]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def receive() -> Message:
+    """Receives an empty request body"""
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message: Message) -> None:
+    """Discards the response"""
+
+
+async def time_requests(app: Any, requests: int) -> float:
+    """Returns the average time in microseconds the app takes to handle a request"""
+    scope = {"type": "http", "method": "GET", "path": "/benchmark", "route": SimpleNamespace(name="Access Shortlink")}
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+def time_query_hooks(queries: int) -> float:
+    """Returns the average time in microseconds the query hooks take for each query"""
+    conn: Any = SimpleNamespace(info={})
+    statement = "SELECT shortlink.id, shortlink.long_url FROM shortlink WHERE shortlink.id = %(shortlink_id)s"
+    start = time.perf_counter()
+    for _ in range(queries):
+        instrumentation._before_cursor_execute(conn, None, statement, None, None, False)  # pyright: ignore[reportPrivateUsage]
+        instrumentation._after_cursor_execute(conn, None, statement, None, None, False)  # pyright: ignore[reportPrivateUsage]
+    return (time.perf_counter() - start) / queries * 1_000_000
+
+
+async def run(requests: int, rounds: int) -> None:
+    """Alternates rounds with and without the request middleware, then times the query hooks, and reports them"""
+    instrumented = RequestMetricsMiddleware(redirect_app)
+    plain: list[float] = []
+    measured: list[float] = []
+    for _ in range(rounds):
+        plain.append(await time_requests(redirect_app, requests // rounds))
+        measured.append(await time_requests(instrumented, requests // rounds))
+    overhead = statistics.median(measured) - statistics.median(plain)
+    query_overhead = statistics.median(time_query_hooks(requests // rounds) for _ in range(rounds))
+
+    print(f"{'instrumentation':<20}{'us':>8}")
+    print(f"{'request middleware':<20}{overhead:>8.2f}")
+    print(f"{'query hooks':<20}{query_overhead:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100_000, help="How many requests and queries to time")
+    parser.add_argument("--rounds", type=int, default=10, help="How many times to alternate between the modes")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.rounds))
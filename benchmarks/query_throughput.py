@@ -0,0 +1,115 @@
+"""Measures how many of each hot query a single worker can run per second, with and without prepared statements.
+
+Each query runs back to back on one session against the database configured by `DATABASE_URL`, which must already
+be migrated. Prepared statements are disabled for the first run and use `DB_PREPARE_THRESHOLD` for the second.
+
+    python -m benchmarks.query_throughput --seconds 2
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlmodel import col, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import get_settings
+from core.db import create_engine
+from shortlinks.cache import get_slug_cache
+from shortlinks.models import Shortlink
+from shortlinks.service import ShortlinkService
+from stats.models import ShortlinkStat, ShortlinkVisitBucket
+from stats.service import StatMetric, StatsService, VisitCount
+
+
+def hot_queries(shortlinks: list[Shortlink]) -> dict[str, Callable[[AsyncSession], Awaitable[object]]]:
+    """Returns each hot query as a function of the session to run it with"""
+    slug_cache = get_slug_cache()
+
+    async def from_slug(session: AsyncSession) -> object:
+        slug_cache.clear()
+        return await ShortlinkService.from_slug(random.choice(shortlinks).slug, session)
+
+    async def get_by_ids(session: AsyncSession) -> object:
+        ids = [shortlink.id for shortlink in random.sample(shortlinks, random.randint(1, 50))]
+        return await ShortlinkService.get_by_ids(ids, session)
+
+    async def get_top_stats(session: AsyncSession) -> object:
+        return await StatsService.get_top_stats(StatMetric.VISITS, 100, session)
+
+    async def get_stats_for_slug(session: AsyncSession) -> object:
+        return await StatsService.get_stats_for_slug(random.choice(shortlinks).slug, session)
+
+    async def record_visit(session: AsyncSession) -> object:
+        return await StatsService.record_visit(random.choice(shortlinks).id, datetime.now(UTC), session)
+
+    return {
+        "from_slug": from_slug,
+        "get_by_ids": get_by_ids,
+        "get_top_stats": get_top_stats,
+        "get_stats_for_slug": get_stats_for_slug,
+        "record_visit": record_visit,
+    }
+
+
+async def measure(query: Callable[[AsyncSession], Awaitable[object]], session: AsyncSession, seconds: float) -> float:
+    """Runs a query back to back for a number of seconds and returns how many ran per second"""
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        await query(session)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+async def run(count: int, seconds: float) -> None:
+    """Seeds shortlinks with stats, measures each hot query in both modes, and reports the rates"""
+    settings = get_settings()
+    primary_engine = create_engine(settings)
+    async with AsyncSession(primary_engine, expire_on_commit=False) as session:
+        long_urls = [f"https://www.example.com/benchmark/queries/{i}" for i in range(count)]
+        shortlinks = await ShortlinkService.create_many(long_urls, session)
+        now = datetime.now(UTC)
+        visits = {shortlink.id: VisitCount.single(now, random.getrandbits(64)) for shortlink in shortlinks}
+        await StatsService.record_visits(visits, session)
+
+    queries = hot_queries(shortlinks)
+    rates: dict[str, dict[int, float]] = {name: {} for name in queries}
+    try:
+        for prepare_threshold in (-1, settings.db_prepare_threshold):
+            engine = create_engine(settings.model_copy(update={"db_prepare_threshold": prepare_threshold}))
+            async with async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)() as session:
+                for name, query in queries.items():
+                    # Warm up the connection, and the prepared statement if there will be one
+                    await measure(query, session, seconds / 10)
+                    rates[name][prepare_threshold] = await measure(query, session, seconds)
+            await engine.dispose()
+    finally:
+        async with AsyncSession(primary_engine) as session:
+            shortlink_ids = [shortlink.id for shortlink in shortlinks]
+            for model, column in (
+                (ShortlinkVisitBucket, ShortlinkVisitBucket.shortlink_id),
+                (ShortlinkStat, ShortlinkStat.shortlink_id),
+                (Shortlink, Shortlink.id),
+            ):
+                await super(AsyncSession, session).execute(delete(model).where(col(column).in_(shortlink_ids)))
+            await session.commit()
+        await primary_engine.dispose()
+
+    print(f"{'query':<20}{'unprepared/s':>14}{'prepared/s':>14}{'speedup':>10}")
+    for name, by_threshold in rates.items():
+        unprepared, prepared = by_threshold[-1], by_threshold[settings.db_prepare_threshold]
+        print(f"{name:<20}{unprepared:>14.0f}{prepared:>14.0f}{prepared / unprepared:>9.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000, help="How many shortlinks with stats to query")
+    parser.add_argument("--seconds", type=float, default=2.0, help="How long to run each query for in each mode")
+    args = parser.parse_args()
+    asyncio.run(run(args.count, args.seconds))
@@ -0,0 +1,87 @@
+"""Compares the latency of `GET /{slug}` redirects with the visit event log disabled and enabled.
+
+The app runs in-process against the database configured by `DATABASE_URL`, which must already be migrated.
+Slug lookups are served from the slug cache, so the difference is the cost of queueing each visit event.
+
+    python -m benchmarks.redirect_events --requests 5000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from httpx import ASGITransport, AsyncClient
+from sqlmodel import col, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.api import app
+from core.config import get_settings
+from core.db import engine, get_session_context
+from shortlinks.models import Shortlink
+from stats.buffer import get_visit_buffer
+from stats.events import get_visit_event_ingester
+from stats.models import ShortlinkStat, ShortlinkVisitBucket, VisitEvent
+from stats.partitions import maintain_partitions
+
+
+async def measure(client: AsyncClient, slug: str, requests: int) -> list[float]:
+    """Returns the latency in microseconds of each redirect"""
+    latencies: list[float] = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get(f"/{slug}", headers={"referer": "https://www.example.com/benchmark"})
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+        assert response.status_code == 307
+    return latencies
+
+
+async def run(requests: int, rounds: int) -> None:
+    """Alternates rounds of redirects with visit events disabled and enabled, and reports the latencies"""
+    settings = get_settings()
+    await maintain_partitions()
+    visit_buffer = get_visit_buffer()
+    ingester = get_visit_event_ingester()
+    visit_buffer.start()
+    ingester.start()
+    latencies: dict[bool, list[float]] = {False: [], True: []}
+    shortlink_id = None
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client:
+            response = await client.post("/shorten", json={"long_url": "https://www.example.com/benchmark/events"})
+            slug = response.json()["slug"]
+            shortlink_id = Shortlink.decode_slug(slug)
+            # Warm up the slug cache and connections before measuring
+            await measure(client, slug, 100)
+            for _ in range(rounds):
+                for enabled in (False, True):
+                    settings.visit_events_enabled = enabled
+                    latencies[enabled] += await measure(client, slug, requests // rounds)
+    finally:
+        await ingester.stop()
+        await visit_buffer.stop()
+        async with get_session_context() as session:
+            for model, column in (
+                (VisitEvent, VisitEvent.shortlink_id),
+                (ShortlinkVisitBucket, ShortlinkVisitBucket.shortlink_id),
+                (ShortlinkStat, ShortlinkStat.shortlink_id),
+                (Shortlink, Shortlink.id),
+            ):
+                await super(AsyncSession, session).execute(delete(model).where(col(column) == shortlink_id))
+            await session.commit()
+        await engine.dispose()
+
+    print(f"{'visit events':<14}{'p50 us':>10}{'p99 us':>10}")
+    for enabled, values in latencies.items():
+        percentiles = statistics.quantiles(values, n=100)
+        p50, p99 = percentiles[49], percentiles[98]
+        print(f"{'enabled' if enabled else 'disabled':<14}{p50:>10.0f}{p99:>10.0f}")
+    print(f"events written: {ingester.written}, dropped: {ingester.dropped}, failed: {ingester.failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="How many redirects to measure in each mode")
+    parser.add_argument("--rounds", type=int, default=10, help="How many times to alternate between the modes")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.rounds))
@@ -0,0 +1,87 @@
+"""Compares the latency of `GET /{slug}` redirects served by the fast path middleware and by the FastAPI route.
+
+The app runs in-process against the database configured by `DATABASE_URL`, which must already be migrated.
+Cached redirects are served from the slug cache, and uncached ones resolve the slug from the database each time.
+
+    python -m benchmarks.redirect_fast_path --requests 5000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from httpx import ASGITransport, AsyncClient
+from sqlmodel import col, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.api import app
+from core.config import get_settings
+from core.db import engine, get_session_context
+from shortlinks.cache import get_slug_cache
+from shortlinks.models import Shortlink
+from stats.buffer import get_visit_buffer
+from stats.models import ShortlinkStat, ShortlinkVisitBucket
+
+
+async def measure(client: AsyncClient, slug: str, requests: int, cached: bool) -> list[float]:
+    """Returns the latency in microseconds of each redirect"""
+    slug_cache = get_slug_cache()
+    latencies: list[float] = []
+    for _ in range(requests):
+        if not cached:
+            slug_cache.clear()
+        start = time.perf_counter()
+        response = await client.get(f"/{slug}")
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+        assert response.status_code == 307
+    return latencies
+
+
+async def run(requests: int, rounds: int) -> None:
+    """Alternates rounds of redirects through the fast path and the route, and reports the latencies"""
+    settings = get_settings()
+    visit_buffer = get_visit_buffer()
+    visit_buffer.start()
+    latencies: dict[tuple[bool, bool], list[float]] = {}
+    shortlink_id = None
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client:
+            response = await client.post("/shorten", json={"long_url": "https://www.example.com/benchmark/redirect"})
+            slug = response.json()["slug"]
+            shortlink_id = Shortlink.decode_slug(slug)
+            # Warm up connections and prepared statements before measuring
+            for fast_path in (False, True):
+                settings.redirect_fast_path = fast_path
+                await measure(client, slug, 100, cached=False)
+            for _ in range(rounds):
+                for cached in (True, False):
+                    for fast_path in (False, True):
+                        settings.redirect_fast_path = fast_path
+                        latencies.setdefault((cached, fast_path), [])
+                        latencies[cached, fast_path] += await measure(client, slug, requests // rounds, cached)
+    finally:
+        await visit_buffer.stop()
+        async with get_session_context() as session:
+            for model, column in (
+                (ShortlinkVisitBucket, ShortlinkVisitBucket.shortlink_id),
+                (ShortlinkStat, ShortlinkStat.shortlink_id),
+                (Shortlink, Shortlink.id),
+            ):
+                await super(AsyncSession, session).execute(delete(model).where(col(column) == shortlink_id))
+            await session.commit()
+        await engine.dispose()
+
+    print(f"{'slug cache':<12}{'handler':<12}{'p50 us':>10}{'p99 us':>10}")
+    for (cached, fast_path), values in latencies.items():
+        percentiles = statistics.quantiles(values, n=100)
+        p50, p99 = percentiles[49], percentiles[98]
+        print(f"{'hit' if cached else 'miss':<12}{'fast path' if fast_path else 'route':<12}{p50:>10.0f}{p99:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="How many redirects to measure in each mode")
+    parser.add_argument("--rounds", type=int, default=10, help="How many times to alternate between the modes")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.rounds))
@@ -0,0 +1,149 @@
+"""Collects benchmark latencies and writes them as JSON, so results from different commits can be compared with
+`python -m benchmarks.compare`."""
+
+import json
+import platform
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+
+
+@dataclass(frozen=True, slots=True)
+class BenchmarkResult:
+    """The summarized latencies of one kind of operation"""
+
+    name: str
+    """What was measured, like a service method or a scenario's request"""
+
+    operations: int
+    """How many operations completed successfully"""
+
+    errors: int
+    """How many operations failed"""
+
+    ops_per_second: float
+    """How many operations completed per second of the benchmark"""
+
+    mean_us: float
+    """The mean latency in microseconds"""
+
+    p50_us: float
+    """The median latency in microseconds"""
+
+    p90_us: float
+    """The 90th percentile latency in microseconds"""
+
+    p99_us: float
+    """The 99th percentile latency in microseconds"""
+
+    max_us: float
+    """The highest latency in microseconds"""
+
+
+class LatencyRecorder:
+    """Records the latency of each operation by name, and summarizes them into results"""
+
+    def __init__(self) -> None:
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        """The latency in seconds of every successful operation, by name"""
+        self.errors: defaultdict[str, int] = defaultdict(int)
+        """How many operations failed, by name"""
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """Times the operation run inside the block, counting it as an error if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[name] += 1
+            raise
+        self.latencies[name].append(time.perf_counter() - start)
+
+    def results(self, elapsed: float) -> list[BenchmarkResult]:
+        """Summarizes the recorded latencies.
+
+        :param elapsed: How long in seconds the operations were run for, to calculate their rates
+        :type elapsed: float
+        :return: A result for each name that was recorded, in the order they were first recorded
+        :rtype: list[BenchmarkResult]
+        """
+        results: list[BenchmarkResult] = []
+        for name in dict.fromkeys([*self.latencies, *self.errors]):
+            latencies = [latency * 1_000_000 for latency in self.latencies[name]]
+            if len(latencies) > 1:
+                percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            else:
+                percentiles = (latencies or [0.0]) * 99
+            results.append(
+                BenchmarkResult(
+                    name=name,
+                    operations=len(latencies),
+                    errors=self.errors[name],
+                    ops_per_second=len(latencies) / elapsed if elapsed else 0.0,
+                    mean_us=statistics.fmean(latencies) if latencies else 0.0,
+                    p50_us=percentiles[49],
+                    p90_us=percentiles[89],
+                    p99_us=percentiles[98],
+                    max_us=max(latencies, default=0.0),
+                )
+            )
+        return results
+
+
+def git_commit() -> tuple[str | None, bool]:
+    """Returns the commit the benchmark ran against and whether the working tree had uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(["git", "status", "--porcelain"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit.strip(), bool(status.strip())
+
+
+def report(
+    suite: str,
+    results: list[BenchmarkResult],
+    parameters: dict[str, object],
+    output: Path | None = None,
+) -> None:
+    """Prints a table of results, and writes them as JSON along with the environment they were measured in.
+
+    :param suite: The name of the benchmark that produced the results
+    :type suite: str
+    :param results: The results to report
+    :type results: list[BenchmarkResult]
+    :param parameters: The options the benchmark was run with
+    :type parameters: dict[str, object]
+    :param output: The file to write the JSON to, if any
+    :type output: Path | None
+    """
+    print(f"{'operation':<32}{'ops':>9}{'errors':>8}{'ops/s':>10}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}")
+    for result in results:
+        print(
+            f"{result.name:<32}{result.operations:>9}{result.errors:>8}{result.ops_per_second:>10.0f}"
+            f"{result.p50_us:>10.0f}{result.p90_us:>10.0f}{result.p99_us:>10.0f}"
+        )
+    if output is None:
+        return
+    commit, dirty = git_commit()
+    document = {
+        "suite": suite,
+        "environment": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "parameters": parameters,
+        "results": [asdict(result) for result in results],
+    }
+    output.write_text(json.dumps(document, indent=2) + "\n")
+    print(f"results written to {output}")
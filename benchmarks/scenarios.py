@@ -0,0 +1,164 @@
+"""Runs a traffic scenario against the app in-process, and reports the latency of each kind of request.
+
+The app runs with its lifespan, so the visit buffer and background tasks behave as they do when deployed, against
+the database configured by `DATABASE_URL`, which must already be migrated. Shortlinks are seeded first with
+`benchmarks.seed` if there aren't enough, and shortlinks created by the benchmark are seeded ones too, so
+`python -m benchmarks.seed --clear` removes everything a run leaves behind.
+
+- `redirect`: redirects only, picking shortlinks with a Zipfian distribution so a few are very popular
+- `create`: shortlink creation only, one at a time with a few batches
+- `dashboard`: polls the top stats by each metric, and the stats and timeseries of popular shortlinks
+- `mixed`: 80% redirects, 10% creation, and 10% dashboard requests
+
+    python -m benchmarks.scenarios redirect --duration 30 --concurrency 32 --output redirect.json
+"""
+
+import argparse
+import asyncio
+import bisect
+import contextlib
+import itertools
+import random
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Literal
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.results import LatencyRecorder, report
+from benchmarks.seed import SEED_URL_PREFIX, ensure_seeded
+from core.api import app
+from core.db import engine, get_session_context, read_engine
+from shortlinks.models import Shortlink
+from stats.service import StatMetric
+
+type Scenario = Literal["redirect", "create", "dashboard", "mixed"]
+type Request = Callable[[AsyncClient, LatencyRecorder], Awaitable[None]]
+
+SCENARIO_MIX: dict[Scenario, dict[str, int]] = {
+    "redirect": {"redirect": 1},
+    "create": {"shorten": 19, "shorten_batch": 1},
+    "dashboard": {"top_stats": 2, "slug_stats": 1, "timeseries": 1},
+    "mixed": {"redirect": 80, "shorten": 9, "shorten_batch": 1, "top_stats": 5, "slug_stats": 3, "timeseries": 2},
+}
+"""The relative weight of each kind of request in each scenario"""
+
+
+class ZipfSampler:
+    """Picks items so that the nth most popular is picked in proportion to ``1 / n ** exponent``"""
+
+    def __init__(self, items: list[str], exponent: float) -> None:
+        self.items = items
+        self.cumulative_weights = list(itertools.accumulate(1 / rank**exponent for rank in range(1, len(items) + 1)))
+
+    def sample(self) -> str:
+        """Returns a random item"""
+        position = random.random() * self.cumulative_weights[-1]
+        return self.items[bisect.bisect(self.cumulative_weights, position)]
+
+
+def scenario_requests(slugs: ZipfSampler) -> dict[str, Request]:
+    """Returns each kind of request by name, each checking its response"""
+    created = itertools.count()
+
+    async def redirect(client: AsyncClient, recorder: LatencyRecorder) -> None:
+        slug = slugs.sample()
+        with recorder.measure("redirect"):
+            response = await client.get(f"/{slug}")
+            assert response.status_code == 307
+
+    async def shorten(client: AsyncClient, recorder: LatencyRecorder) -> None:
+        long_url = f"{SEED_URL_PREFIX}created/{next(created)}"
+        with recorder.measure("shorten"):
+            response = await client.post("/shorten", json={"long_url": long_url})
+            assert response.status_code == 201
+
+    async def shorten_batch(client: AsyncClient, recorder: LatencyRecorder) -> None:
+        long_urls = [f"{SEED_URL_PREFIX}created/{next(created)}" for _ in range(100)]
+        with recorder.measure("shorten_batch"):
+            response = await client.post("/shorten/batch", json={"long_urls": long_urls})
+            assert response.status_code == 201
+
+    async def top_stats(client: AsyncClient, recorder: LatencyRecorder) -> None:
+        metric = random.choice(list(StatMetric))
+        with recorder.measure(f"top_stats:{metric}"):
+            response = await client.get("/stats", params={"metric": metric, "limit": 100})
+            assert response.status_code == 200
+
+    async def slug_stats(client: AsyncClient, recorder: LatencyRecorder) -> None:
+        slug = slugs.sample()
+        with recorder.measure("slug_stats"):
+            response = await client.get(f"/stats/{slug}")
+            assert response.status_code == 200
+
+    async def timeseries(client: AsyncClient, recorder: LatencyRecorder) -> None:
+        slug = slugs.sample()
+        with recorder.measure("timeseries"):
+            response = await client.get(f"/stats/{slug}/timeseries", params={"granularity": "hour"})
+            assert response.status_code == 200
+
+    return {
+        "redirect": redirect,
+        "shorten": shorten,
+        "shorten_batch": shorten_batch,
+        "top_stats": top_stats,
+        "slug_stats": slug_stats,
+        "timeseries": timeseries,
+    }
+
+
+async def run_worker(
+    client: AsyncClient, requests: dict[str, Request], mix: dict[str, int], recorder: LatencyRecorder, end: float
+) -> None:
+    """Sends requests one after another until the benchmark ends, counting failed ones as errors"""
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < end:
+        (name,) = random.choices(names, weights)
+        with contextlib.suppress(Exception):
+            await requests[name](client, recorder)
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Seeds shortlinks if needed, runs the scenario with concurrent clients, and reports the latencies"""
+    random.seed(args.random_seed)
+    try:
+        async with get_session_context() as session:
+            shortlink_ids = await ensure_seeded(args.keys, session)
+        slugs = ZipfSampler([Shortlink.encode_slug(shortlink_id) for shortlink_id in shortlink_ids], args.zipf_exponent)
+        requests = scenario_requests(slugs)
+        mix = SCENARIO_MIX[args.scenario]
+        recorder = LatencyRecorder()
+        async with (
+            app.router.lifespan_context(app),
+            AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client,
+        ):
+            # Warm up connections, caches, and prepared statements before measuring
+            warm_up_end = time.perf_counter() + args.warm_up
+            await asyncio.gather(
+                *(run_worker(client, requests, mix, LatencyRecorder(), warm_up_end) for _ in range(args.concurrency))
+            )
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(run_worker(client, requests, mix, recorder, start + args.duration) for _ in range(args.concurrency))
+            )
+            elapsed = time.perf_counter() - start
+    finally:
+        await engine.dispose()
+        await read_engine.dispose()
+
+    parameters = {name: value for name, value in vars(args).items() if name != "output"}
+    report(f"scenario:{args.scenario}", recorder.results(elapsed), parameters, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=list(SCENARIO_MIX), help="Which traffic scenario to run")
+    parser.add_argument("--duration", type=float, default=30.0, help="How many seconds to measure for")
+    parser.add_argument("--warm-up", type=float, default=5.0, help="How many seconds to run before measuring")
+    parser.add_argument("--concurrency", type=int, default=32, help="How many requests to keep in flight")
+    parser.add_argument("--keys", type=int, default=100_000, help="How many seeded shortlinks to spread requests over")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1, help="How skewed shortlink popularity is")
+    parser.add_argument("--random-seed", type=int, default=0, help="Seeds the random choices, for repeatable runs")
+    parser.add_argument("--output", type=Path, help="Write the results to this file as JSON")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,133 @@
+"""Loads large numbers of shortlinks with stats into the database configured by `DATABASE_URL` with COPY, for the
+other benchmarks to run against. The database must already be migrated.
+
+Seeded shortlinks all point at `SEED_URL_PREFIX`, so they can be found and removed again without touching
+anything else. Their visit counts follow a heavy-tailed distribution, like real traffic.
+
+    python -m benchmarks.seed --count 1000000
+    python -m benchmarks.seed --clear
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import UTC, datetime, timedelta
+from typing import LiteralString
+from uuid import UUID
+
+from psycopg import AsyncConnection
+from psycopg.rows import tuple_row
+from sqlmodel import col, delete, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.db import engine, get_session_context
+from shortlinks.models import IdempotencyKey, Shortlink
+from shortlinks.slugs import get_slug_codec
+from stats.models import ShortlinkStat, ShortlinkVisitBucket
+
+SEED_URL_PREFIX = "https://seed.benchmark.invalid/"
+"""The start of every seeded shortlink's long URL"""
+
+
+async def copy_rows(session: AsyncSession, statement: LiteralString, rows: list[tuple[object, ...]]) -> None:
+    """Copies rows into a table within the session's transaction"""
+    raw_connection = await (await session.connection()).get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    if not isinstance(driver_connection, AsyncConnection):
+        raise TypeError("Rows can only be copied with a psycopg connection")
+    async with driver_connection.cursor(row_factory=tuple_row) as cursor, cursor.copy(statement) as copy:
+        for row in rows:
+            await copy.write_row(row)
+
+
+async def seed(count: int, session: AsyncSession, batch_size: int = 100_000) -> None:
+    """Seeds shortlinks with stats, committing each batch.
+
+    :param count: How many shortlinks to seed
+    :type count: int
+    :param session: An async session connected to the primary database
+    :type session: AsyncSession
+    :param batch_size: How many shortlinks to copy in each transaction
+    :type batch_size: int
+    """
+    now = datetime.now(UTC)
+    codec = get_slug_codec()
+    for offset in range(0, count, batch_size):
+        shortlink_ids = await codec.new_ids(min(batch_size, count - offset), session)
+        shortlinks: list[tuple[object, ...]] = []
+        stats: list[tuple[object, ...]] = []
+        for shortlink_id in shortlink_ids:
+            created_at = now - timedelta(seconds=random.uniform(0, 90 * 86400))
+            shortlinks.append((shortlink_id, f"{SEED_URL_PREFIX}{shortlink_id.hex}", created_at))
+            visits = int(random.paretovariate(1.2))
+            last_visit = created_at + (now - created_at) * random.random()
+            stats.append((shortlink_id, visits, max(1, int(visits * random.uniform(0.3, 1))), last_visit))
+        await copy_rows(session, "COPY shortlink (id, long_url, created_at) FROM STDIN", shortlinks)
+        await copy_rows(
+            session, "COPY shortlinkstat (shortlink_id, visits, unique_visitors, last_visit) FROM STDIN", stats
+        )
+        await session.commit()
+
+
+async def seeded_ids(limit: int, session: AsyncSession) -> list[UUID]:
+    """Returns the ids of up to ``limit`` seeded shortlinks"""
+    statement = select(Shortlink.id).where(col(Shortlink.long_url).startswith(SEED_URL_PREFIX)).limit(limit)
+    return list((await session.exec(statement)).all())
+
+
+async def ensure_seeded(count: int, session: AsyncSession) -> list[UUID]:
+    """Returns the ids of ``count`` seeded shortlinks, seeding more first if there aren't enough"""
+    shortlink_ids = await seeded_ids(count, session)
+    if len(shortlink_ids) < count:
+        await seed(count - len(shortlink_ids), session)
+        shortlink_ids = await seeded_ids(count, session)
+    return shortlink_ids
+
+
+async def clear(session: AsyncSession) -> int:
+    """Removes every seeded shortlink along with its stats, and anything the benchmarks recorded for them.
+
+    :param session: An async session connected to the primary database
+    :type session: AsyncSession
+    :return: The number of shortlinks removed
+    :rtype: int
+    """
+    seeded = select(Shortlink.id).where(col(Shortlink.long_url).startswith(SEED_URL_PREFIX))
+    # Clearing millions of shortlinks takes longer than requests are allowed to
+    await super(AsyncSession, session).execute(text("SET LOCAL statement_timeout = 0"))
+    for model, column in (
+        (IdempotencyKey, IdempotencyKey.shortlink_id),
+        (ShortlinkVisitBucket, ShortlinkVisitBucket.shortlink_id),
+        (ShortlinkStat, ShortlinkStat.shortlink_id),
+    ):
+        await super(AsyncSession, session).execute(delete(model).where(col(column).in_(seeded)))
+    result = await super(AsyncSession, session).execute(
+        delete(Shortlink).where(col(Shortlink.long_url).startswith(SEED_URL_PREFIX))
+    )
+    await session.commit()
+    return result.rowcount
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Seeds or clears shortlinks and reports how long it took"""
+    start = time.perf_counter()
+    try:
+        async with get_session_context() as session:
+            if args.clear:
+                removed = await clear(session)
+                print(f"removed {removed} shortlinks in {time.perf_counter() - start:.1f}s")
+            else:
+                await seed(args.count, session, args.batch_size)
+                elapsed = time.perf_counter() - start
+                print(f"seeded {args.count} shortlinks in {elapsed:.1f}s ({args.count / elapsed:.0f}/s)")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1_000_000, help="How many shortlinks with stats to seed")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="How many shortlinks to copy per transaction")
+    parser.add_argument("--clear", action="store_true", help="Remove all seeded shortlinks instead")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,148 @@
+"""Measures the latency of each service method, called directly in-process so no HTTP handling is included.
+
+Methods run back to back on one session against the database configured by `DATABASE_URL`, which must already be
+migrated, picking from shortlinks seeded with `benchmarks.seed`. Shortlinks created by the benchmark are seeded
+ones too, so `python -m benchmarks.seed --clear` removes everything a run leaves behind. The slug cache is cleared
+before each lookup, so lookups measure the database rather than the cache.
+
+    python -m benchmarks.services --seconds 2 --output services.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from uuid import UUID
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from benchmarks.results import LatencyRecorder, report
+from benchmarks.seed import SEED_URL_PREFIX, ensure_seeded
+from core.db import engine, get_session_context, read_engine
+from shortlinks.cache import get_slug_cache
+from shortlinks.models import Shortlink
+from shortlinks.service import ShortlinkService
+from stats.models import BucketGranularity
+from stats.service import StatMetric, StatsService, VisitCount
+
+type ServiceCall = Callable[[AsyncSession], Awaitable[object]]
+
+
+def service_calls(shortlink_ids: list[UUID]) -> dict[str, ServiceCall]:
+    """Returns a call to each service method by name, each with new arguments every time"""
+    slug_cache = get_slug_cache()
+    created = itertools.count()
+
+    def slug() -> str:
+        return Shortlink.encode_slug(random.choice(shortlink_ids))
+
+    def long_url() -> str:
+        return f"{SEED_URL_PREFIX}services/{next(created)}"
+
+    async def from_slug(session: AsyncSession) -> object:
+        slug_cache.clear()
+        return await ShortlinkService.from_slug(slug(), session)
+
+    async def resolve_slug(session: AsyncSession) -> object:
+        slug_cache.clear()
+        return await ShortlinkService.resolve_slug(slug())
+
+    async def create(session: AsyncSession) -> object:
+        return await ShortlinkService.create(long_url(), session)
+
+    async def create_idempotent(session: AsyncSession) -> object:
+        return await ShortlinkService.create_idempotent(long_url(), f"services-{time.time_ns()}", session)
+
+    async def create_many(session: AsyncSession) -> object:
+        return await ShortlinkService.create_many([long_url() for _ in range(100)], session)
+
+    async def get_by_ids(session: AsyncSession) -> object:
+        return await ShortlinkService.get_by_ids(random.sample(shortlink_ids, 50), session)
+
+    async def record_visit(session: AsyncSession) -> object:
+        return await StatsService.record_visit(random.choice(shortlink_ids), datetime.now(UTC), session)
+
+    async def record_visits(session: AsyncSession) -> object:
+        now = datetime.now(UTC)
+        visits = {shortlink_id: VisitCount.single(now) for shortlink_id in random.sample(shortlink_ids, 100)}
+        return await StatsService.record_visits(visits, session)
+
+    async def get_stats_for_slug(session: AsyncSession) -> object:
+        return await StatsService.get_stats_for_slug(slug(), session)
+
+    async def get_visit_timeseries(session: AsyncSession) -> object:
+        end = datetime.now(UTC)
+        return await StatsService.get_visit_timeseries(
+            random.choice(shortlink_ids), BucketGranularity.HOUR, end - timedelta(days=7), end, session
+        )
+
+    async def get_trending_stats(session: AsyncSession) -> object:
+        return await StatsService.get_trending_stats(60, 100, session)
+
+    def get_top_stats(metric: StatMetric) -> ServiceCall:
+        async def call(session: AsyncSession) -> object:
+            return await StatsService.get_top_stats(metric, 100, session)
+
+        return call
+
+    return {
+        "from_slug": from_slug,
+        "resolve_slug": resolve_slug,
+        "create": create,
+        "create_idempotent": create_idempotent,
+        "create_many": create_many,
+        "get_by_ids": get_by_ids,
+        "record_visit": record_visit,
+        "record_visits": record_visits,
+        "get_stats_for_slug": get_stats_for_slug,
+        "get_visit_timeseries": get_visit_timeseries,
+        "get_trending_stats": get_trending_stats,
+        **{f"get_top_stats:{metric}": get_top_stats(metric) for metric in StatMetric if metric != StatMetric.TRENDING},
+    }
+
+
+async def measure(
+    name: str, call: ServiceCall, session: AsyncSession, recorder: LatencyRecorder, seconds: float
+) -> None:
+    """Calls a service method back to back for a number of seconds, recording the latency of each call"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        with recorder.measure(name):
+            await call(session)
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Seeds shortlinks if needed, measures each service method in turn, and reports the latencies"""
+    random.seed(args.random_seed)
+    recorder = LatencyRecorder()
+    try:
+        async with get_session_context() as session:
+            shortlink_ids = await ensure_seeded(args.keys, session)
+            calls = service_calls(shortlink_ids)
+            for name, call in calls.items():
+                if args.only and name.split(":")[0] not in args.only:
+                    continue
+                # Warm up the connection and prepared statements before measuring
+                await measure(name, call, session, LatencyRecorder(), args.seconds / 10)
+                await measure(name, call, session, recorder, args.seconds)
+    finally:
+        await engine.dispose()
+        await read_engine.dispose()
+
+    # Each method ran for the same time, so rates are per second of its own run
+    parameters = {name: value for name, value in vars(args).items() if name != "output"}
+    report("services", recorder.results(args.seconds), parameters, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="How long to measure each service method for")
+    parser.add_argument("--keys", type=int, default=100_000, help="How many seeded shortlinks to pick from")
+    parser.add_argument("--only", nargs="*", help="Only measure these service methods")
+    parser.add_argument("--random-seed", type=int, default=0, help="Seeds the random choices, for repeatable runs")
+    parser.add_argument("--output", type=Path, help="Write the results to this file as JSON")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,44 @@
+"""Compares creating shortlinks with a single `POST /shorten/batch` request against sequential `POST /shorten` requests.
+
+The app runs in-process against the database configured by `DATABASE_URL`, which must already be migrated.
+
+    python -m benchmarks.shorten_batch --count 1000
+"""
+
+import argparse
+import asyncio
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from core.api import app
+from core.db import engine
+
+
+async def run(count: int) -> None:
+    """Creates `count` shortlinks one request at a time, then `count` more in one batch, and reports the rates"""
+    long_urls = [f"https://www.example.com/benchmark/{i}" for i in range(count)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        for long_url in long_urls:
+            response = await client.post("/shorten", json={"long_url": long_url})
+            response.raise_for_status()
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = await client.post("/shorten/batch", json={"long_urls": long_urls})
+        response.raise_for_status()
+        batch = time.perf_counter() - start
+    await engine.dispose()
+
+    print(f"{'mode':<12}{'seconds':>10}{'links/s':>12}")
+    print(f"{'sequential':<12}{sequential:>10.3f}{count / sequential:>12.0f}")
+    print(f"{'batch':<12}{batch:>10.3f}{count / batch:>12.0f}")
+    print(f"batch is {sequential / batch:.1f}x faster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000, help="How many shortlinks to create in each mode")
+    args = parser.parse_args()
+    asyncio.run(run(args.count))
@@ -0,0 +1,109 @@
+"""Compares how many top stats rows per second can be queried and serialized by hydrating `Shortlink` and
+`ShortlinkStat` models over two queries, as `/stats` used to, against the single joined query of row tuples.
+
+Seeds its own shortlinks with stats into the database configured by `DATABASE_URL`, which must already be
+migrated, and removes them afterwards.
+
+    python -m benchmarks.stats_serialization --rows 1000 --repeat 20
+"""
+
+import argparse
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+
+from pydantic import TypeAdapter
+from sqlmodel import col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.db import engine, get_session_context
+from shortlinks.models import Shortlink
+from shortlinks.service import ShortlinkService
+from stats.models import ShortlinkStat
+from stats.service import ShortlinkWithStats, StatMetric, StatsService, VisitCount
+
+serializer = TypeAdapter(list[ShortlinkWithStats])
+
+
+async def orm_top_stats(limit: int, session: AsyncSession) -> list[ShortlinkWithStats]:
+    """The previous implementation of `StatsService.get_top_stats`"""
+    statement = select(ShortlinkStat).order_by(col(ShortlinkStat.visits).desc()).limit(limit)
+    results = list(await session.exec(statement))
+    shortlinks_by_id = await ShortlinkService.get_by_ids([stat.shortlink_id for stat in results], session)
+    stats: list[ShortlinkWithStats] = []
+    for stat in results:
+        shortlink = shortlinks_by_id[stat.shortlink_id]
+        stats.append(
+            ShortlinkWithStats(
+                slug=shortlink.slug,
+                short_url=shortlink.short_url,
+                long_url=shortlink.long_url,
+                visits=stat.visits,
+                unique_visitors=stat.unique_visitors,
+                last_visit=stat.last_visit,
+            )
+        )
+    return stats
+
+
+async def joined_top_stats(limit: int, session: AsyncSession) -> list[ShortlinkWithStats]:
+    """The current implementation of `StatsService.get_top_stats`"""
+    return await StatsService.get_top_stats(StatMetric.VISITS, limit, session)
+
+
+async def measure(
+    query: Callable[[int, AsyncSession], Awaitable[list[ShortlinkWithStats]]],
+    rows: int,
+    repeat: int,
+) -> float:
+    """Returns how many rows per second the query and serialization handled"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # A new session each time so the identity map can't skip hydrating rows
+        async with get_session_context() as session:
+            serializer.dump_json(await query(rows, session))
+    return rows * repeat / (time.perf_counter() - start)
+
+
+async def run(rows: int, repeat: int) -> None:
+    """Seeds shortlinks with more visits than any existing ones, measures both implementations, and cleans up"""
+    shortlinks: list[Shortlink] = []
+    try:
+        async with get_session_context() as session:
+            shortlinks = await ShortlinkService.create_many(
+                [f"https://www.example.com/benchmark/stats/{i}" for i in range(rows)], session
+            )
+            now = datetime.now(UTC)
+            await StatsService.record_visits(
+                {shortlink.id: VisitCount(2**30, now) for shortlink in shortlinks},
+                session,
+            )
+
+        # Warm up connections and statement caches before measuring
+        await measure(orm_top_stats, rows, 1)
+        await measure(joined_top_stats, rows, 1)
+        orm_rate = await measure(orm_top_stats, rows, repeat)
+        joined_rate = await measure(joined_top_stats, rows, repeat)
+    finally:
+        ids = [shortlink.id for shortlink in shortlinks]
+        async with get_session_context() as session:
+            await super(AsyncSession, session).execute(
+                delete(ShortlinkStat).where(col(ShortlinkStat.shortlink_id).in_(ids))
+            )
+            await super(AsyncSession, session).execute(delete(Shortlink).where(col(Shortlink.id).in_(ids)))
+            await session.commit()
+        await engine.dispose()
+
+    print(f"{'implementation':<16}{'rows/s':>12}")
+    print(f"{'orm':<16}{orm_rate:>12.0f}")
+    print(f"{'joined':<16}{joined_rate:>12.0f}")
+    print(f"joined is {joined_rate / orm_rate:.1f}x faster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="How many rows each query returns")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times each query is run")
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat))
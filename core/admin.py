@@ -0,0 +1,57 @@
+import secrets
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from .config import get_settings
+
+_BEARER = HTTPBearer(auto_error=False, description="The admin API key")
+
+_METRICS_BEARER = HTTPBearer(auto_error=False, description="The metrics scrape token")
+
+
+def _check_bearer_token(credentials: HTTPAuthorizationCredentials | None, token: str, name: str) -> None:
+    """Only lets requests with a token as their bearer token through.
+
+    :param credentials: The request's bearer token, if it has one
+    :type credentials: HTTPAuthorizationCredentials | None
+    :param token: The token the endpoint requires, which disables it while empty
+    :type token: str
+    :param name: What the token is called in the error sent when it's missing or wrong
+    :type name: str
+    :raises HTTPException: 404 if the endpoint is disabled, or 401 if the token is missing or wrong
+    """
+    if not token:
+        # The endpoint doesn't exist as far as clients can tell until a token is configured
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if credentials is None or not secrets.compare_digest(credentials.credentials.encode(), token.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"A valid {name} is required",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+async def require_admin_key(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(_BEARER)],
+) -> None:
+    """Only lets requests with the admin API key as their bearer token through.
+
+    :param credentials: The request's bearer token, if it has one
+    :type credentials: HTTPAuthorizationCredentials | None
+    :raises HTTPException: 404 if admin endpoints are disabled, or 401 if the token is missing or wrong
+    """
+    _check_bearer_token(credentials, get_settings().admin_api_key, "admin API key")
+
+
+async def require_metrics_token(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(_METRICS_BEARER)],
+) -> None:
+    """Only lets requests with the metrics scrape token as their bearer token through.
+
+    :param credentials: The request's bearer token, if it has one
+    :type credentials: HTTPAuthorizationCredentials | None
+    :raises HTTPException: 404 if metrics are disabled, or 401 if the token is missing or wrong
+    """
+    _check_bearer_token(credentials, get_settings().metrics_token, "metrics token")
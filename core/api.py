@@ -1,16 +1,73 @@
-import sentry_sdk
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from core import db
 from core.config import get_settings
+from core.instrumentation import RequestMetricsMiddleware
+from core.routes import router as core_router
+from shortlinks.fastpath import RedirectFastPath
+from shortlinks.filter import get_slug_filter
 from shortlinks.routes import router as shortlinks_router
+from shortlinks.tasks import idempotency_key_pruning
+from stats.buffer import get_visit_buffer
+from stats.events import get_visit_event_ingester, load_visitor_hash_key
 from stats.routes import router as stats_router
+from stats.tasks import trending_pruning, visit_bucket_pruning, visit_event_partitioning
 
 settings = get_settings()
 
 if settings.sentry_dsn:
+    # Only imported when enabled, since importing it is a large share of a worker's startup time
+    import sentry_sdk
+
     sentry_sdk.init(dsn=settings.sentry_dsn, send_default_pii=False)
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Warms up the database pools and starts per-worker background work, and drains it when the worker
+    shuts down"""
+    await asyncio.gather(
+        *(db.warm_up(engine, settings.db_warm_up_connections) for engine in {db.engine, db.read_engine})
+    )
+    # Random UUIDs created by other workers can't be vouched for until the next sync, so only compact ids are
+    # filtered
+    slug_filter = get_slug_filter() if settings.slug_filter_enabled and settings.slug_codec == "compact" else None
+    if slug_filter:
+        slug_filter.start()
+    async with db.get_session_context() as session:
+        await load_visitor_hash_key(session)
+    visit_buffer = get_visit_buffer()
+    visit_buffer.start()
+    # Buckets that expired while no worker was running are pruned straight away, by whichever worker gets to it first
+    visit_bucket_pruning.start(run_now=True)
+    idempotency_key_pruning.start()
+    trending_pruning.start()
+    visit_event_ingester = get_visit_event_ingester() if settings.visit_events_enabled else None
+    if visit_event_ingester:
+        # Make sure today's partition exists before any events are written
+        await visit_event_partitioning.run_once()
+        visit_event_partitioning.start()
+        visit_event_ingester.start()
+    yield
+    if visit_event_ingester:
+        await visit_event_ingester.stop()
+        await visit_event_partitioning.stop()
+    await trending_pruning.stop()
+    await idempotency_key_pruning.stop()
+    await visit_bucket_pruning.stop()
+    await visit_buffer.stop()
+    if slug_filter:
+        await slug_filter.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RedirectFastPath)
+app.add_middleware(RequestMetricsMiddleware)
+
+app.include_router(core_router)
 app.include_router(stats_router)
 app.include_router(shortlinks_router)
@@ -1,9 +1,15 @@
 from functools import cache
-from typing import ClassVar
+from typing import ClassVar, Literal
 
 from pydantic_settings import BaseSettings
 from pydantic_settings.main import SettingsConfigDict
 
+BackpressurePolicy = Literal["drop", "block", "sample"]
+"""What happens to new work when a background writer falls behind"""
+
+SlugCodecName = Literal["shortuuid", "compact"]
+"""How shortlink slugs are generated and decoded"""
+
 
 class Settings(BaseSettings):
     """The class that holds configuration fields loaded from the environment"""
@@ -11,12 +17,183 @@ class Settings(BaseSettings):
     database_url: str = ""
     """The connection URL to be used for the database engine"""
 
+    read_database_url: str = ""
+    """The connection URL for a read replica used by read-only queries, the primary is used if empty"""
+
+    db_pool_size: int = 5
+    """The number of connections each worker keeps open in its database pool"""
+
+    db_max_overflow: int = 5
+    """How many connections each worker can open beyond the pool size under load"""
+
+    db_pool_timeout: float = 10.0
+    """How long in seconds a request waits for a pooled connection before failing"""
+
+    db_pool_recycle: int = 1800
+    """How old in seconds a pooled connection can get before it is replaced, -1 to never replace them"""
+
+    db_pool_pre_ping: bool = True
+    """Whether pooled connections are checked for liveness before being used"""
+
+    db_statement_timeout: int = 5000
+    """How long in milliseconds the server lets a statement run before cancelling it, 0 to disable"""
+
+    db_job_statement_timeout: int = 0
+    """How long in milliseconds a background job's statements can run before being cancelled, 0 to disable"""
+
+    db_idle_in_transaction_timeout: int = 10000
+    """How long in milliseconds the server lets a transaction sit idle before terminating it, 0 to disable"""
+
+    db_prepare_threshold: int = 1
+    """How many times a connection runs a query before preparing it server-side, -1 to disable"""
+
+    db_warm_up_connections: int = 1
+    """How many connections each worker opens to each database as it starts, 0 to connect on demand"""
+
     service_root: str = ""
     """The root URL for the active service"""
 
     sentry_dsn: str = ""
     """The DSN for Sentry integration"""
 
+    shorten_batch_max_size: int = 10_000
+    """The maximum number of URLs that can be shortened in a single batch request"""
+
+    slug_codec: SlugCodecName = "shortuuid"
+    """How new shortlinks' slugs are generated, `compact` for short sequential slugs that can be enumerated"""
+
+    idempotency_key_ttl: int = 86400
+    """How long in seconds an `Idempotency-Key` returns the shortlink it created before it can be reused"""
+
+    redirect_fast_path: bool = True
+    """Whether `GET /{slug}` redirects are served by a lean ASGI middleware ahead of FastAPI's routing"""
+
+    slug_cache_size: int | None = None
+    """The maximum number of slug resolutions each worker keeps in memory, 0 disables the cache"""
+
+    slug_cache_ttl: float = 3600.0
+    """How long in seconds a resolved shortlink stays in the slug cache"""
+
+    slug_cache_miss_ttl: float = 5.0
+    """How long in seconds a slug that does not exist stays in the slug cache"""
+
+    shared_slug_cache_size: int = 100_000
+    """The maximum number of shortlinks held in the slug cache shared by a machine's workers, 0 disables it"""
+
+    shared_slug_cache_url_bytes: int = 16 * 1024 * 1024
+    """The memory in bytes the shared slug cache sets aside for long URLs. It's full once they fill it."""
+
+    shared_slug_cache_reset_interval: float = 3600.0
+    """How long in seconds after it was last cleared a full shared slug cache is cleared again"""
+
+    shared_slug_cache_name: str = "birdseye-slug-cache"
+    """The name of the shared slug cache's memory segment, which must be unique to each app on a machine"""
+
+    slug_filter_enabled: bool = True
+    """Whether workers rule out missing slugs with a Bloom filter of shortlink ids, used only with compact slugs"""
+
+    slug_filter_false_positive_rate: float = 0.01
+    """The fraction of slugs that don't exist which the slug filter lets through to a query"""
+
+    slug_filter_max_bytes: int = 16 * 1024 * 1024
+    """The most memory in bytes each worker's slug filter may use"""
+
+    slug_filter_sync_interval: float = 5.0
+    """How often in seconds each worker adds the shortlinks other workers have created to its slug filter"""
+
+    slug_filter_rebuild_interval: float = 86400.0
+    """How often in seconds each worker rebuilds its slug filter from every shortlink id on the read replica"""
+
+    visit_write_behind: bool = True
+    """Whether visits are buffered in memory and written in batches instead of one write per visit"""
+
+    visit_flush_interval: float = 1.0
+    """How often in seconds buffered visits are written to the database"""
+
+    visit_buffer_max_size: int = 1000
+    """How many distinct shortlinks can have buffered visits before they are written early"""
+
+    visit_buffer_capacity: int = 100_000
+    """How many distinct shortlinks can have buffered visits before visits to others are dropped"""
+
+    visit_buffer_max_failures: int = 3
+    """How many buffered visit writes can fail in a row before they're written one shortlink at a time"""
+
+    visitor_hash_key: str = ""
+    """A secret key of up to 64 bytes for hashing visitors, generated and stored in the database if empty"""
+
+    visitor_ip_header: str = ""
+    """A request header set by a proxy with the visitor's IP address, the client's address is used if empty"""
+
+    visit_events_enabled: bool = False
+    """Whether the details of each visit are also appended to the raw visit event log"""
+
+    visit_event_queue_size: int = 10_000
+    """How many visit events each worker can hold in memory while waiting for them to be written"""
+
+    visit_event_batch_size: int = 1000
+    """The most visit events written with a single COPY"""
+
+    visit_event_flush_interval: float = 1.0
+    """How long in seconds visit events wait to be batched before they are written"""
+
+    visit_event_backpressure: BackpressurePolicy = "drop"
+    """What happens to new visit events when the writer falls behind: `drop`, `block` or `sample`"""
+
+    visit_event_sample_rate: float = 0.1
+    """The fraction of visit events kept by the `sample` backpressure policy while the queue is half full"""
+
+    visit_event_country_header: str = ""
+    """A request header set by a proxy or CDN with the visitor's ISO country code, like `CF-IPCountry`"""
+
+    visit_event_partitions_ahead: int = 3
+    """How many days of visit event partitions are created ahead of time"""
+
+    visit_event_retention_days: int = 30
+    """How many days of visit event partitions are kept before they are dropped, 0 to keep them forever"""
+
+    stats_hourly_retention_days: int = 30
+    """How many days hourly visit buckets are kept for before only the daily buckets remain"""
+
+    stats_daily_retention_days: int = 0
+    """How many days daily visit buckets are kept for, 0 to keep them forever"""
+
+    stats_prune_batch_size: int = 10000
+    """How many expired visit buckets are deleted per transaction when pruning"""
+
+    stats_timeseries_max_buckets: int = 1000
+    """The most buckets that can be requested in a single visit timeseries"""
+
+    stats_trending_capacity: int = 1000
+    """How many shortlinks each minute's trending summary counts, which must be at least the most top stats"""
+
+    stats_trending_max_window: int = 60
+    """The longest window in minutes that trending shortlinks can be ranked over"""
+
+    stats_cache_size: int = 1000
+    """The maximum number of stats responses each worker keeps in memory, 0 disables the cache"""
+
+    stats_cache_max_age: float = 5.0
+    """How long in seconds a stats response is served before it's refreshed, sent as `Cache-Control: max-age`"""
+
+    stats_cache_stale_while_revalidate: float = 30.0
+    """How long in seconds after going stale that a stats response is served while it's refreshed"""
+
+    admin_api_key: str = ""
+    """The bearer token that admin endpoints require, which are disabled while it's empty"""
+
+    metrics_token: str = ""
+    """The bearer token Prometheus scrapes `/metrics` with. Metrics are disabled while it's empty."""
+
+    import_batch_size: int = 10000
+    """How many rows a bulk import copies into its staging table, or merges into the shortlinks, per transaction"""
+
+    export_batch_size: int = 5000
+    """How many rows an export fetches from its server-side cursor at a time, which bounds the memory it uses"""
+
+    export_idle_in_transaction_timeout: int = 60000
+    """How long in milliseconds an export's transaction can sit idle, 0 to disable"""
+
     model_config: ClassVar[SettingsConfigDict] = SettingsConfigDict(env_file=".env")
 
 
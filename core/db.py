@@ -1,24 +1,196 @@
-from collections.abc import AsyncGenerator
-from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import AsyncExitStack, asynccontextmanager
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, QueuePool
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 # ensure models are registered
 from shortlinks import models as shortlinks_models  # noqa: F401  # pyright: ignore[reportUnusedImport]
 from stats import models as stats_models  # noqa: F401 # pyright: ignore[reportUnusedImport]
 
-from .config import get_settings
+from .config import Settings, get_settings
+from .instrumentation import instrument_engine
+from .metrics import db_pool_checked_out, db_pool_checkout_seconds, db_pool_saturation
+
+logger = logging.getLogger(__name__)
+
+_SET_LOCAL_STATEMENT_TIMEOUT = text("SELECT set_config('statement_timeout', :timeout, true)")
+_TRY_JOB_LOCK = text("SELECT pg_try_advisory_xact_lock(hashtext(:job))")
+_TRY_SESSION_JOB_LOCK = text("SELECT pg_try_advisory_lock(hashtext(:job))")
+_RELEASE_SESSION_JOB_LOCK = text("SELECT pg_advisory_unlock(hashtext(:job))")
+
+# Configure the models' mappers up front rather than on first use, so an app preloaded by gunicorn does it once
+# before forking instead of in every worker
+configure_mappers()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """A queue pool that reports how long checkouts wait and how saturated the pool is"""
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.labels(self.logging_name).observe(time.perf_counter() - start)
+            self._report_usage()
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        super()._do_return_conn(record)
+        self._report_usage()
+
+    def _report_usage(self) -> None:
+        checked_out = self.checkedout()
+        db_pool_checked_out.labels(self.logging_name).set(checked_out)
+        db_pool_saturation.labels(self.logging_name).set(checked_out / max(self.size() + self._max_overflow, 1))
+
+
+def create_engine(settings: Settings, database_url: str | None = None, name: str = "primary") -> AsyncEngine:
+    """Creates an async engine with its pool, server-side timeouts, and prepared statements configured from the
+    settings, with its queries timed in the metrics.
+
+    :param settings: The settings to configure the engine with
+    :type settings: Settings
+    :param database_url: The connection URL to use instead of the primary database's
+    :type database_url: str | None
+    :param name: The name the engine's pool is reported as in metrics
+    :type name: str
+    :return: The configured engine
+    :rtype: AsyncEngine
+    """
+    options = [
+        f"-c statement_timeout={settings.db_statement_timeout}",
+        f"-c idle_in_transaction_session_timeout={settings.db_idle_in_transaction_timeout}",
+    ]
+    engine = create_async_engine(
+        database_url or settings.database_url,
+        poolclass=InstrumentedPool,
+        pool_logging_name=name,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            "options": " ".join(options),
+            # Hot statements are built once at import time, so each execution reuses their compiled form, and their
+            # SQL never changes shape, with lists sent as array parameters rather than ``IN`` lists, so psycopg can
+            # prepare them server-side and Postgres only parses and plans them once per connection
+            "prepare_threshold": settings.db_prepare_threshold if settings.db_prepare_threshold >= 0 else None,
+        },
+    )
+    instrument_engine(engine)
+    return engine
+
 
 settings = get_settings()
-engine = create_async_engine(settings.database_url)
+engine = create_engine(settings)
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+read_engine = create_engine(settings, settings.read_database_url, "replica") if settings.read_database_url else engine
+async_read_session = async_sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def warm_up(engine: AsyncEngine, connections: int) -> None:
+    """Opens connections into an engine's pool ahead of the first requests, so they don't wait for connections to
+    be established. Failures are logged rather than raised, since the pool connects on demand anyway.
+
+    :param engine: The engine to open connections for
+    :type engine: AsyncEngine
+    :param connections: How many connections to open, limited to the pool size
+    :type connections: int
+    """
+    if not isinstance(engine.pool, QueuePool):
+        # Other pools, like the NullPool used in tests, don't keep connections open
+        return
+    connections = min(connections, engine.pool.size())
+    try:
+        async with AsyncExitStack() as stack:
+            # All the connections are held at once so each one is new, then they are returned to the pool together
+            opened = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(connections)))
+            for connection in opened:
+                await connection.execute(text("SELECT 1"))
+    except Exception:
+        logger.exception("Failed to warm up the %s database pool", engine.pool.logging_name)
+
+
+def reset_after_fork() -> None:
+    """Gives a forked worker its own connection pools. Connections the parent process opened are left alone
+    rather than closed, since the parent still owns them. To be called straight after forking, like from a
+    gunicorn ``post_fork`` hook when the app is preloaded."""
+    for pool_engine in {engine, read_engine}:
+        pool_engine.sync_engine.dispose(close=False)
+
+
+async def use_job_statement_timeout(session: AsyncSession) -> None:
+    """Swaps the connection's statement timeout for ``db_job_statement_timeout`` until the session's transaction
+    ends, with ``SET LOCAL``. Background jobs call this at the start of each transaction, so their long statements
+    aren't cancelled while the timeout requests run with stays as it is.
+
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    """
+    await super(AsyncSession, session).execute(
+        _SET_LOCAL_STATEMENT_TIMEOUT, {"timeout": str(get_settings().db_job_statement_timeout)}
+    )
+
+
+async def try_job_lock(job: str, session: AsyncSession) -> bool:
+    """Takes an advisory lock named after a background job until the session's transaction ends, unless another
+    worker holds it. Jobs that only need one worker to run them at a time call this at the start of each
+    transaction, and leave the work to the worker holding the lock if they don't get it.
+
+    :param job: The name of the job
+    :type job: str
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    :return: Whether the lock was taken
+    :rtype: bool
+    """
+    return bool((await super(AsyncSession, session).execute(_TRY_JOB_LOCK, {"job": job})).scalar_one())
 
 
 async def get_session() -> AsyncGenerator[AsyncSession]:
     """Get a new async session for the configured database engine. To be used as a FastAPI dependency."""
-    async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     async with async_session() as session:
         yield session
 
 
 get_session_context = asynccontextmanager(get_session)
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession]:
+    """Get a new async session for read-only queries, connected to the read replica if one is configured.
+    To be used as a FastAPI dependency."""
+    async with async_read_session() as session:
+        yield session
+
+
+get_read_session_context = asynccontextmanager(get_read_session)
+
+
+@asynccontextmanager
+async def hold_job_lock(job: str, session: AsyncSession) -> AsyncIterator[bool]:
+    """Holds the advisory lock named after a background job on the session's connection until the context exits,
+    unless another worker holds it, for jobs whose work runs outside of a transaction where ``try_job_lock`` wouldn't
+    last. The session has to keep its connection while the lock is held, so it mustn't commit inside the context.
+    The lock is the same one ``try_job_lock`` takes, so the two keep each other out.
+
+    :param job: The name of the job
+    :type job: str
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    :return: Yields whether the lock was taken
+    :rtype: AsyncIterator[bool]
+    """
+    taken = bool((await super(AsyncSession, session).execute(_TRY_SESSION_JOB_LOCK, {"job": job})).scalar_one())
+    try:
+        yield taken
+    finally:
+        if taken:
+            await super(AsyncSession, session).execute(_RELEASE_SESSION_JOB_LOCK, {"job": job})
@@ -0,0 +1,143 @@
+import hashlib
+import re
+import time
+from functools import lru_cache
+from typing import Any
+
+from prometheus_client.metrics import Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, ExceptionContext, ExecutionContext
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import db_query_duration_seconds, http_request_duration_seconds
+
+_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+\"?(\w+)", re.IGNORECASE)
+
+MAX_QUERY_FINGERPRINTS = 500
+"""How many distinct fingerprints queries are labelled with. Queries with new fingerprints past that, like ad hoc
+SQL with a varying shape, are labelled ``other`` so the metric's cardinality stays bounded."""
+
+_fingerprints: set[str] = set()
+
+
+@lru_cache(maxsize=1024)
+def query_fingerprint(statement: str) -> tuple[str, str, str]:
+    """Identifies a query by its normalized SQL, so executions with different parameters are grouped together.
+    Statements are cached, so fingerprinting a hot query is a dictionary lookup.
+
+    :param statement: The SQL sent to the database
+    :type statement: str
+    :return: The query's operation, like ``SELECT``, the first table it names, and a short hash of its SQL
+        with literals replaced and whitespace collapsed
+    :rtype: tuple[str, str, str]
+    """
+    normalized = _WHITESPACE_PATTERN.sub(" ", _LITERAL_PATTERN.sub("?", statement)).strip()
+    operation = normalized.split(" ", 1)[0].upper()
+    table = _TABLE_PATTERN.search(normalized)
+    digest = hashlib.blake2b(normalized.encode(), digest_size=6).hexdigest()
+    return operation, table[1].lower() if table else "", digest
+
+
+@lru_cache(maxsize=1024)
+def _query_histograms(statement: str) -> tuple[Histogram, Histogram]:
+    operation, table, fingerprint = query_fingerprint(statement)
+    if fingerprint not in _fingerprints:
+        if len(_fingerprints) >= MAX_QUERY_FINGERPRINTS:
+            fingerprint = "other"
+        else:
+            _fingerprints.add(fingerprint)
+    return (
+        db_query_duration_seconds.labels(operation, table, fingerprint, "success"),
+        db_query_duration_seconds.labels(operation, table, fingerprint, "error"),
+    )
+
+
+def _before_cursor_execute(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: ExecutionContext | None,
+    executemany: bool,
+) -> None:
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: ExecutionContext | None,
+    executemany: bool,
+) -> None:
+    duration = time.perf_counter() - conn.info["query_start_times"].pop()
+    _query_histograms(statement)[0].observe(duration)
+
+
+def _handle_error(context: ExceptionContext) -> None:
+    # Errors raised before the query was sent, like failing to connect, have no start time to pop
+    start_times = context.connection.info.get("query_start_times") if context.connection is not None else None
+    if start_times and context.statement is not None:
+        _query_histograms(context.statement)[1].observe(time.perf_counter() - start_times.pop())
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Times every query an engine executes in ``db_query_duration_seconds``, labelled by its fingerprint and
+    whether it raised an error.
+
+    :param engine: The engine to instrument
+    :type engine: AsyncEngine
+    """
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware that records how long each request takes in ``http_request_duration_seconds``, labelled
+    by the name of the route that handled it.
+
+    The time is taken when the last of the response is sent, so background tasks run after the response aren't
+    counted. Labelled histograms are looked up once for each combination of labels and reused.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._histograms: dict[tuple[str, str, int], Histogram] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        sent = False
+
+        async def send_and_record(message: Message) -> None:
+            nonlocal status, sent
+            await send(message)
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif not message.get("more_body", False):
+                sent = True
+                self._observe(scope, status, time.perf_counter() - start)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            # Unhandled errors are turned into a 500 further out, after this middleware has seen them
+            if not sent:
+                self._observe(scope, 500, time.perf_counter() - start)
+
+    def _observe(self, scope: Scope, status: int, duration: float) -> None:
+        # FastAPI puts the matched route in the scope, and so does the redirect fast path
+        route = scope.get("route")
+        key = (getattr(route, "name", None) or "unmatched", scope["method"], status)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = http_request_duration_seconds.labels(*key)
+        histogram.observe(duration)
@@ -0,0 +1,107 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Histogram buckets in seconds fine enough to tell sub-millisecond hot paths apart"""
+
+db_pool_checkout_seconds = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting to check out a connection from the database pool",
+    ["pool"],
+    buckets=LATENCY_BUCKETS,
+)
+
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out",
+    "The number of connections currently checked out of the database pool",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+db_pool_saturation = Gauge(
+    "db_pool_saturation",
+    "The fraction of the database pool's maximum connections that are checked out",
+    ["pool"],
+    multiprocess_mode="livemax",
+)
+
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last of its response",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing database queries, by the table they target, a fingerprint of their normalized SQL, and "
+    "whether they succeeded or raised an error",
+    ["operation", "table", "fingerprint", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+visit_record_lag_seconds = Histogram(
+    "visit_record_lag_seconds",
+    "Time from a redirect to its visit being committed to the stats, for the oldest visit in each write",
+    ["mode"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+visits_dropped = Counter(
+    "visits_dropped",
+    "Visits the visit buffer dropped without recording them, because it was full or they kept failing to be written",
+    ["reason"],
+)
+
+slug_cache_lookups = Counter(
+    "slug_cache_lookups",
+    "Slugs looked up in each worker's slug cache, by whether they were served from it or missed",
+    ["result"],
+)
+
+slug_cache_evictions = Counter(
+    "slug_cache_evictions",
+    "Entries evicted from each worker's slug cache to make room for new ones",
+)
+
+shared_slug_cache_lookups = Counter(
+    "shared_slug_cache_lookups",
+    "Shortlinks looked up in the slug cache shared by a machine's workers, by whether they were found in it",
+    ["result"],
+)
+
+stats_response_cache_lookups = Counter(
+    "stats_response_cache_lookups",
+    "Stats responses looked up in each worker's response cache, by whether they were served fresh, served stale "
+    "while being refreshed, or had to wait to be loaded",
+    ["result"],
+)
+
+slug_filter_checks = Counter(
+    "slug_filter_checks",
+    "Slugs checked against the slug filter, by whether the filter ruled them out, let them through to a query, "
+    "let them through as ids other workers may have just created, or wasn't ready to answer",
+    ["result"],
+)
+
+slug_filter_false_positives = Counter(
+    "slug_filter_false_positives",
+    "Slugs the slug filter let through to a query that found no shortlink",
+)
+
+slug_filter_items = Gauge(
+    "slug_filter_items",
+    "The number of shortlink ids in the slug filter",
+    multiprocess_mode="livemax",
+)
+
+slug_filter_bytes = Gauge(
+    "slug_filter_bytes",
+    "The memory used by the slug filter's bits",
+    multiprocess_mode="livesum",
+)
+
+slug_filter_expected_false_positive_rate = Gauge(
+    "slug_filter_expected_false_positive_rate",
+    "The fraction of slugs that don't exist the slug filter is expected to let through, given how full it is",
+    multiprocess_mode="livemax",
+)
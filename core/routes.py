@@ -0,0 +1,21 @@
+import os
+
+from fastapi import APIRouter, Depends, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from .admin import require_metrics_token
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False, name="Metrics", dependencies=[Depends(require_metrics_token)])
+async def get_metrics() -> Response:
+    """Exposes the service's metrics in the Prometheus text format.
+    When running under gunicorn with `PROMETHEUS_MULTIPROC_DIR` set, the metrics of every worker are aggregated.
+    Requests need `METRICS_TOKEN` as their bearer token."""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,215 @@
+"""Measures how long a worker takes to start, for keeping cold starts fast when machines scale to zero.
+
+Each measurement runs in a fresh interpreter, the way a worker starts after a cold start:
+
+    python -m core.startup imports --limit 20
+    python -m core.startup first-redirect /<slug> --budget 3
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import NamedTuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+"""The directory the app's packages are imported from"""
+
+TIME_TO_FIRST_REDIRECT_BUDGET = 3.0
+"""How long in seconds a fresh worker may take from starting its interpreter to sending its first redirect"""
+
+_FIRST_REDIRECT_SCRIPT = """
+import asyncio, json, sys, time
+
+started = time.time()
+from core.api import app
+imported = time.time()
+
+
+async def main(path):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"startup")],
+        "client": ("127.0.0.1", 0),
+        "server": ("startup", 80),
+    }
+    async with app.router.lifespan_context(app):
+        ready = time.time()
+        await app(scope, receive, send)
+        responded = time.time()
+    return {
+        "status": messages[0]["status"],
+        "started": started,
+        "imported": imported,
+        "ready": ready,
+        "responded": responded,
+    }
+
+
+print(json.dumps(asyncio.run(main(sys.argv[1]))))
+"""
+
+
+class ImportTime(NamedTuple):
+    """How long importing a module took, as reported by ``python -X importtime``"""
+
+    module: str
+    """The module's fully qualified name"""
+
+    self_us: int
+    """The microseconds spent importing the module itself"""
+
+    cumulative_us: int
+    """The microseconds spent importing the module and the modules it imported first"""
+
+    depth: int
+    """How deeply nested the import was, 0 for modules imported directly"""
+
+
+class FirstRedirectTiming(NamedTuple):
+    """How long each phase of a fresh worker's start took before it sent its first redirect, in seconds"""
+
+    status: int
+    """The status code of the first response"""
+
+    interpreter: float
+    """Starting the interpreter"""
+
+    imports: float
+    """Importing the app"""
+
+    startup: float
+    """Running the app's lifespan startup, like warming up the database pools"""
+
+    first_request: float
+    """Handling the first request"""
+
+    @property
+    def total(self) -> float:
+        """The time from starting the interpreter to sending the first redirect"""
+        return self.interpreter + self.imports + self.startup + self.first_request
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    """Parses the report ``python -X importtime`` writes to stderr, in the order modules finished importing.
+
+    :param output: The report, which may include other lines
+    :type output: str
+    :return: The time taken to import each module
+    :rtype: list[ImportTime]
+    """
+    times: list[ImportTime] = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            # The header line
+            continue
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append(ImportTime(module, int(self_us), int(cumulative_us), depth))
+    return times
+
+
+def import_times(module: str) -> list[ImportTime]:
+    """Imports a module in a fresh interpreter and returns how long each module it imported took"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def time_to_first_redirect(path: str) -> FirstRedirectTiming:
+    """Starts a fresh interpreter that imports the app, runs its lifespan startup, and handles a single request
+    in-process, and returns how long each phase took. The app connects to the database from the environment.
+
+    :param path: The path to request, like ``/<slug>`` for a shortlink that exists
+    :type path: str
+    :return: The status of the response and the time taken by each phase
+    :rtype: FirstRedirectTiming
+    """
+    launched = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", _FIRST_REDIRECT_SCRIPT, path],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timestamps = json.loads(result.stdout.splitlines()[-1])
+    return FirstRedirectTiming(
+        status=timestamps["status"],
+        interpreter=timestamps["started"] - launched,
+        imports=timestamps["imported"] - timestamps["started"],
+        startup=timestamps["ready"] - timestamps["imported"],
+        first_request=timestamps["responded"] - timestamps["ready"],
+    )
+
+
+def report_imports(module: str, limit: int) -> None:
+    """Prints the total time to import a module, then the packages and modules that took longest"""
+    times = import_times(module)
+    by_package: defaultdict[str, int] = defaultdict(int)
+    for import_time in times:
+        by_package[import_time.module.split(".", 1)[0]] += import_time.self_us
+    print(f"importing {module} took {sum(by_package.values()) / 1000:.0f} ms\n")
+    print(f"{'package':<40}{'ms':>8}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        print(f"{package:<40}{self_us / 1000:>8.1f}")
+    print(f"\n{'module':<40}{'self ms':>8}{'total ms':>10}")
+    for import_time in sorted(times, key=lambda import_time: import_time.self_us, reverse=True)[:limit]:
+        print(f"{import_time.module:<40}{import_time.self_us / 1000:>8.1f}{import_time.cumulative_us / 1000:>10.1f}")
+
+
+def report_first_redirect(path: str, budget: float) -> bool:
+    """Prints how long each phase of starting a worker took before its first redirect, and whether it was within
+    the budget"""
+    timing = time_to_first_redirect(path)
+    print(f"{'phase':<16}{'ms':>8}")
+    for phase in ("interpreter", "imports", "startup", "first_request", "total"):
+        print(f"{phase:<16}{getattr(timing, phase) * 1000:>8.0f}")
+    within_budget = timing.status == 307 and timing.total <= budget
+    print(f"\nresponded {timing.status}, {'within' if within_budget else 'over'} the budget of {budget:.1f}s")
+    return within_budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    imports_parser = commands.add_parser("imports", help="Report the slowest imports, parsed from -X importtime")
+    imports_parser.add_argument("--module", default="core.api", help="The module to import")
+    imports_parser.add_argument("--limit", type=int, default=15, help="How many packages and modules to list")
+    redirect_parser = commands.add_parser("first-redirect", help="Time a fresh worker's start until its first redirect")
+    redirect_parser.add_argument("path", help="The path of a shortlink to request, like /<slug>")
+    redirect_parser.add_argument(
+        "--budget", type=float, default=TIME_TO_FIRST_REDIRECT_BUDGET, help="The most seconds it may take"
+    )
+    args = parser.parse_args()
+    if args.command == "imports":
+        report_imports(args.module, args.limit)
+    elif not report_first_redirect(args.path, args.budget):
+        sys.exit(1)
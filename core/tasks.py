@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Runs a coroutine function in the background of a worker every ``interval`` seconds until stopped.
+    Failures are logged and don't stop later runs."""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[None]]) -> None:
+        self.name = name
+        """A name for the task, used when logging failures"""
+        self.interval = interval
+        """How often in seconds the task runs"""
+        self._func = func
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self, run_now: bool = False) -> None:
+        """Starts running the task periodically, with the first run after one interval.
+
+        :param run_now: Whether to also run the task straight away, in the background
+        :type run_now: bool
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(run_now))
+
+    async def stop(self) -> None:
+        """Stops running the task, cancelling a run that is in progress"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> None:
+        """Runs the task immediately, logging any failure"""
+        try:
+            await self._func()
+        except Exception:
+            logger.exception("Periodic task %r failed", self.name)
+
+    async def _run(self, run_now: bool) -> None:
+        if run_now:
+            await self.run_once()
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
@@ -0,0 +1,57 @@
+"""Gunicorn settings and hooks for running the app with several workers, loaded automatically from the working
+directory.
+
+The app is preloaded, so it's imported once before the workers are forked instead of once by every worker. On a
+machine with a single shared CPU, which is what a cold start after scaling to zero gets, that makes the workers
+ready several times sooner. Each worker gets its own database pools straight after forking.
+
+The master creates the slug cache shared by the workers before forking them, so they all map the same memory, and
+removes it once they've all exited.
+
+With `PROMETHEUS_MULTIPROC_DIR` set each worker writes its metrics to files in that directory, and `/metrics`
+aggregates the files of every worker so it reports the same totals whichever worker serves the scrape.
+"""
+
+import os
+import shutil
+import sys
+from typing import Any
+
+from prometheus_client import multiprocess
+
+from shortlinks.shared_cache import close_shared_slug_cache, create_shared_slug_cache
+
+preload_app = True
+
+
+def reset_metrics_directory() -> None:
+    """Clears out metrics left behind by workers from a previous run"""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def on_starting(server: Any) -> None:
+    """Clears out the metrics of a previous run and creates the slug cache shared by the workers, before any of them
+    are forked"""
+    reset_metrics_directory()
+    create_shared_slug_cache()
+
+
+def on_exit(server: Any) -> None:
+    """Removes the shared slug cache once every worker has exited"""
+    close_shared_slug_cache()
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    """Replaces the database pools a worker inherited from the preloaded app with its own"""
+    db = sys.modules.get("core.db")
+    if db is not None:
+        db.reset_after_fork()
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    """Stops reporting the live gauges of a worker that has exited"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)  # pyright: ignore[reportUnknownMemberType]
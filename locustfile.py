@@ -1,27 +1,132 @@
+import os
 import random
-import time
 
-from locust import FastHttpUser, task
+import psycopg
+from gevent import Greenlet, sleep, spawn
+from locust import FastHttpUser, between, events, task
+from locust.env import Environment
 
-
-def between(min_val: float, max_val: float) -> float:
-    return min_val + random.random() * (max_val - min_val)
+STAT_METRICS = ("visits", "unique_visitors", "last_visit", "trending")
 
 
 class ShortenUser(FastHttpUser):
+    """Creates shortlinks for varied URLs and revisits the ones it created, pausing between requests."""
+
+    wait_time = between(0.5, 4)
+    slugs: list[str]
+
+    def on_start(self) -> None:
+        self.slugs = []
+
     @task
     def shorten(self) -> None:
-        url = "http://google.com"
-        slug = ""
+        url = f"https://www.example.com/load-test/{random.getrandbits(64):x}"
         with self.rest("POST", "/shorten", json={"long_url": url}) as resp:
             if resp.js and "slug" in resp.js:
-                slug = resp.js["slug"]
+                self.slugs.append(resp.js["slug"])
             else:
                 resp.failure("Missing slug from response")
 
-        visits = random.randint(0, 15)
-        for _ in range(visits):
-            time.sleep(between(0.5, 4))
-            with self.client.get(f"/{slug}", name="/slug", catch_response=True, allow_redirects=False) as resp:
-                if resp.status_code != 307:
-                    resp.failure(f"Invalid status code: {resp.status_code}")
+    @task(5)
+    def visit(self) -> None:
+        if not self.slugs:
+            return
+        slug = random.choice(self.slugs)
+        with self.client.get(f"/{slug}", name="/slug", catch_response=True, allow_redirects=False) as resp:
+            if resp.status_code != 307:
+                resp.failure(f"Invalid status code: {resp.status_code}")
+
+
+class StatsDashboardUser(FastHttpUser):
+    """Polls the top stats like a dashboard, and drills into the stats of the shortlinks it sees."""
+
+    wait_time = between(1, 5)
+
+    @task
+    def top_stats(self) -> None:
+        metric = random.choice(STAT_METRICS)
+        with self.rest("GET", f"/stats?metric={metric}&limit=20", name="/stats") as resp:
+            if resp.js and random.random() < 0.5:
+                slug = random.choice(resp.js)["slug"]
+                self.client.get(f"/stats/{slug}", name="/stats/slug")
+
+
+class RedirectBurstUser(FastHttpUser):
+    """Follows a small set of shortlinks back to back to saturate the redirect path.
+
+    Run with `--pool-occupancy` to compare how many database connections are held per redirect.
+    """
+
+    slugs: list[str]
+
+    def on_start(self) -> None:
+        self.slugs = []
+        for i in range(10):
+            with self.rest("POST", "/shorten", json={"long_url": f"http://example.com/{i}"}) as resp:
+                if resp.js and "slug" in resp.js:
+                    self.slugs.append(resp.js["slug"])
+
+    @task
+    def redirect(self) -> None:
+        if not self.slugs:
+            return
+        slug = random.choice(self.slugs)
+        with self.client.get(f"/{slug}", name="/slug", catch_response=True, allow_redirects=False) as resp:
+            if resp.status_code != 307:
+                resp.failure(f"Invalid status code: {resp.status_code}")
+
+
+@events.init_command_line_parser.add_listener
+def add_arguments(parser) -> None:
+    parser.add_argument(
+        "--pool-occupancy",
+        action="store_true",
+        default=False,
+        help="Sample database connection states from pg_stat_activity using DATABASE_URL",
+    )
+
+
+def sample_pool_occupancy(environment: Environment, database_url: str) -> None:
+    """Reports connection counts by state every second as POOL requests, where the response time is the count.
+
+    Connections that are `active` or `idle in transaction` are checked out of the app's pools,
+    so their maximum under load shows how many pool slots the redirect path holds.
+    """
+    with psycopg.connect(database_url, autocommit=True) as conn:
+        while True:
+            rows = conn.execute("""
+                SELECT coalesce(state, 'unknown'), count(*)
+                FROM pg_stat_activity
+                WHERE datname = current_database()
+                    AND backend_type = 'client backend'
+                    AND pid <> pg_backend_pid()
+                GROUP BY state
+            """).fetchall()
+            counts = dict.fromkeys(("active", "idle", "idle in transaction"), 0) | dict(rows)
+            for state, count in counts.items():
+                environment.events.request.fire(
+                    request_type="POOL",
+                    name=state,
+                    response_time=count,
+                    response_length=0,
+                    exception=None,
+                    context={},
+                )
+            sleep(1)
+
+
+pool_samplers: list[Greenlet] = []
+
+
+@events.test_start.add_listener
+def start_pool_sampler(environment: Environment, **_kwargs) -> None:
+    if not environment.parsed_options or not environment.parsed_options.pool_occupancy:
+        return
+    database_url = os.environ["DATABASE_URL"].replace("+psycopg_async", "")
+    pool_samplers.append(spawn(sample_pool_occupancy, environment, database_url))
+
+
+@events.test_stop.add_listener
+def stop_pool_sampler(**_kwargs) -> None:
+    while pool_samplers:
+        pool_samplers.pop().kill()
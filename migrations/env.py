@@ -12,6 +12,7 @@ from core.config import get_settings
 # ensure models are registered
 from shortlinks import models as shortlinks_models  # noqa: F401  # pyright: ignore[reportUnusedImport]
 from stats import models as stats_models  # noqa: F401 # pyright: ignore[reportUnusedImport]
+from stats.partitions import is_partition_name
 
 config = context.config
 if config.config_file_name is not None:
@@ -24,6 +25,11 @@ if settings.database_url:
 target_metadata = SQLModel.metadata
 
 
+def include_name(name: str | None, type_: str, _: object) -> bool:
+    """Skips the visit event partitions, which are managed outside of migrations"""
+    return not (type_ == "table" and name is not None and is_partition_name(name))
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -42,6 +48,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -49,7 +56,7 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -0,0 +1,43 @@
+"""add_visit_buckets
+
+Revision ID: 5a7f2e940370
+Revises: 87d67635e98e
+Create Date: 2026-10-18 10:58:58.866828
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5a7f2e940370"
+down_revision: str | Sequence[str] | None = "87d67635e98e"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "shortlinkvisitbucket",
+        sa.Column("shortlink_id", sa.Uuid(), nullable=False),
+        sa.Column(
+            "granularity",
+            sa.Enum("hour", "day", name="bucketgranularity", native_enum=False, length=8),
+            nullable=False,
+        ),
+        sa.Column("bucket_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("visits", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["shortlink_id"],
+            ["shortlink.id"],
+        ),
+        sa.PrimaryKeyConstraint("shortlink_id", "granularity", "bucket_start"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("shortlinkvisitbucket")
@@ -0,0 +1,60 @@
+"""add_visit_events
+
+Revision ID: f57dab20a76a
+Revises: 5a7f2e940370
+Create Date: 2026-10-18 11:08:41.079191
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f57dab20a76a"
+down_revision: str | Sequence[str] | None = "5a7f2e940370"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "visitevent",
+        sa.Column("id", sa.BigInteger(), sa.Identity(always=False), nullable=False),
+        sa.Column("visited_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("shortlink_id", sa.Uuid(), nullable=False),
+        sa.Column("referrer", sqlmodel.sql.sqltypes.AutoString(length=2083), nullable=True),
+        sa.Column("user_agent", sqlmodel.sql.sqltypes.AutoString(length=512), nullable=True),
+        sa.Column("country", sqlmodel.sql.sqltypes.AutoString(length=2), nullable=True),
+        sa.PrimaryKeyConstraint("id", "visited_at"),
+        postgresql_partition_by="RANGE (visited_at)",
+    )
+    op.create_index("ix_visitevent_shortlink_id_visited_at", "visitevent", ["shortlink_id", "visited_at"], unique=False)
+    # Workers keep partitions created ahead of time, these let events be written straight after deploying
+    op.execute("""
+        DO $$
+        DECLARE
+            day date;
+        BEGIN
+            FOR day IN
+                SELECT generate_series((now() AT TIME ZONE 'UTC')::date, (now() AT TIME ZONE 'UTC')::date + 3, '1 day')
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF visitevent FOR VALUES FROM (%L) TO (%L)',
+                    'visitevent_p' || to_char(day, 'YYYYMMDD'),
+                    to_char(day, 'YYYY-MM-DD') || ' 00:00+00',
+                    to_char(day + 1, 'YYYY-MM-DD') || ' 00:00+00'
+                );
+            END LOOP;
+        END
+        $$;
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_visitevent_shortlink_id_visited_at", table_name="visitevent")
+    op.drop_table("visitevent")
@@ -0,0 +1,32 @@
+"""add_unique_visitors
+
+Revision ID: ed412e43e704
+Revises: f57dab20a76a
+Create Date: 2026-10-18 11:15:44.749310
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "ed412e43e704"
+down_revision: str | Sequence[str] | None = "f57dab20a76a"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("shortlinkstat", sa.Column("unique_visitors", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("shortlinkstat", sa.Column("visitor_sketch", sa.LargeBinary(), nullable=True))
+    op.create_index(op.f("ix_shortlinkstat_unique_visitors"), "shortlinkstat", ["unique_visitors"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_shortlinkstat_unique_visitors"), table_name="shortlinkstat")
+    op.drop_column("shortlinkstat", "visitor_sketch")
+    op.drop_column("shortlinkstat", "unique_visitors")
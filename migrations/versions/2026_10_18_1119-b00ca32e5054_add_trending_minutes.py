@@ -0,0 +1,33 @@
+"""add_trending_minutes
+
+Revision ID: b00ca32e5054
+Revises: ed412e43e704
+Create Date: 2026-10-18 11:19:30.833531
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b00ca32e5054"
+down_revision: str | Sequence[str] | None = "ed412e43e704"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "trendingminute",
+        sa.Column("minute_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("summary", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("minute_start"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("trendingminute")
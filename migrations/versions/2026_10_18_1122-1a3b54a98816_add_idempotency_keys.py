@@ -0,0 +1,40 @@
+"""add_idempotency_keys
+
+Revision ID: 1a3b54a98816
+Revises: b00ca32e5054
+Create Date: 2026-10-18 11:22:28.491581
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "1a3b54a98816"
+down_revision: str | Sequence[str] | None = "b00ca32e5054"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "idempotencykey",
+        sa.Column("key_hash", sa.LargeBinary(), nullable=False),
+        sa.Column("shortlink_id", sa.Uuid(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["shortlink_id"],
+            ["shortlink.id"],
+        ),
+        sa.PrimaryKeyConstraint("key_hash"),
+    )
+    op.create_index(op.f("ix_idempotencykey_created_at"), "idempotencykey", ["created_at"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_idempotencykey_created_at"), table_name="idempotencykey")
+    op.drop_table("idempotencykey")
@@ -0,0 +1,29 @@
+"""add_shortlink_id_sequence
+
+Revision ID: c3c134d70c0a
+Revises: 1a3b54a98816
+Create Date: 2026-10-18 11:25:58.389857
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c3c134d70c0a"
+down_revision: str | Sequence[str] | None = "1a3b54a98816"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Each call returns the first id of a new block of 1000, starting at 57 ** 6 so slugs are 7 characters long
+    op.execute(sa.schema.CreateSequence(sa.Sequence("shortlink_id_seq", start=34296447249, increment=1000)))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.schema.DropSequence(sa.Sequence("shortlink_id_seq")))
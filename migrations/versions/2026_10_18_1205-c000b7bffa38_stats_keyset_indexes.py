@@ -0,0 +1,73 @@
+"""stats_keyset_indexes
+
+Revision ID: c000b7bffa38
+Revises: c3c134d70c0a
+Create Date: 2026-10-18 12:05:17.976931
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c000b7bffa38"
+down_revision: str | Sequence[str] | None = "c3c134d70c0a"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+METRICS = ("visits", "unique_visitors", "last_visit")
+
+
+# shortlinkstat is written on every flush, so the indexes are built and dropped without locking out writes. That
+# can't be done in a transaction, and an index left invalid by a failed build is dropped before it's rebuilt.
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for metric in METRICS:
+            op.drop_index(
+                f"ix_shortlinkstat_{metric}_shortlink_id",
+                table_name="shortlinkstat",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+            op.create_index(
+                f"ix_shortlinkstat_{metric}_shortlink_id",
+                "shortlinkstat",
+                [metric, "shortlink_id"],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                op.f(f"ix_shortlinkstat_{metric}"),
+                table_name="shortlinkstat",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for metric in METRICS:
+            op.drop_index(
+                op.f(f"ix_shortlinkstat_{metric}"),
+                table_name="shortlinkstat",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+            op.create_index(
+                op.f(f"ix_shortlinkstat_{metric}"),
+                "shortlinkstat",
+                [metric],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f"ix_shortlinkstat_{metric}_shortlink_id",
+                table_name="shortlinkstat",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
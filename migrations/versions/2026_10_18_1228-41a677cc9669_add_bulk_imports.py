@@ -0,0 +1,71 @@
+"""add_bulk_imports
+
+Revision ID: 41a677cc9669
+Revises: c000b7bffa38
+Create Date: 2026-10-18 12:28:20.752473
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "41a677cc9669"
+down_revision: str | Sequence[str] | None = "c000b7bffa38"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "importjob",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("source", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum("loading", "merging", "done", name="importstatus", native_enum=False, length=8),
+            nullable=False,
+        ),
+        sa.Column("loaded_lines", sa.Integer(), nullable=False),
+        sa.Column("merged_rows", sa.Integer(), nullable=False),
+        sa.Column("imported_rows", sa.Integer(), nullable=False),
+        sa.Column("rejected_rows", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "importrejection",
+        sa.Column("job_id", sa.Uuid(), nullable=False),
+        sa.Column("line", sa.BigInteger(), nullable=False),
+        sa.Column("identifier", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("long_url", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("reason", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.ForeignKeyConstraint(["job_id"], ["importjob.id"]),
+        sa.PrimaryKeyConstraint("job_id", "line"),
+    )
+    op.create_table(
+        "importstagingrow",
+        sa.Column("job_id", sa.Uuid(), nullable=False),
+        sa.Column("line", sa.BigInteger(), nullable=False),
+        sa.Column("identifier", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("shortlink_id", sa.Uuid(), nullable=True),
+        sa.Column("long_url", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("visits", sa.Integer(), nullable=True),
+        sa.Column("last_visit", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("error", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.ForeignKeyConstraint(["job_id"], ["importjob.id"]),
+        sa.PrimaryKeyConstraint("job_id", "line"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("importstagingrow")
+    op.drop_table("importrejection")
+    op.drop_table("importjob")
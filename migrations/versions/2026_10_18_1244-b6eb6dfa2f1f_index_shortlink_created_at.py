@@ -0,0 +1,38 @@
+"""index_shortlink_created_at
+
+Revision ID: b6eb6dfa2f1f
+Revises: 41a677cc9669
+Create Date: 2026-10-18 12:44:21.389931
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b6eb6dfa2f1f"
+down_revision: str | Sequence[str] | None = "41a677cc9669"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+# shortlink is written on every create, so the index is built without locking out writes. That can't be done in a
+# transaction, and an index left invalid by a failed build is dropped before it's rebuilt.
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_shortlink_created_at"), table_name="shortlink", postgresql_concurrently=True, if_exists=True
+        )
+        op.create_index(
+            op.f("ix_shortlink_created_at"), "shortlink", ["created_at"], unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f("ix_shortlink_created_at"), table_name="shortlink", postgresql_concurrently=True)
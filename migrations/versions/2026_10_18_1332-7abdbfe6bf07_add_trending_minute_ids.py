@@ -0,0 +1,39 @@
+"""add_trending_minute_ids
+
+Revision ID: 7abdbfe6bf07
+Revises: b6eb6dfa2f1f
+Create Date: 2026-10-18 13:32:16.072801
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7abdbfe6bf07"
+down_revision: str | Sequence[str] | None = "b6eb6dfa2f1f"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "trendingminute", sa.Column("id", sa.Uuid(), server_default=sa.text("gen_random_uuid()"), nullable=False)
+    )
+    op.alter_column("trendingminute", "id", server_default=None)
+    op.drop_constraint("trendingminute_pkey", "trendingminute", type_="primary")
+    op.create_primary_key("trendingminute_pkey", "trendingminute", ["id"])
+    op.create_index(op.f("ix_trendingminute_minute_start"), "trendingminute", ["minute_start"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Minutes with a summary from each flush can't be merged in SQL, and trending summaries only last an hour
+    op.execute("DELETE FROM trendingminute")
+    op.drop_index(op.f("ix_trendingminute_minute_start"), table_name="trendingminute")
+    op.drop_constraint("trendingminute_pkey", "trendingminute", type_="primary")
+    op.create_primary_key("trendingminute_pkey", "trendingminute", ["minute_start"])
+    op.drop_column("trendingminute", "id")
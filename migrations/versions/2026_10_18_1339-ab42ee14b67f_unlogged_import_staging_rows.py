@@ -0,0 +1,32 @@
+"""unlogged_import_staging_rows
+
+Revision ID: ab42ee14b67f
+Revises: 7abdbfe6bf07
+Create Date: 2026-10-18 13:39:22.578766
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "ab42ee14b67f"
+down_revision: str | Sequence[str] | None = "7abdbfe6bf07"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("importjob", sa.Column("staged_rows", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("importjob", sa.Column("merged_lines", sa.Integer(), server_default="0", nullable=False))
+    op.execute("ALTER TABLE importstagingrow SET UNLOGGED")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE importstagingrow SET LOGGED")
+    op.drop_column("importjob", "merged_lines")
+    op.drop_column("importjob", "staged_rows")
@@ -0,0 +1,49 @@
+"""index_visit_buckets_for_pruning
+
+Revision ID: 991561fb6851
+Revises: ab42ee14b67f
+Create Date: 2026-10-18 13:54:15.170422
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "991561fb6851"
+down_revision: str | Sequence[str] | None = "ab42ee14b67f"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+# shortlinkvisitbucket is written on every visit flush, so the index is built without locking out writes. That can't
+# be done in a transaction, and an index left invalid by a failed build is dropped before it's rebuilt.
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_shortlinkvisitbucket_granularity_bucket_start",
+            table_name="shortlinkvisitbucket",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.create_index(
+            "ix_shortlinkvisitbucket_granularity_bucket_start",
+            "shortlinkvisitbucket",
+            ["granularity", "bucket_start"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_shortlinkvisitbucket_granularity_bucket_start",
+            table_name="shortlinkvisitbucket",
+            postgresql_concurrently=True,
+        )
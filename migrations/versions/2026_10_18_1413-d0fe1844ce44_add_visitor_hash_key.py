@@ -0,0 +1,33 @@
+"""add_visitor_hash_key
+
+Revision ID: d0fe1844ce44
+Revises: 991561fb6851
+Create Date: 2026-10-18 14:13:59.058454
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d0fe1844ce44"
+down_revision: str | Sequence[str] | None = "991561fb6851"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "visitorhashkey",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("key", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("visitorhashkey")
@@ -0,0 +1,28 @@
+"""cap_shortlink_id_sequence
+
+Revision ID: 107f5bb74b8d
+Revises: d0fe1844ce44
+Create Date: 2026-10-18 14:24:29.295007
+
+"""
+
+from collections.abc import Sequence
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "107f5bb74b8d"
+down_revision: str | Sequence[str] | None = "d0fe1844ce44"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 57 ** 10 - 1, the largest id that encodes to a 10 character slug
+    op.execute("ALTER SEQUENCE shortlink_id_seq MAXVALUE 362033331456891248")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER SEQUENCE shortlink_id_seq NO MAXVALUE")
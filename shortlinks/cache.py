@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import cache
+
+from core.config import get_settings
+from core.metrics import slug_cache_evictions, slug_cache_lookups
+
+from .models import Shortlink
+from .shared_cache import get_shared_slug_cache
+
+DEFAULT_SLUG_CACHE_SIZE = 10_000
+"""How many slug resolutions each worker keeps by default"""
+
+SHARED_SLUG_CACHE_WORKER_SIZE = 1_000
+"""How many slug resolutions each worker keeps by default when the workers share a slug cache, just enough for its
+hottest slugs, as shared cache hits are copied into the worker's cache"""
+
+
+class SlugCache:
+    """A bounded, per-worker LRU cache mapping slugs to shortlinks.
+
+    Shortlinks never change once created, so entries only expire to bound staleness of misses
+    and to let cold entries age out. Slugs that don't exist are cached as ``None`` with their
+    own, shorter TTL so repeated lookups of random slugs don't each cost a query.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        miss_ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        """The maximum number of entries to hold before evicting the least recently used"""
+        self.ttl = ttl
+        """How long in seconds a found shortlink is cached for"""
+        self.miss_ttl = miss_ttl
+        """How long in seconds a missing shortlink is cached for"""
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, Shortlink | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, slug: str) -> tuple[bool, Shortlink | None]:
+        """Looks up a slug in the cache.
+
+        :param slug: The slug to look up
+        :type slug: str
+        :return: Whether the slug was cached, and the cached shortlink or None if it is known not to exist
+        :rtype: tuple[bool, Shortlink | None]
+        """
+        entry = self._entries.get(slug)
+        if entry is None:
+            slug_cache_lookups.labels("miss").inc()
+            return False, None
+        expires_at, shortlink = entry
+        if expires_at <= self._clock():
+            del self._entries[slug]
+            slug_cache_lookups.labels("miss").inc()
+            return False, None
+        self._entries.move_to_end(slug)
+        slug_cache_lookups.labels("hit").inc()
+        return True, shortlink
+
+    def set(self, slug: str, shortlink: Shortlink | None) -> None:
+        """Caches the resolution of a slug, evicting the least recently used entries if full.
+
+        :param slug: The slug that was resolved
+        :type slug: str
+        :param shortlink: The shortlink the slug resolved to, or None if it does not exist
+        :type shortlink: Shortlink | None
+        """
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if shortlink else self.miss_ttl
+        self._entries[slug] = (self._clock() + ttl, shortlink)
+        self._entries.move_to_end(slug)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            slug_cache_evictions.inc()
+
+    def clear(self) -> None:
+        """Removes all entries"""
+        self._entries.clear()
+
+
+@cache
+def get_slug_cache() -> SlugCache:
+    """Returns the slug cache for this worker, sized from the settings"""
+    settings = get_settings()
+    max_size = settings.slug_cache_size
+    if max_size is None:
+        max_size = SHARED_SLUG_CACHE_WORKER_SIZE if get_shared_slug_cache() is not None else DEFAULT_SLUG_CACHE_SIZE
+    return SlugCache(
+        max_size=max_size,
+        ttl=settings.slug_cache_ttl,
+        miss_ttl=settings.slug_cache_miss_ttl,
+    )
@@ -0,0 +1,69 @@
+from fastapi import BackgroundTasks, Request, status
+from starlette.routing import Route
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.config import get_settings
+
+from .routes import track_visit
+from .service import ShortlinkService
+
+NOT_FOUND_BODY = b'{"detail":"Not Found"}'
+"""The body of the 404 response for a slug that doesn't exist, the same as the ``get_slug`` route's"""
+
+_NOT_FOUND_HEADERS = [(b"content-length", str(len(NOT_FOUND_BODY)).encode()), (b"content-type", b"application/json")]
+
+
+class RedirectFastPath:
+    """ASGI middleware that serves ``GET /{slug}`` redirects before FastAPI resolves dependencies, opens sessions,
+    or validates anything.
+
+    Slugs are resolved with ``ShortlinkService.resolve_slug``, so cache hits never touch the database, and the
+    response is written straight to the server with the shortlink's precomputed ``location`` header. Visits are
+    tracked and 404s returned exactly as by the ``get_slug`` route, which still documents the endpoint and serves
+    redirects if the fast path is disabled. Paths belonging to other routes, like ``/metrics``, are passed through.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._route_paths: frozenset[str] | None = None
+        self._redirect_route: Route | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET" or not get_settings().redirect_fast_path:
+            await self.app(scope, receive, send)
+            return
+        path: str = scope["path"]
+        slug = path[1:]
+        if not slug or "/" in slug or path in self._get_route_paths(scope):
+            await self.app(scope, receive, send)
+            return
+        # Set like FastAPI does for the routes it matches, so the request is reported as the route's in metrics
+        scope["route"] = self._redirect_route
+
+        shortlink = await ShortlinkService.resolve_slug(slug)
+        if shortlink is None:
+            await send(
+                {"type": "http.response.start", "status": status.HTTP_404_NOT_FOUND, "headers": _NOT_FOUND_HEADERS}
+            )
+            await send({"type": "http.response.body", "body": NOT_FOUND_BODY})
+            return
+
+        background_tasks = BackgroundTasks()
+        await track_visit(shortlink.id, Request(scope, receive), background_tasks)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status.HTTP_307_TEMPORARY_REDIRECT,
+                "headers": [(b"content-length", b"0"), (b"location", shortlink.location_header)],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})
+        await background_tasks()
+
+    def _get_route_paths(self, scope: Scope) -> frozenset[str]:
+        # Starlette puts the app in the scope before running its middleware, so its routes can be read from there
+        if self._route_paths is None:
+            routes = [route for route in scope["app"].routes if isinstance(route, Route)]
+            self._route_paths = frozenset(route.path for route in routes)
+            self._redirect_route = next((route for route in routes if route.name == "Access Shortlink"), None)
+        return self._route_paths
@@ -0,0 +1,463 @@
+"""A per-worker filter of every shortlink id, so requests for slugs that don't exist, mostly from bots and mistyped
+links, get a 404 without a query.
+
+The filter is a blocked Bloom filter: each id sets a pattern of bits within a single 64 bit word picked by its hash,
+so adding or checking an id costs one hash and one word. It can say an id might exist when it doesn't, at the
+configured false positive rate, but never the reverse. Each worker builds its filter in the background as it
+starts, adds the shortlinks it creates straight away, and adds those created by other workers every
+``SLUG_FILTER_SYNC_INTERVAL`` seconds. Compact ids that other workers may have handed out since the last sync are
+always looked up, so new shortlinks resolve everywhere as soon as they're created. Until the filter is built, or
+when it hasn't synced for a few intervals, every slug is looked up as before.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import time
+from array import array
+from collections import deque
+from collections.abc import Callable, Iterable
+from datetime import datetime, timedelta
+from functools import cache
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from core import db
+from core.config import get_settings
+from core.metrics import (
+    slug_filter_bytes,
+    slug_filter_checks,
+    slug_filter_expected_false_positive_rate,
+    slug_filter_false_positives,
+    slug_filter_items,
+)
+
+from .slugs import ID_BLOCK_MAX_AGE, ID_BLOCK_SIZE, ID_SEQUENCE_START, compact_number
+
+logger = logging.getLogger(__name__)
+
+BLOCK_BITS = 64
+"""How many bits each id's pattern is set within"""
+
+MAX_BITS_PER_ID = 16
+"""The most bits an id's pattern can set"""
+
+MIN_CAPACITY = 100_000
+"""The fewest ids a filter is sized for, so a new deployment doesn't rebuild its filter as soon as it's used"""
+
+CAPACITY_HEADROOM = 1.5
+"""How many times more ids than exist a filter is sized for, so it stays accurate while shortlinks are created
+until it's next rebuilt"""
+
+BUILD_BATCH_SIZE = 5000
+"""How many ids are fetched at a time while building a filter"""
+
+BUILD_CHUNK_SIZE = 1000
+"""How many ids are added to a new filter before the worker's other requests get a turn, about 2ms of work, so
+building the filter as a worker starts doesn't hold up its first requests"""
+
+SYNC_OVERLAP = timedelta(seconds=5)
+"""How far before the newest shortlink the last sync found each sync looks for new ones. A shortlink commits a
+little after its ``created_at``, and workers' clocks can differ, so a sync that only looked from the newest one
+could miss some."""
+
+STALE_AFTER_SYNC_INTERVALS = 3
+"""How many sync intervals can pass without a successful sync before the filter stops ruling out ids"""
+
+SEQUENCE_HEADROOM = 1_000_000
+"""How many ids past the last block reserved at the last sync other workers may have reserved since. Compact ids up
+to there are looked up rather than ruled out, while higher ones, like most random 7 character slugs, can't exist."""
+
+_PATTERN_HASH_BITS = 12
+
+# A replica has every shortlink committed up to the last transaction it replayed, which can be well before now()
+_SELECT_BUILD_START = text(
+    "SELECT coalesce(pg_last_xact_replay_timestamp(), now()), CAST(greatest(reltuples, 0) AS bigint) "
+    "FROM pg_class WHERE oid = CAST('shortlink' AS regclass)"
+)
+
+_SELECT_ALL_IDS = text("SELECT uuid_send(id) FROM shortlink")
+
+_SELECT_IDS_CREATED_SINCE = text("SELECT uuid_send(id), created_at FROM shortlink WHERE created_at > :since")
+
+# Bulk imports create shortlinks with their original creation time, so syncs can't find them by when they were
+# created. The filter is set aside while an import is merging and rebuilt once it has finished. The first id of
+# the last block reserved from the sequence is NULL until one has been.
+_SELECT_SYNC_START = text(
+    "SELECT now(), count(*) FILTER (WHERE status = 'merging'), max(updated_at), "
+    "(SELECT CASE WHEN is_called THEN last_value END FROM shortlink_id_seq) FROM importjob"
+)
+
+
+def false_positive_rate(ids_per_block: float, bits_per_id: int) -> float:
+    """Returns the expected fraction of ids that weren't added which a blocked Bloom filter says might have been,
+    with ids spread over its blocks at random.
+
+    :param ids_per_block: How many ids have been added per block on average
+    :type ids_per_block: float
+    :param bits_per_id: How many bits each id's pattern sets
+    :type bits_per_id: int
+    :return: The expected false positive rate
+    :rtype: float
+    """
+    if ids_per_block <= 0:
+        return 0.0
+    if ids_per_block > 500:
+        return 1.0
+    # The number of ids in a block is Poisson distributed, and an id is a false positive if all of its bits were
+    # set by the other ids in its block, or one of them was given the same pattern
+    rate = 0.0
+    probability = math.exp(-ids_per_block)
+    unset = 1 - bits_per_id / BLOCK_BITS
+    other_pattern = 1 - 1 / (1 << _PATTERN_HASH_BITS)
+    for ids in range(int(ids_per_block + 12 * math.sqrt(ids_per_block) + 30)):
+        rate += probability * (1 - (1 - (1 - unset**ids) ** bits_per_id) * other_pattern**ids)
+        probability *= ids_per_block / (ids + 1)
+    return rate
+
+
+def plan_filter(capacity: int, target_rate: float, max_bytes: int) -> tuple[int, int]:
+    """Sizes a blocked Bloom filter for the fewest blocks that keep its false positive rate at the target, or as
+    low as possible within the memory budget.
+
+    :param capacity: How many ids the filter should hold
+    :type capacity: int
+    :param target_rate: The highest acceptable false positive rate
+    :type target_rate: float
+    :param max_bytes: The most memory the filter's blocks may use
+    :type max_bytes: int
+    :return: How many blocks the filter has, and how many bits each id's pattern sets
+    :rtype: tuple[int, int]
+    """
+    max_blocks = max(max_bytes * 8 // BLOCK_BITS, 1)
+    best: tuple[int, int] | None = None
+    for bits_per_id in range(1, MAX_BITS_PER_ID + 1):
+        # Bisect for the most ids per block that keeps the rate at the target
+        low, high = 0.0, float(BLOCK_BITS)
+        for _ in range(30):
+            middle = (low + high) / 2
+            if false_positive_rate(middle, bits_per_id) <= target_rate:
+                low = middle
+            else:
+                high = middle
+        blocks = math.ceil(capacity / low) if low > 0 else max_blocks + 1
+        if best is None or blocks < best[0]:
+            best = (blocks, bits_per_id)
+    assert best is not None
+    blocks, bits_per_id = best
+    if blocks > max_blocks:
+        blocks = max_blocks
+        bits_per_id = min(range(1, MAX_BITS_PER_ID + 1), key=lambda bits: false_positive_rate(capacity / blocks, bits))
+    return blocks, bits_per_id
+
+
+@cache
+def bit_patterns(bits_per_id: int) -> array[int]:
+    """Returns the patterns of bits that ids set within their block, picked from by their hash. The patterns are
+    the same in every worker, though they don't have to be."""
+    generator = random.Random(bits_per_id)
+    patterns = array("Q")
+    for _ in range(1 << _PATTERN_HASH_BITS):
+        pattern = 0
+        while pattern.bit_count() < bits_per_id:
+            pattern |= 1 << generator.getrandbits(6)
+        patterns.append(pattern)
+    return patterns
+
+
+class ShortlinkIdFilter:
+    """A blocked Bloom filter of shortlink ids, sized for a number of ids and a false positive rate.
+
+    Each id is hashed, and sets one of a fixed table of bit patterns within one 64 bit block. That takes a single
+    read and write of the block, much quicker in Python than setting bits spread over the whole filter. In exchange
+    it needs more memory for the same false positive rate: about 35% more at 1%, and more again for lower rates.
+    """
+
+    def __init__(self, capacity: int, target_rate: float, max_bytes: int) -> None:
+        """Creates an empty filter.
+
+        :param capacity: How many ids the filter should hold at the target rate
+        :type capacity: int
+        :param target_rate: The highest acceptable false positive rate once the filter holds ``capacity`` ids
+        :type target_rate: float
+        :param max_bytes: The most memory the filter's bits may use, even if that means a higher rate
+        :type max_bytes: int
+        """
+        self.capacity = capacity
+        """How many ids the filter was sized for"""
+        blocks, bits_per_id = plan_filter(capacity, target_rate, max_bytes)
+        self.bits_per_id = bits_per_id
+        """How many bits each id's pattern sets"""
+        self._blocks = array("Q", bytes(blocks * BLOCK_BITS // 8))
+        self._patterns = bit_patterns(self.bits_per_id)
+        self._count = 0
+
+    def __len__(self) -> int:
+        """The number of ids added. Adding an id whose bits were all already set isn't counted, so ids added more
+        than once are only counted once."""
+        return self._count
+
+    @property
+    def size_bytes(self) -> int:
+        """The memory used by the filter's bits"""
+        return len(self._blocks) * self._blocks.itemsize
+
+    @property
+    def expected_false_positive_rate(self) -> float:
+        """The fraction of ids that weren't added which the filter is expected to say might have been"""
+        return false_positive_rate(self._count / len(self._blocks), self.bits_per_id)
+
+    def add(self, shortlink_id: UUID) -> None:
+        """Adds a shortlink id to the filter"""
+        self.add_many((shortlink_id.bytes,))
+
+    def add_many(self, ids: Iterable[bytes]) -> None:
+        """Adds many shortlink ids to the filter, each as the 16 bytes of its UUID"""
+        blocks, patterns, block_count = self._blocks, self._patterns, len(self._blocks)
+        blake2b, from_bytes = hashlib.blake2b, int.from_bytes
+        pattern_mask = (1 << _PATTERN_HASH_BITS) - 1
+        for id_bytes in ids:
+            digest = from_bytes(blake2b(id_bytes, digest_size=8).digest())
+            index = (digest >> _PATTERN_HASH_BITS) % block_count
+            pattern = patterns[digest & pattern_mask]
+            block = blocks[index]
+            if block & pattern != pattern:
+                blocks[index] = block | pattern
+                self._count += 1
+
+    def might_contain(self, shortlink_id: UUID) -> bool:
+        """Checks whether a shortlink id might have been added. If not, it certainly wasn't."""
+        digest = int.from_bytes(hashlib.blake2b(shortlink_id.bytes, digest_size=8).digest())
+        pattern = self._patterns[digest & ((1 << _PATTERN_HASH_BITS) - 1)]
+        return self._blocks[(digest >> _PATTERN_HASH_BITS) % len(self._blocks)] & pattern == pattern
+
+
+class SlugFilter:
+    """A worker's filter of every shortlink id, kept up to date in the background.
+
+    The filter is built from every shortlink id on the read replica, then synced with the primary every
+    ``sync_interval`` seconds to add the shortlinks other workers have created since, and rebuilt every
+    ``rebuild_interval`` seconds or once it holds more ids than it was sized for. Checks and false positives are
+    counted in the ``slug_filter_checks`` and ``slug_filter_false_positives`` metrics.
+
+    Other workers hand out compact ids from blocks they reserved up to ``ID_BLOCK_MAX_AGE`` seconds earlier, so an
+    id is only ruled out if its block was reserved long enough before the last sync that it has to have been synced.
+    Ids from blocks reserved since then are looked up, and ids past any block that could have been reserved yet are
+    ruled out.
+    """
+
+    def __init__(
+        self,
+        target_rate: float,
+        max_bytes: int,
+        sync_interval: float,
+        rebuild_interval: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.target_rate = target_rate
+        """The highest acceptable false positive rate"""
+        self.max_bytes = max_bytes
+        """The most memory the filter's bits may use"""
+        self.sync_interval = sync_interval
+        """How often in seconds shortlinks created by other workers are added"""
+        self.rebuild_interval = rebuild_interval
+        """How often in seconds the filter is rebuilt from every shortlink id"""
+        self.settle_time = timedelta(seconds=ID_BLOCK_MAX_AGE) + SYNC_OVERLAP
+        """How long after a block of ids is reserved every shortlink created with them has been committed"""
+        self._clock = clock
+        self._filter: ShortlinkIdFilter | None = None
+        self._built_at: datetime | None = None
+        self._rebuilt_at = 0.0
+        self._newest_created_at: datetime | None = None
+        self._last_synced: float | None = None
+        self._reserved_ids: deque[tuple[datetime, int]] = deque()
+        self._settled_id = ID_SEQUENCE_START - 1
+        self._max_possible_id = ID_SEQUENCE_START - 1
+        self._paused = False
+        self._added_while_building: list[UUID] | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._filter) if self._filter else 0
+
+    @property
+    def ready(self) -> bool:
+        """Whether the filter has been built, and synced recently enough to rule out ids"""
+        return (
+            self._filter is not None
+            and not self._paused
+            and self._last_synced is not None
+            and self._clock() - self._last_synced <= STALE_AFTER_SYNC_INTERVALS * self.sync_interval
+        )
+
+    def might_exist(self, shortlink_id: UUID) -> bool:
+        """Checks whether a shortlink might exist. If not, it certainly doesn't, unless it has a random UUID and was
+        created by another worker since the last sync. Every shortlink might exist while the filter isn't ready.
+
+        :param shortlink_id: The UUID of the shortlink
+        :type shortlink_id: UUID
+        :return: False if the shortlink doesn't exist, True if it needs to be looked up
+        :rtype: bool
+        """
+        if self._filter is None or not self.ready:
+            if self._task is not None:
+                slug_filter_checks.labels("unavailable").inc()
+            return True
+        if self._filter.might_contain(shortlink_id):
+            slug_filter_checks.labels("present").inc()
+            return True
+        number = compact_number(shortlink_id)
+        if number is not None and self._settled_id < number <= self._max_possible_id:
+            slug_filter_checks.labels("recent").inc()
+            return True
+        slug_filter_checks.labels("absent").inc()
+        return False
+
+    def might_be_created(self, shortlink_id: UUID) -> bool:
+        """Checks whether a shortlink that doesn't exist might still be created with an id. Compact ids are handed out
+        in order, so that's only ruled out for those from blocks that had settled by the last sync, while random
+        UUIDs can't be guessed ahead of time.
+
+        :param shortlink_id: The UUID of the shortlink
+        :type shortlink_id: UUID
+        :return: True if the id may be handed out later, so a miss for it shouldn't be cached
+        :rtype: bool
+        """
+        number = compact_number(shortlink_id)
+        return number is not None and not (self.ready and number <= self._settled_id)
+
+    def record_false_positive(self) -> None:
+        """Counts a shortlink that might have existed according to the filter but was found not to"""
+        if self.ready:
+            slug_filter_false_positives.inc()
+
+    def add(self, shortlink_id: UUID) -> None:
+        """Adds a shortlink this worker has created, so it's found straight away"""
+        if self._filter is not None:
+            self._filter.add(shortlink_id)
+        if self._added_while_building is not None:
+            self._added_while_building.append(shortlink_id)
+
+    async def rebuild(self) -> None:
+        """Builds a new filter from every shortlink id and replaces the current one with it"""
+        self._added_while_building = []
+        try:
+            async with db.read_engine.connect() as connection:
+                built_at, estimated_count = (await connection.execute(_SELECT_BUILD_START)).one()
+                capacity = int(max(estimated_count, len(self)) * CAPACITY_HEADROOM)
+                new_filter = ShortlinkIdFilter(max(capacity, MIN_CAPACITY), self.target_rate, self.max_bytes)
+                result = await connection.stream(_SELECT_ALL_IDS, execution_options={"yield_per": BUILD_BATCH_SIZE})
+                async for rows in result.partitions():
+                    for start in range(0, len(rows), BUILD_CHUNK_SIZE):
+                        new_filter.add_many(row[0] for row in rows[start : start + BUILD_CHUNK_SIZE])
+                        await asyncio.sleep(0)
+            # Shortlinks committed to the primary since the replica last caught up, or created by this worker while
+            # the ids were read, may have been missed by the read
+            async with db.engine.connect() as connection:
+                newest_created_at = await self._add_created_since(new_filter, built_at, connection)
+            for shortlink_id in self._added_while_building:
+                new_filter.add(shortlink_id)
+        finally:
+            self._added_while_building = None
+        self._filter = new_filter
+        self._built_at = built_at
+        self._newest_created_at = max(built_at, newest_created_at or built_at)
+        self._rebuilt_at = self._clock()
+        self._report()
+
+    async def sync(self) -> bool:
+        """Adds the shortlinks created by any worker since the last sync, and sets the filter aside while a bulk
+        import is merging.
+
+        :return: Whether the filter needs rebuilding because a bulk import has finished since it was built
+        :rtype: bool
+        """
+        async with db.engine.connect() as connection:
+            synced_at, merging_imports, last_import, last_block = (await connection.execute(_SELECT_SYNC_START)).one()
+            imported = last_import is not None and self._built_at is not None and last_import > self._built_at
+            self._paused = bool(merging_imports) or imported
+            if self._filter is None or self._newest_created_at is None:
+                return False
+            newest_created_at = await self._add_created_since(self._filter, self._newest_created_at, connection)
+        if newest_created_at is not None:
+            # A shortlink from a worker whose clock is ahead mustn't move the next sync past others created since
+            self._newest_created_at = min(max(self._newest_created_at, newest_created_at), synced_at)
+        self._track_reserved_ids(
+            synced_at, ID_SEQUENCE_START - 1 if last_block is None else last_block + ID_BLOCK_SIZE - 1
+        )
+        self._last_synced = self._clock()
+        self._report()
+        return imported and not merging_imports
+
+    def start(self) -> None:
+        """Starts building the filter, and then keeping it up to date, in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops keeping the filter up to date"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _add_created_since(
+        self, id_filter: ShortlinkIdFilter, newest_created_at: datetime, connection: AsyncConnection
+    ) -> datetime | None:
+        # Only shortlinks created shortly before the newest one already found are read again, so under load each
+        # new id is only read by a sync or two
+        result = await connection.execute(_SELECT_IDS_CREATED_SINCE, {"since": newest_created_at - SYNC_OVERLAP})
+        rows = result.all()
+        id_filter.add_many(id_bytes for id_bytes, _ in rows)
+        return max((created_at for _, created_at in rows), default=None)
+
+    def _track_reserved_ids(self, synced_at: datetime, last_reserved_id: int) -> None:
+        self._reserved_ids.append((synced_at, last_reserved_id))
+        self._max_possible_id = last_reserved_id + SEQUENCE_HEADROOM
+        # Every id reserved long enough before this sync had been handed out and committed by the time it ran, so
+        # the last one reserved then is the highest id the filter can rule out
+        settled_at = synced_at - self.settle_time
+        while len(self._reserved_ids) > 1 and self._reserved_ids[1][0] <= settled_at:
+            self._reserved_ids.popleft()
+        if self._reserved_ids[0][0] <= settled_at:
+            self._settled_id = self._reserved_ids[0][1]
+
+    def _needs_rebuild(self) -> bool:
+        return (
+            self._filter is None
+            or self._clock() - self._rebuilt_at >= self.rebuild_interval
+            or len(self._filter) > self._filter.capacity
+        )
+
+    def _report(self) -> None:
+        if self._filter is not None:
+            slug_filter_items.set(len(self._filter))
+            slug_filter_bytes.set(self._filter.size_bytes)
+            slug_filter_expected_false_positive_rate.set(self._filter.expected_false_positive_rate)
+
+    async def _run(self) -> None:
+        imported = False
+        while True:
+            try:
+                if imported or self._needs_rebuild():
+                    await self.rebuild()
+                imported = await self.sync()
+            except Exception:
+                logger.exception("Failed to update the slug filter")
+            await asyncio.sleep(self.sync_interval)
+
+
+@cache
+def get_slug_filter() -> SlugFilter:
+    """Returns the slug filter for this worker, configured from the settings"""
+    settings = get_settings()
+    return SlugFilter(
+        target_rate=settings.slug_filter_false_positive_rate,
+        max_bytes=settings.slug_filter_max_bytes,
+        sync_interval=settings.slug_filter_sync_interval,
+        rebuild_interval=settings.slug_filter_rebuild_interval,
+    )
@@ -1,12 +1,15 @@
+import hashlib
 import uuid
 from datetime import UTC, datetime
 from functools import cached_property
+from urllib.parse import quote
 
-import shortuuid
-from sqlmodel import Column, DateTime, Field, SQLModel
+from sqlmodel import Column, DateTime, Field, LargeBinary, SQLModel
 
 from core.config import get_settings
 
+from .slugs import get_slug_codec
+
 
 class Shortlink(SQLModel, table=True):
     """A model containing a mapping of UUID to long URL, also known as shortlinks"""
@@ -19,17 +22,59 @@ class Shortlink(SQLModel, table=True):
 
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(UTC),
-        sa_column=Column(DateTime(timezone=True), nullable=False),
+        sa_column=Column(DateTime(timezone=True), nullable=False, index=True),
     )
-    """When the shortlink was created"""
+    """When the shortlink was created, indexed so workers can find the shortlinks created since they last looked"""
 
     @cached_property
     def slug(self) -> str:
         """The URL-friendly shortened form of the shortlink's UUID"""
-        return shortuuid.encode(self.id)
+        return self.encode_slug(self.id)
 
     @cached_property
     def short_url(self) -> str:
         """The URL to the service where this shortlink is hosted"""
+        return self.build_short_url(self.slug)
+
+    @cached_property
+    def location_header(self) -> bytes:
+        """The long URL quoted for the ``location`` header of a redirect, the same way ``RedirectResponse`` does"""
+        return quote(self.long_url, safe=":/%#?=@[]!$&'()*+,;").encode("latin-1")
+
+    @staticmethod
+    def encode_slug(shortlink_id: uuid.UUID) -> str:
+        """Encodes a shortlink's UUID into its slug with the configured slug codec"""
+        return get_slug_codec().encode(shortlink_id)
+
+    @staticmethod
+    def decode_slug(slug: str) -> uuid.UUID | None:
+        """Decodes a slug into a shortlink's UUID with the configured slug codec, or None if the slug is invalid"""
+        return get_slug_codec().decode(slug)
+
+    @staticmethod
+    def build_short_url(slug: str) -> str:
+        """Builds the URL to the service where the shortlink with the given slug is hosted"""
         settings = get_settings()
-        return f"{settings.service_root}/{self.slug}"
+        return f"{settings.service_root}/{slug}"
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """A model mapping a hash of a client's idempotency key to the shortlink created with it, so retried requests
+    return the original shortlink. Only a hash of the key is stored, never the long URL."""
+
+    key_hash: bytes = Field(sa_column=Column(LargeBinary, primary_key=True))
+    """A hash of the idempotency key, used as the primary key for this table"""
+
+    shortlink_id: uuid.UUID = Field(foreign_key="shortlink.id")
+    """The id of the shortlink created with the key"""
+
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False, index=True),
+    )
+    """When the key was first used, after which it expires once its TTL has passed"""
+
+    @staticmethod
+    def hash_key(key: str) -> bytes:
+        """Hashes an idempotency key into the 16 bytes that are stored"""
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
@@ -1,12 +1,17 @@
 from datetime import UTC, datetime
 from typing import Annotated, Self
+from uuid import UUID
 
-from fastapi import APIRouter, BackgroundTasks, Depends, Path, Response, status
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Path, Request, Response, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, RedirectResponse
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, ValidationError
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from core.db import get_session
+from core.config import get_settings
+from core.db import get_read_session, get_session
+from stats.buffer import get_visit_buffer
+from stats.events import get_visit_event_ingester, visit_event_from_request, visitor_hash_from_request
 from stats.service import StatsService
 
 from .models import Shortlink as ShortlinkModel
@@ -19,6 +24,16 @@ class ShortlinkCreate(BaseModel):
     long_url: HttpUrl = Field(description="The long URL to point the new shortlink to")
 
 
+class ShortlinkBatchCreate(BaseModel):
+    """The input for creating many shortlinks at once"""
+
+    long_urls: list[HttpUrl] = Field(
+        description="The long URLs to create shortlinks for",
+        min_length=1,
+        max_length=get_settings().shorten_batch_max_size,
+    )
+
+
 class Shortlink(BaseModel):
     """A response detailing a newly created shortlink"""
 
@@ -36,29 +51,165 @@ class Shortlink(BaseModel):
         )
 
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 router = APIRouter()
 
 
+async def read_ndjson_urls(request: Request) -> list[str]:
+    """Reads and validates a streamed NDJSON request body with one `ShortlinkCreate` object per line.
+
+    :param request: The request to read the body of
+    :type request: Request
+    :raises RequestValidationError: If any line is invalid or there are too many lines
+    :return: The long URLs from each line, in order
+    :rtype: list[str]
+    """
+    max_size = get_settings().shorten_batch_max_size
+    long_urls: list[str] = []
+    errors: list[dict[str, object]] = []
+
+    def read_line(line: bytes) -> None:
+        if not line.strip():
+            return
+        index = len(long_urls) + len(errors)
+        if index >= max_size:
+            raise RequestValidationError(
+                [
+                    {
+                        "type": "too_long",
+                        "loc": ("body",),
+                        "msg": f"Batches should have at most {max_size} URLs",
+                        "input": None,
+                    }
+                ]
+            )
+        try:
+            long_urls.append(str(ShortlinkCreate.model_validate_json(line).long_url))
+        except ValidationError as e:
+            errors.extend({**error, "loc": ("body", index, *error["loc"])} for error in e.errors())
+
+    remainder = b""
+    async for chunk in request.stream():
+        *lines, remainder = (remainder + chunk).split(b"\n")
+        for line in lines:
+            read_line(line)
+    read_line(remainder)
+    if not long_urls and not errors:
+        raise RequestValidationError(
+            [{"type": "too_short", "loc": ("body",), "msg": "Batches should have at least 1 URL", "input": None}]
+        )
+    if errors:
+        raise RequestValidationError(errors)
+    return long_urls
+
+
 @router.post("/shorten", status_code=status.HTTP_201_CREATED, response_model=Shortlink, name="Shorten URL")
 async def post_shorten(
     shortlink_create: ShortlinkCreate,
     session: Annotated[AsyncSession, Depends(get_session)],
+    response: Response,
+    idempotency_key: Annotated[
+        str | None,
+        Header(
+            alias="Idempotency-Key",
+            min_length=1,
+            max_length=255,
+            description="A unique key for this creation, so retrying the request returns the original shortlink",
+        ),
+    ] = None,
 ) -> Shortlink:
-    """Create a new shortlink with the given long URL and return it"""
-    shortlink = await ShortlinkService.create(str(shortlink_create.long_url), session)
+    """Create a new shortlink with the given long URL and return it.
+    Retries sent with the same `Idempotency-Key` return the original shortlink with an `Idempotent-Replayed` header."""
+    long_url = str(shortlink_create.long_url)
+    if idempotency_key is None:
+        return Shortlink.from_model(await ShortlinkService.create(long_url, session))
+    shortlink, created = await ShortlinkService.create_idempotent(long_url, idempotency_key, session)
+    if shortlink.long_url != long_url:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "value_error",
+                    "loc": ("header", "Idempotency-Key"),
+                    "msg": "The idempotency key was already used to shorten a different URL",
+                    "input": idempotency_key,
+                }
+            ]
+        )
+    if not created:
+        response.headers["Idempotent-Replayed"] = "true"
     return Shortlink.from_model(shortlink)
 
 
+@router.post(
+    "/shorten/batch",
+    status_code=status.HTTP_201_CREATED,
+    response_model=list[Shortlink],
+    name="Shorten URLs in Batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": ShortlinkBatchCreate.model_json_schema()},
+                NDJSON_MEDIA_TYPE: {"schema": ShortlinkCreate.model_json_schema()},
+            },
+        },
+    },
+)
+async def post_shorten_batch(
+    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
+) -> list[Shortlink]:
+    """Create new shortlinks for many long URLs at once, returned in the same order as the URLs.
+    URLs can be sent as a JSON object, or streamed as NDJSON with one `{"long_url": ...}` object per line."""
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        long_urls = await read_ndjson_urls(request)
+    else:
+        try:
+            batch = ShortlinkBatchCreate.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()]) from e
+        long_urls = [str(long_url) for long_url in batch.long_urls]
+    shortlinks = await ShortlinkService.create_many(long_urls, session)
+    return [Shortlink.from_model(shortlink) for shortlink in shortlinks]
+
+
+async def track_visit(shortlink_id: UUID, request: Request, background_tasks: BackgroundTasks) -> None:
+    """Records a visit to a shortlink, either buffered or in a background task, and queues its visit event.
+
+    :param shortlink_id: The UUID of the visited shortlink
+    :type shortlink_id: UUID
+    :param request: The request for the shortlink
+    :type request: Request
+    :param background_tasks: The tasks to run once the redirect has been sent
+    :type background_tasks: BackgroundTasks
+    """
+    visited_at = datetime.now(UTC)
+    visitor_hash = visitor_hash_from_request(request)
+    settings = get_settings()
+    if settings.visit_write_behind:
+        get_visit_buffer().add(shortlink_id, visited_at, visitor_hash)
+    else:
+        background_tasks.add_task(StatsService.record_visit_in_new_session, shortlink_id, visited_at, visitor_hash)
+    if settings.visit_events_enabled:
+        await get_visit_event_ingester().add(visit_event_from_request(shortlink_id, visited_at, request))
+
+
 @router.get("/{slug}", status_code=status.HTTP_307_TEMPORARY_REDIRECT, response_model=None, name="Access Shortlink")
 async def get_slug(
     slug: Annotated[str, Path(description="The slug used to identify the shortlink")],
+    request: Request,
     background_tasks: BackgroundTasks,
-    session: Annotated[AsyncSession, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    primary_session: Annotated[AsyncSession, Depends(get_session)],
 ) -> Response:
     """Redirect using the given shortlink, or return a 404 if none is found"""
-    shortlink = await ShortlinkService.from_slug(slug, session)
+    shortlink = await ShortlinkService.from_slug(slug, session, primary_session)
+    # Return the connections to their pools now rather than holding them while the response is sent
+    await session.close()
+    await primary_session.close()
     if not shortlink:
         return JSONResponse({"detail": "Not Found"}, status_code=status.HTTP_404_NOT_FOUND)
 
-    background_tasks.add_task(StatsService.record_visit, shortlink.id, datetime.now(UTC), session)
+    await track_visit(shortlink.id, request, background_tasks)
     return RedirectResponse(shortlink.long_url)
@@ -1,32 +1,137 @@
 from collections.abc import Sequence
+from datetime import UTC, datetime, timedelta
 from uuid import UUID
 
-import shortuuid
-from sqlmodel import col, select
+from sqlalchemy import Uuid, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlmodel import col, delete, insert, select, text
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .models import Shortlink
+from core import db
+from core.config import get_settings
+
+from .cache import get_slug_cache
+from .filter import get_slug_filter
+from .models import IdempotencyKey, Shortlink
+from .shared_cache import get_shared_slug_cache
+from .slugs import get_slug_codec
+
+_SELECT_SHORTLINK = select(Shortlink).where(col(Shortlink.id) == bindparam("shortlink_id"))
+_SELECT_SHORTLINKS = select(Shortlink).where(
+    col(Shortlink.id) == any_(bindparam("shortlink_ids", type_=ARRAY(Uuid(as_uuid=True))))
+)
+_SELECT_LONG_URL = text("SELECT long_url, created_at FROM shortlink WHERE id = :shortlink_id")
+
+
+def _from_shared_cache(slug: str, shortlink_id: UUID) -> Shortlink | None:
+    """Looks a shortlink up in the slug cache shared by the machine's workers, and keeps a hit in the worker's own
+    slug cache so it's not decoded from shared memory again while it's hot"""
+    shared_cache = get_shared_slug_cache()
+    shortlink = shared_cache.get(shortlink_id) if shared_cache is not None else None
+    if shortlink is not None:
+        get_slug_cache().set(slug, shortlink)
+    return shortlink
+
+
+def _cache_shortlink(slug: str, shortlink_id: UUID, shortlink: Shortlink | None) -> None:
+    """Caches a slug's resolution in the worker's slug cache, and a shortlink that exists in the shared one too.
+    Misses aren't cached for compact ids that may still be handed out, so a scanner counting up through slugs can't
+    make a shortlink created with one of them a 404 on this worker until the miss expires."""
+    if shortlink is None and get_slug_filter().might_be_created(shortlink_id):
+        return
+    get_slug_cache().set(slug, shortlink)
+    shared_cache = get_shared_slug_cache()
+    if shortlink is not None and shared_cache is not None:
+        shared_cache.set(shortlink)
 
 
 class ShortlinkService:
     """Service to handle creation and retrieval of shortlinks"""
 
     @classmethod
-    async def from_slug(cls, slug: str, session: AsyncSession) -> Shortlink | None:
+    async def from_slug(
+        cls,
+        slug: str,
+        session: AsyncSession,
+        fallback_session: AsyncSession | None = None,
+    ) -> Shortlink | None:
         """Retrieves a shortlink instance from a slug.
+        Resolutions are served from the worker's slug cache, or the slug cache shared by the machine's workers,
+        when possible, so a hit never uses the session, and slugs the worker's slug filter rules out aren't looked
+        up at all.
 
         :param slug: The short UUID slug for a shortlink
         :type slug: str
         :param session: An async session connected to a database
         :type session: AsyncSession
+        :param fallback_session: A session connected to the primary database, used when ``session`` is
+            connected to a read replica that may not have caught up with a recently created shortlink
+        :type fallback_session: AsyncSession | None
         :returns: The retrieved Shortlink instance or None if not found
         :rtype: Shortlink | None
         """
-        try:
-            uuid = shortuuid.decode(slug)
-        except ValueError:
+        slug_cache = get_slug_cache()
+        cached, shortlink = slug_cache.get(slug)
+        if shortlink is not None:
+            return shortlink
+        uuid = Shortlink.decode_slug(slug)
+        if uuid is None:
             return None
-        return await session.get(Shortlink, uuid)
+        # Another worker may have created the shortlink since this worker cached it as missing
+        if shortlink := _from_shared_cache(slug, uuid):
+            return shortlink
+        if cached:
+            return None
+        slug_filter = get_slug_filter()
+        # Slugs ruled out by the filter aren't cached, so they can't push out the slugs that do exist
+        if not slug_filter.might_exist(uuid):
+            return None
+        params = {"shortlink_id": uuid}
+        shortlink = (await session.exec(_SELECT_SHORTLINK, params=params)).first()
+        if shortlink is None and fallback_session is not None and fallback_session.bind is not session.bind:
+            shortlink = (await fallback_session.exec(_SELECT_SHORTLINK, params=params)).first()
+        if shortlink is None:
+            slug_filter.record_false_positive()
+        _cache_shortlink(slug, uuid, shortlink)
+        return shortlink
+
+    @classmethod
+    async def resolve_slug(cls, slug: str) -> Shortlink | None:
+        """Retrieves a shortlink from a slug for a redirect, without opening a session or loading it through the ORM.
+        Like ``from_slug`` it's served from the slug caches when possible, skips slugs the slug filter rules out, and
+        falls back to the primary database if the read replica doesn't have the shortlink yet.
+
+        :param slug: The slug for a shortlink
+        :type slug: str
+        :return: The retrieved Shortlink instance or None if not found
+        :rtype: Shortlink | None
+        """
+        slug_cache = get_slug_cache()
+        cached, shortlink = slug_cache.get(slug)
+        if shortlink is not None:
+            return shortlink
+        shortlink_id = Shortlink.decode_slug(slug)
+        if shortlink_id is None:
+            return None
+        # Another worker may have created the shortlink since this worker cached it as missing
+        if shortlink := _from_shared_cache(slug, shortlink_id):
+            return shortlink
+        if cached:
+            return None
+        slug_filter = get_slug_filter()
+        if not slug_filter.might_exist(shortlink_id):
+            return None
+        for engine in (db.read_engine,) if db.read_engine is db.engine else (db.read_engine, db.engine):
+            async with engine.connect() as connection:
+                row = (await connection.execute(_SELECT_LONG_URL, {"shortlink_id": shortlink_id})).first()
+            if row is not None:
+                long_url, created_at = row
+                shortlink = Shortlink(id=shortlink_id, long_url=long_url, created_at=created_at)
+                break
+        else:
+            slug_filter.record_false_positive()
+        _cache_shortlink(slug, shortlink_id, shortlink)
+        return shortlink
 
     @classmethod
     async def create(cls, long_url: str, session: AsyncSession) -> Shortlink:
@@ -39,14 +144,127 @@ class ShortlinkService:
         :return: The new shortlink instance
         :rtype: Shortlink
         """
-        shortlink = Shortlink(long_url=long_url)
+        (shortlink_id,) = await get_slug_codec().new_ids(1, session)
+        shortlink = Shortlink(id=shortlink_id, long_url=long_url)
         session.add(shortlink)
         await session.commit()
+        get_slug_filter().add(shortlink.id)
+        _cache_shortlink(shortlink.slug, shortlink.id, shortlink)
         return shortlink
 
+    @classmethod
+    async def create_idempotent(
+        cls, long_url: str, idempotency_key: str, session: AsyncSession
+    ) -> tuple[Shortlink, bool]:
+        """Creates a new shortlink for a given URL, unless the idempotency key was already used to create one
+        within its TTL, in which case that shortlink is returned instead. Looking the key up costs a single
+        primary key probe, and concurrent requests with the same key are settled by the key's unique constraint.
+
+        :param long_url: The long URL to create a shortlink for
+        :type long_url: str
+        :param idempotency_key: The client's key identifying this creation across retries
+        :type idempotency_key: str
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The shortlink for the key, and whether it was created by this call
+        :rtype: tuple[Shortlink, bool]
+        """
+        key_hash = IdempotencyKey.hash_key(idempotency_key)
+        while True:
+            expires_before = datetime.now(UTC) - timedelta(seconds=get_settings().idempotency_key_ttl)
+            statement = (
+                select(Shortlink)
+                .join(IdempotencyKey, col(IdempotencyKey.shortlink_id) == col(Shortlink.id))
+                .where(col(IdempotencyKey.key_hash) == key_hash, col(IdempotencyKey.created_at) >= expires_before)
+            )
+            existing = (await session.exec(statement)).first()
+            if existing:
+                return existing, False
+
+            (shortlink_id,) = await get_slug_codec().new_ids(1, session)
+            shortlink = Shortlink(id=shortlink_id, long_url=long_url)
+            session.add(shortlink)
+            await session.flush()
+            # An expired key is taken over, while a live one means another request claimed the key first
+            claimed = await super(AsyncSession, session).execute(
+                text("""
+                    INSERT INTO idempotencykey (key_hash, shortlink_id, created_at)
+                    VALUES (:key_hash, :shortlink_id, :created_at)
+                    ON CONFLICT (key_hash) DO UPDATE
+                    SET shortlink_id = EXCLUDED.shortlink_id, created_at = EXCLUDED.created_at
+                    WHERE idempotencykey.created_at < :expires_before
+                    RETURNING key_hash
+                """),
+                {
+                    "key_hash": key_hash,
+                    "shortlink_id": shortlink.id,
+                    "created_at": shortlink.created_at,
+                    "expires_before": expires_before,
+                },
+            )
+            if claimed.first() is None:
+                # Discard this shortlink and return the one created by the request that claimed the key
+                await session.rollback()
+                continue
+            await session.commit()
+            get_slug_filter().add(shortlink.id)
+            _cache_shortlink(shortlink.slug, shortlink.id, shortlink)
+            return shortlink, True
+
+    @classmethod
+    async def prune_idempotency_keys(cls, before: datetime, session: AsyncSession) -> int:
+        """Deletes idempotency keys that were first used before the given timestamp.
+
+        :param before: The timestamp that keys must have been created before to be deleted
+        :type before: datetime
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The number of keys deleted
+        :rtype: int
+        """
+        await db.use_job_statement_timeout(session)
+        result = await super(AsyncSession, session).execute(
+            delete(IdempotencyKey).where(col(IdempotencyKey.created_at) < before)
+        )
+        await session.commit()
+        return result.rowcount
+
+    @classmethod
+    async def create_many(cls, long_urls: Sequence[str], session: AsyncSession) -> list[Shortlink]:
+        """Creates new shortlink instances for many URLs at once, inserting them all in a single
+        multi-row statement instead of flushing each instance through the ORM.
+
+        :param long_urls: The long URLs to create shortlinks for
+        :type long_urls: Sequence[str]
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The new shortlink instances, in the same order as the URLs
+        :rtype: list[Shortlink]
+        """
+        if not long_urls:
+            return []
+        shortlink_ids = await get_slug_codec().new_ids(len(long_urls), session)
+        shortlinks = [
+            Shortlink(id=shortlink_id, long_url=long_url)
+            for shortlink_id, long_url in zip(shortlink_ids, long_urls, strict=True)
+        ]
+        await super(AsyncSession, session).execute(
+            insert(Shortlink),
+            [
+                {"id": shortlink.id, "long_url": shortlink.long_url, "created_at": shortlink.created_at}
+                for shortlink in shortlinks
+            ],
+        )
+        await session.commit()
+        slug_filter = get_slug_filter()
+        for shortlink in shortlinks:
+            slug_filter.add(shortlink.id)
+        return shortlinks
+
     @classmethod
     async def get_by_ids(cls, ids: Sequence[UUID], session: AsyncSession) -> dict[UUID, Shortlink]:
         """Returns a mapping of UUID to Shortlink for the requested ids.
+        The ids are sent as a single array parameter, so the query is the same however many there are.
 
         :param ids: A sequence of shortlink UUIDs
         :type ids: Sequence[UUID]
@@ -55,6 +273,5 @@ class ShortlinkService:
         :return: A mapping of UUID to Shortlink
         :rtype: dict[UUID, Shortlink]
         """
-        statement = select(Shortlink).where(col(Shortlink.id).in_(ids))
-        results = await session.exec(statement)
+        results = await session.exec(_SELECT_SHORTLINKS, params={"shortlink_ids": list(ids)})
         return {shortlink.id: shortlink for shortlink in results}
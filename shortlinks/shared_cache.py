@@ -0,0 +1,351 @@
+"""A slug cache shared by every gunicorn worker on a machine, so the hot set of shortlinks is held and warmed up
+once per machine rather than once per worker.
+
+The cache is a fixed layout hash table in a ``multiprocessing.shared_memory`` segment, created by the gunicorn
+master before it forks the workers so they all map the same memory. It's made of a header, a table of slots keyed
+by shortlink id with linear probing, and an append-only arena of long URLs the slots point into::
+
+    header  generation | urls_used | entries | resets | cleared_at
+    slots   sequence | url_length | id | url_offset | created_at   (one per slot)
+    arena   long URLs, UTF-8, back to back
+
+Readers never lock. Each slot has a sequence number that's odd while it's being written, and the header has a
+generation that's odd while the whole cache is being cleared, so a reader that saw either change while it read a
+slot knows what it read may be torn and tries again. Writers take an exclusive ``flock`` on a lock file, which the
+kernel releases if a worker dies while holding it, and skip caching a shortlink if another worker is writing.
+Shortlinks never change, so slots are only written once. Once the table or the arena is full no more shortlinks are
+cached, so the ones already held stay put, until ``reset_interval`` seconds after the cache was last cleared, when
+it's cleared and starts over.
+
+The segment and lock file have fixed names, so those left behind by a master that was killed before it could remove
+them are replaced the next time a cache with the same name is created, rather than piling up.
+"""
+
+import fcntl
+import math
+import os
+import struct
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import UTC, datetime, timedelta
+from multiprocessing.shared_memory import SharedMemory
+from typing import Self
+from uuid import UUID
+
+from core.config import get_settings
+from core.metrics import shared_slug_cache_lookups
+
+from .models import Shortlink
+
+MAX_LOAD_FACTOR = 0.75
+"""The fraction of slots that can be filled before the cache is full, which keeps probe sequences short"""
+
+MAX_PROBES = 32
+"""How many slots a lookup checks before giving up. A shortlink that can't be placed within this many isn't cached."""
+
+READ_ATTEMPTS = 3
+"""How many times a lookup is retried when a writer changes the slot it's reading, before it's treated as a miss"""
+
+_HEADER = struct.Struct("<QQQQd")
+_GENERATION = struct.Struct("<Q")
+_USAGE = struct.Struct("<QQ")
+_CLEARED_AT = struct.Struct("<d")
+_SLOT = struct.Struct("<II16sQq")
+_SEQUENCE = struct.Struct("<I")
+_EMPTY_ID = bytes(16)
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_HASH_MASK = (1 << 64) - 1
+
+
+class SharedSlugCache:
+    """A cache of shortlinks by id in shared memory, readable without locks by every process that maps it.
+
+    Only shortlinks that exist are cached, as they never change and never expire. Slugs that don't exist are left
+    to the worker's own ``SlugCache``, with its short miss TTL.
+    """
+
+    def __init__(
+        self,
+        memory: SharedMemory,
+        lock_path: str,
+        slots: int,
+        url_bytes: int,
+        reset_interval: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Wraps a shared memory segment laid out as a cache. Use ``create`` to create a new one.
+
+        :param memory: The shared memory segment holding the cache
+        :type memory: SharedMemory
+        :param lock_path: The path of the file writers lock
+        :type lock_path: str
+        :param slots: How many slots the table has
+        :type slots: int
+        :param url_bytes: The size of the arena of long URLs
+        :type url_bytes: int
+        :param reset_interval: How long in seconds after the cache was last cleared a full cache is cleared again
+        :type reset_interval: float
+        :param clock: The clock the time the cache was cleared is read from, which must be the same in every process
+        :type clock: Callable[[], float]
+        """
+        self.memory = memory
+        """The shared memory segment holding the cache"""
+        self.lock_path = lock_path
+        """The path of the file writers lock"""
+        self.slots = slots
+        """How many slots the table has"""
+        self.url_bytes = url_bytes
+        """The size in bytes of the arena of long URLs"""
+        self.max_entries = int(slots * MAX_LOAD_FACTOR)
+        """How many shortlinks the cache holds before it's full"""
+        self.reset_interval = reset_interval
+        """How long in seconds after the cache was last cleared a full cache is cleared again"""
+        self._buffer = memory.buf
+        self._slots_at = _HEADER.size
+        self._urls_at = self._slots_at + slots * _SLOT.size
+        self._clock = clock
+        self._lock_fd: int | None = None
+        self._lock_pid: int | None = None
+
+    @classmethod
+    def create(
+        cls,
+        name: str,
+        max_entries: int,
+        url_bytes: int,
+        reset_interval: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> Self:
+        """Creates a new, empty cache in a new shared memory segment, replacing any segment left behind with the
+        same name.
+
+        :param name: The name of the shared memory segment, which its lock file is named after too
+        :type name: str
+        :param max_entries: How many shortlinks the cache should hold before it's full
+        :type max_entries: int
+        :param url_bytes: The size in bytes of the arena of long URLs
+        :type url_bytes: int
+        :param reset_interval: How long in seconds after the cache was last cleared a full cache is cleared again
+        :type reset_interval: float
+        :param clock: The clock the time the cache was cleared is read from, which must be the same in every process
+        :type clock: Callable[[], float]
+        :return: The new cache
+        :rtype: Self
+        """
+        slots = max(math.ceil(max_entries / MAX_LOAD_FACTOR), 1)
+        try:
+            stale = SharedMemory(name, track=False)
+        except FileNotFoundError:
+            pass
+        else:
+            # Workers still mapping a stale segment keep it until they exit, it just can't be found by name any more
+            stale.close()
+            stale.unlink()
+        # Segments are unlinked by whoever created them, without a resource tracker process per machine to do it
+        memory = SharedMemory(name, create=True, size=_HEADER.size + slots * _SLOT.size + url_bytes, track=False)
+        lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        os.close(os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600))
+        shared_cache = cls(memory, lock_path, slots, url_bytes, reset_interval, clock)
+        _CLEARED_AT.pack_into(memory.buf, _HEADER.size - _CLEARED_AT.size, clock())
+        return shared_cache
+
+    def __len__(self) -> int:
+        return _HEADER.unpack_from(self._buffer)[2]
+
+    @property
+    def size_bytes(self) -> int:
+        """The size of the shared memory segment"""
+        return self.memory.size
+
+    @property
+    def urls_used(self) -> int:
+        """How many bytes of the arena of long URLs are used"""
+        return _HEADER.unpack_from(self._buffer)[1]
+
+    @property
+    def resets(self) -> int:
+        """How many times the cache has been cleared, by any process"""
+        return _HEADER.unpack_from(self._buffer)[3]
+
+    def get(self, shortlink_id: UUID) -> Shortlink | None:
+        """Looks up a shortlink in the cache, without taking any lock.
+
+        :param shortlink_id: The UUID of the shortlink
+        :type shortlink_id: UUID
+        :return: The cached shortlink, or None if it isn't cached
+        :rtype: Shortlink | None
+        """
+        id_bytes = shortlink_id.bytes
+        for _ in range(READ_ATTEMPTS):
+            consistent, shortlink = self._read(shortlink_id, id_bytes)
+            if consistent:
+                break
+        else:
+            shortlink = None
+        shared_slug_cache_lookups.labels("miss" if shortlink is None else "hit").inc()
+        return shortlink
+
+    def set(self, shortlink: Shortlink) -> bool:
+        """Caches a shortlink. Skipped if another process is writing, or if the cache is full and was cleared less
+        than ``reset_interval`` seconds ago, otherwise a full cache is cleared first.
+
+        :param shortlink: The shortlink to cache
+        :type shortlink: Shortlink
+        :return: Whether the shortlink is now cached
+        :rtype: bool
+        """
+        url = shortlink.long_url.encode()
+        if len(url) > self.url_bytes:
+            return False
+        lock_fd = self._get_lock_fd()
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            return self._write(shortlink.id.bytes, url, shortlink.created_at)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def clear(self) -> None:
+        """Removes every shortlink from the cache, for every process"""
+        lock_fd = self._get_lock_fd()
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            self._reset()
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def close(self, unlink: bool = False) -> None:
+        """Stops using the cache in this process.
+
+        :param unlink: Whether to also remove the shared memory segment and lock file, once every process using
+            them has closed them. Only the process that created the cache should.
+        :type unlink: bool
+        """
+        if self._lock_fd is not None and self._lock_pid == os.getpid():
+            os.close(self._lock_fd)
+        self._lock_fd = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+            os.unlink(self.lock_path)
+
+    def _slot_index(self, id_bytes: bytes) -> int:
+        # Compact ids are sequential in their low bits, so both halves are mixed before picking a slot
+        mixed = (int.from_bytes(id_bytes[:8]) ^ int.from_bytes(id_bytes[8:])) * _HASH_MULTIPLIER & _HASH_MASK
+        return mixed * self.slots >> 64
+
+    def _read(self, shortlink_id: UUID, id_bytes: bytes) -> tuple[bool, Shortlink | None]:
+        buffer = self._buffer
+        (generation,) = _GENERATION.unpack_from(buffer)
+        if generation & 1:
+            return False, None
+        index = self._slot_index(id_bytes)
+        for _ in range(MAX_PROBES):
+            position = self._slots_at + index * _SLOT.size
+            sequence, url_length, slot_id, url_offset, created_at = _SLOT.unpack_from(buffer, position)
+            if sequence & 1:
+                return False, None
+            if slot_id == _EMPTY_ID:
+                return _GENERATION.unpack_from(buffer)[0] == generation, None
+            if slot_id == id_bytes:
+                url_at = self._urls_at + url_offset
+                url = bytes(buffer[url_at : url_at + url_length])
+                if _SEQUENCE.unpack_from(buffer, position)[0] != sequence or (
+                    _GENERATION.unpack_from(buffer)[0] != generation
+                ):
+                    return False, None
+                # Only shortlinks that were valid are cached, so they're not validated again
+                return True, Shortlink.model_construct(
+                    id=shortlink_id,
+                    long_url=url.decode(),
+                    created_at=_EPOCH + timedelta(microseconds=created_at),
+                )
+            index = index + 1 if index + 1 < self.slots else 0
+        return _GENERATION.unpack_from(buffer)[0] == generation, None
+
+    def _write(self, id_bytes: bytes, url: bytes, created_at: datetime) -> bool:
+        buffer = self._buffer
+        _, urls_used, entries, _, cleared_at = _HEADER.unpack_from(buffer)
+        if entries >= self.max_entries or urls_used + len(url) > self.url_bytes:
+            # Clearing a full cache straight away would throw out the hot shortlinks along with the cold ones
+            if self._clock() - cleared_at < self.reset_interval:
+                return False
+            self._reset()
+            urls_used = entries = 0
+        index = self._slot_index(id_bytes)
+        for _ in range(MAX_PROBES):
+            position = self._slots_at + index * _SLOT.size
+            sequence, _, slot_id, _, _ = _SLOT.unpack_from(buffer, position)
+            if slot_id == id_bytes:
+                return True
+            if slot_id == _EMPTY_ID:
+                break
+            index = index + 1 if index + 1 < self.slots else 0
+        else:
+            return False
+        # The URL is written before the slot that points to it, and the slot between two sequence increments, so
+        # readers never follow a slot to a URL that isn't there yet
+        url_at = self._urls_at + urls_used
+        buffer[url_at : url_at + len(url)] = url
+        _SEQUENCE.pack_into(buffer, position, sequence + 1)
+        created_at_us = (created_at - _EPOCH) // timedelta(microseconds=1)
+        _SLOT.pack_into(buffer, position, sequence + 1, len(url), id_bytes, urls_used, created_at_us)
+        _SEQUENCE.pack_into(buffer, position, sequence + 2)
+        _USAGE.pack_into(buffer, _GENERATION.size, urls_used + len(url), entries + 1)
+        return True
+
+    def _reset(self) -> None:
+        buffer = self._buffer
+        generation, _, _, resets, _ = _HEADER.unpack_from(buffer)
+        _GENERATION.pack_into(buffer, 0, generation + 1)
+        buffer[self._slots_at : self._urls_at] = bytes(self._urls_at - self._slots_at)
+        _HEADER.pack_into(buffer, 0, generation + 2, 0, 0, resets + 1, self._clock())
+
+    def _get_lock_fd(self) -> int:
+        # Each process opens the lock file itself, as flock locks are shared by every copy of a descriptor
+        pid = os.getpid()
+        if self._lock_fd is None or self._lock_pid != pid:
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR)
+            self._lock_pid = pid
+        return self._lock_fd
+
+
+# Set by the gunicorn master before it forks, so kept in a list that's changed in place rather than a global
+_shared_slug_cache: list[SharedSlugCache] = []
+
+
+def create_shared_slug_cache() -> SharedSlugCache | None:
+    """Creates the shared slug cache for this machine, sized from the settings. To be called before the workers are
+    forked, like from a gunicorn ``on_starting`` hook, so they all inherit it.
+
+    :return: The shared slug cache, or None if it's disabled
+    :rtype: SharedSlugCache | None
+    """
+    settings = get_settings()
+    if not _shared_slug_cache and settings.shared_slug_cache_size > 0:
+        _shared_slug_cache.append(
+            SharedSlugCache.create(
+                settings.shared_slug_cache_name,
+                settings.shared_slug_cache_size,
+                settings.shared_slug_cache_url_bytes,
+                settings.shared_slug_cache_reset_interval,
+            )
+        )
+    return get_shared_slug_cache()
+
+
+def get_shared_slug_cache() -> SharedSlugCache | None:
+    """Returns the shared slug cache this process inherited, or None if there isn't one, like when the app isn't
+    run by gunicorn"""
+    return _shared_slug_cache[0] if _shared_slug_cache else None
+
+
+def close_shared_slug_cache() -> None:
+    """Removes the shared slug cache, once every worker using it has exited. To be called by the process that
+    created it, like from a gunicorn ``on_exit`` hook."""
+    if _shared_slug_cache:
+        _shared_slug_cache.pop().close(unlink=True)
@@ -0,0 +1,189 @@
+import asyncio
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from functools import cache
+
+import shortuuid
+from sqlmodel import Sequence, SQLModel, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import get_settings
+
+ALPHABET = shortuuid.get_alphabet()
+"""The characters slugs are made of, which leaves out ones that are easily confused like 0, O, 1, I, and l"""
+
+_ALPHABET_INDEX = {character: index for index, character in enumerate(ALPHABET)}
+
+LEGACY_SLUG_LENGTH = 22
+"""The length of every slug encoded from a random UUID"""
+
+ID_BLOCK_SIZE = 1000
+"""How many ids each worker reserves from the database at a time"""
+
+ID_BLOCK_MAX_AGE = 60.0
+"""How long in seconds a worker keeps using a block of ids after reserving it. Ids left in an older block are
+skipped, so every id is handed out within this long of being reserved, which the slug filter relies on."""
+
+ID_SEQUENCE_START = len(ALPHABET) ** 6
+"""The first id handed out, which is the smallest that encodes to 7 characters"""
+
+MAX_COMPACT_ID = len(ALPHABET) ** 10 - 1
+"""The largest id handed out, which is the largest that encodes to 10 characters"""
+
+shortlink_id_sequence = Sequence(
+    "shortlink_id_seq",
+    start=ID_SEQUENCE_START,
+    increment=ID_BLOCK_SIZE,
+    maxvalue=MAX_COMPACT_ID,
+    metadata=SQLModel.metadata,
+)
+"""The sequence that compact ids are reserved from, which returns the first id of a new block each call"""
+
+# A UUIDv8 is tagged with "slug" in its first 32 bits, so compact ids can never collide with random UUIDs
+_COMPACT_TAG = 0x736C7567_0000_8000
+_COMPACT_VARIANT = 1 << 63
+_COMPACT_NUMBER_MASK = (1 << 62) - 1
+
+
+def encode_number(number: int) -> str:
+    """Encodes a non-negative number with the slug alphabet, most significant character first"""
+    characters: list[str] = []
+    while True:
+        number, remainder = divmod(number, len(ALPHABET))
+        characters.append(ALPHABET[remainder])
+        if not number:
+            return "".join(reversed(characters))
+
+
+def decode_number(slug: str) -> int | None:
+    """Decodes a number encoded with ``encode_number``, or None if the slug has characters not in the alphabet"""
+    number = 0
+    for character in slug:
+        index = _ALPHABET_INDEX.get(character)
+        if index is None:
+            return None
+        number = number * len(ALPHABET) + index
+    return number
+
+
+def compact_id(number: int) -> uuid.UUID:
+    """Wraps a compact id in the UUID a shortlink is stored with"""
+    return uuid.UUID(int=(_COMPACT_TAG << 64) | _COMPACT_VARIANT | number)
+
+
+def compact_number(shortlink_id: uuid.UUID) -> int | None:
+    """Unwraps the compact id from a shortlink's UUID, or None if it's a random UUID"""
+    value = shortlink_id.int
+    if value >> 64 != _COMPACT_TAG or value & (3 << 62) != _COMPACT_VARIANT:
+        return None
+    return value & _COMPACT_NUMBER_MASK
+
+
+def _decode_compact(slug: str) -> uuid.UUID | None:
+    # Only the one slug each id encodes to is accepted, so ids never handed out, and slugs padded with leading
+    # zero characters, are rejected without a query
+    number = decode_number(slug) if slug else None
+    if number is None or not ID_SEQUENCE_START <= number <= MAX_COMPACT_ID or encode_number(number) != slug:
+        return None
+    return compact_id(number)
+
+
+class SlugCodec(ABC):
+    """Converts between shortlink UUIDs and the slugs in their short URLs, and generates the UUIDs of new
+    shortlinks so that they encode well"""
+
+    @abstractmethod
+    def encode(self, shortlink_id: uuid.UUID) -> str:
+        """Encodes a shortlink's UUID into its slug"""
+
+    @abstractmethod
+    def decode(self, slug: str) -> uuid.UUID | None:
+        """Decodes a slug into a shortlink's UUID, or None if the slug is invalid"""
+
+    async def new_ids(self, count: int, session: AsyncSession) -> list[uuid.UUID]:
+        """Generates the UUIDs for new shortlinks.
+
+        :param count: How many UUIDs to generate
+        :type count: int
+        :param session: An async session connected to the primary database
+        :type session: AsyncSession
+        :return: The new, unique UUIDs
+        :rtype: list[uuid.UUID]
+        """
+        return [uuid.uuid4() for _ in range(count)]
+
+
+class ShortUUIDCodec(SlugCodec):
+    """Encodes random UUIDs into 22 character slugs, the original slug scheme. Compact ids keep their short slugs,
+    so shortlinks created with ``CompactSlugCodec`` still resolve after switching back to this codec."""
+
+    def encode(self, shortlink_id: uuid.UUID) -> str:
+        number = compact_number(shortlink_id)
+        if number is None:
+            return shortuuid.encode(shortlink_id)
+        return encode_number(number)
+
+    def decode(self, slug: str) -> uuid.UUID | None:
+        if len(slug) != LEGACY_SLUG_LENGTH:
+            return _decode_compact(slug)
+        try:
+            return shortuuid.decode(slug)
+        except ValueError:
+            return None
+
+
+class CompactSlugCodec(ShortUUIDCodec):
+    """Encodes ids counted up from a database sequence into slugs of 7 to 10 characters.
+
+    The ids are stored as UUIDv8s tagged so they're distinguishable from random UUIDs, so they fit the existing
+    UUID columns. Each worker reserves blocks of ``ID_BLOCK_SIZE`` ids from the sequence, so only one in every
+    thousand new shortlinks costs a round trip and workers never coordinate otherwise. Ids left in a block when
+    a worker stops, or once it's older than ``ID_BLOCK_MAX_AGE``, are skipped. Shortlinks created with random UUIDs
+    keep their 22 character slugs.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._blocks: list[range] = []
+        self._blocks_reserved_at: list[float] = []
+        self._lock = asyncio.Lock()
+
+    async def new_ids(self, count: int, session: AsyncSession) -> list[uuid.UUID]:
+        async with self._lock:
+            while self._blocks_reserved_at and self._clock() - self._blocks_reserved_at[0] >= ID_BLOCK_MAX_AGE:
+                self._blocks.pop(0)
+                self._blocks_reserved_at.pop(0)
+            available = sum(len(block) for block in self._blocks)
+            if available < count:
+                await self._reserve_blocks(-(-(count - available) // ID_BLOCK_SIZE), session)
+            ids: list[uuid.UUID] = []
+            while len(ids) < count:
+                block = self._blocks[0]
+                taken = block[: count - len(ids)]
+                ids.extend(compact_id(number) for number in taken)
+                if len(taken) == len(block):
+                    self._blocks.pop(0)
+                    self._blocks_reserved_at.pop(0)
+                else:
+                    self._blocks[0] = block[len(taken) :]
+            return ids
+
+    async def _reserve_blocks(self, blocks: int, session: AsyncSession) -> None:
+        result = await super(AsyncSession, session).execute(
+            text("SELECT nextval(:sequence) FROM generate_series(1, :blocks)"),
+            {"sequence": shortlink_id_sequence.name, "blocks": blocks},
+        )
+        reserved_at = self._clock()
+        for (start,) in result:
+            self._blocks.append(range(start, min(start + ID_BLOCK_SIZE, MAX_COMPACT_ID + 1)))
+            self._blocks_reserved_at.append(reserved_at)
+
+
+@cache
+def get_slug_codec() -> SlugCodec:
+    """Returns the slug codec for this worker, chosen by the settings"""
+    if get_settings().slug_codec == "compact":
+        return CompactSlugCodec()
+    return ShortUUIDCodec()
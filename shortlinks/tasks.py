@@ -0,0 +1,18 @@
+from datetime import UTC, datetime, timedelta
+
+from core.config import get_settings
+from core.db import get_session_context
+from core.tasks import PeriodicTask
+
+from .service import ShortlinkService
+
+
+async def prune_idempotency_keys() -> None:
+    """Deletes idempotency keys that have outlived their TTL"""
+    before = datetime.now(UTC) - timedelta(seconds=get_settings().idempotency_key_ttl)
+    async with get_session_context() as session:
+        await ShortlinkService.prune_idempotency_keys(before, session)
+
+
+idempotency_key_pruning = PeriodicTask("prune idempotency keys", 3600, prune_idempotency_keys)
+"""Deletes expired idempotency keys once an hour"""
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from datetime import UTC, datetime
+from functools import cache
+from uuid import UUID
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import get_settings
+from core.db import get_session_context
+from core.metrics import visit_record_lag_seconds, visits_dropped
+
+from .service import StatsService, VisitCount
+
+logger = logging.getLogger(__name__)
+
+
+class VisitBuffer:
+    """A per-worker, write-behind buffer that coalesces visits by shortlink in memory
+    and periodically records them with a single multi-row upsert.
+
+    Visits are flushed every ``flush_interval`` seconds, or early once ``max_size`` distinct
+    shortlinks have pending visits. Anything still buffered when the worker dies is lost.
+    While flushes fail, visits to at most ``capacity`` distinct shortlinks are kept, and once
+    ``max_failures`` flushes have failed in a row the next one records each shortlink on its own,
+    so a single shortlink that can't be recorded doesn't hold back the rest.
+    """
+
+    def __init__(self, max_size: int, flush_interval: float, capacity: int = 100_000, max_failures: int = 3) -> None:
+        self.max_size = max_size
+        """How many distinct shortlinks can have pending visits before flushing early"""
+        self.flush_interval = flush_interval
+        """How often in seconds pending visits are flushed"""
+        self.capacity = capacity
+        """How many distinct shortlinks can have pending visits at most, before visits to others are dropped"""
+        self.max_failures = max_failures
+        """How many flushes can fail in a row before shortlinks are recorded one at a time"""
+        self.failures = 0
+        """How many flushes have failed in a row"""
+        self._pending: dict[UUID, VisitCount] = {}
+        self._oldest_visit: datetime | None = None
+        self._flush_lock = asyncio.Lock()
+        self._flusher: asyncio.Task[None] | None = None
+        self._early_flushes: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, shortlink_id: UUID, visited_at: datetime, visitor_hash: int | None = None) -> None:
+        """Buffers a visit to a shortlink, scheduling an early flush if the buffer is full. The visit is dropped if
+        the buffer is at capacity and has no visits to the shortlink yet.
+
+        :param shortlink_id: The UUID of the visited shortlink
+        :type shortlink_id: UUID
+        :param visited_at: The timestamp of the visit
+        :type visited_at: datetime
+        :param visitor_hash: The hashed identifier of the visitor, to count unique visitors
+        :type visitor_hash: int | None
+        """
+        if len(self._pending) >= self.capacity and shortlink_id not in self._pending:
+            visits_dropped.labels("overflow").inc()
+            return
+        self._merge(shortlink_id, VisitCount.single(visited_at, visitor_hash))
+        if self._oldest_visit is None or visited_at < self._oldest_visit:
+            self._oldest_visit = visited_at
+        if len(self._pending) >= self.max_size and not self._early_flushes:
+            task = asyncio.create_task(self._flush_in_new_session())
+            self._early_flushes.add(task)
+            task.add_done_callback(self._early_flushes.discard)
+
+    async def flush(self, session: AsyncSession) -> int:
+        """Records all pending visits. If recording fails the visits are kept for the next flush.
+        After ``max_failures`` failed flushes in a row, each shortlink is recorded in its own transaction
+        instead, and the visits to those that still fail are logged and dropped.
+        How long the oldest of them waited to be recorded is reported in ``visit_record_lag_seconds``.
+
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The number of shortlinks that had visits recorded
+        :rtype: int
+        """
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            oldest_visit, self._oldest_visit = self._oldest_visit, None
+            if not pending:
+                return 0
+            try:
+                if self.failures >= self.max_failures:
+                    recorded = await self._record_separately(pending, session)
+                else:
+                    await StatsService.record_visits(pending, session)
+                    recorded = len(pending)
+            except BaseException as e:
+                if isinstance(e, Exception):
+                    self.failures += 1
+                for shortlink_id, visit_count in pending.items():
+                    self._merge(shortlink_id, visit_count)
+                if oldest_visit and (self._oldest_visit is None or oldest_visit < self._oldest_visit):
+                    self._oldest_visit = oldest_visit
+                raise
+            self.failures = 0
+            if oldest_visit and recorded:
+                visit_record_lag_seconds.labels("buffer").observe((datetime.now(UTC) - oldest_visit).total_seconds())
+            return recorded
+
+    def start(self) -> None:
+        """Starts flushing pending visits periodically in the background"""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the periodic flushes and drains any pending visits"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await asyncio.gather(*self._early_flushes, return_exceptions=True)
+        await self._flush_in_new_session()
+
+    def _merge(self, shortlink_id: UUID, visit_count: VisitCount) -> None:
+        pending = self._pending.get(shortlink_id)
+        if pending is None:
+            self._pending[shortlink_id] = pending = VisitCount(0, visit_count.last_visit)
+        pending.add(visit_count)
+
+    async def _record_separately(self, pending: dict[UUID, VisitCount], session: AsyncSession) -> int:
+        # Shortlinks are removed from the pending visits as they're recorded or dropped, so only those that weren't
+        # reached are kept if this is interrupted
+        recorded = 0
+        for shortlink_id in sorted(pending):
+            visit_count = pending[shortlink_id]
+            try:
+                await StatsService.record_visits({shortlink_id: visit_count}, session)
+                recorded += 1
+            except Exception:
+                await session.rollback()
+                logger.exception(
+                    "Dropped %d visits to shortlink %s that failed to be recorded", visit_count.visits, shortlink_id
+                )
+                visits_dropped.labels("failed").inc(visit_count.visits)
+            del pending[shortlink_id]
+        return recorded
+
+    async def _flush_in_new_session(self) -> None:
+        try:
+            async with get_session_context() as session:
+                await self.flush(session)
+        except Exception:
+            logger.exception("Failed to flush %d buffered shortlink visits", len(self._pending))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_in_new_session()
+
+
+@cache
+def get_visit_buffer() -> VisitBuffer:
+    """Returns the visit buffer for this worker, configured from the settings"""
+    settings = get_settings()
+    return VisitBuffer(
+        max_size=settings.visit_buffer_max_size,
+        flush_interval=settings.visit_flush_interval,
+        capacity=settings.visit_buffer_capacity,
+        max_failures=settings.visit_buffer_max_failures,
+    )
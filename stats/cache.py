@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from functools import cache
+from typing import NamedTuple
+
+from core.config import get_settings
+from core.metrics import stats_response_cache_lookups
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    """A serialized stats response and when the stats in it were read"""
+
+    body: bytes
+    """The JSON body of the response"""
+
+    etag: str
+    """A strong entity tag for the body, quoted as it's sent in the ``ETag`` header"""
+
+    read_at: float
+    """The clock time the stats in the body were read at"""
+
+    @classmethod
+    def create(cls, body: bytes, read_at: float) -> "CachedResponse":
+        """Creates a cached response, tagging it with a hash of its body"""
+        return cls(body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', read_at)
+
+
+type ResponseLoader = Callable[[], Awaitable[tuple[bytes, float] | None]]
+"""Loads a response's body, and how many seconds old the stats in it already were, or None if there is nothing"""
+
+
+class ResponseCache:
+    """A bounded, per-worker LRU cache of serialized stats responses that serves stale responses while it
+    refreshes them.
+
+    A response is fresh for ``max_age`` seconds after its stats were read. For ``stale_while_revalidate`` seconds
+    after that it's still served, while a single load refreshes it in the background. After that it's loaded again
+    before being served. Concurrent requests for a response that isn't cached share a single load, so a burst of
+    dashboard polls costs at most one query per key. Missing responses aren't cached, so a shortlink can be read as
+    soon as it has been created.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        max_age: float,
+        stale_while_revalidate: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        """The maximum number of responses to hold before evicting the least recently used, 0 disables the cache"""
+        self.max_age = max_age
+        """How long in seconds a response is served without being refreshed"""
+        self.stale_while_revalidate = stale_while_revalidate
+        """How long in seconds after it goes stale that a response is served while it's refreshed in the
+        background"""
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self._loads: dict[Hashable, asyncio.Task[CachedResponse | None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Hashable, load: ResponseLoader) -> tuple[CachedResponse | None, float]:
+        """Returns the response cached for a key, loading it first if there isn't a usable one.
+
+        :param key: What identifies the response, like the parameters of the request
+        :type key: Hashable
+        :param load: Loads the response when it isn't cached or needs refreshing. It's run separately from the
+            request, so it must open its own database sessions.
+        :type load: ResponseLoader
+        :return: The response, or None if the loader found nothing, and how old its stats are in seconds
+        :rtype: tuple[CachedResponse | None, float]
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = self._clock() - entry.read_at
+            if age < self.max_age:
+                self._entries.move_to_end(key)
+                stats_response_cache_lookups.labels("hit").inc()
+                return entry, age
+            if age < self.max_age + self.stale_while_revalidate:
+                self._entries.move_to_end(key)
+                stats_response_cache_lookups.labels("stale").inc()
+                self._load(key, load)
+                return entry, age
+            del self._entries[key]
+        stats_response_cache_lookups.labels("miss").inc()
+        # Shielded so a request that is cancelled doesn't cancel the load other requests are waiting on
+        entry = await asyncio.shield(self._load(key, load))
+        return entry, self._clock() - entry.read_at if entry else 0.0
+
+    async def wait(self) -> None:
+        """Waits for the loads in progress to finish"""
+        await asyncio.gather(*self._loads.values(), return_exceptions=True)
+
+    def clear(self) -> None:
+        """Removes all responses. Loads in progress still finish."""
+        self._entries.clear()
+
+    def _load(self, key: Hashable, load: ResponseLoader) -> asyncio.Task[CachedResponse | None]:
+        task = self._loads.get(key)
+        if task is None:
+            task = self._loads[key] = asyncio.create_task(self._run_load(key, load))
+            task.add_done_callback(lambda task: self._finish_load(key, task))
+        return task
+
+    def _finish_load(self, key: Hashable, task: asyncio.Task[CachedResponse | None]) -> None:
+        del self._loads[key]
+        # Retrieving the exception stops asyncio warning about background refreshes that failed, which are logged
+        if not task.cancelled():
+            task.exception()
+
+    async def _run_load(self, key: Hashable, load: ResponseLoader) -> CachedResponse | None:
+        try:
+            loaded = await load()
+        except Exception:
+            logger.exception("Failed to load the stats response for %r", key)
+            raise
+        if loaded is None:
+            self._entries.pop(key, None)
+            return None
+        body, age = loaded
+        entry = CachedResponse.create(body, self._clock() - age)
+        if self.max_size > 0:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches an entity tag, comparing them weakly as RFC 9110 requires"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+@cache
+def get_stats_response_cache() -> ResponseCache:
+    """Returns the stats response cache for this worker, configured from the settings"""
+    settings = get_settings()
+    return ResponseCache(
+        max_size=settings.stats_cache_size,
+        max_age=settings.stats_cache_max_age,
+        stale_while_revalidate=settings.stats_cache_stale_while_revalidate,
+    )
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import logging
+import random
+import secrets
+from collections.abc import Callable
+from datetime import datetime
+from functools import cache
+from uuid import UUID
+
+from fastapi import Request
+from sqlmodel import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import BackpressurePolicy, get_settings
+from core.db import get_session_context
+
+from .service import StatsService, VisitEventData
+
+logger = logging.getLogger(__name__)
+
+VISITOR_HASH_KEY_BYTES = 32
+"""The size of the visitor hash keys that are generated, within the 64 bytes BLAKE2b keys are limited to"""
+
+_INSERT_VISITOR_HASH_KEY = text("INSERT INTO visitorhashkey (id, key) VALUES (1, :key) ON CONFLICT (id) DO NOTHING")
+_SELECT_VISITOR_HASH_KEY = text("SELECT key FROM visitorhashkey WHERE id = 1")
+
+# Loaded by each worker as it starts, so kept in a list that's changed in place rather than a global
+_visitor_hash_key: list[bytes] = []
+
+
+def visit_event_from_request(shortlink_id: UUID, visited_at: datetime, request: Request) -> VisitEventData:
+    """Collects the details of a visit from the redirect request, truncated to fit the visit event log.
+
+    :param shortlink_id: The UUID of the visited shortlink
+    :type shortlink_id: UUID
+    :param visited_at: The timestamp of the visit
+    :type visited_at: datetime
+    :param request: The request for the shortlink
+    :type request: Request
+    :return: The visit event to append to the log
+    :rtype: VisitEventData
+    """
+    headers = request.headers
+    referrer = headers.get("referer")
+    user_agent = headers.get("user-agent")
+    country_header = get_settings().visit_event_country_header
+    country = headers.get(country_header) if country_header else None
+    return VisitEventData(
+        shortlink_id=shortlink_id,
+        visited_at=visited_at,
+        referrer=referrer[:2083] if referrer else None,
+        user_agent=user_agent[:512] if user_agent else None,
+        country=country[:2].upper() if country else None,
+    )
+
+
+async def load_visitor_hash_key(session: AsyncSession) -> bytes:
+    """Loads the secret key visitors are hashed with. Unless ``visitor_hash_key`` is set, the first worker to start
+    generates a random key and stores it in the database, so visitor hashes are never unkeyed and every worker hashes
+    a visitor the same way. To be called as a worker starts, before it counts any visits.
+
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    :return: The key
+    :rtype: bytes
+    :raises ValueError: If the configured key is too long
+    """
+    key = get_settings().visitor_hash_key.encode()
+    if len(key) > hashlib.blake2b.MAX_KEY_SIZE:
+        raise ValueError(f"The visitor hash key can be at most {hashlib.blake2b.MAX_KEY_SIZE} bytes, not {len(key)}")
+    if not key:
+        # A worker racing this one to store its own key waits for it to commit, and then loads the same key
+        await super(AsyncSession, session).execute(
+            _INSERT_VISITOR_HASH_KEY, {"key": secrets.token_bytes(VISITOR_HASH_KEY_BYTES)}
+        )
+        key = (await super(AsyncSession, session).execute(_SELECT_VISITOR_HASH_KEY)).scalar_one()
+        await session.commit()
+    _visitor_hash_key[:] = [key]
+    return key
+
+
+def get_visitor_hash_key() -> bytes:
+    """Returns the secret key visitors are hashed with, which is ``visitor_hash_key`` if it's set or else the key
+    this worker loaded from the database
+
+    :raises RuntimeError: If the key isn't set and hasn't been loaded
+    """
+    key = get_settings().visitor_hash_key
+    if key:
+        return key.encode()
+    if not _visitor_hash_key:
+        raise RuntimeError("The visitor hash key hasn't been loaded")
+    return _visitor_hash_key[0]
+
+
+def visitor_hash_from_request(request: Request) -> int:
+    """Hashes the visitor's IP address and user agent with the secret key, to count unique visitors without
+    storing anything that identifies them.
+
+    :param request: The request for the shortlink
+    :type request: Request
+    :return: A 64-bit hash identifying the visitor
+    :rtype: int
+    """
+    settings = get_settings()
+    ip_address = request.headers.get(settings.visitor_ip_header) if settings.visitor_ip_header else None
+    if not ip_address and request.client:
+        ip_address = request.client.host
+    identifier = f"{ip_address or ''}\0{request.headers.get('user-agent', '')}".encode()
+    digest = hashlib.blake2b(identifier, digest_size=8, key=get_visitor_hash_key()).digest()
+    return int.from_bytes(digest)
+
+
+class VisitEventIngester:
+    """A per-worker queue of visit events that appends them to the visit event log in batches with COPY,
+    off the request path.
+
+    Events are written once ``batch_size`` are queued, or after waiting ``flush_interval`` seconds for a batch
+    to fill. When the queue fills up faster than it's written the ``policy`` decides what happens to new events.
+    Anything still queued when the worker dies is lost.
+    """
+
+    def __init__(
+        self,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        policy: BackpressurePolicy,
+        sample_rate: float,
+        sampler: Callable[[], float] = random.random,
+    ) -> None:
+        self.batch_size = batch_size
+        """The most events written with a single COPY"""
+        self.flush_interval = flush_interval
+        """How long in seconds events wait to be batched before they are written"""
+        self.policy = policy
+        """What happens to new events when the queue is full"""
+        self.sample_rate = sample_rate
+        """The fraction of events kept by the ``sample`` policy while the queue is at least half full"""
+        self.accepted = 0
+        """The number of events queued to be written"""
+        self.dropped = 0
+        """The number of events discarded by the backpressure policy"""
+        self.written = 0
+        """The number of events appended to the log"""
+        self.failed = 0
+        """The number of events lost because writing them failed"""
+        self._sampler = sampler
+        self._queue: asyncio.Queue[VisitEventData] = asyncio.Queue(queue_size)
+        self._batch: list[VisitEventData] = []
+        self._writer: asyncio.Task[None] | None = None
+        self._writes: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return self._queue.qsize() + len(self._batch)
+
+    async def add(self, event: VisitEventData) -> bool:
+        """Queues a visit event to be written, applying the backpressure policy if the writer has fallen behind.
+
+        :param event: The visit event to queue
+        :type event: VisitEventData
+        :return: Whether the event was queued rather than dropped
+        :rtype: bool
+        """
+        if self.policy == "block":
+            await self._queue.put(event)
+        elif (
+            self.policy == "sample"
+            and self._queue.qsize() * 2 >= self._queue.maxsize
+            and self._sampler() >= self.sample_rate
+        ):
+            self.dropped += 1
+            return False
+        else:
+            try:
+                self._queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                return False
+        self.accepted += 1
+        return True
+
+    def start(self) -> None:
+        """Starts writing queued events in the background"""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the background writer, waiting for writes in progress, and writes any events still queued"""
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        await asyncio.gather(*self._writes, return_exceptions=True)
+        pending, self._batch = self._batch + self._take(self._queue.qsize()), []
+        for i in range(0, len(pending), self.batch_size):
+            await self._write_in_new_session(pending[i : i + self.batch_size])
+
+    def _take(self, limit: int) -> list[VisitEventData]:
+        events: list[VisitEventData] = []
+        while len(events) < limit and not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    async def _write_in_new_session(self, events: list[VisitEventData]) -> None:
+        try:
+            async with get_session_context() as session:
+                await StatsService.record_visit_events(events, session)
+        except Exception:
+            self.failed += len(events)
+            logger.exception("Failed to write %d visit events", len(events))
+        else:
+            self.written += len(events)
+
+    async def _run(self) -> None:
+        while True:
+            self._batch.append(await self._queue.get())
+            self._batch.extend(self._take(self.batch_size - len(self._batch)))
+            if len(self._batch) < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+                self._batch.extend(self._take(self.batch_size - len(self._batch)))
+            batch, self._batch = self._batch, []
+            # Shielded so stopping the worker waits for the batch to be written instead of rolling it back
+            write = asyncio.create_task(self._write_in_new_session(batch))
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
+            await asyncio.shield(write)
+
+
+@cache
+def get_visit_event_ingester() -> VisitEventIngester:
+    """Returns the visit event ingester for this worker, configured from the settings"""
+    settings = get_settings()
+    return VisitEventIngester(
+        queue_size=settings.visit_event_queue_size,
+        batch_size=settings.visit_event_batch_size,
+        flush_interval=settings.visit_event_flush_interval,
+        policy=settings.visit_event_backpressure,
+        sample_rate=settings.visit_event_sample_rate,
+    )
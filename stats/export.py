@@ -0,0 +1,149 @@
+"""Streams every shortlink, or every shortlink with its stats, as NDJSON or CSV for bulk exports.
+
+Rows are fetched in batches from a server-side cursor and each batch is encoded straight from the raw columns, so
+an export uses the same memory however many shortlinks there are.
+"""
+
+import csv
+import io
+import json
+from collections.abc import AsyncIterator, Callable, Iterable
+from datetime import datetime
+from enum import StrEnum
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import ColumnElement, Row, Select, func, select
+from sqlalchemy.orm import Mapped
+from sqlmodel import col, text
+
+from core.config import get_settings
+from core.db import get_read_session_context
+from shortlinks.models import Shortlink
+from shortlinks.slugs import get_slug_codec
+
+from .models import ShortlinkStat
+
+type ExportFields = tuple[str | int | None, ...]
+"""The values of a single exported row, in the order of its columns"""
+
+SHORTLINK_EXPORT_COLUMNS = ("slug", "short_url", "long_url", "created_at")
+"""The columns of a shortlinks export"""
+
+STATS_EXPORT_COLUMNS = ("slug", "short_url", "long_url", "visits", "unique_visitors", "last_visit")
+"""The columns of a stats export, matching the fields of the stats responses"""
+
+_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+_ISO_8601_UTC = 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'
+
+_SET_IDLE_TIMEOUT = text("SELECT set_config('idle_in_transaction_session_timeout', :timeout, true)")
+
+
+def utc_isoformat(timestamp: Mapped[datetime]) -> ColumnElement[str | None]:
+    """Formats a timestamp column as ISO 8601 in UTC in the database, which is much quicker than converting each
+    one to a datetime and back to a string in Python"""
+    return func.to_char(func.timezone("UTC", timestamp), _ISO_8601_UTC)
+
+
+# Both exports are ordered by id, which follows the primary keys, so consecutive exports can be diffed
+_SELECT_SHORTLINKS = select(
+    col(Shortlink.id), col(Shortlink.long_url), utc_isoformat(col(Shortlink.created_at))
+).order_by(col(Shortlink.id))
+
+_SELECT_STATS = (
+    select(
+        col(Shortlink.id),
+        col(Shortlink.long_url),
+        func.coalesce(col(ShortlinkStat.visits), 0),
+        func.coalesce(col(ShortlinkStat.unique_visitors), 0),
+        utc_isoformat(col(ShortlinkStat.last_visit)),
+    )
+    .outerjoin(ShortlinkStat, col(ShortlinkStat.shortlink_id) == col(Shortlink.id))
+    .order_by(col(Shortlink.id))
+)
+
+
+class ExportFormat(StrEnum):
+    """Enum defining the formats that exports can be streamed in"""
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+    @property
+    def media_type(self) -> str:
+        """The content type of an export in this format"""
+        return "application/x-ndjson" if self == ExportFormat.NDJSON else "text/csv"
+
+
+def encode_ndjson(columns: tuple[str, ...], rows: Iterable[ExportFields]) -> bytes:
+    """Encodes rows as JSON objects keyed by column, one per line"""
+    encode = _JSON_ENCODER.encode
+    return "".join([f"{encode(dict(zip(columns, fields, strict=True)))}\n" for fields in rows]).encode()
+
+
+def encode_csv(rows: Iterable[ExportFields]) -> bytes:
+    """Encodes rows as CSV, with None as an empty value"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def stream_rows[T: tuple[Any, ...]](
+    statement: Select[T],
+    to_fields: Callable[[Row[T]], ExportFields],
+    columns: tuple[str, ...],
+    export_format: ExportFormat,
+) -> AsyncIterator[bytes]:
+    """Runs a query with a server-side cursor and streams its rows encoded in an export format, a batch at a time.
+
+    :param statement: The query to export the rows of
+    :type statement: Select[T]
+    :param to_fields: Converts a row into the values of the exported columns
+    :type to_fields: Callable[[Row[T]], ExportFields]
+    :param columns: The names of the exported columns
+    :type columns: tuple[str, ...]
+    :param export_format: What to encode the rows as
+    :type export_format: ExportFormat
+    :return: The encoded export, starting with a header row for CSV
+    :rtype: AsyncIterator[bytes]
+    """
+    settings = get_settings()
+    # The export opens its own session, since it's still streaming after the request's dependencies have closed
+    async with get_read_session_context() as session:
+        connection = await session.connection()
+        # The transaction sits idle while a slow client catches up, which would usually terminate it
+        await connection.execute(_SET_IDLE_TIMEOUT, {"timeout": str(settings.export_idle_in_transaction_timeout)})
+        if export_format == ExportFormat.CSV:
+            yield encode_csv([columns])
+        result = await connection.stream(statement, execution_options={"yield_per": settings.export_batch_size})
+        async for rows in result.partitions():
+            fields = map(to_fields, rows)
+            yield encode_ndjson(columns, fields) if export_format == ExportFormat.NDJSON else encode_csv(fields)
+
+
+def export_shortlinks(export_format: ExportFormat) -> AsyncIterator[bytes]:
+    """Streams every shortlink, ordered by id"""
+    encode_slug = get_slug_codec().encode
+    service_root = get_settings().service_root
+
+    def to_fields(row: Row[tuple[UUID, str, str | None]]) -> ExportFields:
+        shortlink_id, long_url, created_at = row
+        slug = encode_slug(shortlink_id)
+        return slug, f"{service_root}/{slug}", long_url, created_at
+
+    return stream_rows(_SELECT_SHORTLINKS, to_fields, SHORTLINK_EXPORT_COLUMNS, export_format)
+
+
+def export_stats(export_format: ExportFormat) -> AsyncIterator[bytes]:
+    """Streams every shortlink with its stats, ordered by id. Shortlinks that haven't been visited are included
+    with no visits."""
+    encode_slug = get_slug_codec().encode
+    service_root = get_settings().service_root
+
+    def to_fields(row: Row[tuple[UUID, str, int, int, str | None]]) -> ExportFields:
+        shortlink_id, long_url, visits, unique_visitors, last_visit = row
+        slug = encode_slug(shortlink_id)
+        return slug, f"{service_root}/{slug}", long_url, visits, unique_visitors, last_visit
+
+    return stream_rows(_SELECT_STATS, to_fields, STATS_EXPORT_COLUMNS, export_format)
@@ -0,0 +1,127 @@
+import math
+import struct
+from collections import Counter
+from collections.abc import Iterable
+from typing import Self
+
+DEFAULT_PRECISION = 12
+"""The number of hash bits used to pick a register, giving 4096 one byte registers and a standard error of ~1.6%"""
+
+HASH_BITS = 64
+"""The number of bits in the hashes added to sketches"""
+
+_INVERSE_POWERS = [2.0**-rank for rank in range(HASH_BITS + 2)]
+
+
+class HyperLogLog:
+    """A sketch that estimates the number of distinct values added to it.
+
+    Values are added as uniformly distributed 64-bit hashes. A sketch starts out sparse, keeping the distinct hashes
+    themselves and counting them exactly, until it has more than ``max_sparse_hashes`` of them, when it switches to
+    fixed-size registers. Most shortlinks only ever have a few visitors, so their sketches stay a fraction of the
+    size of the registers. Sketches with the same precision can be merged, so each worker can build its own and the
+    database keeps the union, and the serialized form is small enough to be stored in a ``bytea`` column.
+    """
+
+    def __init__(
+        self, precision: int = DEFAULT_PRECISION, registers: bytes | None = None, hashes: Iterable[int] = ()
+    ) -> None:
+        if not 4 <= precision <= 18:
+            raise ValueError(f"The precision must be between 4 and 18, not {precision}")
+        self.precision = precision
+        """The number of hash bits used to pick a register"""
+        self.max_sparse_hashes = (1 << precision) // 32
+        """How many distinct hashes a sparse sketch keeps before switching to registers, which keeps it at most a
+        quarter of the size of the registers"""
+        self.hashes: set[int] | None = set(hashes) if registers is None else None
+        """The distinct hashes added to the sketch while it's sparse, or None once it has switched to registers"""
+        self.registers = bytearray(registers) if registers is not None else bytearray()
+        """The longest run of leading zeros, plus one, seen in the hashes assigned to each register, empty while
+        the sketch is sparse"""
+        if registers is not None and len(self.registers) != 1 << precision:
+            raise ValueError(f"A sketch with precision {precision} must have {1 << precision} registers")
+        if self.hashes is not None and len(self.hashes) > self.max_sparse_hashes:
+            self._switch_to_registers()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        """Loads a sketch serialized with ``to_bytes``. Registers are a power of two bytes long, which tells the
+        precision, while a sparse sketch is its precision followed by its 8 byte hashes, so its length is odd."""
+        if len(data) % 2:
+            return cls(data[0], hashes=(value_hash for (value_hash,) in struct.iter_unpack(">Q", data[1:])))
+        return cls(len(data).bit_length() - 1, data)
+
+    def to_bytes(self) -> bytes:
+        """Serializes the sketch as its registers, or as its precision and sorted hashes while it's sparse"""
+        if self.hashes is not None:
+            return struct.pack(f">B{len(self.hashes)}Q", self.precision, *sorted(self.hashes))
+        return bytes(self.registers)
+
+    def add(self, value_hash: int) -> bool:
+        """Adds a value to the sketch by its 64-bit hash.
+
+        :param value_hash: A uniformly distributed 64-bit hash of the value
+        :type value_hash: int
+        :return: Whether the sketch changed, which it doesn't for values it has seen before
+        :rtype: bool
+        """
+        if self.hashes is None:
+            return self._add_to_registers(value_hash)
+        if value_hash in self.hashes:
+            return False
+        self.hashes.add(value_hash)
+        if len(self.hashes) > self.max_sparse_hashes:
+            self._switch_to_registers()
+        return True
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Adds all of the values in another sketch with the same precision to this one.
+
+        :param other: The sketch to merge into this one
+        :type other: HyperLogLog
+        :raises ValueError: If the sketches have different precisions
+        """
+        if other.precision != self.precision:
+            raise ValueError("Only sketches with the same precision can be merged")
+        if other.hashes is not None:
+            for value_hash in other.hashes:
+                self.add(value_hash)
+            return
+        if self.hashes is not None:
+            self._switch_to_registers()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimates the number of distinct values added to the sketch.
+
+        :return: The estimated number of distinct values
+        :rtype: int
+        """
+        if self.hashes is not None:
+            return len(self.hashes)
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        # Registers only hold a few distinct ranks, so summing over them is much quicker than over every register
+        ranks = Counter(self.registers)
+        estimate = alpha * size * size / sum(_INVERSE_POWERS[rank] * n for rank, n in ranks.items())
+        empty = ranks[0]
+        # Linear counting is much more accurate while most registers are still empty
+        if estimate <= 2.5 * size and empty:
+            estimate = size * math.log(size / empty)
+        return round(estimate)
+
+    def _add_to_registers(self, value_hash: int) -> bool:
+        remaining_bits = HASH_BITS - self.precision
+        index = value_hash >> remaining_bits
+        rank = remaining_bits - (value_hash & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank <= self.registers[index]:
+            return False
+        self.registers[index] = rank
+        return True
+
+    def _switch_to_registers(self) -> None:
+        hashes = self.hashes or ()
+        self.hashes = None
+        self.registers = bytearray(1 << self.precision)
+        for value_hash in hashes:
+            self._add_to_registers(value_hash)
@@ -0,0 +1,595 @@
+"""Bulk imports shortlinks and their stats from another system, like a legacy shortener being migrated from.
+
+The input is CSV with a header row naming its columns: `id` or `slug`, `long_url`, and optionally `created_at`,
+`visits` and `last_visit`. Each batch of rows is parsed and copied into a staging table with COPY, then merged into
+the shortlinks in bounded transactions, one statement per batch. Long URLs are validated and normalised the same way
+as when a URL is shortened. Rows can span several lines where a quoted field has line breaks in it. Compact slugs the
+sequence hasn't reached yet are kept, and the sequence is moved past them so new shortlinks never get them. Rejected
+rows are kept with the reason they were rejected. Progress is committed with every batch, so an interrupted import is
+resumed from where it stopped:
+
+    python -m stats.imports run links.csv
+    python -m stats.imports resume <job id> links.csv
+    python -m stats.imports status <job id>
+    python -m stats.imports rejections <job id> > rejections.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import logging
+import sys
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from uuid import UUID
+
+from psycopg import AsyncConnection
+from psycopg.rows import tuple_row
+from pydantic import HttpUrl, TypeAdapter, ValidationError
+from sqlalchemy import Row, select
+from sqlmodel import col, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import get_settings
+from core.db import get_session_context, use_job_statement_timeout
+from shortlinks.slugs import ID_BLOCK_SIZE, ID_SEQUENCE_START, compact_number, get_slug_codec, shortlink_id_sequence
+
+from .export import ExportFields, ExportFormat, stream_rows
+from .models import ImportJob, ImportRejection, ImportStatus
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ("id", "slug", "long_url", "created_at", "visits", "last_visit")
+"""The columns an import's input can have"""
+
+REJECTION_COLUMNS = ("line", "identifier", "long_url", "reason")
+"""The columns of an import's rejections"""
+
+MAX_VISITS = 2**31 - 1
+"""The most visits a shortlink can have"""
+
+MAX_ROW_LENGTH = 16 * 1024
+"""The longest a row spanning several lines can get before it's rejected, so a quote that's never closed can't
+swallow the rest of the input"""
+
+type StagingRow = tuple[
+    UUID, int, str | None, UUID | None, str | None, datetime | None, int | None, datetime | None, str | None
+]
+"""A parsed row of an import in the order it's copied into the staging table"""
+
+_URL_ADAPTER = TypeAdapter(HttpUrl)
+
+_COPY_STAGING_ROWS = """
+    COPY importstagingrow (job_id, line, identifier, shortlink_id, long_url, created_at, visits, last_visit, error)
+    FROM STDIN
+"""
+
+# Altering the sequence locks out nextval until the transaction ends, so workers can't reserve a block of ids while
+# the sequence is moved past imported ones
+_LOCK_SEQUENCE = text(f"ALTER SEQUENCE {shortlink_id_sequence.name} INCREMENT BY {ID_BLOCK_SIZE}")
+
+_SELECT_SEQUENCE_POSITION = text(f"""
+    SELECT CASE WHEN is_called THEN last_value + {ID_BLOCK_SIZE} ELSE last_value END FROM {shortlink_id_sequence.name}
+""")
+
+_ADVANCE_SEQUENCE = text(f"SELECT setval('{shortlink_id_sequence.name}', :last_id)")
+
+_LOCK_JOB = text("SELECT id FROM importjob WHERE id = :job_id FOR UPDATE")
+
+_UPDATE_LOADED_LINES = text("""
+    UPDATE importjob SET
+        loaded_lines = :loaded_lines, staged_rows = staged_rows + :staged_rows, status = :status, updated_at = now()
+    WHERE id = :job_id
+""")
+
+# The staging table is unlogged, so a database crash empties it. An import whose staged rows aren't all merged but
+# has none left lost them, and goes back to loading from the last line that was merged
+_RELOAD_LOST_ROWS = text("""
+    UPDATE importjob SET status = :status, loaded_lines = merged_lines, staged_rows = merged_rows, updated_at = now()
+    WHERE id = :job_id AND status != :done AND staged_rows > merged_rows
+        AND NOT EXISTS (SELECT FROM importstagingrow WHERE job_id = :job_id)
+    RETURNING loaded_lines
+""")
+
+_SELECT_FIRST_STAGED_LINE = text("SELECT min(line) FROM importstagingrow WHERE job_id = :job_id")
+
+# Merges a range of lines of a job's staged rows in a single statement. Rows are checked all at once, the valid ones
+# are inserted along with their stats, the rest are logged with why they were rejected, and the batch is deleted from
+# the staging table. A row whose shortlink already exists, or that repeats an earlier row's shortlink, is rejected,
+# as is one whose shortlink was created by someone else after it was checked, which only the insert can tell.
+# Staged rows are only matched up with the batch by looking them up in an index, never by joining the batch to itself,
+# so the plan doesn't depend on how many rows the planner guesses a batch has. Only the rows that were inserted are
+# joined back to the batch, by hashing them
+_MERGE_STAGED_ROWS = text("""
+    WITH batch AS (
+        SELECT * FROM importstagingrow WHERE job_id = :job_id AND line >= :first_line AND line < :end_line
+    ), checked AS (
+        SELECT batch.*, CASE
+            WHEN error IS NOT NULL THEN error
+            WHEN EXISTS (SELECT FROM shortlink WHERE shortlink.id = batch.shortlink_id) THEN 'shortlink already exists'
+        END AS reason
+        FROM batch
+    ), valid AS (
+        SELECT DISTINCT ON (shortlink_id) * FROM checked WHERE reason IS NULL ORDER BY shortlink_id, line
+    ), inserted AS (
+        INSERT INTO shortlink (id, long_url, created_at)
+        SELECT shortlink_id, long_url, coalesce(created_at, now()) FROM valid
+        ON CONFLICT (id) DO NOTHING
+        RETURNING id
+    ), inserted_rows AS (
+        SELECT valid.* FROM valid JOIN inserted ON inserted.id = valid.shortlink_id
+    ), inserted_stats AS (
+        INSERT INTO shortlinkstat (shortlink_id, visits, last_visit)
+        SELECT shortlink_id, coalesce(visits, 0), coalesce(last_visit, created_at, now()) FROM inserted_rows
+        WHERE visits > 0 OR last_visit IS NOT NULL
+        ON CONFLICT (shortlink_id) DO NOTHING
+    ), rejected AS (
+        INSERT INTO importrejection (job_id, line, identifier, long_url, reason)
+        SELECT job_id, line, identifier, long_url, reason FROM checked WHERE reason IS NOT NULL
+        UNION ALL
+        SELECT job_id, line, identifier, long_url, 'duplicate of an earlier row' FROM checked
+        WHERE reason IS NULL AND line NOT IN (SELECT line FROM valid)
+        UNION ALL
+        SELECT job_id, line, identifier, long_url, 'shortlink already exists' FROM valid
+        WHERE line NOT IN (SELECT line FROM inserted_rows)
+        RETURNING line
+    ), merged AS (
+        DELETE FROM importstagingrow WHERE job_id = :job_id AND line >= :first_line AND line < :end_line
+        RETURNING line
+    )
+    UPDATE importjob SET
+        merged_rows = merged_rows + (SELECT count(*) FROM merged),
+        merged_lines = coalesce(
+            (SELECT min(line) - 2 FROM importstagingrow WHERE job_id = :job_id AND line >= :end_line), loaded_lines
+        ),
+        imported_rows = imported_rows + (SELECT count(*) FROM inserted),
+        rejected_rows = rejected_rows + (SELECT count(*) FROM rejected),
+        updated_at = now()
+    WHERE id = :job_id
+""")
+
+_FINISH_MERGE = text("""
+    UPDATE importjob SET status = :status, merged_lines = loaded_lines, updated_at = now() WHERE id = :job_id
+""")
+
+
+class ImportRowParser:
+    """Parses the rows of an import's input into staging rows, rejecting those whose values can't be parsed.
+    Long URLs are validated a batch at a time, once the batch's rows have been parsed."""
+
+    def __init__(self, job_id: UUID, header: Sequence[str]) -> None:
+        """Checks an input's header and creates a parser for its rows.
+
+        :param job_id: The id of the import the rows belong to
+        :type job_id: UUID
+        :param header: The names of the input's columns
+        :type header: Sequence[str]
+        :raises ValueError: If a column isn't known, or the columns don't identify shortlinks and their long URLs
+        """
+        self.job_id = job_id
+        """The id of the import the rows belong to"""
+        self._reserved_ids: list[range] = []
+        self._columns = {name.strip(): index for index, name in enumerate(header)}
+        unknown = set(self._columns) - set(IMPORT_COLUMNS)
+        if unknown:
+            raise ValueError(
+                f"Unknown columns {', '.join(sorted(unknown))}, expected some of {', '.join(IMPORT_COLUMNS)}"
+            )
+        if ("id" in self._columns) == ("slug" in self._columns) or "long_url" not in self._columns:
+            raise ValueError("The header must have either an id or a slug column, and a long_url column")
+        self._width = len(header)
+        self._decode_slug = get_slug_codec().decode
+
+    def parse(self, line: int, fields: Sequence[str]) -> StagingRow:
+        """Parses a row of the input, rejecting it if any of its values can't be parsed.
+
+        :param line: The row's line number in the input
+        :type line: int
+        :param fields: The row's values, in the order of the header
+        :type fields: Sequence[str]
+        :return: The row to copy into the staging table, with why it was rejected if it was
+        :rtype: StagingRow
+        """
+        identifier = self._field(fields, "id") or self._field(fields, "slug")
+        long_url = self._field(fields, "long_url")
+        if len(fields) != self._width:
+            return self.reject(line, identifier, long_url, f"expected {self._width} fields, got {len(fields)}")
+        shortlink_id = self._parse_identifier(identifier)
+        if shortlink_id is None:
+            return self.reject(line, identifier, long_url, f"invalid {'id' if 'id' in self._columns else 'slug'}")
+        try:
+            created_at = self._parse_timestamp(fields, "created_at")
+        except ValueError:
+            return self.reject(line, identifier, long_url, "invalid created_at")
+        try:
+            last_visit = self._parse_timestamp(fields, "last_visit")
+        except ValueError:
+            return self.reject(line, identifier, long_url, "invalid last_visit")
+        visits = self._field(fields, "visits")
+        if visits is not None and not (visits.isascii() and visits.isdigit() and int(visits) <= MAX_VISITS):
+            return self.reject(line, identifier, long_url, "invalid visits")
+        return (
+            self.job_id,
+            line,
+            identifier,
+            shortlink_id,
+            long_url,
+            created_at,
+            int(visits) if visits is not None else None,
+            last_visit,
+            None,
+        )
+
+    async def reserve_compact_ids(self, rows: Sequence[StagingRow], session: AsyncSession) -> list[StagingRow]:
+        """Moves the sequence compact ids are generated from past the compact ids of a batch of parsed rows, so new
+        shortlinks are never given them. Rows with compact ids the sequence had already passed may have been given
+        to new shortlinks, so they're rejected instead, unless this import moved the sequence past them itself.
+        The sequence stays locked until the session's transaction ends.
+
+        :param rows: The parsed rows
+        :type rows: Sequence[StagingRow]
+        :param session: An async session connected to the primary database
+        :type session: AsyncSession
+        :return: The rows, with those whose ids may have been given to new shortlinks rejected
+        :rtype: list[StagingRow]
+        """
+        numbers: dict[int, int] = {}
+        for row in rows:
+            number = compact_number(row[3]) if row[3] is not None else None
+            if number is not None and not any(number in reserved for reserved in self._reserved_ids):
+                numbers[row[1]] = number
+        if not numbers:
+            return list(rows)
+        await super(AsyncSession, session).execute(_LOCK_SEQUENCE)
+        position = (await super(AsyncSession, session).execute(_SELECT_SEQUENCE_POSITION)).scalar_one()
+        last_id = max(numbers.values())
+        if last_id >= position:
+            await super(AsyncSession, session).execute(_ADVANCE_SEQUENCE, {"last_id": last_id})
+            self._reserved_ids.append(range(position, last_id + 1))
+        return [
+            self.reject(row[1], row[2], row[4], "slug may have been generated for a new shortlink")
+            if numbers.get(row[1], position) < position
+            else row
+            for row in rows
+        ]
+
+    def validate_urls(self, rows: Sequence[StagingRow]) -> list[StagingRow]:
+        """Validates the long URLs of a batch of parsed rows with the same ``HttpUrl`` type shortening a URL uses, and
+        normalises them the same way, so imported shortlinks redirect just like new ones would.
+
+        :param rows: The parsed rows
+        :type rows: Sequence[StagingRow]
+        :return: The rows with their long URLs normalised, and those whose long URL isn't valid rejected
+        :rtype: list[StagingRow]
+        """
+        validated: list[StagingRow] = []
+        for row in rows:
+            job_id, line, identifier, shortlink_id, long_url, created_at, visits, last_visit, error = row
+            if error is not None:
+                validated.append(row)
+                continue
+            try:
+                long_url = str(_URL_ADAPTER.validate_python(long_url))
+            except ValidationError:
+                validated.append(self.reject(line, identifier, long_url, "invalid long_url"))
+            else:
+                validated.append(
+                    (job_id, line, identifier, shortlink_id, long_url, created_at, visits, last_visit, error)
+                )
+        return validated
+
+    def reject(self, line: int, identifier: str | None, long_url: str | None, reason: str) -> StagingRow:
+        """Returns the staging row for a row that was rejected before it was merged"""
+        return self.job_id, line, identifier, None, long_url, None, None, None, reason
+
+    def _field(self, fields: Sequence[str], column: str) -> str | None:
+        index = self._columns.get(column)
+        if index is None or index >= len(fields):
+            return None
+        return fields[index].strip() or None
+
+    def _parse_identifier(self, identifier: str | None) -> UUID | None:
+        if identifier is None:
+            return None
+        if "slug" in self._columns:
+            return self._decode_slug(identifier)
+        try:
+            shortlink_id = UUID(identifier)
+        except ValueError:
+            return None
+        # Compact ids below the sequence's start have no slug that resolves to them
+        number = compact_number(shortlink_id)
+        return shortlink_id if number is None or number >= ID_SEQUENCE_START else None
+
+    def _parse_timestamp(self, fields: Sequence[str], column: str) -> datetime | None:
+        value = self._field(fields, column)
+        if value is None:
+            return None
+        timestamp = datetime.fromisoformat(value)
+        return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=UTC)
+
+
+async def read_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str | None]:
+    """Splits a stream of bytes into lines, without their line endings. Lines that aren't valid UTF-8 are None."""
+    remainder = b""
+    async for chunk in chunks:
+        *lines, remainder = (remainder + chunk).split(b"\n")
+        for line in lines:
+            yield decode_line(line)
+    if remainder:
+        yield decode_line(remainder)
+
+
+def ends_in_quoted_field(text: str) -> bool:
+    """Checks whether CSV text stops partway through a quoted field, so its row continues on the next line"""
+    quoted = closed = False
+    for index, character in enumerate(text):
+        if quoted:
+            if character == '"':
+                quoted, closed = False, True
+        elif character == '"' and (closed or index == 0 or text[index - 1] in ",\n"):
+            # Either a field opening with a quote, or an escaped quote straight after a closing one
+            quoted, closed = True, False
+        else:
+            closed = False
+    return quoted
+
+
+def decode_line(line: bytes) -> str | None:
+    """Decodes a line of UTF-8 without its line ending, or returns None if it isn't valid UTF-8"""
+    try:
+        return line.removesuffix(b"\r").decode()
+    except UnicodeDecodeError:
+        return None
+
+
+async def read_file(path: Path, chunk_size: int = 1 << 20) -> AsyncIterator[bytes]:
+    """Reads a file in chunks"""
+    with path.open("rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+async def create_import(source: str, session: AsyncSession) -> ImportJob:
+    """Starts a new import.
+
+    :param source: Where the imported rows come from, like the name of the file
+    :type source: str
+    :param session: An async session connected to the primary database
+    :type session: AsyncSession
+    :return: The new import
+    :rtype: ImportJob
+    """
+    job = ImportJob(source=source)
+    session.add(job)
+    await session.commit()
+    return job
+
+
+async def get_import(job_id: UUID, session: AsyncSession) -> ImportJob | None:
+    """Gets an import's progress, or None if there is no import with the id. An import whose staged rows were lost
+    when the database crashed is set back to loading, so it's resumed with its input from the last merged line."""
+    params = {"job_id": job_id, "status": ImportStatus.LOADING, "done": ImportStatus.DONE}
+    result = await super(AsyncSession, session).execute(_RELOAD_LOST_ROWS, params)
+    loaded_lines = result.scalar_one_or_none()
+    await session.commit()
+    if loaded_lines is not None:
+        logger.warning("Import %s lost its staged rows, so must be loaded again from line %s", job_id, loaded_lines + 2)
+    return await session.get(ImportJob, job_id, populate_existing=True)
+
+
+async def copy_staging_rows(rows: Iterable[StagingRow], session: AsyncSession) -> None:
+    """Copies parsed rows into the staging table within the session's transaction"""
+    # COPY isn't supported by SQLAlchemy, so it's run on the psycopg connection inside the session's transaction
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    if not isinstance(driver_connection, AsyncConnection):
+        raise TypeError("Import rows can only be copied with a psycopg connection")
+    async with driver_connection.cursor(row_factory=tuple_row) as cursor, cursor.copy(_COPY_STAGING_ROWS) as copy:
+        for row in rows:
+            await copy.write_row(row)
+
+
+async def load_import(
+    job: ImportJob,
+    chunks: AsyncIterable[bytes],
+    session: AsyncSession,
+    batch_size: int | None = None,
+) -> ImportJob:
+    """Parses an import's input and copies it into the staging table a batch at a time, each in its own
+    transaction. Lines that were already loaded by an earlier attempt are skipped, so resuming an import with the
+    same input continues where it stopped.
+
+    :param job: The import to load the input of
+    :type job: ImportJob
+    :param chunks: The input as a stream of bytes
+    :type chunks: AsyncIterable[bytes]
+    :param session: An async session connected to the primary database
+    :type session: AsyncSession
+    :param batch_size: How many rows to copy in each transaction, defaults to ``IMPORT_BATCH_SIZE``
+    :type batch_size: int | None
+    :raises ValueError: If the input's header is missing or invalid
+    :return: The import, ready to be merged
+    :rtype: ImportJob
+    """
+    batch_size = batch_size or get_settings().import_batch_size
+    lines = read_lines(chunks)
+    header = await anext(lines, None)
+    if not header:
+        raise ValueError("The input must start with a header row naming its columns")
+    parser = ImportRowParser(job.id, next(csv.reader([header])))
+
+    position = 0
+    batch: list[StagingRow] = []
+    row_lines: list[str] = []
+
+    async def flush(status: ImportStatus) -> None:
+        rows = await parser.reserve_compact_ids(parser.validate_urls(batch), session)
+        await copy_staging_rows(rows, session)
+        params = {"job_id": job.id, "loaded_lines": position, "staged_rows": len(batch), "status": status}
+        await super(AsyncSession, session).execute(_UPDATE_LOADED_LINES, params)
+        await session.commit()
+        batch.clear()
+
+    async for line in lines:
+        position += 1
+        if position <= job.loaded_lines:
+            continue
+        # Rows are numbered by the line they start on, and progress is only saved between rows
+        line_number = position + 1 - len(row_lines)
+        if line is None:
+            batch.append(parser.reject(line_number, None, None, "not valid UTF-8"))
+            row_lines.clear()
+        elif row_lines or line.strip():
+            row_lines.append(line)
+            row = "\n".join(row_lines)
+            if ('"' in line or len(row_lines) > 1) and ends_in_quoted_field(row) and len(row) < MAX_ROW_LENGTH:
+                continue
+            row_lines.clear()
+            try:
+                batch.append(parser.parse(line_number, next(csv.reader([row]))))
+            except csv.Error:
+                batch.append(parser.reject(line_number, None, None, "invalid CSV"))
+        if len(batch) >= batch_size:
+            await flush(ImportStatus.LOADING)
+    if row_lines:
+        batch.append(parser.reject(position + 2 - len(row_lines), None, None, "invalid CSV"))
+    await flush(ImportStatus.MERGING)
+    await session.refresh(job)
+    return job
+
+
+async def merge_import(job: ImportJob, session: AsyncSession, batch_size: int | None = None) -> ImportJob:
+    """Merges an import's staged rows into the shortlinks a batch at a time, each in its own transaction.
+
+    :param job: The import to merge, which must have been loaded
+    :type job: ImportJob
+    :param session: An async session connected to the primary database
+    :type session: AsyncSession
+    :param batch_size: How many lines to merge in each transaction, defaults to ``IMPORT_BATCH_SIZE``
+    :type batch_size: int | None
+    :return: The finished import
+    :rtype: ImportJob
+    """
+    batch_size = batch_size or get_settings().import_batch_size
+    params = {"job_id": job.id}
+    # Batches are ranges of lines rather than the first rows left, so each one is read straight from the primary key
+    # without sorting the rest of the staged rows or skipping over the ones already merged
+    result = await super(AsyncSession, session).execute(_SELECT_FIRST_STAGED_LINE, {"job_id": job.id})
+    first_line = result.scalar_one()
+    while first_line is not None and first_line <= job.loaded_lines + 1:
+        # Locking the import means two attempts at merging it take turns rather than merging the same rows
+        await use_job_statement_timeout(session)
+        await super(AsyncSession, session).execute(_LOCK_JOB, {"job_id": job.id})
+        end_line = first_line + batch_size
+        await super(AsyncSession, session).execute(
+            _MERGE_STAGED_ROWS, {**params, "first_line": first_line, "end_line": end_line}
+        )
+        await session.commit()
+        first_line = end_line
+    await super(AsyncSession, session).execute(_FINISH_MERGE, {"job_id": job.id, "status": ImportStatus.DONE})
+    await session.commit()
+    await session.refresh(job)
+    return job
+
+
+async def run_import(job: ImportJob, chunks: AsyncIterable[bytes] | None, session: AsyncSession) -> ImportJob:
+    """Runs an import, or resumes one that was interrupted, by loading its input unless that already finished and
+    then merging it.
+
+    :param job: The import to run
+    :type job: ImportJob
+    :param chunks: The import's input as a stream of bytes, which is only needed if it hasn't been loaded yet
+    :type chunks: AsyncIterable[bytes] | None
+    :param session: An async session connected to the primary database
+    :type session: AsyncSession
+    :raises ValueError: If the input is needed but missing, or its header is invalid
+    :return: The finished import
+    :rtype: ImportJob
+    """
+    if job.status == ImportStatus.LOADING:
+        if chunks is None:
+            raise ValueError(f"Import {job.id} hasn't finished loading, so its input is needed to resume it")
+        job = await load_import(job, chunks, session)
+    if job.status == ImportStatus.MERGING:
+        job = await merge_import(job, session)
+    return job
+
+
+async def merge_import_in_new_session(job_id: UUID) -> None:
+    """Merges a loaded import in its own session, logging any failure, so it can run in the background"""
+    try:
+        async with get_session_context() as session:
+            job = await get_import(job_id, session)
+            if job is not None and job.status == ImportStatus.MERGING:
+                await merge_import(job, session)
+    except Exception:
+        logger.exception("Failed to merge import %s", job_id)
+
+
+def stream_rejections(job_id: UUID, export_format: ExportFormat) -> AsyncIterator[bytes]:
+    """Streams the rows an import rejected and why, in the order of the input"""
+    statement = (
+        select(
+            col(ImportRejection.line),
+            col(ImportRejection.identifier),
+            col(ImportRejection.long_url),
+            col(ImportRejection.reason),
+        )
+        .where(col(ImportRejection.job_id) == job_id)
+        .order_by(col(ImportRejection.line))
+    )
+
+    def to_fields(row: Row[tuple[int, str | None, str | None, str]]) -> ExportFields:
+        line, identifier, long_url, reason = row
+        return line, identifier, long_url, reason
+
+    return stream_rows(statement, to_fields, REJECTION_COLUMNS, export_format)
+
+
+def report(job: ImportJob) -> None:
+    """Prints an import's progress"""
+    print(
+        f"import {job.id} from {job.source}: {job.status}, {job.loaded_lines} lines loaded, "
+        f"{job.merged_rows} rows merged, {job.imported_rows} imported, {job.rejected_rows} rejected",
+        file=sys.stderr,
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Runs the command line interface"""
+    if args.command == "rejections":
+        async for chunk in stream_rejections(args.job_id, ExportFormat.CSV):
+            sys.stdout.buffer.write(chunk)
+        return
+    async with get_session_context() as session:
+        if args.command == "run":
+            job = await create_import(args.file.name, session)
+            # Printed first so the import can be resumed if it's interrupted
+            report(job)
+        else:
+            job = await get_import(args.job_id, session)
+            if job is None:
+                sys.exit(f"There is no import {args.job_id}")
+        if args.command != "status":
+            job = await run_import(job, read_file(args.file) if args.file else None, session)
+        report(job)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Import shortlinks from a CSV file")
+    run_parser.add_argument("file", type=Path, help="The CSV file to import")
+    resume_parser = commands.add_parser("resume", help="Resume an import that was interrupted")
+    resume_parser.add_argument("job_id", type=UUID, help="The id of the import")
+    resume_parser.add_argument(
+        "file", type=Path, nargs="?", help="The same CSV file, needed unless the import finished loading"
+    )
+    status_parser = commands.add_parser("status", help="Show an import's progress")
+    status_parser.add_argument("job_id", type=UUID, help="The id of the import")
+    rejections_parser = commands.add_parser("rejections", help="Write the rows an import rejected as CSV")
+    rejections_parser.add_argument("job_id", type=UUID, help="The id of the import")
+    asyncio.run(main(parser.parse_args()))
@@ -1,17 +1,243 @@
 import uuid
-from datetime import datetime
+from datetime import UTC, datetime, timedelta
+from enum import StrEnum
 
-from sqlmodel import Column, DateTime, Field, SQLModel
+from sqlmodel import BigInteger, Column, DateTime, Enum, Field, Identity, Index, LargeBinary, SQLModel
 
 
 class ShortlinkStat(SQLModel, table=True):
-    """A model containing visitation stats for a shortlink"""
+    """A model containing visitation stats for a shortlink.
+
+    Each metric that stats are sorted by is indexed together with the shortlink id, so the top stats can be read
+    from the end of an index and pages of all stats can seek to where the previous page ended."""
+
+    __table_args__ = (
+        Index("ix_shortlinkstat_visits_shortlink_id", "visits", "shortlink_id"),
+        Index("ix_shortlinkstat_unique_visitors_shortlink_id", "unique_visitors", "shortlink_id"),
+        Index("ix_shortlinkstat_last_visit_shortlink_id", "last_visit", "shortlink_id"),
+    )
 
     shortlink_id: uuid.UUID = Field(primary_key=True, foreign_key="shortlink.id")
     """The id of the shortlink, used as the primary key for this table"""
 
-    visits: int = Field(default=0, index=True)
+    visits: int = Field(default=0)
     """The total visit count for this shortlink"""
 
-    last_visit: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False, index=True))
+    last_visit: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
     """The timestamp for the last time this shortlink was visited"""
+
+    unique_visitors: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    """The approximate number of distinct visitors to this shortlink, estimated from the visitor sketch"""
+
+    visitor_sketch: bytes | None = Field(default=None, sa_column=Column(LargeBinary, nullable=True))
+    """A HyperLogLog sketch of the hashed identifiers of this shortlink's visitors"""
+
+
+def enum_values(enum_class: type[StrEnum]) -> list[str]:
+    """Returns the values of an enum's members, so that values rather than names are stored in the database"""
+    return [member.value for member in enum_class]
+
+
+class VisitorHashKey(SQLModel, table=True):
+    """A model containing the secret key visitors are hashed with when ``visitor_hash_key`` isn't set. The first
+    worker to start generates it, and every worker loads the same one, so a visitor's hash doesn't depend on which
+    worker counted their visit."""
+
+    id: int = Field(default=1, primary_key=True, sa_column_kwargs={"autoincrement": False})
+    """Always 1, since there's only ever one key"""
+
+    key: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    """The random key"""
+
+
+class BucketGranularity(StrEnum):
+    """Enum defining the time spans that visits are rolled up into"""
+
+    HOUR = "hour"
+    DAY = "day"
+
+    @property
+    def span(self) -> timedelta:
+        """How long each bucket of this granularity lasts"""
+        return timedelta(hours=1) if self == BucketGranularity.HOUR else timedelta(days=1)
+
+    def bucket_start(self, timestamp: datetime) -> datetime:
+        """Returns the start of the bucket that a timezone aware timestamp falls into, in UTC"""
+        start = timestamp.astimezone(UTC).replace(minute=0, second=0, microsecond=0)
+        return start if self == BucketGranularity.HOUR else start.replace(hour=0)
+
+
+class ShortlinkVisitBucket(SQLModel, table=True):
+    """A model containing the number of visits to a shortlink within an hourly or daily bucket of time"""
+
+    # Lets pruning find expired buckets without scanning every shortlink's buckets
+    __table_args__ = (Index("ix_shortlinkvisitbucket_granularity_bucket_start", "granularity", "bucket_start"),)
+
+    shortlink_id: uuid.UUID = Field(primary_key=True, foreign_key="shortlink.id")
+    """The id of the visited shortlink"""
+
+    granularity: BucketGranularity = Field(
+        sa_column=Column(
+            Enum(BucketGranularity, native_enum=False, length=8, values_callable=enum_values),
+            primary_key=True,
+        )
+    )
+    """How long the bucket lasts"""
+
+    bucket_start: datetime = Field(sa_column=Column(DateTime(timezone=True), primary_key=True))
+    """When the bucket starts, in UTC"""
+
+    visits: int = 0
+    """The number of visits within the bucket"""
+
+
+class VisitEvent(SQLModel, table=True):
+    """A model containing the details of a single visit to a shortlink, appended to a log partitioned by day.
+    Partitions are created ahead of time and dropped once they are past retention, see ``stats.partitions``."""
+
+    __table_args__ = (
+        Index("ix_visitevent_shortlink_id_visited_at", "shortlink_id", "visited_at"),
+        {"postgresql_partition_by": "RANGE (visited_at)"},
+    )
+
+    id: int | None = Field(default=None, sa_column=Column(BigInteger, Identity(), primary_key=True))
+    """A generated id for the event, unique together with the timestamp"""
+
+    visited_at: datetime = Field(sa_column=Column(DateTime(timezone=True), primary_key=True))
+    """When the visit happened, which decides the partition the event is stored in"""
+
+    shortlink_id: uuid.UUID
+    """The id of the visited shortlink. This isn't a foreign key so appending events doesn't have to check it"""
+
+    referrer: str | None = Field(default=None, max_length=2083)
+    """The page that linked to the shortlink, if the visitor's browser sent one"""
+
+    user_agent: str | None = Field(default=None, max_length=512)
+    """The user agent of the visitor's browser"""
+
+    country: str | None = Field(default=None, max_length=2)
+    """The ISO 3166 country code of the visitor, if a proxy in front of the service provided one"""
+
+
+class TrendingMinute(SQLModel, table=True):
+    """A model containing a summary of the most visited shortlinks within a minute from one flush. Each flush adds
+    its own rows, so workers never wait on each other, and a minute's rows are merged into one once it's over."""
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    """The UUID of the summary"""
+
+    minute_start: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False, index=True))
+    """When the minute starts, in UTC"""
+
+    summary: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    """A serialized Space-Saving summary of the visits to each shortlink within the minute"""
+
+
+class ImportStatus(StrEnum):
+    """Enum defining the stages of a bulk import"""
+
+    LOADING = "loading"
+    MERGING = "merging"
+    DONE = "done"
+
+
+class ImportJob(SQLModel, table=True):
+    """A model tracking the progress of a bulk import of shortlinks from another system, so an interrupted import
+    can be resumed where it stopped"""
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    """The UUID of the import"""
+
+    source: str
+    """Where the imported rows came from, like the name of the file"""
+
+    status: ImportStatus = Field(
+        default=ImportStatus.LOADING,
+        sa_column=Column(Enum(ImportStatus, native_enum=False, length=8, values_callable=enum_values), nullable=False),
+    )
+    """Which stage the import has reached"""
+
+    loaded_lines: int = 0
+    """How many lines of the input after its header have been copied into the staging table"""
+
+    staged_rows: int = 0
+    """How many rows have been copied into the staging table"""
+
+    merged_rows: int = 0
+    """How many staged rows have been merged into the shortlinks, or rejected"""
+
+    merged_lines: int = 0
+    """How many lines of the input after its header have been merged, up to the first row still staged"""
+
+    imported_rows: int = 0
+    """How many shortlinks have been created"""
+
+    rejected_rows: int = 0
+    """How many rows have been rejected, each with its reason in the import's rejections"""
+
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+    """When the import started"""
+
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+    """When the import last made progress"""
+
+
+class ImportStagingRow(SQLModel, table=True):
+    """A model containing a row of a bulk import that has been parsed but not yet merged into the shortlinks.
+    Rows are copied in with COPY and deleted once they are merged. The table is unlogged, so staging rows aren't
+    written to the WAL or replicated, and it's emptied if the database crashes, after which the import is loaded
+    again from the last line that was merged."""
+
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    job_id: uuid.UUID = Field(primary_key=True, foreign_key="importjob.id")
+    """The id of the import the row belongs to"""
+
+    line: int = Field(sa_column=Column(BigInteger, primary_key=True))
+    """The row's line number in the input, counting the header as line 1"""
+
+    identifier: str | None = None
+    """The slug or UUID the row identified its shortlink by, as it was given"""
+
+    shortlink_id: uuid.UUID | None = None
+    """The UUID of the shortlink to create, or None if the row was rejected while it was parsed"""
+
+    long_url: str | None = None
+    """The long URL the shortlink redirects to, which is validated when it's merged"""
+
+    created_at: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True), nullable=True))
+    """When the shortlink was created, or None to use the time it's imported"""
+
+    visits: int | None = None
+    """The total visit count for the shortlink"""
+
+    last_visit: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True), nullable=True))
+    """The timestamp of the last visit to the shortlink"""
+
+    error: str | None = None
+    """Why the row was rejected while it was parsed, if it was"""
+
+
+class ImportRejection(SQLModel, table=True):
+    """A model containing a row of a bulk import that was rejected and why, as the import's error log"""
+
+    job_id: uuid.UUID = Field(primary_key=True, foreign_key="importjob.id")
+    """The id of the import the row belonged to"""
+
+    line: int = Field(sa_column=Column(BigInteger, primary_key=True))
+    """The row's line number in the input, counting the header as line 1"""
+
+    identifier: str | None = None
+    """The slug or UUID the row identified its shortlink by"""
+
+    long_url: str | None = None
+    """The long URL of the row"""
+
+    reason: str
+    """Why the row was rejected"""
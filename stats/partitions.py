@@ -0,0 +1,212 @@
+"""Creates and drops the daily partitions of the visit event log.
+
+Partitions are maintained by each worker while visit events are enabled, but can also be managed by hand:
+
+    python -m stats.partitions list
+    python -m stats.partitions create --days 7
+    python -m stats.partitions drop --retention-days 30
+"""
+
+import argparse
+import asyncio
+import re
+from datetime import UTC, date, datetime, timedelta
+
+from sqlmodel import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import get_settings
+from core.db import engine, get_session_context, hold_job_lock, try_job_lock, use_job_statement_timeout
+
+VISIT_EVENT_TABLE = "visitevent"
+"""The name of the partitioned visit event table"""
+
+PARTITION_NAME_PATTERN = re.compile(rf"^{VISIT_EVENT_TABLE}_p(\d{{8}})$")
+"""Matches the names of visit event partitions, capturing the day they hold"""
+
+PARTITION_JOB = "visit event partitions"
+"""The name of the advisory lock that lets one worker at a time create or drop partitions"""
+
+_LIST_PARTITION_TABLES = text("""
+    SELECT child.relname, pg_inherits.inhrelid IS NOT NULL, coalesce(pg_inherits.inhdetachpending, false)
+    FROM pg_class child
+    LEFT JOIN pg_inherits ON pg_inherits.inhrelid = child.oid
+    WHERE child.relkind = 'r' AND child.relname LIKE :prefix
+""")
+_SET_STATEMENT_TIMEOUT = text("SELECT set_config('statement_timeout', :timeout, false)")
+_RESET_STATEMENT_TIMEOUT = text("RESET statement_timeout")
+
+
+def partition_name(day: date) -> str:
+    """Returns the name of the visit event partition that holds a day of events"""
+    return f"{VISIT_EVENT_TABLE}_p{day:%Y%m%d}"
+
+
+def is_partition_name(name: str) -> bool:
+    """Returns whether a table name is a visit event partition, which the models don't describe"""
+    return PARTITION_NAME_PATTERN.match(name) is not None
+
+
+async def list_partitions(session: AsyncSession) -> dict[date, str]:
+    """Lists the existing visit event partitions.
+
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    :return: The names of the partitions keyed by the day they hold, in chronological order
+    :rtype: dict[date, str]
+    """
+    result = await super(AsyncSession, session).execute(
+        text("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+        """),
+        {"table": VISIT_EVENT_TABLE},
+    )
+    partitions: dict[date, str] = {}
+    for (name,) in result:
+        match = PARTITION_NAME_PATTERN.match(name)
+        if match:
+            partitions[date.fromisoformat(match[1])] = name
+    return dict(sorted(partitions.items()))
+
+
+async def create_partitions(start: date, days: int, session: AsyncSession) -> list[str]:
+    """Creates the visit event partitions for a range of days, skipping any that already exist.
+    Nothing is created while another worker is creating or dropping partitions, since it will create the same ones.
+
+    :param start: The first day to create a partition for
+    :type start: date
+    :param days: How many days to create partitions for
+    :type days: int
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    :return: The names of the partitions that were created
+    :rtype: list[str]
+    """
+    await use_job_statement_timeout(session)
+    created: list[str] = []
+    if not await try_job_lock(PARTITION_JOB, session):
+        await session.commit()
+        return created
+    existing = await list_partitions(session)
+    for day in (start + timedelta(days=i) for i in range(days)):
+        if day in existing:
+            continue
+        name = partition_name(day)
+        next_day = day + timedelta(days=1)
+        # Names and bounds are generated from dates, so they are safe to format into the DDL
+        await super(AsyncSession, session).execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {VISIT_EVENT_TABLE} "
+                f"FOR VALUES FROM ('{day.isoformat()} 00:00+00') TO ('{next_day.isoformat()} 00:00+00')"
+            )
+        )
+        created.append(name)
+    await session.commit()
+    return created
+
+
+async def drop_partitions(before: date, session: AsyncSession) -> list[str]:
+    """Drops the visit event partitions holding days before the given one.
+    Dropping a whole partition is much cheaper than deleting its rows, and leaves no dead tuples behind.
+
+    Each partition is detached with ``DETACH PARTITION ... CONCURRENTLY`` before it's dropped, so queries and
+    inserts on the visit event table aren't blocked while it waits for the queries using the partition to finish.
+    That can't run in a transaction, so the session's connection runs in autocommit mode, holding the partition
+    lock until it's done, and any transaction the session has in progress is committed first. Nothing is dropped
+    while another worker is creating or dropping partitions. Partitions left detached, or still detaching, by a
+    drop that was interrupted are finished off.
+
+    :param before: The first day to keep
+    :type before: date
+    :param session: An async session connected to a database
+    :type session: AsyncSession
+    :return: The names of the partitions that were dropped
+    :rtype: list[str]
+    """
+    await session.commit()
+    await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+    dropped: list[str] = []
+    async with hold_job_lock(PARTITION_JOB, session) as locked:
+        if not locked:
+            await session.commit()
+            return dropped
+        # SET LOCAL wouldn't outlast each statement in autocommit mode, so the job's timeout is set on the
+        # connection and reset before it goes back to the pool
+        await super(AsyncSession, session).execute(
+            _SET_STATEMENT_TIMEOUT, {"timeout": str(get_settings().db_job_statement_timeout)}
+        )
+        try:
+            result = await super(AsyncSession, session).execute(
+                _LIST_PARTITION_TABLES, {"prefix": f"{VISIT_EVENT_TABLE}\\_p%"}
+            )
+            for name, attached, detaching in sorted(result.tuples()):
+                match = PARTITION_NAME_PATTERN.match(name)
+                if not match or date.fromisoformat(match[1]) >= before:
+                    continue
+                if detaching:
+                    await super(AsyncSession, session).execute(
+                        text(f"ALTER TABLE {VISIT_EVENT_TABLE} DETACH PARTITION {name} FINALIZE")
+                    )
+                elif attached:
+                    await super(AsyncSession, session).execute(
+                        text(f"ALTER TABLE {VISIT_EVENT_TABLE} DETACH PARTITION {name} CONCURRENTLY")
+                    )
+                await super(AsyncSession, session).execute(text(f"DROP TABLE IF EXISTS {name}"))
+                dropped.append(name)
+        finally:
+            await super(AsyncSession, session).execute(_RESET_STATEMENT_TIMEOUT)
+    await session.commit()
+    return dropped
+
+
+async def maintain_partitions() -> None:
+    """Creates the partitions for today and the configured days ahead, and drops those past retention"""
+    settings = get_settings()
+    today = datetime.now(UTC).date()
+    async with get_session_context() as session:
+        await create_partitions(today, settings.visit_event_partitions_ahead + 1, session)
+        if settings.visit_event_retention_days:
+            await drop_partitions(today - timedelta(days=settings.visit_event_retention_days), session)
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Runs a partition management command"""
+    today = datetime.now(UTC).date()
+    try:
+        async with get_session_context() as session:
+            if args.command == "create":
+                names = await create_partitions(today, args.days, session)
+            elif args.command == "drop":
+                names = await drop_partitions(today - timedelta(days=args.retention_days), session)
+            else:
+                names = list((await list_partitions(session)).values())
+    finally:
+        await engine.dispose()
+    for name in names:
+        print(name)
+
+
+if __name__ == "__main__":
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the existing partitions")
+    create_parser = commands.add_parser("create", help="Create partitions for today and the days after it")
+    create_parser.add_argument(
+        "--days",
+        type=int,
+        default=settings.visit_event_partitions_ahead + 1,
+        help="How many days to create partitions for, including today",
+    )
+    drop_parser = commands.add_parser("drop", help="Drop partitions older than the retention period")
+    drop_parser.add_argument(
+        "--retention-days",
+        type=int,
+        default=settings.visit_event_retention_days,
+        help="How many days before today to keep partitions for",
+    )
+    asyncio.run(main(parser.parse_args()))
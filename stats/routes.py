@@ -1,36 +1,357 @@
-from typing import Annotated
+from collections.abc import AsyncIterator
+from contextlib import suppress
+from datetime import UTC, datetime, timedelta
+from typing import Annotated, Any
+from uuid import UUID
 
-from fastapi import APIRouter, Depends, Path, Query, Response, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Path, Query, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import TypeAdapter
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from core.db import get_session
+from core.admin import require_admin_key
+from core.config import get_settings
+from core.db import get_read_session, get_read_session_context, get_session, get_session_context
 from shortlinks.service import ShortlinkService
-from stats.service import ShortlinkWithStats
 
-from .service import StatMetric, StatsService
+from .cache import CachedResponse, etag_matches, get_stats_response_cache
+from .export import ExportFormat, export_shortlinks, export_stats
+from .imports import create_import, get_import, load_import, merge_import_in_new_session, stream_rejections
+from .models import BucketGranularity, ImportJob, ImportStatus
+from .service import (
+    DEFAULT_TRENDING_WINDOW,
+    MAX_STATS_PAGE_SIZE,
+    MAX_TOP_STATS,
+    ShortlinkTimeseries,
+    ShortlinkWithStats,
+    StatMetric,
+    StatsCursor,
+    StatsFilters,
+    StatsPage,
+    StatsService,
+    StatsSort,
+)
+
+_TOP_STATS_ADAPTER = TypeAdapter(list[ShortlinkWithStats])
+
+_NOT_MODIFIED_RESPONSE: dict[int | str, dict[str, Any]] = {
+    status.HTTP_304_NOT_MODIFIED: {"description": "The stats match the `ETag` sent in `If-None-Match`"}
+}
+
+IfNoneMatch = Annotated[
+    str | None, Header(description="The `ETag` of stats already held, which are not sent again if unchanged")
+]
+
+ExportFormatQuery = Annotated[ExportFormat, Query(alias="format", description="What to encode the export as")]
+
+ImportJobId = Annotated[UUID, Path(description="The id of the import")]
+
+_IMPORT_NOT_FOUND = {"detail": "Not Found"}
+
+_IMPORT_BODY: dict[str, Any] = {
+    "requestBody": {"required": True, "content": {"text/csv": {"schema": {"type": "string", "format": "binary"}}}}
+}
 
 router = APIRouter()
 
 
-@router.get("/stats", name="Top Stats")
+def as_utc(timestamp: datetime) -> datetime:
+    """Treats timestamps without a timezone as UTC"""
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=UTC)
+
+
+def export_response(name: str, body: AsyncIterator[bytes], export_format: ExportFormat) -> StreamingResponse:
+    """Streams an export to the client as a file download"""
+    return StreamingResponse(
+        body,
+        media_type=export_format.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'},
+    )
+
+
+def cached_response(cached: CachedResponse | None, age: float, if_none_match: str | None) -> Response:
+    """Sends a cached stats response with headers that let clients and CDNs cache it and revalidate it,
+    an empty 304 if the client already has it, or a 404 if there was nothing to cache"""
+    if cached is None:
+        return JSONResponse({"detail": "Not Found"}, status_code=status.HTTP_404_NOT_FOUND)
+    settings = get_settings()
+    headers = {
+        "ETag": cached.etag,
+        "Cache-Control": (
+            f"public, max-age={int(settings.stats_cache_max_age)}, "
+            f"stale-while-revalidate={int(settings.stats_cache_stale_while_revalidate)}"
+        ),
+        "Age": str(int(age)),
+        "X-Stats-Age": f"{age:.3f}",
+    }
+    if if_none_match and etag_matches(if_none_match, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+
+@router.get("/stats", name="Top Stats", response_model=list[ShortlinkWithStats], responses=_NOT_MODIFIED_RESPONSE)
 async def get_stats(
     *,
     metric: Annotated[StatMetric, Query(description="Which metric to sort the results by")] = StatMetric.VISITS,
-    limit: Annotated[int, Query(description="How many results to return", ge=0, le=100)] = 10,
-    session: Annotated[AsyncSession, Depends(get_session)],
-) -> list[ShortlinkWithStats]:
-    """Gets the top shortlink stats based on the requested metric and limit"""
-    return await StatsService.get_top_stats(metric, limit, session)
+    limit: Annotated[int, Query(description="How many results to return", ge=0, le=MAX_TOP_STATS)] = 10,
+    window: Annotated[
+        int,
+        Query(
+            description="How many minutes of recent visits to rank the `trending` metric by",
+            ge=1,
+            le=get_settings().stats_trending_max_window,
+        ),
+    ] = DEFAULT_TRENDING_WINDOW,
+    if_none_match: IfNoneMatch = None,
+) -> Response:
+    """Gets the top shortlink stats based on the requested metric and limit.
+    The stats can be up to a few seconds old, the `Age` and `X-Stats-Age` headers say how old in seconds."""
 
+    async def load() -> tuple[bytes, float]:
+        async with get_read_session_context() as session:
+            stats = await StatsService.get_top_stats(metric, limit, session, window)
+        return _TOP_STATS_ADAPTER.dump_json(stats), 0.0
 
-@router.get("/stats/{slug}", name="Stats for Shortlink", response_model=ShortlinkWithStats)
+    # The window only changes the trending shortlinks
+    key = ("top", metric, limit, window if metric == StatMetric.TRENDING else 0)
+    cached, age = await get_stats_response_cache().get(key, load)
+    return cached_response(cached, age, if_none_match)
+
+
+@router.get("/stats/list", name="List Stats", response_model=StatsPage, dependencies=[Depends(require_admin_key)])
+async def list_stats(
+    *,
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    sort: Annotated[StatsSort, Query(description="Which metric to sort the results by, highest first")] = (
+        StatsSort.VISITS
+    ),
+    limit: Annotated[int, Query(description="How many results to return", ge=1, le=MAX_STATS_PAGE_SIZE)] = 100,
+    cursor: Annotated[
+        str | None, Query(description="The `next_cursor` of the previous page, omitted for the first page")
+    ] = None,
+    created_after: Annotated[datetime | None, Query(description="Only include shortlinks created after this")] = None,
+    created_before: Annotated[datetime | None, Query(description="Only include shortlinks created before this")] = None,
+    min_visits: Annotated[
+        int | None, Query(description="Only include shortlinks with at least this many visits", ge=0)
+    ] = None,
+    last_visit_after: Annotated[
+        datetime | None, Query(description="Only include shortlinks last visited after this")
+    ] = None,
+    last_visit_before: Annotated[
+        datetime | None, Query(description="Only include shortlinks last visited before this")
+    ] = None,
+) -> StatsPage:
+    """Pages through the stats of every shortlink that has been visited, for exporting them all.
+    Pass each page's `next_cursor` to get the page after it, with the same sort and filters.
+    Every page takes the same time to read however deep it is. Timestamps without a timezone are in UTC.
+    Needs the admin API key."""
+    after = None
+    if cursor is not None:
+        with suppress(ValueError):
+            after = StatsCursor.decode(cursor)
+        if after is None or after.sort != sort:
+            raise RequestValidationError(
+                [
+                    {
+                        "type": "value_error",
+                        "loc": ("query", "cursor"),
+                        "msg": "The cursor must be the next_cursor of a page with the same sort",
+                        "input": cursor,
+                    }
+                ]
+            )
+    filters = StatsFilters(
+        created_after=as_utc(created_after) if created_after else None,
+        created_before=as_utc(created_before) if created_before else None,
+        min_visits=min_visits,
+        last_visit_after=as_utc(last_visit_after) if last_visit_after else None,
+        last_visit_before=as_utc(last_visit_before) if last_visit_before else None,
+    )
+    items, next_cursor = await StatsService.get_stats_page(sort, limit, session, after, filters)
+    return StatsPage(items=items, next_cursor=next_cursor.encode() if next_cursor else None)
+
+
+@router.get(
+    "/stats/{slug}",
+    name="Stats for Shortlink",
+    response_model=ShortlinkWithStats,
+    responses=_NOT_MODIFIED_RESPONSE,
+)
 async def get_stats_for_slug(
     slug: Annotated[str, Path(description="The slug used to identify the shortlink")],
-    session: Annotated[AsyncSession, Depends(get_session)],
-) -> Response | ShortlinkWithStats:
-    """Gets the stats for a specific shortlink"""
-    shortlink = await ShortlinkService.from_slug(slug, session)
+    if_none_match: IfNoneMatch = None,
+) -> Response:
+    """Gets the stats for a specific shortlink.
+    The stats can be up to a few seconds old, the `Age` and `X-Stats-Age` headers say how old in seconds."""
+
+    async def load() -> tuple[bytes, float] | None:
+        async with get_read_session_context() as session, get_session_context() as primary_session:
+            stats = await StatsService.get_stats_for_slug(slug, session, primary_session)
+        return (stats.model_dump_json().encode(), 0.0) if stats else None
+
+    cached, age = await get_stats_response_cache().get(("slug", slug), load)
+    return cached_response(cached, age, if_none_match)
+
+
+@router.get("/stats/{slug}/timeseries", name="Visit Timeseries for Shortlink", response_model=ShortlinkTimeseries)
+async def get_timeseries_for_slug(
+    slug: Annotated[str, Path(description="The slug used to identify the shortlink")],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    primary_session: Annotated[AsyncSession, Depends(get_session)],
+    start: Annotated[
+        datetime | None,
+        Query(alias="from", description="When to start the timeseries from, defaults to 7 days before `to`"),
+    ] = None,
+    end: Annotated[
+        datetime | None, Query(alias="to", description="When to end the timeseries, defaults to now")
+    ] = None,
+    granularity: Annotated[
+        BucketGranularity, Query(description="How long each bucket of visits lasts")
+    ] = BucketGranularity.HOUR,
+) -> Response | ShortlinkTimeseries:
+    """Gets the number of visits to a specific shortlink per hour or day. Timestamps without a timezone are in UTC."""
+    end = as_utc(end) if end else datetime.now(UTC)
+    start = as_utc(start) if start else end - timedelta(days=7)
+    max_buckets = get_settings().stats_timeseries_max_buckets
+    if start >= end or (end - start) / granularity.span > max_buckets:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "value_error",
+                    "loc": ("query", "from"),
+                    "msg": f"The timeseries must start before it ends and have at most {max_buckets} buckets",
+                    "input": start.isoformat(),
+                }
+            ]
+        )
+    shortlink = await ShortlinkService.from_slug(slug, session, primary_session)
     if not shortlink:
         return JSONResponse({"detail": "Not Found"}, status_code=status.HTTP_404_NOT_FOUND)
-    return await StatsService.get_shortlink_stats(shortlink, session)
+    buckets = await StatsService.get_visit_timeseries(shortlink.id, granularity, start, end, session)
+    return ShortlinkTimeseries(slug=shortlink.slug, granularity=granularity, buckets=buckets)
+
+
+@router.get(
+    "/export/shortlinks",
+    name="Export Shortlinks",
+    response_class=StreamingResponse,
+    dependencies=[Depends(require_admin_key)],
+)
+async def get_shortlinks_export(export_format: ExportFormatQuery = ExportFormat.NDJSON) -> StreamingResponse:
+    """Streams every shortlink as newline delimited JSON or CSV, ordered by id. Needs the admin API key."""
+    return export_response("shortlinks", export_shortlinks(export_format), export_format)
+
+
+@router.get(
+    "/export/stats",
+    name="Export Stats",
+    response_class=StreamingResponse,
+    dependencies=[Depends(require_admin_key)],
+)
+async def get_stats_export(export_format: ExportFormatQuery = ExportFormat.NDJSON) -> StreamingResponse:
+    """Streams every shortlink with its stats as newline delimited JSON or CSV, ordered by id. Needs the admin API
+    key. Shortlinks that haven't been visited are included with no visits."""
+    return export_response("stats", export_stats(export_format), export_format)
+
+
+def invalid_import_body(error: ValueError) -> RequestValidationError:
+    """Describes an import input that can't be loaded as a validation error of the request body"""
+    return RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": str(error), "input": None}])
+
+
+def has_body(request: Request) -> bool:
+    """Whether a request was sent with a body"""
+    return request.headers.get("content-length", "0") != "0" or "transfer-encoding" in request.headers
+
+
+@router.post(
+    "/admin/imports",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ImportJob,
+    name="Start Import",
+    dependencies=[Depends(require_admin_key)],
+    openapi_extra=_IMPORT_BODY,
+)
+async def post_import(
+    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    background_tasks: BackgroundTasks,
+    source: Annotated[str, Query(description="Where the imported rows come from", max_length=255)] = "upload",
+) -> ImportJob:
+    """Bulk imports shortlinks and their stats from a CSV body with a header row naming its columns: `id` or
+    `slug`, `long_url`, and optionally `created_at`, `visits` and `last_visit`. The body is loaded before this
+    responds, and the rows are merged in the background. Rows that can't be imported are kept with the reason."""
+    job = await create_import(source, session)
+    try:
+        job = await load_import(job, request.stream(), session)
+    except ValueError as e:
+        await session.delete(job)
+        await session.commit()
+        raise invalid_import_body(e) from e
+    background_tasks.add_task(merge_import_in_new_session, job.id)
+    return job
+
+
+@router.post(
+    "/admin/imports/{job_id}",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ImportJob,
+    name="Resume Import",
+    dependencies=[Depends(require_admin_key)],
+    openapi_extra={"requestBody": {**_IMPORT_BODY["requestBody"], "required": False}},
+)
+async def post_resume_import(
+    job_id: ImportJobId,
+    request: Request,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    background_tasks: BackgroundTasks,
+) -> Response | ImportJob:
+    """Resumes an import that was interrupted. The same CSV body must be sent again unless the import had finished
+    loading, and the lines that were already loaded are skipped."""
+    job = await get_import(job_id, session)
+    if job is None:
+        return JSONResponse(_IMPORT_NOT_FOUND, status_code=status.HTTP_404_NOT_FOUND)
+    if job.status == ImportStatus.LOADING:
+        if not has_body(request):
+            raise invalid_import_body(ValueError("The import hasn't finished loading, so its input is needed"))
+        try:
+            job = await load_import(job, request.stream(), session)
+        except ValueError as e:
+            raise invalid_import_body(e) from e
+    if job.status == ImportStatus.MERGING:
+        background_tasks.add_task(merge_import_in_new_session, job.id)
+    return job
+
+
+@router.get(
+    "/admin/imports/{job_id}",
+    response_model=ImportJob,
+    name="Import Progress",
+    dependencies=[Depends(require_admin_key)],
+)
+async def get_import_progress(
+    job_id: ImportJobId, session: Annotated[AsyncSession, Depends(get_session)]
+) -> Response | ImportJob:
+    """Gets how far an import has got"""
+    job = await get_import(job_id, session)
+    if job is None:
+        return JSONResponse(_IMPORT_NOT_FOUND, status_code=status.HTTP_404_NOT_FOUND)
+    return job
+
+
+@router.get(
+    "/admin/imports/{job_id}/rejections",
+    name="Import Rejections",
+    response_class=StreamingResponse,
+    dependencies=[Depends(require_admin_key)],
+)
+async def get_import_rejections(
+    job_id: ImportJobId,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    export_format: ExportFormatQuery = ExportFormat.CSV,
+) -> Response:
+    """Streams the rows an import rejected with why, ordered by their line in the input"""
+    if await get_import(job_id, session) is None:
+        return JSONResponse(_IMPORT_NOT_FOUND, status_code=status.HTTP_404_NOT_FOUND)
+    return export_response(f"import-{job_id}-rejections", stream_rejections(job_id, export_format), export_format)
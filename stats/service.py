@@ -1,18 +1,41 @@
-from datetime import datetime
+import base64
+import json
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
 from enum import StrEnum
-from typing import Annotated, Self
+from typing import Annotated, NamedTuple, Self
 from uuid import UUID
 
 from fastapi import Depends
+from psycopg import AsyncConnection
+from psycopg.rows import tuple_row
 from pydantic import BaseModel, Field
-from sqlmodel import col, select, text
+from sqlalchemy import ColumnElement, Select, Uuid, any_, bindparam, tuple_
+from sqlalchemy import select as sa_select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlmodel import col, delete, select, text
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from core.db import get_session
+from core.config import get_settings
+from core.db import get_session, get_session_context, try_job_lock, use_job_statement_timeout
+from core.metrics import visit_record_lag_seconds
+from shortlinks.filter import get_slug_filter
 from shortlinks.models import Shortlink
-from shortlinks.service import ShortlinkService
 
-from .models import ShortlinkStat
+from .hyperloglog import HyperLogLog
+from .models import BucketGranularity, ShortlinkStat, ShortlinkVisitBucket, TrendingMinute
+from .spacesaving import SpaceSaving
+
+MAX_TOP_STATS = 100
+"""The most top stats that can be requested at once"""
+
+DEFAULT_TRENDING_WINDOW = 5
+"""How many minutes of recent visits trending shortlinks are ranked by if no window is given"""
+
+MAX_STATS_PAGE_SIZE = 1000
+"""The most stats that can be requested in a single page"""
 
 
 class ShortlinkWithStats(BaseModel):
@@ -22,27 +45,317 @@ class ShortlinkWithStats(BaseModel):
     short_url: str = Field(description="The URL the shortlink can be accessed at")
     long_url: str = Field(description="The URL the shortlink redirects to")
     visits: int = Field(description="The number of visits to this shortlink")
+    unique_visitors: int = Field(description="The approximate number of distinct visitors to this shortlink")
     last_visit: datetime | None = Field(description="The timestamp of the last visit to this shortlink")
 
     @classmethod
-    def from_models(cls, shortlink: Shortlink | None = None, stats: ShortlinkStat | None = None) -> Self:
-        """Creates a new instance from a shortlink and/or shortlink stats"""
+    def from_row(
+        cls,
+        shortlink_id: UUID,
+        long_url: str,
+        visits: int | None,
+        unique_visitors: int | None,
+        last_visit: datetime | None,
+    ) -> Self:
+        """Creates a new instance directly from the columns of a shortlink joined with its stats,
+        skipping validation since the values come straight from the database"""
+        slug = Shortlink.encode_slug(shortlink_id)
+        return cls.model_construct(
+            slug=slug,
+            short_url=Shortlink.build_short_url(slug),
+            long_url=long_url,
+            visits=visits or 0,
+            unique_visitors=unique_visitors or 0,
+            last_visit=last_visit,
+        )
+
+
+def select_shortlinks_with_stats() -> Select[tuple[UUID, str, int | None, int | None, datetime | None]]:
+    """Selects the columns of shortlinks and their stats that ``ShortlinkWithStats.from_row`` is created from.
+    There are more columns than SQLModel's ``select`` can type, so SQLAlchemy's is used."""
+    return sa_select(
+        col(Shortlink.id),
+        col(Shortlink.long_url),
+        col(ShortlinkStat.visits),
+        col(ShortlinkStat.unique_visitors),
+        col(ShortlinkStat.last_visit),
+    )
+
+
+def minute_start(timestamp: datetime) -> datetime:
+    """Returns the start of the minute that a timezone aware timestamp falls into, in UTC"""
+    return timestamp.astimezone(UTC).replace(second=0, microsecond=0)
+
+
+@dataclass(slots=True)
+class VisitCount:
+    """A number of visits to a shortlink that have not been recorded yet"""
+
+    visits: int
+    """How many visits have happened"""
+
+    last_visit: datetime
+    """The timestamp of the latest of those visits"""
+
+    hourly_visits: Counter[datetime] = field(default_factory=Counter[datetime])
+    """How many of the visits fall into each hourly bucket, keyed by the start of the bucket"""
+
+    visitor_hashes: set[int] = field(default_factory=set[int])
+    """The hashed identifiers of the visitors, to be added to the shortlink's visitor sketch"""
+
+    minute_visits: Counter[datetime] = field(default_factory=Counter[datetime])
+    """How many of the visits fall into each minute, keyed by its start, to rank trending shortlinks by"""
+
+    @classmethod
+    def single(cls, visited_at: datetime, visitor_hash: int | None = None) -> Self:
+        """Creates a count of a single visit at the given timestamp, by a visitor if their hash is known"""
         return cls(
-            slug=shortlink.slug if shortlink else "",
-            short_url=shortlink.short_url if shortlink else "",
-            long_url=shortlink.long_url if shortlink else "",
-            visits=stats.visits if stats else 0,
-            last_visit=stats.last_visit if stats else None,
+            1,
+            visited_at,
+            Counter({BucketGranularity.HOUR.bucket_start(visited_at): 1}),
+            {visitor_hash} if visitor_hash is not None else set(),
+            Counter({minute_start(visited_at): 1}),
         )
 
+    def add(self, other: "VisitCount") -> None:
+        """Adds another count of visits to the same shortlink to this one"""
+        self.visits += other.visits
+        self.last_visit = max(self.last_visit, other.last_visit)
+        self.hourly_visits.update(other.hourly_visits)
+        self.visitor_hashes.update(other.visitor_hashes)
+        self.minute_visits.update(other.minute_visits)
+
+
+class VisitEventData(NamedTuple):
+    """The details of a single visit to a shortlink for the visit event log, in the order they are copied"""
+
+    shortlink_id: UUID
+    """The id of the visited shortlink"""
+
+    visited_at: datetime
+    """When the visit happened"""
+
+    referrer: str | None
+    """The page that linked to the shortlink"""
+
+    user_agent: str | None
+    """The user agent of the visitor's browser"""
+
+    country: str | None
+    """The ISO 3166 country code of the visitor"""
+
+
+class VisitBucket(BaseModel):
+    """A response detailing the number of visits to a shortlink within a bucket of time"""
+
+    bucket_start: datetime = Field(description="When the bucket starts")
+    visits: int = Field(description="The number of visits within the bucket")
+
+
+class ShortlinkTimeseries(BaseModel):
+    """A response detailing the visits to a shortlink over time"""
+
+    slug: str = Field(description="The slug used to identify the shortlink")
+    granularity: BucketGranularity = Field(description="How long each bucket lasts")
+    buckets: list[VisitBucket] = Field(description="The visits within each bucket, in chronological order")
+
 
 class StatMetric(StrEnum):
     """Enum defining what metric options can be selected for sorting stats"""
 
     VISITS = "visits"
+    UNIQUE_VISITORS = "unique_visitors"
+    LAST_VISIT = "last_visit"
+    TRENDING = "trending"
+
+
+class StatsSort(StrEnum):
+    """Enum defining the orders that all stats can be paged through in, highest first"""
+
+    VISITS = "visits"
+    UNIQUE_VISITORS = "unique_visitors"
     LAST_VISIT = "last_visit"
 
 
+class StatsCursor(NamedTuple):
+    """The position of the last shortlink on a page of stats, which the next page starts after"""
+
+    sort: StatsSort
+    """The order the stats are paged through in"""
+
+    value: int | datetime
+    """The shortlink's value of the metric the stats are sorted by"""
+
+    shortlink_id: UUID
+    """The shortlink's id, which orders shortlinks with the same value"""
+
+    def encode(self) -> str:
+        """Encodes the cursor as an opaque, URL safe string"""
+        value = self.value.isoformat() if isinstance(self.value, datetime) else self.value
+        payload = json.dumps([self.sort.value, value, self.shortlink_id.hex], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).rstrip(b"=").decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> Self:
+        """Decodes a cursor encoded by ``encode``, raising ValueError if it isn't a valid cursor"""
+        try:
+            sort, value, shortlink_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            sort = StatsSort(sort)
+            if sort == StatsSort.LAST_VISIT:
+                value = datetime.fromisoformat(value)
+                if value.tzinfo is None:
+                    raise ValueError("The timestamp has no timezone")
+            elif type(value) is not int:
+                raise ValueError("The value is not an integer")
+            return cls(sort, value, UUID(hex=shortlink_id))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+@dataclass(frozen=True, slots=True)
+class StatsFilters:
+    """Conditions that shortlinks must meet to be included when paging through stats, each is ignored if None"""
+
+    created_after: datetime | None = None
+    """Only include shortlinks created after this timestamp"""
+
+    created_before: datetime | None = None
+    """Only include shortlinks created before this timestamp"""
+
+    min_visits: int | None = None
+    """Only include shortlinks with at least this many visits"""
+
+    last_visit_after: datetime | None = None
+    """Only include shortlinks last visited after this timestamp"""
+
+    last_visit_before: datetime | None = None
+    """Only include shortlinks last visited before this timestamp"""
+
+    def conditions(self) -> list[ColumnElement[bool]]:
+        """Returns the SQL conditions for the filters that are set"""
+        conditions: list[ColumnElement[bool]] = []
+        if self.created_after is not None:
+            conditions.append(col(Shortlink.created_at) > self.created_after)
+        if self.created_before is not None:
+            conditions.append(col(Shortlink.created_at) < self.created_before)
+        if self.min_visits is not None:
+            conditions.append(col(ShortlinkStat.visits) >= self.min_visits)
+        if self.last_visit_after is not None:
+            conditions.append(col(ShortlinkStat.last_visit) > self.last_visit_after)
+        if self.last_visit_before is not None:
+            conditions.append(col(ShortlinkStat.last_visit) < self.last_visit_before)
+        return conditions
+
+
+class StatsPage(BaseModel):
+    """A response containing a page of shortlinks with their stats"""
+
+    items: list[ShortlinkWithStats] = Field(description="The shortlinks on this page, in order")
+    next_cursor: str | None = Field(description="The cursor to request the next page with, or null on the last page")
+
+
+# One disadvantage with SQLModel is it's not as nice to do raw optimized SQL like this
+_UPSERT_STATS = text("""
+    INSERT INTO shortlinkstat AS sls
+        (shortlink_id, visits, last_visit)
+    SELECT * FROM unnest(
+        CAST(:shortlink_ids AS uuid[]),
+        CAST(:visits AS integer[]),
+        CAST(:last_visits AS timestamptz[])
+    )
+    ON CONFLICT (shortlink_id)
+    DO UPDATE SET
+        visits = sls.visits + EXCLUDED.visits,
+        last_visit = GREATEST(sls.last_visit, EXCLUDED.last_visit)
+""")
+
+_UPSERT_VISIT_BUCKETS = text("""
+    INSERT INTO shortlinkvisitbucket AS b
+        (shortlink_id, granularity, bucket_start, visits)
+    SELECT * FROM unnest(
+        CAST(:shortlink_ids AS uuid[]),
+        CAST(:granularities AS varchar[]),
+        CAST(:bucket_starts AS timestamptz[]),
+        CAST(:visits AS integer[])
+    )
+    ON CONFLICT (shortlink_id, granularity, bucket_start)
+    DO UPDATE SET visits = b.visits + EXCLUDED.visits
+""")
+
+_UPDATE_VISITOR_SKETCHES = text("""
+    UPDATE shortlinkstat AS sls
+    SET visitor_sketch = v.visitor_sketch, unique_visitors = v.unique_visitors
+    FROM unnest(
+        CAST(:shortlink_ids AS uuid[]),
+        CAST(:visitor_sketches AS bytea[]),
+        CAST(:unique_visitors AS integer[])
+    ) AS v(shortlink_id, visitor_sketch, unique_visitors)
+    WHERE sls.shortlink_id = v.shortlink_id
+""")
+
+_INSERT_TRENDING_MINUTES = text("""
+    INSERT INTO trendingminute (id, minute_start, summary)
+    SELECT gen_random_uuid(), * FROM unnest(CAST(:minute_starts AS timestamptz[]), CAST(:summaries AS bytea[]))
+""")
+
+# Expired buckets are found from the granularity and bucket start index and deleted by their physical location, as
+# DELETE has no LIMIT to bound each batch with
+_PRUNE_VISIT_BUCKETS = text("""
+    WITH pruned AS (
+        DELETE FROM shortlinkvisitbucket
+        WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM shortlinkvisitbucket
+            WHERE granularity = :granularity AND bucket_start < :before
+            LIMIT :batch_size
+        ))
+        RETURNING 1
+    )
+    SELECT count(*) FROM pruned
+""")
+
+# Rows deleted by a concurrent compaction are skipped, so each row is merged by only one worker
+_DELETE_UNMERGED_TRENDING_MINUTES = text("""
+    DELETE FROM trendingminute
+    WHERE minute_start IN (
+        SELECT minute_start FROM trendingminute
+        WHERE minute_start < :before
+        GROUP BY minute_start
+        HAVING count(*) > 1
+    )
+    RETURNING minute_start, summary
+""")
+
+_TOP_STATS_COLUMNS = {
+    StatMetric.VISITS: col(ShortlinkStat.visits),
+    StatMetric.UNIQUE_VISITORS: col(ShortlinkStat.unique_visitors),
+    StatMetric.LAST_VISIT: col(ShortlinkStat.last_visit),
+}
+
+_SELECT_TOP_STATS = {
+    metric: select_shortlinks_with_stats()
+    .join(Shortlink, col(Shortlink.id) == col(ShortlinkStat.shortlink_id))
+    .order_by(column.desc())
+    .limit(bindparam("limit"))
+    for metric, column in _TOP_STATS_COLUMNS.items()
+}
+
+_SELECT_STATS_FOR_IDS = (
+    select_shortlinks_with_stats()
+    .outerjoin(ShortlinkStat, col(ShortlinkStat.shortlink_id) == col(Shortlink.id))
+    .where(col(Shortlink.id) == any_(bindparam("shortlink_ids", type_=ARRAY(Uuid(as_uuid=True)))))
+)
+
+_SELECT_STATS_FOR_ID = (
+    select_shortlinks_with_stats()
+    .outerjoin(ShortlinkStat, col(ShortlinkStat.shortlink_id) == col(Shortlink.id))
+    .where(col(Shortlink.id) == bindparam("shortlink_id"))
+)
+
+_SELECT_VISITOR_SKETCHES = select(
+    ShortlinkStat.shortlink_id, ShortlinkStat.visits, ShortlinkStat.unique_visitors, ShortlinkStat.visitor_sketch
+).where(col(ShortlinkStat.shortlink_id) == any_(bindparam("shortlink_ids", type_=ARRAY(Uuid(as_uuid=True)))))
+
+
 class StatsService:
     """Service to handle tracking and querying stats on shortlinks"""
 
@@ -52,6 +365,7 @@ class StatsService:
         shortlink_id: UUID,
         last_visit: datetime,
         session: Annotated[AsyncSession, Depends(get_session)],
+        visitor_hash: int | None = None,
     ) -> None:
         """Records a visit to a shortlink by incrementing its visit count
         and updating the last visit timestamp if applicable.
@@ -62,26 +376,155 @@ class StatsService:
         :type last_visit: datetime
         :param session: An async session connected to a database
         :type session: AsyncSession
+        :param visitor_hash: The hashed identifier of the visitor, to count unique visitors
+        :type visitor_hash: int | None
+        """
+        await cls.record_visits({shortlink_id: VisitCount.single(last_visit, visitor_hash)}, session)
+
+    @classmethod
+    async def record_visit_in_new_session(
+        cls, shortlink_id: UUID, last_visit: datetime, visitor_hash: int | None = None
+    ) -> None:
+        """Records a visit to a shortlink using its own short-lived session, so that it can run
+        as a background task without holding on to the connection of the request that scheduled it.
+        How long the visit waited to be recorded is reported in ``visit_record_lag_seconds``.
+
+        :param shortlink_id: The UUID of the shortlink to update
+        :type shortlink_id: UUID
+        :param last_visit: The timestamp of the visit that's being recorded
+        :type last_visit: datetime
+        :param visitor_hash: The hashed identifier of the visitor, to count unique visitors
+        :type visitor_hash: int | None
         """
-        # One disadvantage with SQLModel is it's not as nice to do raw optimized SQL like this
+        async with get_session_context() as session:
+            await cls.record_visit(shortlink_id, last_visit, session, visitor_hash)
+        visit_record_lag_seconds.labels("background").observe((datetime.now(UTC) - last_visit).total_seconds())
+
+    @classmethod
+    async def record_visits(cls, visits: Mapping[UUID, VisitCount], session: AsyncSession) -> None:
+        """Records visits to many shortlinks at once with a single multi-row upsert,
+        adding to their visit counts and updating their last visit timestamps if applicable.
+        The hourly visits are added to both the hourly and daily buckets with a second upsert,
+        and the visitor hashes are merged into each shortlink's visitor sketch.
+        The visits in each minute are also added as new trending summaries for those minutes.
+
+        :param visits: The visits to record for each shortlink UUID
+        :type visits: Mapping[UUID, VisitCount]
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        """
+        if not visits:
+            return
+        # Rows are upserted in a consistent order so concurrent flushes from other workers can't deadlock
+        shortlink_ids = sorted(visits)
+        await super(AsyncSession, session).execute(
+            _UPSERT_STATS,
+            {
+                "shortlink_ids": shortlink_ids,
+                "visits": [visits[shortlink_id].visits for shortlink_id in shortlink_ids],
+                "last_visits": [visits[shortlink_id].last_visit for shortlink_id in shortlink_ids],
+            },
+        )
+
+        buckets: Counter[tuple[UUID, BucketGranularity, datetime]] = Counter()
+        for shortlink_id, visit_count in visits.items():
+            for hour_start, count in visit_count.hourly_visits.items():
+                buckets[shortlink_id, BucketGranularity.HOUR, hour_start] += count
+                buckets[shortlink_id, BucketGranularity.DAY, BucketGranularity.DAY.bucket_start(hour_start)] += count
+        if buckets:
+            keys = sorted(buckets)
+            await super(AsyncSession, session).execute(
+                _UPSERT_VISIT_BUCKETS,
+                {
+                    "shortlink_ids": [shortlink_id for shortlink_id, _, _ in keys],
+                    "granularities": [granularity.value for _, granularity, _ in keys],
+                    "bucket_starts": [bucket_start for _, _, bucket_start in keys],
+                    "visits": [buckets[key] for key in keys],
+                },
+            )
+        await cls._merge_visitor_sketches(visits, session)
+        await cls._add_trending_summaries(visits, session)
+        await session.commit()
+
+    @classmethod
+    async def _merge_visitor_sketches(cls, visits: Mapping[UUID, VisitCount], session: AsyncSession) -> None:
+        shortlink_ids = sorted(
+            shortlink_id for shortlink_id, visit_count in visits.items() if visit_count.visitor_hashes
+        )
+        if not shortlink_ids:
+            return
+        # The upsert of these rows locked them until the transaction commits, so concurrent flushes
+        # from other workers wait for this read-modify-write instead of overwriting the merged sketch
+        sketches: dict[UUID, bytes] = {}
+        unique_visitors: dict[UUID, int] = {}
+        for shortlink_id, total_visits, counted_visitors, data in await session.exec(
+            _SELECT_VISITOR_SKETCHES, params={"shortlink_ids": shortlink_ids}
+        ):
+            visit_count = visits[shortlink_id]
+            sketch = HyperLogLog.from_bytes(data) if data else HyperLogLog()
+            changed = False
+            for visitor_hash in visit_count.visitor_hashes:
+                changed |= sketch.add(visitor_hash)
+            # Visitors who were already counted leave the sketch as it was, so it's only written and estimated again
+            # when it changed, or when its estimate was capped by the visits before these ones
+            if not changed and data and counted_visitors < total_visits - visit_count.visits:
+                continue
+            sketches[shortlink_id] = sketch.to_bytes()
+            # The estimate can be slightly off, but there can never be more visitors than visits
+            unique_visitors[shortlink_id] = min(sketch.count(), total_visits)
+        if not sketches:
+            return
+        changed_ids = sorted(sketches)
         await super(AsyncSession, session).execute(
-            text("""
-                INSERT INTO shortlinkstat AS sls
-                    (shortlink_id, visits, last_visit)
-                VALUES (:shortlink_id, 1, :last_visit)
-                ON CONFLICT (shortlink_id)
-                DO UPDATE SET
-                    visits = sls.visits + 1,
-                    last_visit = (CASE
-                        WHEN sls.last_visit < EXCLUDED.last_visit THEN EXCLUDED.last_visit
-                        ELSE sls.last_visit
-                    END)
-            """),
+            _UPDATE_VISITOR_SKETCHES,
             {
-                "shortlink_id": shortlink_id,
-                "last_visit": last_visit,
+                "shortlink_ids": changed_ids,
+                "visitor_sketches": [sketches[shortlink_id] for shortlink_id in changed_ids],
+                "unique_visitors": [unique_visitors[shortlink_id] for shortlink_id in changed_ids],
             },
         )
+
+    @classmethod
+    async def _add_trending_summaries(cls, visits: Mapping[UUID, VisitCount], session: AsyncSession) -> None:
+        capacity = get_settings().stats_trending_capacity
+        summaries: dict[datetime, SpaceSaving] = {}
+        for shortlink_id, visit_count in visits.items():
+            # Counts made without visit times are ranked in the minute of the last visit
+            minute_visits = visit_count.minute_visits or {minute_start(visit_count.last_visit): visit_count.visits}
+            for minute, count in minute_visits.items():
+                summaries.setdefault(minute, SpaceSaving(capacity)).add(shortlink_id, count)
+        if not summaries:
+            return
+        minutes = sorted(summaries)
+        await super(AsyncSession, session).execute(
+            _INSERT_TRENDING_MINUTES,
+            {"minute_starts": minutes, "summaries": [summaries[minute].to_bytes() for minute in minutes]},
+        )
+
+    @classmethod
+    async def record_visit_events(cls, events: Sequence[VisitEventData], session: AsyncSession) -> None:
+        """Appends visit events to the visit event log with a single COPY, which is much cheaper than
+        inserting rows for large batches. The partitions the events fall into must already exist.
+
+        :param events: The visit events to append
+        :type events: Sequence[VisitEventData]
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        """
+        if not events:
+            return
+        # COPY isn't supported by SQLAlchemy, so it's run on the psycopg connection inside the session's transaction
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        if not isinstance(driver_connection, AsyncConnection):
+            raise TypeError("Visit events can only be copied with a psycopg connection")
+        async with (
+            driver_connection.cursor(row_factory=tuple_row) as cursor,
+            cursor.copy("COPY visitevent (shortlink_id, visited_at, referrer, user_agent, country) FROM STDIN") as copy,
+        ):
+            for event in events:
+                await copy.write_row(event)
         await session.commit()
 
     @classmethod
@@ -90,6 +533,7 @@ class StatsService:
         metric: StatMetric,
         limit: int,
         session: AsyncSession,
+        window: int = DEFAULT_TRENDING_WINDOW,
     ) -> list[ShortlinkWithStats]:
         """Returns a list of the top shortlinks by the specified metric.
 
@@ -99,30 +543,254 @@ class StatsService:
         :type limit: int
         :param session: An async session connected to a database
         :type session: AsyncSession
+        :param window: How many minutes of recent visits to rank trending shortlinks by
+        :type window: int
         :return: A list of the top shortlinks with stats
         :rtype: ShortlinkWithStats
         """
-        column = ShortlinkStat.visits if metric == StatMetric.VISITS else ShortlinkStat.last_visit
-        statement = select(ShortlinkStat).order_by(col(column).desc()).limit(limit)
-        results = list(await session.exec(statement))
-        ids = [stat.shortlink_id for stat in results]
-        shortlinks_by_id = await ShortlinkService.get_by_ids(ids, session)
-        stats: list[ShortlinkWithStats] = []
-        for stat in results:
-            shortlink = shortlinks_by_id.get(stat.shortlink_id)
-            stats.append(ShortlinkWithStats.from_models(shortlink, stat))
-        return stats
-
-    @classmethod
-    async def get_shortlink_stats(cls, shortlink: Shortlink, session: AsyncSession) -> ShortlinkWithStats:
-        """Gets the stats for a particular shortlink.
-
-        :param shortlink: The shortlink to retrieve metrics for
-        :type shortlink: Shortlink
+        if metric == StatMetric.TRENDING:
+            return await cls.get_trending_stats(window, limit, session)
+        results = await super(AsyncSession, session).execute(_SELECT_TOP_STATS[metric], {"limit": limit})
+        return [ShortlinkWithStats.from_row(*row) for row in results]
+
+    @classmethod
+    async def get_trending_stats(cls, window: int, limit: int, session: AsyncSession) -> list[ShortlinkWithStats]:
+        """Returns the shortlinks with the most visits in the last few minutes, by merging the trending summaries
+        of each minute in the window. Finished minutes have been compacted into one small row each, so this reads
+        about one row per minute however many visits there were, plus a row per flush in the latest minutes.
+
+        :param window: How many minutes of recent visits to rank by, including the current minute
+        :type window: int
+        :param limit: The total number of shortlinks to return
+        :type limit: int
         :param session: An async session connected to a database
         :type session: AsyncSession
-        :return: The shortlink with its stats
-        :rtype: ShortlinkWithStats
+        :return: A list of the trending shortlinks with stats, most visited first
+        :rtype: list[ShortlinkWithStats]
+        """
+        since = datetime.now(UTC).replace(second=0, microsecond=0) - timedelta(minutes=window - 1)
+        summary = SpaceSaving(get_settings().stats_trending_capacity)
+        statement = select(TrendingMinute.summary).where(col(TrendingMinute.minute_start) >= since)
+        for data in await session.exec(statement):
+            summary.merge(SpaceSaving.from_bytes(data))
+        top = summary.top(limit)
+        if not top:
+            return []
+        results = await super(AsyncSession, session).execute(
+            _SELECT_STATS_FOR_IDS, {"shortlink_ids": [shortlink_id for shortlink_id, _ in top]}
+        )
+        stats_by_id = {row[0]: ShortlinkWithStats.from_row(*row) for row in results}
+        return [stats_by_id[shortlink_id] for shortlink_id, _ in top if shortlink_id in stats_by_id]
+
+    @classmethod
+    async def get_stats_for_slug(
+        cls,
+        slug: str,
+        session: AsyncSession,
+        fallback_session: AsyncSession | None = None,
+    ) -> ShortlinkWithStats | None:
+        """Gets a shortlink and its stats by slug in a single query.
+
+        :param slug: The slug for the shortlink to retrieve stats for
+        :type slug: str
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :param fallback_session: A session connected to the primary database, used when ``session`` is
+            connected to a read replica that may not have caught up with a recently created shortlink
+        :type fallback_session: AsyncSession | None
+        :return: The shortlink with its stats, or None if not found
+        :rtype: ShortlinkWithStats | None
         """
-        stats = await session.get(ShortlinkStat, shortlink.id)
-        return ShortlinkWithStats.from_models(shortlink, stats)
+        shortlink_id = Shortlink.decode_slug(slug)
+        slug_filter = get_slug_filter()
+        if shortlink_id is None or not slug_filter.might_exist(shortlink_id):
+            return None
+        params = {"shortlink_id": shortlink_id}
+        row = (await super(AsyncSession, session).execute(_SELECT_STATS_FOR_ID, params)).first()
+        if row is None and fallback_session is not None and fallback_session.bind is not session.bind:
+            row = (await super(AsyncSession, fallback_session).execute(_SELECT_STATS_FOR_ID, params)).first()
+        if row is None:
+            slug_filter.record_false_positive()
+            return None
+        return ShortlinkWithStats.from_row(*row)
+
+    @classmethod
+    async def get_stats_page(
+        cls,
+        sort: StatsSort,
+        limit: int,
+        session: AsyncSession,
+        after: StatsCursor | None = None,
+        filters: StatsFilters | None = None,
+    ) -> tuple[list[ShortlinkWithStats], StatsCursor | None]:
+        """Gets a page of all shortlinks with stats, for paging through them all in order.
+
+        Pages are found by seeking the composite index on the sorted metric and the shortlink id to where the
+        previous page ended, rather than skipping the shortlinks before it with an offset, so reading any page
+        costs the same however deep into the stats it is.
+
+        :param sort: The metric to sort by, highest first. Shortlinks with the same value are sorted by id.
+        :type sort: StatsSort
+        :param limit: The most shortlinks to return
+        :type limit: int
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :param after: The cursor of the previous page, or None for the first page
+        :type after: StatsCursor | None
+        :param filters: Conditions the shortlinks must meet
+        :type filters: StatsFilters | None
+        :return: The shortlinks with their stats, and the cursor for the next page if there are more
+        :rtype: tuple[list[ShortlinkWithStats], StatsCursor | None]
+        """
+        column = _TOP_STATS_COLUMNS[StatMetric(sort)]
+        shortlink_id_column = col(ShortlinkStat.shortlink_id)
+        statement = (
+            select_shortlinks_with_stats()
+            .join(Shortlink, col(Shortlink.id) == shortlink_id_column)
+            .where(*(filters or StatsFilters()).conditions())
+            .order_by(column.desc(), shortlink_id_column.desc())
+            # One more than the page is read to tell whether there is another page after it
+            .limit(limit + 1)
+        )
+        if after is not None:
+            statement = statement.where(
+                tuple_(column, shortlink_id_column)
+                < tuple_(bindparam("after_value", after.value), bindparam("after_id", after.shortlink_id))
+            )
+        rows = (await super(AsyncSession, session).execute(statement)).all()
+        page = [ShortlinkWithStats.from_row(*row) for row in rows[:limit]]
+        if len(rows) <= limit:
+            return page, None
+        shortlink_id, _, visits, unique_visitors, last_visit = rows[limit - 1]
+        values = {
+            StatsSort.VISITS: visits,
+            StatsSort.UNIQUE_VISITORS: unique_visitors,
+            StatsSort.LAST_VISIT: last_visit,
+        }
+        value = values[sort]
+        if value is None:
+            raise ValueError(f"Shortlink {shortlink_id} has no {sort} to page from")
+        return page, StatsCursor(sort, value, shortlink_id)
+
+    @classmethod
+    async def get_visit_timeseries(
+        cls,
+        shortlink_id: UUID,
+        granularity: BucketGranularity,
+        start: datetime,
+        end: datetime,
+        session: AsyncSession,
+    ) -> list[VisitBucket]:
+        """Gets the visits to a shortlink per bucket of time from its rollups, including empty buckets.
+
+        :param shortlink_id: The UUID of the shortlink to get visits for
+        :type shortlink_id: UUID
+        :param granularity: How long each bucket lasts
+        :type granularity: BucketGranularity
+        :param start: The timestamp to start from, rounded down to the start of its bucket
+        :type start: datetime
+        :param end: The timestamp to end at, exclusive
+        :type end: datetime
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The visits within each bucket, in chronological order
+        :rtype: list[VisitBucket]
+        """
+        first_bucket_start = granularity.bucket_start(start)
+        statement = select(ShortlinkVisitBucket.bucket_start, ShortlinkVisitBucket.visits).where(
+            col(ShortlinkVisitBucket.shortlink_id) == shortlink_id,
+            col(ShortlinkVisitBucket.granularity) == granularity,
+            col(ShortlinkVisitBucket.bucket_start) >= first_bucket_start,
+            col(ShortlinkVisitBucket.bucket_start) < end,
+        )
+        visits_by_bucket_start = dict(list(await session.exec(statement)))
+        buckets: list[VisitBucket] = []
+        bucket_start = first_bucket_start
+        while bucket_start < end:
+            buckets.append(VisitBucket(bucket_start=bucket_start, visits=visits_by_bucket_start.get(bucket_start, 0)))
+            bucket_start += granularity.span
+        return buckets
+
+    @classmethod
+    async def prune_visit_buckets(
+        cls,
+        granularity: BucketGranularity,
+        before: datetime,
+        session: AsyncSession,
+        batch_size: int | None = None,
+    ) -> int:
+        """Deletes the buckets of a granularity that start before the given timestamp, a batch at a time, each in
+        its own transaction. Only one worker prunes at a time, so this stops early if another one is pruning.
+        Hourly buckets are rolled up into daily buckets as they are recorded, so pruning hourly buckets
+        leaves the daily totals intact.
+
+        :param granularity: The granularity of buckets to delete
+        :type granularity: BucketGranularity
+        :param before: The timestamp that buckets must start before to be deleted
+        :type before: datetime
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :param batch_size: How many buckets to delete in each transaction, defaults to ``STATS_PRUNE_BATCH_SIZE``
+        :type batch_size: int | None
+        :return: The number of buckets deleted
+        :rtype: int
+        """
+        batch_size = batch_size or get_settings().stats_prune_batch_size
+        params = {"granularity": granularity.value, "before": before, "batch_size": batch_size}
+        pruned = 0
+        while True:
+            await use_job_statement_timeout(session)
+            if not await try_job_lock("prune visit buckets", session):
+                await session.commit()
+                return pruned
+            batch = (await super(AsyncSession, session).execute(_PRUNE_VISIT_BUCKETS, params)).scalar_one()
+            await session.commit()
+            pruned += batch
+            if batch < batch_size:
+                return pruned
+
+    @classmethod
+    async def compact_trending_summaries(cls, before: datetime, session: AsyncSession) -> int:
+        """Merges the trending summaries each flush added for minutes before the given timestamp into one per
+        minute, so reading the trending shortlinks stays cheap. Flushes that are still adding to those minutes
+        aren't blocked, and their summaries are merged next time.
+
+        :param before: The timestamp that minutes must start before to be compacted
+        :type before: datetime
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The number of minutes compacted
+        :rtype: int
+        """
+        capacity = get_settings().stats_trending_capacity
+        summaries: dict[datetime, SpaceSaving] = {}
+        await use_job_statement_timeout(session)
+        result = await super(AsyncSession, session).execute(_DELETE_UNMERGED_TRENDING_MINUTES, {"before": before})
+        for minute, data in result:
+            summaries.setdefault(minute, SpaceSaving(capacity)).merge(SpaceSaving.from_bytes(data))
+        if summaries:
+            minutes = sorted(summaries)
+            await super(AsyncSession, session).execute(
+                _INSERT_TRENDING_MINUTES,
+                {"minute_starts": minutes, "summaries": [summaries[minute].to_bytes() for minute in minutes]},
+            )
+        await session.commit()
+        return len(summaries)
+
+    @classmethod
+    async def prune_trending_summaries(cls, before: datetime, session: AsyncSession) -> int:
+        """Deletes the trending summaries for minutes before the given timestamp.
+
+        :param before: The timestamp that minutes must start before to be deleted
+        :type before: datetime
+        :param session: An async session connected to a database
+        :type session: AsyncSession
+        :return: The number of summaries deleted
+        :rtype: int
+        """
+        await use_job_statement_timeout(session)
+        result = await super(AsyncSession, session).execute(
+            delete(TrendingMinute).where(col(TrendingMinute.minute_start) < before)
+        )
+        await session.commit()
+        return result.rowcount
@@ -0,0 +1,118 @@
+import heapq
+import struct
+from typing import Self
+from uuid import UUID
+
+_HEADER = struct.Struct(">I")
+_ENTRY = struct.Struct(">16sQQ")
+
+
+class SpaceSaving:
+    """A fixed-size summary of the most frequent keys in a stream, using the Space-Saving algorithm.
+
+    At most ``capacity`` keys are counted. When a new key arrives and the summary is full, the least counted
+    key is replaced and the new key inherits its count as an error bound, so counts are never underestimated
+    and any key seen more than ``total / capacity`` times is guaranteed to be kept. Summaries can be merged,
+    so each worker's visits can be added to a shared summary, and are serialized compactly for storage.
+
+    The least counted key is found with a min-heap holding each key once. Counts only grow, so a key's entry is
+    only updated when it reaches the top of the heap with a count that's out of date, which keeps adding a key
+    to a full summary at O(log capacity) amortized rather than a scan of every key.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("The capacity must be at least 1")
+        self.capacity = capacity
+        """The most keys counted at once"""
+        self.counts: dict[UUID, int] = {}
+        """The estimated count of each key, which can be higher than the true count by up to its error"""
+        self.errors: dict[UUID, int] = {}
+        """The most each key's count can have been overestimated by"""
+        self._heap: list[tuple[int, UUID]] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        """Loads a summary serialized with ``to_bytes``"""
+        (capacity,) = _HEADER.unpack_from(data)
+        summary = cls(capacity)
+        for key_bytes, count, error in _ENTRY.iter_unpack(data[_HEADER.size :]):
+            key = UUID(bytes=key_bytes)
+            summary.counts[key] = count
+            summary.errors[key] = error
+        summary._rebuild_heap()
+        return summary
+
+    def to_bytes(self) -> bytes:
+        """Serializes the summary as its capacity followed by each key with its count and error"""
+        return _HEADER.pack(self.capacity) + b"".join(
+            _ENTRY.pack(key.bytes, count, self.errors[key]) for key, count in self.counts.items()
+        )
+
+    @property
+    def floor(self) -> int:
+        """The count a key that isn't in the summary could have, which is zero until the summary is full"""
+        return self._least_counted()[0] if len(self.counts) >= self.capacity else 0
+
+    def add(self, key: UUID, count: int = 1) -> None:
+        """Counts occurrences of a key, replacing the least counted key if the summary is full.
+
+        :param key: The key that occurred
+        :type key: UUID
+        :param count: How many times it occurred
+        :type count: int
+        """
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            error, evicted = self._least_counted()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            heapq.heapreplace(self._heap, (error + count, key))
+        else:
+            heapq.heappush(self._heap, (count, key))
+        self.counts[key] = error + count
+        self.errors[key] = error
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """Adds the counts of another summary to this one, keeping the ``capacity`` most counted keys.
+        A key missing from a full summary could have been counted up to its floor, so that is added instead.
+
+        :param other: The summary to merge into this one
+        :type other: SpaceSaving
+        """
+        floor, other_floor = self.floor, other.floor
+        counts: dict[UUID, int] = {}
+        errors: dict[UUID, int] = {}
+        for key in self.counts.keys() | other.counts.keys():
+            counts[key] = self.counts.get(key, floor) + other.counts.get(key, other_floor)
+            errors[key] = self.errors.get(key, floor) + other.errors.get(key, other_floor)
+        kept = heapq.nlargest(self.capacity, counts, key=counts.__getitem__)
+        self.counts = {key: counts[key] for key in kept}
+        self.errors = {key: errors[key] for key in kept}
+        self._rebuild_heap()
+
+    def top(self, limit: int) -> list[tuple[UUID, int]]:
+        """Returns the most counted keys with their estimated counts.
+
+        :param limit: How many keys to return
+        :type limit: int
+        :return: The keys and their counts, most counted first
+        :rtype: list[tuple[UUID, int]]
+        """
+        return heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+
+    def _least_counted(self) -> tuple[int, UUID]:
+        # Entries are never higher than their key's count, so once the top entry is up to date it's the least
+        while (entry := self._heap[0])[0] != self.counts[entry[1]]:
+            heapq.heapreplace(self._heap, (self.counts[entry[1]], entry[1]))
+        return entry
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,49 @@
+from datetime import UTC, datetime, timedelta
+
+from core.config import get_settings
+from core.db import get_session_context
+from core.tasks import PeriodicTask
+
+from .models import BucketGranularity
+from .partitions import maintain_partitions
+from .service import StatsService
+
+
+async def prune_visit_buckets() -> None:
+    """Deletes visit buckets that are older than the retention period for their granularity"""
+    settings = get_settings()
+    now = datetime.now(UTC)
+    async with get_session_context() as session:
+        await StatsService.prune_visit_buckets(
+            BucketGranularity.HOUR,
+            now - timedelta(days=settings.stats_hourly_retention_days),
+            session,
+        )
+        if settings.stats_daily_retention_days:
+            await StatsService.prune_visit_buckets(
+                BucketGranularity.DAY,
+                now - timedelta(days=settings.stats_daily_retention_days),
+                session,
+            )
+
+
+async def prune_trending_summaries() -> None:
+    """Merges the trending summaries of each finished minute into one, and deletes those for minutes that are older
+    than the longest trending window"""
+    now = datetime.now(UTC)
+    async with get_session_context() as session:
+        # Flushes can still be adding to the last minute or so, which are merged next time
+        await StatsService.compact_trending_summaries(now - timedelta(minutes=2), session)
+        await StatsService.prune_trending_summaries(
+            now - timedelta(minutes=get_settings().stats_trending_max_window), session
+        )
+
+
+visit_bucket_pruning = PeriodicTask("prune visit buckets", 3600, prune_visit_buckets)
+"""Applies the visit bucket retention policy once an hour"""
+
+visit_event_partitioning = PeriodicTask("maintain visit event partitions", 3600, maintain_partitions)
+"""Creates upcoming visit event partitions and drops expired ones once an hour"""
+
+trending_pruning = PeriodicTask("prune trending summaries", 60, prune_trending_summaries)
+"""Compacts trending summaries and deletes those that have left every window once a minute"""
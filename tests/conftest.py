@@ -6,14 +6,38 @@ from httpx import ASGITransport, AsyncClient
 from sqlalchemy import text
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.pool import StaticPool
 
+from core import db
 from core.api import app
 from core.config import Settings, get_settings
-from core.db import get_session
+from core.db import get_read_session, get_session
+from shortlinks.cache import get_slug_cache
+from shortlinks.filter import get_slug_filter
 from shortlinks.models import Shortlink
+from shortlinks.slugs import get_slug_codec
+from stats.buffer import get_visit_buffer
+from stats.cache import get_stats_response_cache
+from stats.events import get_visit_event_ingester
+
+
+class FakeClock:
+    """A controllable clock for testing expiry and staleness"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock() -> FakeClock:
+    """A clock that only moves when a test sets its time"""
+    return FakeClock()
 
 
 @pytest.fixture(autouse=True, scope="session")
@@ -22,7 +46,14 @@ def test_settings() -> Settings:
     settings = get_settings()
     os.environ["DATABASE_URL"] = f"{settings.database_url}_test"
     os.environ["SERVICE_ROOT"] = "http://test"
+    # The app loads or generates a key as it starts, which the test client doesn't do
+    os.environ["VISITOR_HASH_KEY"] = "test"
     settings.__init__()
+    # Sessions the app opens itself, like for background work, use the test database too
+    db.engine = create_async_engine(settings.database_url, poolclass=NullPool)
+    db.async_session.configure(bind=db.engine)
+    db.read_engine = db.engine
+    db.async_read_session.configure(bind=db.read_engine)
     return settings
 
 
@@ -44,6 +75,22 @@ async def db_models(test_settings: Settings) -> None:
         except ProgrammingError:
             pass
         await conn.execute(text(f"CREATE DATABASE {db_name};"))
+        try:
+            await conn.execute(text(f"DROP DATABASE {db_name}_replica;"))
+        except ProgrammingError:
+            pass
+        await conn.execute(text(f"CREATE DATABASE {db_name}_replica;"))
+
+
+@pytest.fixture(autouse=True)
+def clear_caches() -> None:
+    """Clears per-worker caches so state does not leak between tests"""
+    get_slug_cache().clear()
+    get_slug_codec.cache_clear()
+    get_slug_filter.cache_clear()
+    get_visit_buffer.cache_clear()
+    get_visit_event_ingester.cache_clear()
+    get_stats_response_cache.cache_clear()
 
 
 @pytest.fixture()
@@ -59,6 +106,19 @@ async def session(test_settings: Settings) -> AsyncGenerator[AsyncSession]:
         await conn.run_sync(SQLModel.metadata.drop_all)
 
 
+@pytest.fixture()
+async def replica_session(test_settings: Settings) -> AsyncGenerator[AsyncSession]:
+    """An async session to a second, empty test database standing in for a read replica that is behind"""
+    engine = create_async_engine(f"{test_settings.database_url}_replica", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with async_session() as session:
+        yield session
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+
+
 @pytest.fixture()
 def client(session: AsyncSession) -> Generator[AsyncClient]:
     """An async test client"""
@@ -67,9 +127,18 @@ def client(session: AsyncSession) -> Generator[AsyncClient]:
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
     client = AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
     yield client
     del app.dependency_overrides[get_session]
+    del app.dependency_overrides[get_read_session]
+
+
+@pytest.fixture()
+def metrics_headers(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> dict[str, str]:
+    """Enables metrics with a known scrape token, and headers authorizing requests for them"""
+    monkeypatch.setattr(test_settings, "metrics_token", "metrics-secret")
+    return {"Authorization": "Bearer metrics-secret"}
 
 
 @pytest.fixture()
@@ -0,0 +1,119 @@
+import pytest
+from prometheus_client import REGISTRY
+from psycopg import AsyncConnection
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import greenlet_spawn
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core import db
+from core.config import Settings
+from core.db import create_engine, use_job_statement_timeout, warm_up
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_engine_server_timeouts(test_settings: Settings) -> None:
+    """Tests that the configured timeouts are applied to new connections"""
+    engine = create_engine(test_settings)
+    async with engine.connect() as conn:
+        results = await conn.execute(
+            text("""
+                SELECT name, setting FROM pg_settings
+                WHERE name IN ('statement_timeout', 'idle_in_transaction_session_timeout')
+            """)
+        )
+        timeouts = {name: int(setting) for name, setting in results}
+    await engine.dispose()
+
+    assert timeouts == {
+        "statement_timeout": test_settings.db_statement_timeout,
+        "idle_in_transaction_session_timeout": test_settings.db_idle_in_transaction_timeout,
+    }
+
+
+async def test_job_statement_timeout(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that background jobs get their own statement timeout for one transaction at a time"""
+    monkeypatch.setattr(test_settings, "db_job_statement_timeout", 60_000)
+    show_timeout = text("SHOW statement_timeout")
+    async with db.get_session_context() as session:
+        before = (await super(AsyncSession, session).execute(show_timeout)).scalar_one()
+        await session.commit()
+        await use_job_statement_timeout(session)
+        during = (await super(AsyncSession, session).execute(show_timeout)).scalar_one()
+        await session.commit()
+        after = (await super(AsyncSession, session).execute(show_timeout)).scalar_one()
+
+    assert during == "1min"
+    assert after == before != during
+
+
+async def test_engine_pool_metrics(test_settings: Settings) -> None:
+    """Tests that checking connections out of the pool is reported as metrics"""
+    engine = create_engine(test_settings, name="test")
+    labels = {"pool": "test"}
+    checkouts = REGISTRY.get_sample_value("db_pool_checkout_seconds_count", labels) or 0
+    max_connections = test_settings.db_pool_size + test_settings.db_max_overflow
+
+    async with engine.connect():
+        assert REGISTRY.get_sample_value("db_pool_checkout_seconds_count", labels) == checkouts + 1
+        assert REGISTRY.get_sample_value("db_pool_checked_out", labels) == 1
+        assert REGISTRY.get_sample_value("db_pool_saturation", labels) == 1 / max_connections
+    await engine.dispose()
+
+    assert REGISTRY.get_sample_value("db_pool_checked_out", labels) == 0
+    assert REGISTRY.get_sample_value("db_pool_saturation", labels) == 0
+
+
+@pytest.mark.parametrize(("prepare_threshold", "expected"), [(1, 1), (0, 0), (-1, None)])
+async def test_engine_prepare_threshold(test_settings: Settings, prepare_threshold: int, expected: int | None) -> None:
+    """Tests that the prepare threshold is passed to psycopg, with a negative threshold disabling it"""
+    settings = test_settings.model_copy(update={"db_prepare_threshold": prepare_threshold})
+    engine = create_engine(settings)
+    async with engine.connect() as conn:
+        raw_connection = await conn.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        assert isinstance(driver_connection, AsyncConnection)
+        assert driver_connection.prepare_threshold == expected
+    await engine.dispose()
+
+
+@pytest.mark.parametrize(("connections", "expected"), [(0, 0), (2, 2), (100, 5)])
+async def test_warm_up(test_settings: Settings, connections: int, expected: int) -> None:
+    """Tests that warming up opens distinct connections into the pool, up to its size"""
+    engine = create_engine(test_settings.model_copy(update={"db_pool_size": 5}))
+    await warm_up(engine, connections)
+    pool = engine.pool
+    assert isinstance(pool, QueuePool)
+    assert pool.checkedin() == expected
+    assert pool.checkedout() == 0
+    await engine.dispose()
+
+
+async def test_warm_up_failure(test_settings: Settings) -> None:
+    """Tests that failing to warm up leaves the pool to connect on demand rather than failing startup"""
+    engine = create_engine(test_settings, "postgresql+psycopg_async://nobody@127.0.0.1:1/missing")
+    await warm_up(engine, 1)
+    pool = engine.pool
+    assert isinstance(pool, QueuePool)
+    assert pool.checkedin() == 0
+    await engine.dispose()
+
+
+async def test_reset_after_fork(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that a forked worker gets new pools without closing the connections of the parent's"""
+    engine = create_engine(test_settings)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(db, "read_engine", engine)
+    await warm_up(engine, 1)
+    parent_pool = engine.pool
+    assert isinstance(parent_pool, QueuePool)
+
+    db.reset_after_fork()
+
+    assert engine.pool is not parent_pool
+    assert parent_pool.checkedin() == 1
+    await engine.dispose()
+    # No other process owns the parent's connections here, so they're closed too
+    await greenlet_spawn(parent_pool.dispose)
+    assert parent_pool.checkedin() == 0
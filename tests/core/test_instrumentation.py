@@ -0,0 +1,123 @@
+import multiprocessing
+from pathlib import Path
+
+import pytest
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from core.config import Settings
+from core.db import create_engine
+from core.instrumentation import MAX_QUERY_FINGERPRINTS, query_fingerprint
+from core.metrics import visits_dropped
+from shortlinks.models import Shortlink
+
+pytestmark = pytest.mark.anyio
+
+
+def drop_visits(count: int) -> None:
+    """Counts dropped visits from another process, like a gunicorn worker"""
+    visits_dropped.labels("overflow").inc(count)
+
+
+def query_count(statement: str, outcome: str) -> float:
+    """Gets how many times a query has been timed with an outcome"""
+    operation, table, fingerprint = query_fingerprint(statement)
+    labels = {"operation": operation, "table": table, "fingerprint": fingerprint, "outcome": outcome}
+    return REGISTRY.get_sample_value("db_query_duration_seconds_count", labels) or 0
+
+
+async def test_query_fingerprint() -> None:
+    """Tests that queries differing only by literals and whitespace share a fingerprint"""
+    operation, table, fingerprint = query_fingerprint("SELECT long_url FROM shortlink WHERE id = 'a' LIMIT 1")
+
+    assert (operation, table) == ("SELECT", "shortlink")
+    assert query_fingerprint("select long_url\n  FROM shortlink WHERE id = 'b''c' LIMIT 20")[2] != fingerprint
+    assert query_fingerprint("SELECT long_url FROM shortlink\n WHERE id = 'b''c' LIMIT 20")[2] == fingerprint
+    assert query_fingerprint("SELECT long_url FROM shortlinkstat WHERE id = 'a' LIMIT 1")[2] != fingerprint
+    assert query_fingerprint("INSERT INTO shortlink (id) VALUES (%(id)s)")[:2] == ("INSERT", "shortlink")
+
+
+async def test_engine_query_metrics(test_settings: Settings) -> None:
+    """Tests that queries run by an engine are timed by their fingerprint"""
+    engine = create_engine(test_settings)
+    count = query_count("SELECT 1 FROM pg_class LIMIT 1", "success")
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1 FROM pg_class LIMIT 1"))
+        await conn.execute(text("SELECT 2 FROM pg_class LIMIT 1"))
+    await engine.dispose()
+
+    assert query_count("SELECT 1 FROM pg_class LIMIT 1", "success") == count + 2
+
+
+async def test_engine_query_error_metrics(test_settings: Settings) -> None:
+    """Tests that queries that raise an error are timed too, labelled as errors"""
+    engine = create_engine(test_settings)
+    statement = "SELECT missing_column FROM pg_class LIMIT 1"
+    errors = query_count(statement, "error")
+    async with engine.connect() as conn:
+        with pytest.raises(ProgrammingError):
+            await conn.execute(text(statement))
+        # The start time is popped, so the next query's duration isn't measured from the failed one's
+        assert conn.sync_connection and not conn.sync_connection.info["query_start_times"]
+    await engine.dispose()
+
+    assert query_count(statement, "error") == errors + 1
+    assert query_count(statement, "success") == 0
+
+
+async def test_query_fingerprints_capped(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that queries with fingerprints past the limit are labelled together rather than each on its own"""
+    monkeypatch.setattr("core.instrumentation._fingerprints", {str(i) for i in range(MAX_QUERY_FINGERPRINTS)})
+    engine = create_engine(test_settings)
+    labels = {"operation": "SELECT", "table": "pg_type", "fingerprint": "other", "outcome": "success"}
+    count = REGISTRY.get_sample_value("db_query_duration_seconds_count", labels) or 0
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT typname FROM pg_type LIMIT 1"))
+        await conn.execute(text("SELECT oid FROM pg_type LIMIT 1"))
+    await engine.dispose()
+
+    assert REGISTRY.get_sample_value("db_query_duration_seconds_count", labels) == count + 2
+
+
+@pytest.mark.parametrize("fast_path", [True, False])
+async def test_request_metrics(
+    client: AsyncClient,
+    shortlink: Shortlink,
+    test_settings: Settings,
+    monkeypatch: pytest.MonkeyPatch,
+    fast_path: bool,
+) -> None:
+    """Tests that request latencies are recorded by route name, including redirects served by the fast path"""
+    monkeypatch.setattr(test_settings, "redirect_fast_path", fast_path)
+    requests = [
+        ({"route": "Access Shortlink", "method": "GET", "status": "307"}, "GET", f"/{shortlink.slug}"),
+        ({"route": "Top Stats", "method": "GET", "status": "200"}, "GET", "/stats"),
+        ({"route": "unmatched", "method": "GET", "status": "404"}, "GET", "/not/a/route"),
+    ]
+    for labels, method, path in requests:
+        count = REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) or 0
+        await client.request(method, path)
+        assert REGISTRY.get_sample_value("http_request_duration_seconds_count", labels) == count + 1
+
+
+async def test_metrics_multiprocess(
+    client: AsyncClient, metrics_headers: dict[str, str], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that metrics written by several processes are summed from the multiprocess directory when it is
+    configured"""
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=drop_visits, args=(count,)) for count in (2, 3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    response = await client.get("/metrics", headers=metrics_headers)
+
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    assert response.status_code == 200
+    assert 'visits_dropped_total{reason="overflow"} 5.0' in response.text
+    assert "db_pool_checkout_seconds_bucket" not in response.text
@@ -0,0 +1,33 @@
+import pytest
+from httpx import AsyncClient
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics(client: AsyncClient, metrics_headers: dict[str, str]) -> None:
+    """Tests that metrics are exposed in the Prometheus text format"""
+    response = await client.get("/metrics", headers=metrics_headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "db_pool_checkout_seconds_bucket" in response.text
+
+
+async def test_metrics_disabled_without_token(client: AsyncClient) -> None:
+    """Tests that metrics aren't exposed until a scrape token is configured"""
+    response = await client.get("/metrics")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", "Basic metrics-secret"])
+async def test_metrics_require_token(
+    client: AsyncClient, metrics_headers: dict[str, str], authorization: str | None
+) -> None:
+    """Tests that metrics are only exposed to requests with the scrape token"""
+    headers = {"Authorization": authorization} if authorization else {}
+
+    response = await client.get("/metrics", headers=headers)
+
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
@@ -0,0 +1,55 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from core.config import Settings
+from core.startup import TIME_TO_FIRST_REDIRECT_BUDGET, ImportTime, parse_importtime, time_to_first_redirect
+from shortlinks.models import Shortlink
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_parse_importtime() -> None:
+    """Tests that the modules and times are parsed from an import time report, skipping other lines"""
+    output = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     encodings.idna
+import time:       310 |        430 |   encodings
+unrelated warning
+import time:      1500 |       1930 | core.api
+"""
+    assert parse_importtime(output) == [
+        ImportTime("encodings.idna", 120, 120, 2),
+        ImportTime("encodings", 310, 430, 1),
+        ImportTime("core.api", 1500, 1930, 0),
+    ]
+
+
+@pytest.mark.slow
+async def test_time_to_first_redirect(shortlink: Shortlink) -> None:
+    """Tests that a fresh worker sends its first redirect within the startup budget"""
+    timing = await asyncio.to_thread(time_to_first_redirect, f"/{shortlink.slug}")
+
+    assert timing.status == 307
+    assert timing.total < TIME_TO_FIRST_REDIRECT_BUDGET
+
+
+async def test_gunicorn_resets_metrics_directory(
+    test_settings: Settings, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that the gunicorn master clears out a previous run's metrics as it starts, not when its config loads"""
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(test_settings, "shared_slug_cache_size", 0)
+    leftover = tmp_path / "counter_123.db"
+    leftover.write_bytes(b"")
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", Path(__file__).parents[2] / "gunicorn.conf.py")
+    assert spec and spec.loader
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    assert leftover.exists()
+
+    gunicorn_conf.on_starting(None)
+
+    assert tmp_path.is_dir()
+    assert not leftover.exists()
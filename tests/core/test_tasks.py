@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from core.tasks import PeriodicTask
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_periodic_task_runs_until_stopped() -> None:
+    """Tests that a periodic task keeps running on its interval until it is stopped"""
+    runs: list[None] = []
+
+    async def func() -> None:
+        runs.append(None)
+
+    task = PeriodicTask("test", 0.01, func)
+    task.start()
+    await asyncio.sleep(0.05)
+    await task.stop()
+    count = len(runs)
+    await asyncio.sleep(0.03)
+
+    assert count >= 2
+    assert len(runs) == count
+
+
+async def test_periodic_task_runs_now() -> None:
+    """Tests that a periodic task can also run as soon as it's started, rather than after one interval"""
+    runs: list[None] = []
+
+    async def func() -> None:
+        runs.append(None)
+
+    task = PeriodicTask("test", 3600, func)
+    task.start(run_now=True)
+    await asyncio.sleep(0.01)
+    await task.stop()
+
+    assert len(runs) == 1
+
+
+async def test_periodic_task_survives_failures(caplog: pytest.LogCaptureFixture) -> None:
+    """Tests that a failing run is logged rather than raised"""
+
+    async def func() -> None:
+        raise RuntimeError("boom")
+
+    await PeriodicTask("failing", 1, func).run_once()
+
+    assert "Periodic task 'failing' failed" in caplog.text
@@ -0,0 +1,73 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from shortlinks.cache import SlugCache
+from shortlinks.models import Shortlink
+from tests.conftest import FakeClock
+
+pytestmark = pytest.mark.anyio
+
+
+def cache_lookups(result: str) -> float:
+    """Gets how many slugs have been looked up in slug caches with a result"""
+    return REGISTRY.get_sample_value("slug_cache_lookups_total", {"result": result}) or 0
+
+
+async def test_cache_hit_and_miss() -> None:
+    """Tests that cached slugs are hits and unknown slugs are misses"""
+    slug_cache = SlugCache(max_size=10, ttl=60, miss_ttl=5)
+    shortlink = Shortlink(long_url="https://www.example.com/very/long/url")
+    slug_cache.set(shortlink.slug, shortlink)
+    hits, misses = cache_lookups("hit"), cache_lookups("miss")
+
+    assert slug_cache.get(shortlink.slug) == (True, shortlink)
+    assert slug_cache.get("unknown") == (False, None)
+    assert cache_lookups("hit") == hits + 1
+    assert cache_lookups("miss") == misses + 1
+
+
+async def test_cache_negative_entries(clock: FakeClock) -> None:
+    """Tests that slugs known not to exist are cached with the shorter miss TTL"""
+    slug_cache = SlugCache(max_size=10, ttl=60, miss_ttl=5, clock=clock)
+    slug_cache.set("missing", None)
+
+    assert slug_cache.get("missing") == (True, None)
+    clock.now = 5
+    assert slug_cache.get("missing") == (False, None)
+    assert len(slug_cache) == 0
+
+
+async def test_cache_expiry(clock: FakeClock) -> None:
+    """Tests that found shortlinks expire after the TTL"""
+    slug_cache = SlugCache(max_size=10, ttl=60, miss_ttl=5, clock=clock)
+    shortlink = Shortlink(long_url="https://www.example.com/very/long/url")
+    slug_cache.set(shortlink.slug, shortlink)
+
+    clock.now = 59
+    assert slug_cache.get(shortlink.slug) == (True, shortlink)
+    clock.now = 60
+    assert slug_cache.get(shortlink.slug) == (False, None)
+
+
+async def test_cache_evicts_least_recently_used() -> None:
+    """Tests that the least recently used entry is evicted once the cache is full"""
+    slug_cache = SlugCache(max_size=2, ttl=60, miss_ttl=5)
+    evictions = REGISTRY.get_sample_value("slug_cache_evictions_total") or 0
+    slug_cache.set("a", None)
+    slug_cache.set("b", None)
+    slug_cache.get("a")
+    slug_cache.set("c", None)
+
+    assert REGISTRY.get_sample_value("slug_cache_evictions_total") == evictions + 1
+    assert slug_cache.get("b") == (False, None)
+    assert slug_cache.get("a") == (True, None)
+    assert slug_cache.get("c") == (True, None)
+
+
+async def test_cache_disabled() -> None:
+    """Tests that a cache with no size never stores entries"""
+    slug_cache = SlugCache(max_size=0, ttl=60, miss_ttl=5)
+    slug_cache.set("a", None)
+
+    assert len(slug_cache) == 0
+    assert slug_cache.get("a") == (False, None)
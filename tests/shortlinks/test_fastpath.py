@@ -0,0 +1,79 @@
+from uuid import uuid4
+
+import pytest
+import shortuuid
+from httpx import AsyncClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import Settings
+from shortlinks.cache import get_slug_cache
+from shortlinks.models import Shortlink
+from shortlinks.service import ShortlinkService
+from stats.buffer import get_visit_buffer
+
+pytestmark = pytest.mark.anyio
+
+
+async def get_with_and_without_fast_path(
+    client: AsyncClient, path: str, test_settings: Settings, monkeypatch: pytest.MonkeyPatch
+) -> list[tuple[int, dict[str, str], bytes]]:
+    """Requests a path with the fast path enabled and disabled, returning each response's status, headers, and body"""
+    responses: list[tuple[int, dict[str, str], bytes]] = []
+    for enabled in (True, False):
+        monkeypatch.setattr(test_settings, "redirect_fast_path", enabled)
+        get_slug_cache().clear()
+        response = await client.get(path)
+        responses.append((response.status_code, dict(response.headers), response.content))
+    return responses
+
+
+@pytest.mark.parametrize(
+    "long_url",
+    ["https://www.example.com/very/long/url", "https://www.example.com/a path/ünïcode?q=1&r=a b#fragment"],
+)
+async def test_redirect_matches_route(
+    client: AsyncClient,
+    session: AsyncSession,
+    test_settings: Settings,
+    monkeypatch: pytest.MonkeyPatch,
+    long_url: str,
+) -> None:
+    """Tests that redirects from the fast path are identical to those from the route"""
+    shortlink = await ShortlinkService.create(long_url, session)
+    fast, routed = await get_with_and_without_fast_path(client, f"/{shortlink.slug}", test_settings, monkeypatch)
+
+    assert fast == routed
+    assert fast[0] == 307
+    assert len(get_visit_buffer()) == 1
+
+
+@pytest.mark.parametrize("slug", [shortuuid.encode(uuid4()), "2222222", "invalid"])
+async def test_not_found_matches_route(
+    client: AsyncClient, test_settings: Settings, monkeypatch: pytest.MonkeyPatch, slug: str
+) -> None:
+    """Tests that slugs that don't exist get the same 404 from the fast path as from the route"""
+    fast, routed = await get_with_and_without_fast_path(client, f"/{slug}", test_settings, monkeypatch)
+
+    assert fast == routed
+    assert fast[0] == 404
+    assert len(get_visit_buffer()) == 0
+
+
+async def test_other_routes_pass_through(client: AsyncClient, metrics_headers: dict[str, str]) -> None:
+    """Tests that paths belonging to other routes are not treated as slugs"""
+    response = await client.get("/metrics", headers=metrics_headers)
+
+    assert response.status_code == 200
+    assert len(get_slug_cache()) == 0
+
+
+async def test_resolve_slug_uses_cache(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that resolved slugs are cached, along with slugs that don't exist"""
+    missing_slug = shortuuid.encode(uuid4())
+    resolved = await ShortlinkService.resolve_slug(shortlink.slug)
+    assert resolved
+    assert resolved.long_url == shortlink.long_url
+    assert not await ShortlinkService.resolve_slug(missing_slug)
+
+    assert get_slug_cache().get(shortlink.slug) == (True, resolved)
+    assert get_slug_cache().get(missing_slug) == (True, None)
@@ -0,0 +1,241 @@
+import random
+from datetime import UTC, datetime, timedelta
+from uuid import UUID, uuid4
+
+import pytest
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from shortlinks.filter import (
+    MIN_CAPACITY,
+    SEQUENCE_HEADROOM,
+    STALE_AFTER_SYNC_INTERVALS,
+    SYNC_OVERLAP,
+    ShortlinkIdFilter,
+    SlugFilter,
+    false_positive_rate,
+    get_slug_filter,
+    plan_filter,
+)
+from shortlinks.models import Shortlink
+from shortlinks.service import ShortlinkService
+from shortlinks.slugs import MAX_COMPACT_ID, CompactSlugCodec, compact_id, compact_number
+from stats.models import ImportJob, ImportStatus
+from tests.conftest import FakeClock
+
+pytestmark = pytest.mark.anyio
+
+
+def filter_checks(result: str) -> float:
+    """Gets how many slugs the slug filter has checked with a result"""
+    return REGISTRY.get_sample_value("slug_filter_checks_total", {"result": result}) or 0
+
+
+@pytest.fixture()
+async def slug_filter(shortlink_list: list[Shortlink]) -> SlugFilter:
+    """The worker's slug filter, built from a list of shortlinks and synced"""
+    slug_filter = get_slug_filter()
+    await slug_filter.rebuild()
+    await slug_filter.sync()
+    return slug_filter
+
+
+async def test_false_positive_rate() -> None:
+    """Tests the expected false positive rate grows as a filter fills up"""
+    rates = [false_positive_rate(ids_per_block, 6) for ids_per_block in (0, 1, 4, 8, 16)]
+
+    assert rates[0] == 0
+    assert rates == sorted(rates)
+    assert 0.001 < rates[3] < 0.05
+
+
+@pytest.mark.parametrize("target_rate", [0.1, 0.01, 0.001])
+async def test_shortlink_id_filter(target_rate: float) -> None:
+    """Tests that every id added is found, and ids that weren't are ruled out at about the target rate"""
+    generator = random.Random(0)
+    id_filter = ShortlinkIdFilter(20_000, target_rate, 1 << 20)
+    added = [UUID(int=generator.getrandbits(128)) for _ in range(20_000)]
+    for shortlink_id in added[:10]:
+        id_filter.add(shortlink_id)
+    id_filter.add_many(shortlink_id.bytes for shortlink_id in added[10:])
+
+    checked = [UUID(int=generator.getrandbits(128)) for _ in range(100_000)]
+    false_positives = sum(id_filter.might_contain(shortlink_id) for shortlink_id in checked) / len(checked)
+
+    assert all(id_filter.might_contain(shortlink_id) for shortlink_id in added)
+    assert false_positives < target_rate * 1.25
+    assert id_filter.expected_false_positive_rate <= target_rate
+    assert len(id_filter) > 20_000 * (1 - target_rate)
+
+
+async def test_shortlink_id_filter_memory_budget() -> None:
+    """Tests that a filter stays within its memory budget, at the cost of a higher false positive rate"""
+    blocks, _ = plan_filter(1_000_000, 0.01, 1 << 30)
+    id_filter = ShortlinkIdFilter(1_000_000, 0.01, 100_000)
+    id_filter.add_many(uuid4().bytes for _ in range(1_000_000))
+
+    assert id_filter.size_bytes == 100_000 < blocks * 8
+    assert id_filter.expected_false_positive_rate > 0.01
+
+
+async def test_slug_filter_rules_out_missing_shortlinks(
+    slug_filter: SlugFilter, shortlink_list: list[Shortlink]
+) -> None:
+    """Tests that a built slug filter finds every shortlink and rules out most others"""
+    assert slug_filter.ready
+    assert len(slug_filter) == len(shortlink_list)
+    assert all(slug_filter.might_exist(shortlink.id) for shortlink in shortlink_list)
+    assert sum(slug_filter.might_exist(uuid4()) for _ in range(1000)) < 50
+
+
+async def test_slug_filter_unavailable_until_built() -> None:
+    """Tests that every shortlink might exist until the filter is built"""
+    slug_filter = get_slug_filter()
+
+    assert not slug_filter.ready
+    assert slug_filter.might_exist(uuid4())
+
+
+async def test_slug_filter_syncs_shortlinks_from_other_workers(slug_filter: SlugFilter, session: AsyncSession) -> None:
+    """Tests that shortlinks created by this worker are found straight away, and random UUIDs created by others once
+    synced"""
+    created = await ShortlinkService.create("https://example.com/here", session)
+    elsewhere = Shortlink(long_url="https://example.com/elsewhere")
+    session.add(elsewhere)
+    await session.commit()
+
+    assert slug_filter.might_exist(created.id)
+    assert not slug_filter.might_exist(elsewhere.id)
+    assert await slug_filter.sync() is False
+    assert slug_filter.might_exist(elsewhere.id)
+
+
+async def test_slug_filter_syncs_from_newest_shortlink(slug_filter: SlugFilter, session: AsyncSession) -> None:
+    """Tests that each sync only reads the shortlinks created shortly before the newest one it has already found"""
+    generator = random.Random(1)
+    newest, late, stale = (
+        Shortlink(id=UUID(int=generator.getrandbits(128)), long_url=f"https://example.com/{i}") for i in range(3)
+    )
+    session.add(newest)
+    await session.commit()
+    await slug_filter.sync()
+    late.created_at = newest.created_at - SYNC_OVERLAP / 2
+    stale.created_at = newest.created_at - SYNC_OVERLAP * 2
+    session.add_all([late, stale])
+    await session.commit()
+
+    await slug_filter.sync()
+
+    assert slug_filter.might_exist(newest.id)
+    assert slug_filter.might_exist(late.id)
+    assert not slug_filter.might_exist(stale.id)
+
+
+async def test_new_compact_ids_from_other_workers_resolved(slug_filter: SlugFilter, session: AsyncSession) -> None:
+    """Tests that a shortlink another worker has just created is found before the filter has synced, while ids too
+    far past the sequence to have been reserved are still ruled out"""
+    (shortlink_id,) = await CompactSlugCodec().new_ids(1, session)
+    elsewhere = Shortlink(id=shortlink_id, long_url="https://example.com/elsewhere")
+    session.add(elsewhere)
+    await session.commit()
+    recent = filter_checks("recent")
+
+    found = await ShortlinkService.from_slug(elsewhere.slug, session)
+
+    assert found and found.long_url == elsewhere.long_url
+    assert filter_checks("recent") == recent + 1
+    assert not slug_filter.might_exist(compact_id(MAX_COMPACT_ID))
+    assert not slug_filter.might_exist(compact_id((compact_number(shortlink_id) or 0) + 2 * SEQUENCE_HEADROOM))
+
+
+async def test_settled_compact_ids_ruled_out(slug_filter: SlugFilter, session: AsyncSession) -> None:
+    """Tests that compact ids from blocks reserved long enough before a sync are ruled out unless they were synced,
+    and can't be handed out any more"""
+    slug_filter.settle_time = timedelta(0)
+    (unused_id,) = await CompactSlugCodec().new_ids(1, session)
+    assert slug_filter.might_exist(unused_id)
+    assert slug_filter.might_be_created(unused_id)
+
+    await slug_filter.sync()
+
+    assert not slug_filter.might_exist(unused_id)
+    assert not slug_filter.might_be_created(unused_id)
+    assert not slug_filter.might_be_created(uuid4())
+    (next_id,) = await CompactSlugCodec().new_ids(1, session)
+    assert (compact_number(next_id) or 0) > (compact_number(unused_id) or 0)
+    assert slug_filter.might_exist(next_id)
+
+
+async def test_slug_filter_unavailable_once_stale(shortlink_list: list[Shortlink], clock: FakeClock) -> None:
+    """Tests that a filter that hasn't synced for a few intervals stops ruling out ids until it syncs again"""
+    slug_filter = SlugFilter(0.01, 1 << 20, sync_interval=1.0, rebuild_interval=3600.0, clock=clock)
+    await slug_filter.rebuild()
+    assert not slug_filter.ready
+    await slug_filter.sync()
+    assert slug_filter.ready
+
+    clock.now += STALE_AFTER_SYNC_INTERVALS * slug_filter.sync_interval + 1
+
+    assert not slug_filter.ready
+    assert slug_filter.might_exist(uuid4())
+    await slug_filter.sync()
+    assert slug_filter.ready
+
+
+async def test_slug_filter_set_aside_during_imports(slug_filter: SlugFilter, session: AsyncSession) -> None:
+    """Tests that the filter isn't used while a bulk import is merging, and is rebuilt once it has finished"""
+    job = ImportJob(source="links.csv", status=ImportStatus.MERGING)
+    session.add(job)
+    await session.commit()
+    imported = Shortlink(long_url="https://example.com/imported", created_at=datetime(2020, 1, 1, tzinfo=UTC))
+    session.add(imported)
+    await session.commit()
+
+    assert await slug_filter.sync() is False
+    assert not slug_filter.ready
+    assert slug_filter.might_exist(imported.id)
+
+    job.status = ImportStatus.DONE
+    job.updated_at = datetime.now(UTC)
+    await session.commit()
+    assert await slug_filter.sync() is True
+    assert not slug_filter.ready
+
+    await slug_filter.rebuild()
+    assert await slug_filter.sync() is False
+    assert slug_filter.ready
+    assert slug_filter.might_exist(imported.id)
+
+
+async def test_slug_filter_sized_with_headroom(slug_filter: SlugFilter) -> None:
+    """Tests that a filter is sized for more shortlinks than exist, and reports its size"""
+    assert len(slug_filter) == 100
+    assert REGISTRY.get_sample_value("slug_filter_items") == 100
+    assert REGISTRY.get_sample_value("slug_filter_bytes") == plan_filter(MIN_CAPACITY, 0.01, 1 << 30)[0] * 8
+    assert (REGISTRY.get_sample_value("slug_filter_expected_false_positive_rate") or 1) < 0.001
+
+
+@pytest.mark.usefixtures("slug_filter")
+async def test_missing_slug_not_found_without_query(client: AsyncClient, session: AsyncSession) -> None:
+    """Tests that a slug ruled out by the filter gets a 404 without looking it up"""
+    absent = filter_checks("absent")
+    missing = Shortlink(id=uuid4(), long_url="https://example.com/missing")
+
+    response = await client.get(f"/{missing.slug}")
+
+    assert response.status_code == 404
+    assert filter_checks("absent") == absent + 1
+
+
+@pytest.mark.usefixtures("slug_filter")
+async def test_existing_slug_found_with_filter(client: AsyncClient, shortlink_list: list[Shortlink]) -> None:
+    """Tests that shortlinks in the filter are still redirected to, whichever way the slug is resolved"""
+    present = filter_checks("present")
+
+    response = await client.get(f"/{shortlink_list[0].slug}")
+    stats_response = await client.get(f"/stats/{shortlink_list[1].slug}")
+
+    assert response.status_code == 307
+    assert stats_response.status_code == 200
+    assert filter_checks("present") == present + 2
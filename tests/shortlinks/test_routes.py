@@ -1,5 +1,15 @@
+from uuid import uuid4
+
 import pytest
+import shortuuid
 from httpx import AsyncClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import Settings
+from shortlinks.models import Shortlink
+from stats.buffer import get_visit_buffer
+from stats.events import get_visit_event_ingester
+from stats.models import ShortlinkStat
 
 pytestmark = pytest.mark.anyio
 
@@ -54,3 +64,154 @@ async def test_create_shortlink_protocol(client: AsyncClient, protocol: str, is_
     assert data
     expected_code = 201 if is_valid else 422
     assert response.status_code == expected_code
+
+
+async def test_create_shortlink_idempotency_key(client: AsyncClient) -> None:
+    """Tests that retrying a creation with the same idempotency key returns the original shortlink"""
+    body = {"long_url": "http://example.com/long-url"}
+    headers = {"Idempotency-Key": "f0e6b5a4"}
+    first = await client.post("/shorten", json=body, headers=headers)
+    retry = await client.post("/shorten", json=body, headers=headers)
+
+    assert first.status_code == 201
+    assert "idempotent-replayed" not in first.headers
+    assert retry.status_code == 201
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+
+
+async def test_create_shortlink_idempotency_key_different_url(client: AsyncClient) -> None:
+    """Tests that reusing an idempotency key for a different URL is rejected"""
+    headers = {"Idempotency-Key": "f0e6b5a4"}
+    await client.post("/shorten", json={"long_url": "http://example.com/long-url"}, headers=headers)
+    response = await client.post("/shorten", json={"long_url": "http://example.com/other-url"}, headers=headers)
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["header", "Idempotency-Key"]
+
+
+async def test_access_shortlink(client: AsyncClient, shortlink: Shortlink) -> None:
+    """Tests that accessing a shortlink redirects to its long URL and buffers the visit"""
+    response = await client.get(f"/{shortlink.slug}")
+
+    assert response.status_code == 307
+    assert response.headers["location"] == shortlink.long_url
+    assert len(get_visit_buffer()) == 1
+
+
+async def test_access_shortlink_write_through(
+    client: AsyncClient,
+    session: AsyncSession,
+    shortlink: Shortlink,
+    test_settings: Settings,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Tests that visits are recorded immediately when write-behind buffering is disabled"""
+    monkeypatch.setattr(test_settings, "visit_write_behind", False)
+    response = await client.get(f"/{shortlink.slug}")
+
+    assert response.status_code == 307
+    assert len(get_visit_buffer()) == 0
+    stats = await session.get(ShortlinkStat, shortlink.id)
+    assert stats
+    assert stats.visits == 1
+
+
+async def test_access_shortlink_visit_event(
+    client: AsyncClient,
+    shortlink: Shortlink,
+    test_settings: Settings,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Tests that visit details are queued for the visit event log when it is enabled"""
+    response = await client.get(f"/{shortlink.slug}")
+    assert len(get_visit_event_ingester()) == 0
+
+    monkeypatch.setattr(test_settings, "visit_events_enabled", True)
+    response = await client.get(f"/{shortlink.slug}", headers={"referer": "https://www.example.com/"})
+
+    assert response.status_code == 307
+    assert get_visit_event_ingester().accepted == 1
+
+
+async def test_access_shortlink_does_not_exist(client: AsyncClient) -> None:
+    """Tests that accessing a slug that does not exist returns an error"""
+    response = await client.get(f"/{shortuuid.encode(uuid4())}")
+    data = response.json()
+
+    assert response.status_code == 404
+    assert data == {"detail": "Not Found"}
+
+
+async def test_create_shortlink_batch(client: AsyncClient) -> None:
+    """Tests that creating shortlinks in a batch returns them in the same order as the URLs"""
+    long_urls = [f"http://example.com/long-url/{i}" for i in range(5)]
+    response = await client.post("/shorten/batch", json={"long_urls": long_urls})
+    data = response.json()
+
+    assert response.status_code == 201
+    assert [d["long_url"] for d in data] == long_urls
+    assert len({d["slug"] for d in data}) == 5
+    for d in data:
+        assert d["short_url"] == f"http://test/{d['slug']}"
+
+
+async def test_create_shortlink_batch_ndjson(client: AsyncClient) -> None:
+    """Tests that creating shortlinks in a batch works with an NDJSON body"""
+    long_urls = [f"http://example.com/long-url/{i}" for i in range(5)]
+    content = "\n".join(f'{{"long_url": "{long_url}"}}' for long_url in long_urls) + "\n"
+    response = await client.post(
+        "/shorten/batch",
+        content=content,
+        headers={"content-type": "application/x-ndjson"},
+    )
+    data = response.json()
+
+    assert response.status_code == 201
+    assert [d["long_url"] for d in data] == long_urls
+
+
+async def test_create_shortlink_batch_ndjson_invalid_url(client: AsyncClient) -> None:
+    """Tests that an invalid line in an NDJSON batch returns an error pointing at that line"""
+    content = '{"long_url": "http://example.com/long-url"}\n{"long_url": "bad url"}'
+    response = await client.post(
+        "/shorten/batch",
+        content=content,
+        headers={"content-type": "application/x-ndjson"},
+    )
+    data = response.json()
+
+    assert response.status_code == 422
+    assert data["detail"][0]["loc"] == ["body", 1, "long_url"]
+
+
+@pytest.mark.parametrize(
+    "long_urls",
+    (
+        [],
+        ["http://example.com/long-url", "bad url"],
+        ["wss://example.com/long-url"],
+    ),
+)
+async def test_create_shortlink_batch_invalid(client: AsyncClient, long_urls: list[str]) -> None:
+    """Tests that creating a batch with no URLs or any invalid URL returns an error"""
+    response = await client.post("/shorten/batch", json={"long_urls": long_urls})
+    data = response.json()
+
+    assert response.status_code == 422
+    assert data
+
+
+async def test_create_shortlink_batch_too_large(
+    client: AsyncClient, test_settings: Settings, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that a streamed batch with more URLs than allowed returns an error"""
+    monkeypatch.setattr(test_settings, "shorten_batch_max_size", 2)
+    content = "\n".join('{"long_url": "http://example.com/long-url"}' for _ in range(3))
+    response = await client.post(
+        "/shorten/batch",
+        content=content,
+        headers={"content-type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 422
@@ -1,11 +1,19 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
 from uuid import uuid4
 
 import pytest
 import shortuuid
+from prometheus_client import REGISTRY
+from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from shortlinks.models import Shortlink
+from core.config import Settings
+from core.db import get_session_context
+from shortlinks.cache import get_slug_cache
+from shortlinks.models import IdempotencyKey, Shortlink
 from shortlinks.service import ShortlinkService
+from shortlinks.slugs import ID_SEQUENCE_START, compact_id
 
 pytestmark = pytest.mark.anyio
 
@@ -62,3 +70,146 @@ async def test_get_by_ids(session: AsyncSession) -> None:
     for shortlink in shortlinks:
         assert loaded_shortlinks[shortlink.id] == shortlink
     assert new_uuid not in loaded_shortlinks
+
+
+async def test_loading_shortlink_is_cached(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that a loaded shortlink is served from the slug cache without querying again"""
+    await ShortlinkService.from_slug(shortlink.slug, session)
+    await session.delete(shortlink)
+    await session.commit()
+    hits = REGISTRY.get_sample_value("slug_cache_lookups_total", {"result": "hit"}) or 0
+
+    loaded_shortlink = await ShortlinkService.from_slug(shortlink.slug, session)
+    assert loaded_shortlink == shortlink
+    assert REGISTRY.get_sample_value("slug_cache_lookups_total", {"result": "hit"}) == hits + 1
+
+
+async def test_loading_shortlink_does_not_exist_is_cached(session: AsyncSession) -> None:
+    """Tests that a slug that does not exist is cached as a miss"""
+    slug = shortuuid.encode(uuid4())
+    await ShortlinkService.from_slug(slug, session)
+    assert get_slug_cache().get(slug) == (True, None)
+
+
+async def test_create_shortlink_is_cached(session: AsyncSession) -> None:
+    """Tests that a newly created shortlink is added to the slug cache"""
+    new_shortlink = await ShortlinkService.create("https://www.example.com/very/long/url", session)
+    assert get_slug_cache().get(new_shortlink.slug) == (True, new_shortlink)
+
+
+async def test_loading_shortlink_from_replica_falls_back_to_primary(
+    session: AsyncSession, replica_session: AsyncSession, shortlink: Shortlink
+) -> None:
+    """Tests that a shortlink the read replica does not have yet is loaded from the primary"""
+    assert not await ShortlinkService.from_slug(shortlink.slug, replica_session)
+    get_slug_cache().clear()
+
+    loaded_shortlink = await ShortlinkService.from_slug(shortlink.slug, replica_session, session)
+    assert loaded_shortlink == shortlink
+
+
+async def test_loading_shortlink_does_not_exist_with_fallback(
+    session: AsyncSession, replica_session: AsyncSession
+) -> None:
+    """Tests that a slug missing from both the read replica and the primary returns None"""
+    slug = shortuuid.encode(uuid4())
+    loaded_shortlink = await ShortlinkService.from_slug(slug, replica_session, session)
+    assert not loaded_shortlink
+
+
+async def test_create_many_shortlinks(session: AsyncSession) -> None:
+    """Tests creating shortlinks for many long URLs at once"""
+    long_urls = [f"https://www.example.com/very/long/url/{i}" for i in range(3)]
+    new_shortlinks = await ShortlinkService.create_many(long_urls, session)
+    assert [shortlink.long_url for shortlink in new_shortlinks] == long_urls
+
+    loaded_shortlinks = await ShortlinkService.get_by_ids([shortlink.id for shortlink in new_shortlinks], session)
+    assert {shortlink.id: shortlink.long_url for shortlink in loaded_shortlinks.values()} == {
+        shortlink.id: shortlink.long_url for shortlink in new_shortlinks
+    }
+
+
+async def test_create_idempotent_returns_original(session: AsyncSession) -> None:
+    """Tests that retrying a creation with the same idempotency key returns the original shortlink"""
+    long_url = "https://www.example.com/very/long/url"
+    first, first_created = await ShortlinkService.create_idempotent(long_url, "key", session)
+    second, second_created = await ShortlinkService.create_idempotent(long_url, "key", session)
+    other, other_created = await ShortlinkService.create_idempotent(long_url, "other-key", session)
+
+    assert (first_created, second_created, other_created) == (True, False, True)
+    assert second.id == first.id
+    assert other.id != first.id
+    keys = list(await session.exec(select(IdempotencyKey)))
+    assert {key.key_hash for key in keys} == {IdempotencyKey.hash_key("key"), IdempotencyKey.hash_key("other-key")}
+
+
+async def test_create_idempotent_reuses_expired_key(
+    session: AsyncSession, test_settings: Settings, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that an idempotency key creates a new shortlink once it has expired"""
+    long_url = "https://www.example.com/very/long/url"
+    first, _ = await ShortlinkService.create_idempotent(long_url, "key", session)
+    monkeypatch.setattr(test_settings, "idempotency_key_ttl", -1)
+    second, created = await ShortlinkService.create_idempotent(long_url, "key", session)
+
+    assert created
+    assert second.id != first.id
+
+
+@pytest.mark.usefixtures("session")
+async def test_create_idempotent_concurrently() -> None:
+    """Tests that concurrent requests with the same idempotency key only create one shortlink"""
+
+    async def create() -> tuple[Shortlink, bool]:
+        async with get_session_context() as session:
+            return await ShortlinkService.create_idempotent("https://www.example.com/", "key", session)
+
+    results = await asyncio.gather(*(create() for _ in range(5)))
+
+    assert len({shortlink.id for shortlink, _ in results}) == 1
+    assert [created for _, created in results].count(True) == 1
+
+
+async def test_prune_idempotency_keys(session: AsyncSession) -> None:
+    """Tests that only keys created before the cutoff are pruned"""
+    await ShortlinkService.create_idempotent("https://www.example.com/", "key", session)
+
+    assert await ShortlinkService.prune_idempotency_keys(datetime.now(UTC) - timedelta(hours=1), session) == 0
+    assert await ShortlinkService.prune_idempotency_keys(datetime.now(UTC) + timedelta(hours=1), session) == 1
+
+
+async def test_create_shortlink_random_slug_by_default(session: AsyncSession) -> None:
+    """Tests that new shortlinks get unguessable random UUID slugs unless compact slugs are opted into"""
+    new_shortlink = await ShortlinkService.create("https://www.example.com/very/long/url", session)
+    assert len(new_shortlink.slug) == 22
+
+
+async def test_create_shortlink_compact_slug(
+    session: AsyncSession, shortlink: Shortlink, test_settings: Settings, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that new shortlinks get compact slugs, while existing ones keep resolving by their UUID slugs"""
+    monkeypatch.setattr(test_settings, "slug_codec", "compact")
+    new_shortlink = await ShortlinkService.create("https://www.example.com/very/long/url", session)
+    assert len(new_shortlink.slug) == 7
+    assert len(shortlink.slug) == 22
+    get_slug_cache().clear()
+    assert await ShortlinkService.from_slug(new_shortlink.slug, session) == new_shortlink
+    assert await ShortlinkService.from_slug(shortlink.slug, session) == shortlink
+
+
+async def test_upcoming_compact_slug_miss_not_cached(session: AsyncSession) -> None:
+    """Tests that a miss for a compact slug that may still be handed out isn't cached, so the shortlink another
+    worker creates with it resolves straight away"""
+    upcoming = Shortlink(id=compact_id(ID_SEQUENCE_START), long_url="https://example.com/upcoming")
+
+    assert await ShortlinkService.from_slug(upcoming.slug, session) is None
+    assert get_slug_cache().get(upcoming.slug) == (False, None)
+    session.add(upcoming)
+    await session.commit()
+
+    assert await ShortlinkService.from_slug(upcoming.slug, session) == upcoming
+
+
+async def test_get_by_ids_empty(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests getting shortlinks by an empty list of UUIDs returns nothing"""
+    assert await ShortlinkService.get_by_ids([], session) == {}
@@ -0,0 +1,308 @@
+import importlib.util
+import multiprocessing
+import os
+import random
+import time
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.config import Settings
+from shortlinks.cache import DEFAULT_SLUG_CACHE_SIZE, SHARED_SLUG_CACHE_WORKER_SIZE, get_slug_cache
+from shortlinks.models import Shortlink
+from shortlinks.service import ShortlinkService
+from shortlinks.shared_cache import (
+    SharedSlugCache,
+    close_shared_slug_cache,
+    create_shared_slug_cache,
+    get_shared_slug_cache,
+)
+from tests.conftest import FakeClock
+
+pytestmark = pytest.mark.anyio
+
+
+def shared_cache_lookups(result: str) -> float:
+    """Gets how many shortlinks have been looked up in shared slug caches with a result"""
+    return REGISTRY.get_sample_value("shared_slug_cache_lookups_total", {"result": result}) or 0
+
+
+def url_for(shortlink_id: UUID) -> str:
+    """A long URL that can be checked against the id it's cached with"""
+    return f"https://example.com/{shortlink_id}/" + "x" * (shortlink_id.int % 200)
+
+
+def attach(memory_name: str, lock_path: str, slots: int, url_bytes: int) -> SharedSlugCache:
+    """Attaches to a cache created by another process, like a worker forked from the gunicorn master"""
+    return SharedSlugCache(SharedMemory(memory_name, track=False), lock_path, slots, url_bytes, reset_interval=0)
+
+
+def numbered_shortlinks(name: str, count: int) -> list[Shortlink]:
+    """Shortlinks with the same ids every run, so whether they all fit within the probe limit of a small cache
+    doesn't change from run to run"""
+    generator = random.Random(name)
+    return [
+        Shortlink(id=UUID(int=generator.getrandbits(128)), long_url=f"https://example.com/{name}/{i}")
+        for i in range(count)
+    ]
+
+
+def cache_name() -> str:
+    """A name for a shared memory segment that no other test uses"""
+    return f"test-slug-cache-{uuid4().hex[:12]}"
+
+
+def segment_exists(name: str) -> bool:
+    """Checks whether a shared memory segment with a name exists"""
+    try:
+        SharedMemory(name, track=False).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def write_shortlinks(memory_name: str, lock_path: str, slots: int, url_bytes: int, ids: list[UUID]) -> None:
+    """Caches shortlinks from another process"""
+    shared_cache = attach(memory_name, lock_path, slots, url_bytes)
+    for shortlink_id in ids:
+        shared_cache.set(Shortlink(id=shortlink_id, long_url=url_for(shortlink_id)))
+    shared_cache.close()
+
+
+def keep_writing(memory_name: str, lock_path: str, slots: int, url_bytes: int, seconds: float) -> None:
+    """Caches new shortlinks from another process for a while, filling and clearing the cache over and over"""
+    shared_cache = attach(memory_name, lock_path, slots, url_bytes)
+    stop_at = time.monotonic() + seconds
+    while time.monotonic() < stop_at:
+        shortlink_id = uuid4()
+        shared_cache.set(Shortlink(id=shortlink_id, long_url=url_for(shortlink_id)))
+    shared_cache.close()
+
+
+@pytest.fixture()
+def shared_cache() -> Iterator[SharedSlugCache]:
+    """A small shared slug cache that's cleared as soon as it's full, removed after the test"""
+    shared_cache = SharedSlugCache.create(cache_name(), max_entries=100, url_bytes=64 * 1024, reset_interval=0)
+    yield shared_cache
+    shared_cache.close(unlink=True)
+
+
+@pytest.fixture()
+def machine_shared_cache(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> Iterator[SharedSlugCache]:
+    """The shared slug cache the workers would inherit from the gunicorn master"""
+    monkeypatch.setattr(test_settings, "shared_slug_cache_size", 1000)
+    monkeypatch.setattr(test_settings, "shared_slug_cache_url_bytes", 1024 * 1024)
+    monkeypatch.setattr(test_settings, "shared_slug_cache_name", cache_name())
+    shared_cache = create_shared_slug_cache()
+    assert shared_cache is not None
+    yield shared_cache
+    close_shared_slug_cache()
+
+
+async def test_shared_cache_hit_and_miss(shared_cache: SharedSlugCache) -> None:
+    """Tests that cached shortlinks are found with their URL and creation time, and others aren't"""
+    shortlink = Shortlink(
+        long_url="https://example.com/ünïcode?q=1", created_at=datetime(2020, 1, 2, 3, 4, 5, 678901, tzinfo=UTC)
+    )
+
+    assert shared_cache.set(shortlink)
+    assert shared_cache.set(shortlink)
+    hits, misses = shared_cache_lookups("hit"), shared_cache_lookups("miss")
+
+    assert shared_cache.get(shortlink.id) == shortlink
+    assert shared_cache.get(uuid4()) is None
+    assert len(shared_cache) == 1
+    assert (shared_cache_lookups("hit"), shared_cache_lookups("miss")) == (hits + 1, misses + 1)
+
+
+async def test_shared_cache_cleared_when_full(shared_cache: SharedSlugCache) -> None:
+    """Tests that the cache starts over once its table or its URLs are full"""
+    shortlinks = numbered_shortlinks("full", shared_cache.max_entries + 1)
+    for shortlink in shortlinks:
+        assert shared_cache.set(shortlink)
+
+    assert (len(shared_cache), shared_cache.resets) == (1, 1)
+    assert shared_cache.get(shortlinks[-1].id) == shortlinks[-1]
+    assert shared_cache.get(shortlinks[0].id) is None
+
+    long_shortlink = Shortlink(long_url="https://example.com/" + "x" * (shared_cache.url_bytes - 40))
+    assert shared_cache.set(long_shortlink)
+    assert shared_cache.set(Shortlink(long_url="https://example.com/" + "x" * 100))
+    assert (len(shared_cache), shared_cache.resets) == (1, 3)
+    assert not shared_cache.set(Shortlink(long_url="https://example.com/" + "x" * shared_cache.url_bytes))
+
+
+async def test_full_shared_cache_keeps_its_shortlinks(clock: FakeClock) -> None:
+    """Tests that once the cache is full, new shortlinks aren't cached and the ones it holds stay until the reset
+    interval has passed since it was last cleared"""
+    shared_cache = SharedSlugCache.create(cache_name(), 100, 64 * 1024, reset_interval=60, clock=clock)
+    try:
+        hot = numbered_shortlinks("hot", 10)
+        for shortlink in hot:
+            assert shared_cache.set(shortlink)
+        cold = numbered_shortlinks("cold", 3 * shared_cache.max_entries)
+        cached = sum(shared_cache.set(shortlink) for shortlink in cold)
+
+        assert cached == shared_cache.max_entries - len(hot)
+        assert (len(shared_cache), shared_cache.resets) == (shared_cache.max_entries, 0)
+        assert all(shared_cache.get(shortlink.id) == shortlink for shortlink in hot)
+
+        clock.now += 59
+        assert not shared_cache.set(cold[-1])
+        clock.now += 1
+        assert shared_cache.set(cold[-1])
+        assert (len(shared_cache), shared_cache.resets) == (1, 1)
+        assert shared_cache.get(hot[0].id) is None
+    finally:
+        shared_cache.close(unlink=True)
+
+
+async def test_shared_cache_replaces_leftover_segment() -> None:
+    """Tests that a segment and lock file left behind by a master that was killed are replaced by the next one"""
+    name = cache_name()
+    killed = SharedSlugCache.create(name, 100, 64 * 1024, reset_interval=0)
+    leftover = Shortlink(long_url="https://example.com/leftover")
+    killed.set(leftover)
+    killed.close()
+    assert segment_exists(name)
+
+    shared_cache = SharedSlugCache.create(name, 100, 64 * 1024, reset_interval=0)
+
+    assert shared_cache.lock_path == killed.lock_path
+    assert (len(shared_cache), shared_cache.get(leftover.id)) == (0, None)
+    shared_cache.close(unlink=True)
+    assert not segment_exists(name)
+    assert not os.path.exists(shared_cache.lock_path)
+
+
+async def test_shared_cache_shared_between_processes(shared_cache: SharedSlugCache) -> None:
+    """Tests that shortlinks cached by one process are found by another"""
+    ids = [uuid4() for _ in range(50)]
+    context = multiprocessing.get_context("spawn")
+    writer = context.Process(
+        target=write_shortlinks,
+        args=(shared_cache.memory.name, shared_cache.lock_path, shared_cache.slots, shared_cache.url_bytes, ids),
+    )
+    writer.start()
+    writer.join()
+
+    assert writer.exitcode == 0
+    assert len(shared_cache) == 50
+    for shortlink_id in ids:
+        shortlink = shared_cache.get(shortlink_id)
+        assert shortlink and shortlink.long_url == url_for(shortlink_id)
+
+
+async def test_shared_cache_reads_never_torn(shared_cache: SharedSlugCache) -> None:
+    """Tests that lookups racing another process's writes and clears only ever find whole shortlinks"""
+    context = multiprocessing.get_context("spawn")
+    writer = context.Process(
+        target=keep_writing,
+        args=(shared_cache.memory.name, shared_cache.lock_path, shared_cache.slots, shared_cache.url_bytes, 1.0),
+    )
+    writer.start()
+    ids = [uuid4() for _ in range(20)]
+    checked = 0
+    while writer.is_alive():
+        for shortlink_id in ids:
+            shared_cache.set(Shortlink(id=shortlink_id, long_url=url_for(shortlink_id)))
+        for shortlink_id in ids:
+            shortlink = shared_cache.get(shortlink_id)
+            if shortlink is not None:
+                assert shortlink.long_url == url_for(shortlink_id)
+                checked += 1
+    writer.join()
+
+    assert writer.exitcode == 0
+    assert shared_cache.resets > 0
+    assert checked > 0
+
+
+async def test_shared_cache_disabled(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that there's no shared cache unless it's created, or when it's disabled"""
+    monkeypatch.setattr(test_settings, "shared_slug_cache_size", 0)
+
+    assert get_shared_slug_cache() is None
+    assert create_shared_slug_cache() is None
+
+
+async def test_slug_resolved_from_shared_cache(client: AsyncClient, machine_shared_cache: SharedSlugCache) -> None:
+    """Tests that a shortlink another worker cached is redirected to without looking it up"""
+    shortlink = Shortlink(long_url="https://example.com/cached-by-another-worker")
+    machine_shared_cache.set(shortlink)
+    hits = shared_cache_lookups("hit")
+
+    response = await client.get(f"/{shortlink.slug}")
+
+    assert response.status_code == 307
+    assert response.headers["location"] == shortlink.long_url
+    assert shared_cache_lookups("hit") == hits + 1
+
+
+async def test_cached_miss_resolved_from_shared_cache(
+    client: AsyncClient, session: AsyncSession, machine_shared_cache: SharedSlugCache
+) -> None:
+    """Tests that a slug this worker cached as missing is still resolved once another worker has shared it"""
+    shortlink = Shortlink(long_url="https://example.com/created-by-another-worker")
+    slug_cache = get_slug_cache()
+    slug_cache.set(shortlink.slug, None)
+    machine_shared_cache.set(shortlink)
+
+    response = await client.get(f"/{shortlink.slug}")
+    assert response.status_code == 307
+    assert response.headers["location"] == shortlink.long_url
+    assert slug_cache.get(shortlink.slug) == (True, shortlink)
+
+    slug_cache.set(shortlink.slug, None)
+    assert await ShortlinkService.from_slug(shortlink.slug, session) == shortlink
+
+
+async def test_resolved_slug_shared(
+    session: AsyncSession, shortlink: Shortlink, machine_shared_cache: SharedSlugCache
+) -> None:
+    """Tests that shortlinks found or created by a worker are shared with the others, and missing ones aren't"""
+    found = await ShortlinkService.from_slug(shortlink.slug, session)
+    created = await ShortlinkService.create("https://example.com/created", session)
+    missing = await ShortlinkService.from_slug(Shortlink(long_url="https://example.com/missing").slug, session)
+
+    assert found and machine_shared_cache.get(shortlink.id) == found
+    assert machine_shared_cache.get(created.id) == created
+    assert missing is None
+    assert len(machine_shared_cache) == 2
+
+
+async def test_worker_slug_cache_smaller_with_shared_cache(machine_shared_cache: SharedSlugCache) -> None:
+    """Tests that workers keep fewer slugs themselves by default when they share a slug cache"""
+    get_slug_cache.cache_clear()
+
+    assert get_slug_cache().max_size == SHARED_SLUG_CACHE_WORKER_SIZE
+    close_shared_slug_cache()
+    get_slug_cache.cache_clear()
+    assert get_slug_cache().max_size == DEFAULT_SLUG_CACHE_SIZE
+
+
+async def test_gunicorn_hooks_create_and_remove_shared_cache(machine_shared_cache: SharedSlugCache) -> None:
+    """Tests that the gunicorn master creates the shared cache before forking and removes it when it exits"""
+    config_path = Path(__file__).parents[2] / "gunicorn.conf.py"
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", config_path)
+    assert spec and spec.loader
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    close_shared_slug_cache()
+    name = machine_shared_cache.memory.name
+
+    gunicorn_conf.on_starting(None)
+    shared_cache = get_shared_slug_cache()
+    assert shared_cache is not None and segment_exists(shared_cache.memory.name)
+
+    gunicorn_conf.on_exit(None)
+    assert get_shared_slug_cache() is None
+    assert not segment_exists(name)
+    assert not os.path.exists(shared_cache.lock_path)
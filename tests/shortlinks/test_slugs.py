@@ -0,0 +1,117 @@
+from uuid import uuid4
+
+import pytest
+import shortuuid
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from shortlinks.slugs import (
+    ID_BLOCK_MAX_AGE,
+    ID_BLOCK_SIZE,
+    ID_SEQUENCE_START,
+    MAX_COMPACT_ID,
+    CompactSlugCodec,
+    ShortUUIDCodec,
+    compact_id,
+    compact_number,
+)
+from tests.conftest import FakeClock
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("number", [ID_SEQUENCE_START, ID_SEQUENCE_START + 1, 57**7 - 1, 57**7, MAX_COMPACT_ID])
+async def test_compact_round_trip(number: int) -> None:
+    """Tests that compact ids are encoded into short slugs that decode back to the same UUID"""
+    codec = CompactSlugCodec()
+    shortlink_id = compact_id(number)
+    slug = codec.encode(shortlink_id)
+    assert 7 <= len(slug) <= 10
+    assert codec.decode(slug) == shortlink_id
+    assert compact_number(shortlink_id) == number
+
+
+async def test_compact_id_is_uuid_v8() -> None:
+    """Tests that compact ids are valid UUIDv8s that can't be mistaken for random UUIDs"""
+    assert compact_id(ID_SEQUENCE_START).version == 8
+    assert compact_number(uuid4()) is None
+
+
+async def test_compact_codec_handles_legacy_slugs() -> None:
+    """Tests that random UUIDs keep their 22 character slugs and that those slugs still resolve"""
+    codec = CompactSlugCodec()
+    shortlink_id = uuid4()
+    slug = codec.encode(shortlink_id)
+    assert slug == shortuuid.encode(shortlink_id)
+    assert codec.decode(slug) == shortlink_id
+    assert ShortUUIDCodec().decode(slug) == shortlink_id
+
+
+@pytest.mark.parametrize(
+    "slug", ["", "invalid", "0000000", "z" * 11, "32222222222", "a" * 23, "a", "2222222", "23222222"]
+)
+async def test_compact_codec_invalid_slugs(slug: str) -> None:
+    """Tests that slugs with characters outside the alphabet, the wrong length, ids outside the sequence's range or
+    leading zero characters don't decode"""
+    assert CompactSlugCodec().decode(slug) is None
+    assert ShortUUIDCodec().decode(slug) is None
+
+
+async def test_shortuuid_codec_handles_compact_slugs() -> None:
+    """Tests that shortlinks created with compact ids keep resolving after switching back to random UUIDs"""
+    shortlink_id = compact_id(ID_SEQUENCE_START + 1234)
+    slug = CompactSlugCodec().encode(shortlink_id)
+
+    assert ShortUUIDCodec().encode(shortlink_id) == slug
+    assert ShortUUIDCodec().decode(slug) == shortlink_id
+
+
+async def test_compact_ids_reserved_in_blocks(session: AsyncSession) -> None:
+    """Tests that new ids are taken from blocks reserved from the sequence, and that workers get separate blocks"""
+    codec = CompactSlugCodec()
+    other_codec = CompactSlugCodec()
+    first = await codec.new_ids(3, session)
+    other = await other_codec.new_ids(1, session)
+    rest = await codec.new_ids(ID_BLOCK_SIZE, session)
+    numbers = [compact_number(shortlink_id) for shortlink_id in first + rest]
+    third_block = ID_SEQUENCE_START + 2 * ID_BLOCK_SIZE
+    assert numbers == [
+        *range(ID_SEQUENCE_START, ID_SEQUENCE_START + ID_BLOCK_SIZE),
+        *range(third_block, third_block + 3),
+    ]
+    assert compact_number(other[0]) == ID_SEQUENCE_START + ID_BLOCK_SIZE
+    assert all(len(codec.encode(shortlink_id)) == 7 for shortlink_id in first + rest)
+
+
+async def test_compact_id_blocks_expire(session: AsyncSession, clock: FakeClock) -> None:
+    """Tests that ids left in a block once it's too old are skipped, so ids are only handed out soon after they're
+    reserved"""
+    codec = CompactSlugCodec(clock=clock)
+    first = await codec.new_ids(1, session)
+    clock.now = ID_BLOCK_MAX_AGE - 1
+    second = await codec.new_ids(1, session)
+    clock.now = ID_BLOCK_MAX_AGE
+    third = await codec.new_ids(1, session)
+
+    assert [compact_number(shortlink_id) for shortlink_id in first + second + third] == [
+        ID_SEQUENCE_START,
+        ID_SEQUENCE_START + 1,
+        ID_SEQUENCE_START + ID_BLOCK_SIZE,
+    ]
+
+
+async def test_compact_ids_end_at_ten_characters(session: AsyncSession) -> None:
+    """Tests that the last block of ids stops at the largest id with a 10 character slug, and that no more are
+    handed out after it"""
+    await super(AsyncSession, session).execute(
+        text("SELECT setval('shortlink_id_seq', :last_id)"), {"last_id": MAX_COMPACT_ID - ID_BLOCK_SIZE - 1}
+    )
+    codec = CompactSlugCodec()
+
+    last_ids = await codec.new_ids(2, session)
+
+    assert [compact_number(shortlink_id) for shortlink_id in last_ids] == [MAX_COMPACT_ID - 1, MAX_COMPACT_ID]
+    assert len(codec.encode(last_ids[-1])) == 10
+    with pytest.raises(DBAPIError, match="reached maximum value"):
+        await codec.new_ids(1, session)
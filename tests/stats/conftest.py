@@ -1,10 +1,25 @@
-from datetime import UTC, datetime, timedelta
+from datetime import UTC, date, datetime, timedelta
 
 import pytest
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from core.config import Settings
 from shortlinks.models import Shortlink
 from stats.models import ShortlinkStat
+from stats.partitions import create_partitions
+
+
+@pytest.fixture()
+def admin_api_key(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Enables the admin endpoints with a known key"""
+    monkeypatch.setattr(test_settings, "admin_api_key", "admin-secret")
+    return "admin-secret"
+
+
+@pytest.fixture()
+def admin_headers(admin_api_key: str) -> dict[str, str]:
+    """Headers authorizing requests to the admin endpoints"""
+    return {"Authorization": f"Bearer {admin_api_key}"}
 
 
 @pytest.fixture()
@@ -13,6 +28,7 @@ async def shortlink_with_stats(session: AsyncSession, shortlink: Shortlink) -> S
     stats = ShortlinkStat(
         shortlink_id=shortlink.id,
         visits=10,
+        unique_visitors=4,
         last_visit=datetime(2025, 1, 1, 12, 0, tzinfo=UTC),
     )
     session.add(stats)
@@ -28,8 +44,17 @@ async def shortlink_list_with_stats(session: AsyncSession, shortlink_list: list[
         stats = ShortlinkStat(
             shortlink_id=shortlink.id,
             visits=i,
+            unique_visitors=min(i, (i * 37) % 100),
             last_visit=start_dt - timedelta(hours=i),
         )
         session.add(stats)
     await session.commit()
     return shortlink_list
+
+
+@pytest.fixture()
+async def visit_event_partitions(session: AsyncSession) -> list[str]:
+    """Visit event partitions for the first few days of 2026 and today"""
+    partitions = await create_partitions(date(2026, 1, 1), 3, session)
+    partitions += await create_partitions(datetime.now(UTC).date(), 1, session)
+    return partitions
@@ -0,0 +1,125 @@
+from datetime import UTC, datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import IntegrityError
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from shortlinks.models import Shortlink
+from stats.buffer import VisitBuffer
+from stats.models import ShortlinkStat
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_buffer_coalesces_visits(session: AsyncSession, shortlink_list: list[Shortlink]) -> None:
+    """Tests that buffered visits are coalesced per shortlink and recorded together"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60)
+    start_dt = datetime(2025, 1, 1, 12, 0, tzinfo=UTC)
+    first, second = shortlink_list[:2]
+    visit_buffer.add(first.id, start_dt + timedelta(hours=1))
+    visit_buffer.add(first.id, start_dt + timedelta(hours=2))
+    visit_buffer.add(first.id, start_dt)
+    visit_buffer.add(second.id, start_dt)
+    assert len(visit_buffer) == 2
+
+    assert await visit_buffer.flush(session) == 2
+    assert len(visit_buffer) == 0
+
+    first_stats = await session.get(ShortlinkStat, first.id)
+    assert first_stats
+    assert first_stats.visits == 3
+    assert first_stats.last_visit == start_dt + timedelta(hours=2)
+    second_stats = await session.get(ShortlinkStat, second.id)
+    assert second_stats
+    assert second_stats.visits == 1
+
+
+async def test_buffer_adds_to_existing_stats(session: AsyncSession, shortlink_with_stats: Shortlink) -> None:
+    """Tests that flushing adds to the existing visit count and keeps the latest visit"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60)
+    last_visit = datetime(2024, 1, 1, 12, 0, tzinfo=UTC)
+    visit_buffer.add(shortlink_with_stats.id, last_visit)
+    visit_buffer.add(shortlink_with_stats.id, last_visit)
+    await visit_buffer.flush(session)
+
+    stats = await session.get(ShortlinkStat, shortlink_with_stats.id)
+    assert stats
+    await session.refresh(stats)
+    assert stats.visits == 12
+    assert stats.last_visit == datetime(2025, 1, 1, 12, 0, tzinfo=UTC)
+
+
+async def test_buffer_keeps_visits_on_failure(session: AsyncSession) -> None:
+    """Tests that visits are kept in the buffer if recording them fails"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60)
+    visit_buffer.add(uuid4(), datetime(2025, 1, 1, 12, 0, tzinfo=UTC))
+
+    with pytest.raises(IntegrityError):
+        await visit_buffer.flush(session)
+    await session.rollback()
+    assert len(visit_buffer) == 1
+
+
+async def test_buffer_flush_empty(session: AsyncSession) -> None:
+    """Tests that flushing an empty buffer does nothing"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60)
+    assert await visit_buffer.flush(session) == 0
+
+
+async def test_buffer_reports_lag(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that the time the oldest buffered visit waited to be recorded is reported"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60)
+    labels = {"mode": "buffer"}
+    count = REGISTRY.get_sample_value("visit_record_lag_seconds_count", labels) or 0
+    total = REGISTRY.get_sample_value("visit_record_lag_seconds_sum", labels) or 0
+    now = datetime.now(UTC)
+    visit_buffer.add(shortlink.id, now - timedelta(seconds=1))
+    visit_buffer.add(shortlink.id, now - timedelta(seconds=30))
+
+    await visit_buffer.flush(session)
+
+    assert REGISTRY.get_sample_value("visit_record_lag_seconds_count", labels) == count + 1
+    assert (REGISTRY.get_sample_value("visit_record_lag_seconds_sum", labels) or 0) - total >= 30
+
+
+async def test_buffer_records_separately_after_failures(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that after failing a few times in a row, the buffer records each shortlink on its own and drops the
+    visits to the ones that still fail, instead of retrying them all forever"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60, max_failures=2)
+    visited_at = datetime(2025, 1, 1, 12, 0, tzinfo=UTC)
+    dropped = REGISTRY.get_sample_value("visits_dropped_total", {"reason": "failed"}) or 0
+    shortlink_id = shortlink.id
+    visit_buffer.add(shortlink_id, visited_at)
+    visit_buffer.add(uuid4(), visited_at)
+    visit_buffer.add(uuid4(), visited_at)
+
+    for failures in (1, 2):
+        with pytest.raises(IntegrityError):
+            await visit_buffer.flush(session)
+        await session.rollback()
+        assert (visit_buffer.failures, len(visit_buffer)) == (failures, 3)
+
+    assert await visit_buffer.flush(session) == 1
+    assert (visit_buffer.failures, len(visit_buffer)) == (0, 0)
+    assert REGISTRY.get_sample_value("visits_dropped_total", {"reason": "failed"}) == dropped + 2
+    stats = await session.get(ShortlinkStat, shortlink_id)
+    assert stats and stats.visits == 1
+
+
+async def test_buffer_drops_visits_past_capacity() -> None:
+    """Tests that once the buffer holds visits to as many shortlinks as it can, visits to others are dropped and
+    counted, while visits to the shortlinks it holds are still added"""
+    visit_buffer = VisitBuffer(max_size=100, flush_interval=60, capacity=2)
+    visited_at = datetime(2025, 1, 1, 12, 0, tzinfo=UTC)
+    dropped = REGISTRY.get_sample_value("visits_dropped_total", {"reason": "overflow"}) or 0
+    held = [uuid4(), uuid4()]
+    for shortlink_id in held:
+        visit_buffer.add(shortlink_id, visited_at)
+
+    visit_buffer.add(uuid4(), visited_at)
+    visit_buffer.add(held[0], visited_at)
+
+    assert len(visit_buffer) == 2
+    assert REGISTRY.get_sample_value("visits_dropped_total", {"reason": "overflow"}) == dropped + 1
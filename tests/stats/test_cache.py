@@ -0,0 +1,201 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from stats.cache import CachedResponse, ResponseCache, etag_matches
+from tests.conftest import FakeClock
+
+pytestmark = pytest.mark.anyio
+
+
+def cache_lookups(result: str) -> float:
+    """Gets how many stats responses have been looked up in response caches with a result"""
+    return REGISTRY.get_sample_value("stats_response_cache_lookups_total", {"result": result}) or 0
+
+
+class CountingLoader:
+    """A response loader that counts its calls and returns a body numbered by them"""
+
+    def __init__(self, age: float = 0.0) -> None:
+        self.calls = 0
+        self.age = age
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self) -> tuple[bytes, float]:
+        self.calls += 1
+        await self.release.wait()
+        return f"[{self.calls}]".encode(), self.age
+
+
+async def test_response_cache_serves_fresh_responses(clock: FakeClock) -> None:
+    """Tests that a response is served from the cache without loading it again while it's fresh"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30, clock=clock)
+    load = CountingLoader()
+    hits, misses = cache_lookups("hit"), cache_lookups("miss")
+
+    first, age = await cache.get("key", load)
+    clock.now = 4
+    second, second_age = await cache.get("key", load)
+
+    assert first == second
+    assert first and first.body == b"[1]"
+    assert (age, second_age) == (0, 4)
+    assert load.calls == 1
+    assert (cache_lookups("hit"), cache_lookups("miss")) == (hits + 1, misses + 1)
+
+
+async def test_response_cache_refreshes_stale_responses_in_background(clock: FakeClock) -> None:
+    """Tests that a stale response is served while a single refresh runs in the background"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30, clock=clock)
+    load = CountingLoader()
+    await cache.get("key", load)
+    stale_hits = cache_lookups("stale")
+
+    clock.now = 10
+    load.release.clear()
+    stale_responses = [await cache.get("key", load) for _ in range(3)]
+    load.release.set()
+    await cache.wait()
+    refreshed, age = await cache.get("key", load)
+
+    assert all(response and response.body == b"[1]" and age == 10 for response, age in stale_responses)
+    assert refreshed and refreshed.body == b"[2]"
+    assert age == 0
+    assert load.calls == 2
+    assert cache_lookups("stale") == stale_hits + 3
+
+
+async def test_response_cache_reloads_expired_responses(clock: FakeClock) -> None:
+    """Tests that a response older than the stale window is loaded again before it's served"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30, clock=clock)
+    load = CountingLoader()
+    await cache.get("key", load)
+    misses = cache_lookups("miss")
+
+    clock.now = 35
+    response, age = await cache.get("key", load)
+
+    assert response and response.body == b"[2]"
+    assert age == 0
+    assert cache_lookups("miss") == misses + 1
+
+
+async def test_response_cache_coalesces_concurrent_misses() -> None:
+    """Tests that concurrent requests for a response that isn't cached share a single load"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30)
+    load = CountingLoader()
+    load.release.clear()
+
+    requests = [asyncio.create_task(cache.get("key", load)) for _ in range(10)]
+    await asyncio.sleep(0)
+    load.release.set()
+    responses = await asyncio.gather(*requests)
+
+    assert load.calls == 1
+    assert {response.body for response, _ in responses if response} == {b"[1]"}
+
+
+async def test_response_cache_keeps_load_running_when_request_is_cancelled() -> None:
+    """Tests that cancelling a request waiting on a load doesn't cancel the load for other requests"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30)
+    load = CountingLoader()
+    load.release.clear()
+
+    cancelled = asyncio.create_task(cache.get("key", load))
+    waiting = asyncio.create_task(cache.get("key", load))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    load.release.set()
+    response, _ = await waiting
+
+    assert response and response.body == b"[1]"
+    assert load.calls == 1
+
+
+async def test_response_cache_includes_age_of_loaded_stats(clock: FakeClock) -> None:
+    """Tests that stats that were already old when loaded go stale sooner"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30, clock=clock)
+    load = CountingLoader(age=3)
+    stale_hits = cache_lookups("stale")
+
+    _, age = await cache.get("key", load)
+    clock.now = 2
+    await cache.get("key", load)
+
+    assert age == 3
+    assert cache_lookups("stale") == stale_hits + 1
+
+
+async def test_response_cache_does_not_cache_missing_responses() -> None:
+    """Tests that a loader finding nothing isn't cached, so the next request loads again"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30)
+    calls = 0
+
+    async def load() -> None:
+        nonlocal calls
+        calls += 1
+
+    assert await cache.get("key", load) == (None, 0)
+    assert await cache.get("key", load) == (None, 0)
+    assert calls == 2
+    assert len(cache) == 0
+
+
+async def test_response_cache_keeps_stale_response_when_refresh_fails(clock: FakeClock) -> None:
+    """Tests that a failed background refresh keeps serving the stale response, and a failed load raises"""
+    cache = ResponseCache(max_size=10, max_age=5, stale_while_revalidate=30, clock=clock)
+    await cache.get("key", CountingLoader())
+
+    async def fail() -> tuple[bytes, float]:
+        raise ConnectionError("database unavailable")
+
+    clock.now = 10
+    response, _ = await cache.get("key", fail)
+    await cache.wait()
+    assert response and response.body == b"[1]"
+    response, _ = await cache.get("key", fail)
+    assert response and response.body == b"[1]"
+    await cache.wait()
+
+    with pytest.raises(ConnectionError):
+        await cache.get("other", fail)
+
+
+async def test_response_cache_evicts_least_recently_used() -> None:
+    """Tests that the least recently used response is evicted when the cache is full"""
+    cache = ResponseCache(max_size=2, max_age=5, stale_while_revalidate=30)
+    load = CountingLoader()
+    for key in ("a", "b", "a", "c"):
+        await cache.get(key, load)
+
+    assert len(cache) == 2
+    await cache.get("b", load)
+    assert load.calls == 4
+
+
+@pytest.mark.parametrize(
+    ("if_none_match", "expected"),
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+        ("abc", False),
+    ],
+)
+async def test_etag_matches(if_none_match: str, expected: bool) -> None:
+    """Tests matching If-None-Match headers against an entity tag"""
+    assert etag_matches(if_none_match, '"abc"') is expected
+
+
+async def test_cached_response_etag() -> None:
+    """Tests that entity tags are quoted and change with the body"""
+    first = CachedResponse.create(b"[1]", 0)
+    second = CachedResponse.create(b"[2]", 0)
+
+    assert first.etag.startswith('"') and first.etag.endswith('"')
+    assert first.etag != second.etag
+    assert CachedResponse.create(b"[1]", 5).etag == first.etag
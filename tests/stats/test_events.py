@@ -0,0 +1,175 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.requests import Request
+
+from core.config import Settings
+from core.db import get_session_context
+from stats.events import (
+    VISITOR_HASH_KEY_BYTES,
+    VisitEventIngester,
+    get_visitor_hash_key,
+    load_visitor_hash_key,
+    visit_event_from_request,
+    visitor_hash_from_request,
+)
+from stats.models import VisitEvent
+from stats.service import VisitEventData
+
+pytestmark = pytest.mark.anyio
+
+VISITED_AT = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+
+
+def make_event(visited_at: datetime = VISITED_AT) -> VisitEventData:
+    """Returns a visit event to a random shortlink"""
+    return VisitEventData(uuid4(), visited_at, "https://www.example.com/", "test-agent", "NZ")
+
+
+@pytest.mark.usefixtures("visit_event_partitions")
+async def test_ingester_writes_events_on_stop(session: AsyncSession) -> None:
+    """Tests that queued events are written with COPY when the ingester stops"""
+    ingester = VisitEventIngester(queue_size=10, batch_size=2, flush_interval=60, policy="drop", sample_rate=0)
+    events = [make_event(VISITED_AT + timedelta(days=i)) for i in range(3)]
+    for event in events:
+        assert await ingester.add(event)
+    await ingester.stop()
+
+    results = await session.exec(select(VisitEvent).order_by(col(VisitEvent.visited_at)))
+
+    assert [
+        VisitEventData(e.shortlink_id, e.visited_at, e.referrer, e.user_agent, e.country) for e in results
+    ] == events
+    assert ingester.written == 3
+    assert len(ingester) == 0
+
+
+@pytest.mark.usefixtures("visit_event_partitions")
+async def test_ingester_writes_full_batches_in_background(session: AsyncSession) -> None:
+    """Tests that the background writer writes a batch as soon as it fills up"""
+    ingester = VisitEventIngester(queue_size=10, batch_size=2, flush_interval=60, policy="drop", sample_rate=0)
+    ingester.start()
+    await ingester.add(make_event())
+    await ingester.add(make_event())
+    for _ in range(100):
+        if ingester.written:
+            break
+        await asyncio.sleep(0.01)
+    await ingester.stop()
+
+    assert ingester.written == 2
+    assert len(list(await session.exec(select(VisitEvent)))) == 2
+
+
+async def test_ingester_drops_events_when_full() -> None:
+    """Tests that the drop policy discards new events once the queue is full"""
+    ingester = VisitEventIngester(queue_size=2, batch_size=2, flush_interval=60, policy="drop", sample_rate=1)
+
+    assert [await ingester.add(make_event()) for _ in range(3)] == [True, True, False]
+    assert (ingester.accepted, ingester.dropped) == (2, 1)
+
+
+async def test_ingester_samples_events_under_pressure() -> None:
+    """Tests that the sample policy keeps a fraction of events once the queue is half full"""
+    samples = iter([0.5, 0.05])
+    ingester = VisitEventIngester(
+        queue_size=4, batch_size=4, flush_interval=60, policy="sample", sample_rate=0.1, sampler=lambda: next(samples)
+    )
+
+    assert [await ingester.add(make_event()) for _ in range(4)] == [True, True, False, True]
+    assert (ingester.accepted, ingester.dropped) == (3, 1)
+
+
+async def test_ingester_blocks_when_full() -> None:
+    """Tests that the block policy waits for space in the queue"""
+    ingester = VisitEventIngester(queue_size=1, batch_size=1, flush_interval=60, policy="block", sample_rate=0)
+    await ingester.add(make_event())
+
+    with pytest.raises(TimeoutError):
+        await asyncio.wait_for(ingester.add(make_event()), 0.05)
+    assert ingester.dropped == 0
+
+
+async def test_ingester_counts_failed_writes() -> None:
+    """Tests that events are counted as failed when their partition doesn't exist"""
+    ingester = VisitEventIngester(queue_size=1, batch_size=1, flush_interval=60, policy="drop", sample_rate=0)
+    await ingester.add(make_event(datetime(2000, 1, 1, tzinfo=UTC)))
+    await ingester.stop()
+
+    assert (ingester.written, ingester.failed) == (0, 1)
+
+
+def test_visit_event_from_request(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that visit details are read from the request headers and truncated to fit"""
+    monkeypatch.setattr(test_settings, "visit_event_country_header", "CF-IPCountry")
+    shortlink_id = uuid4()
+    request = Request(
+        {
+            "type": "http",
+            "headers": [
+                (b"referer", b"https://www.example.com/"),
+                (b"user-agent", b"a" * 1000),
+                (b"cf-ipcountry", b"nz"),
+            ],
+        }
+    )
+
+    event = visit_event_from_request(shortlink_id, VISITED_AT, request)
+
+    assert event == VisitEventData(shortlink_id, VISITED_AT, "https://www.example.com/", "a" * 512, "NZ")
+
+
+def test_visitor_hash_from_request(test_settings: Settings, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that visitors are identified by their IP address and user agent, hashed with the secret key"""
+
+    def visitor_hash(ip_address: str, user_agent: bytes) -> int:
+        request = Request(
+            {
+                "type": "http",
+                "client": ("127.0.0.1", 1234),
+                "headers": [(b"user-agent", user_agent), (b"fly-client-ip", ip_address.encode())],
+            }
+        )
+        return visitor_hash_from_request(request)
+
+    monkeypatch.setattr(test_settings, "visitor_ip_header", "Fly-Client-IP")
+    first = visitor_hash("192.0.2.1", b"test-agent")
+
+    assert visitor_hash("192.0.2.1", b"test-agent") == first
+    assert visitor_hash("192.0.2.2", b"test-agent") != first
+    assert visitor_hash("192.0.2.1", b"other-agent") != first
+    assert 0 <= first < 2**64
+
+    monkeypatch.setattr(test_settings, "visitor_hash_key", "secret")
+    assert visitor_hash("192.0.2.1", b"test-agent") != first
+
+
+async def test_visitor_hash_key_generated_once(
+    session: AsyncSession, test_settings: Settings, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that without a configured key, the first worker generates one and every other worker loads it"""
+    monkeypatch.setattr(test_settings, "visitor_hash_key", "")
+
+    key = await load_visitor_hash_key(session)
+    async with get_session_context() as other_worker:
+        assert await load_visitor_hash_key(other_worker) == key
+
+    assert len(key) == VISITOR_HASH_KEY_BYTES
+    assert get_visitor_hash_key() == key
+
+
+async def test_configured_visitor_hash_key(
+    session: AsyncSession, test_settings: Settings, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Tests that a configured key is used instead of a generated one, as long as it fits in a BLAKE2b key"""
+    monkeypatch.setattr(test_settings, "visitor_hash_key", "secret")
+
+    assert await load_visitor_hash_key(session) == get_visitor_hash_key() == b"secret"
+
+    monkeypatch.setattr(test_settings, "visitor_hash_key", "x" * 65)
+    with pytest.raises(ValueError, match="at most 64 bytes"):
+        await load_visitor_hash_key(session)
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import resource
+from pathlib import Path
+
+import pytest
+from httpx import AsyncClient
+from sqlmodel import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from shortlinks.models import Shortlink
+from stats.export import STATS_EXPORT_COLUMNS, ExportFormat, export_stats
+
+pytestmark = pytest.mark.anyio
+
+EXPORT_ROWS = 1_000_000
+"""How many shortlinks are exported when checking that an export's memory stays flat"""
+
+EXPORT_RSS_CEILING = 64 * 1024 * 1024
+"""How many bytes the resident memory may grow by while exporting, however many rows there are"""
+
+
+def resident_memory() -> int:
+    """Returns the current resident memory of this process in bytes"""
+    return int(Path("/proc/self/statm").read_text().split()[1]) * resource.getpagesize()
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_export_stats_ndjson(client: AsyncClient, shortlink: Shortlink, admin_headers: dict[str, str]) -> None:
+    """Tests exporting every shortlink with its stats as NDJSON, including shortlinks without visits"""
+    response = await client.get("/export/stats", headers=admin_headers)
+    rows = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="stats.ndjson"'
+    assert len(rows) == 101
+    assert sorted(row["visits"] for row in rows) == [0, *range(100)]
+    by_slug = {row["slug"]: row for row in rows}
+    assert by_slug[shortlink.slug] == {
+        "slug": shortlink.slug,
+        "short_url": f"http://test/{shortlink.slug}",
+        "long_url": shortlink.long_url,
+        "visits": 0,
+        "unique_visitors": 0,
+        "last_visit": None,
+    }
+    assert all(row["last_visit"].endswith("Z") for row in rows if row["visits"])
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_export_stats_csv(client: AsyncClient, admin_headers: dict[str, str]) -> None:
+    """Tests exporting stats as CSV with a header row"""
+    response = await client.get("/export/stats", params={"format": "csv"}, headers=admin_headers)
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert tuple(rows[0]) == STATS_EXPORT_COLUMNS
+    assert sorted(int(row["visits"]) for row in rows) == list(range(100))
+
+
+async def test_export_shortlinks(
+    client: AsyncClient, shortlink_list: list[Shortlink], admin_headers: dict[str, str]
+) -> None:
+    """Tests exporting every shortlink, ordered by id"""
+    response = await client.get("/export/shortlinks", headers=admin_headers)
+    rows = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert [row["slug"] for row in rows] == [s.slug for s in sorted(shortlink_list, key=lambda s: s.id)]
+    assert rows[0]["created_at"].endswith("Z")
+
+
+async def test_export_invalid_format(client: AsyncClient, admin_headers: dict[str, str]) -> None:
+    """Tests that an unknown export format is rejected"""
+    response = await client.get("/export/shortlinks", params={"format": "xml"}, headers=admin_headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.usefixtures("admin_api_key")
+@pytest.mark.parametrize("path", ["/export/shortlinks", "/export/stats"])
+async def test_export_requires_admin_key(client: AsyncClient, path: str) -> None:
+    """Tests that exports, which include every long URL, are only streamed with the admin API key"""
+    response = await client.get(path)
+    assert response.status_code == 401
+
+    response = await client.get(path, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("path", ["/export/shortlinks", "/export/stats"])
+async def test_export_disabled_without_key(client: AsyncClient, path: str) -> None:
+    """Tests that exports don't exist until an admin API key is configured"""
+    response = await client.get(path)
+    assert response.status_code == 404
+
+
+@pytest.mark.skipif(not Path("/proc/self/statm").exists(), reason="Resident memory is read from /proc")
+async def test_export_memory_stays_flat(session: AsyncSession) -> None:
+    """Tests that exporting a million shortlinks with stats streams them without holding them in memory"""
+    # Ids are generated in order and only one in sixteen shortlinks has stats, which keeps seeding quick
+    connection = await session.connection()
+    await connection.execute(
+        text("""
+            INSERT INTO shortlink (id, long_url, created_at)
+            SELECT CAST(lpad(to_hex(i), 32, '0') AS uuid), 'https://www.example.com/very/long/url/' || i, now()
+            FROM generate_series(1, :count) AS i
+        """),
+        {"count": EXPORT_ROWS},
+    )
+    await connection.execute(
+        text("""
+            INSERT INTO shortlinkstat (shortlink_id, visits, last_visit)
+            SELECT id, 1, now() FROM shortlink WHERE right(CAST(id AS text), 1) = '0'
+        """)
+    )
+    await session.commit()
+
+    baseline = peak = resident_memory()
+    lines = 0
+    async for chunk in export_stats(ExportFormat.NDJSON):
+        lines += chunk.count(b"\n")
+        peak = max(peak, resident_memory())
+
+    assert lines == EXPORT_ROWS
+    assert peak - baseline < EXPORT_RSS_CEILING
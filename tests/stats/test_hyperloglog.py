@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from stats.hyperloglog import HyperLogLog
+
+
+def random_hashes(count: int, seed: int) -> list[int]:
+    """Returns reproducible random 64-bit hashes"""
+    generator = random.Random(seed)
+    return [generator.getrandbits(64) for _ in range(count)]
+
+
+@pytest.mark.parametrize("count", [0, 1, 10, 100])
+def test_small_counts_are_nearly_exact(count: int) -> None:
+    """Tests that small numbers of distinct values are counted to within one by linear counting"""
+    sketch = HyperLogLog()
+    for value_hash in random_hashes(count, seed=count):
+        sketch.add(value_hash)
+        assert not sketch.add(value_hash)
+
+    assert abs(sketch.count() - count) <= 1
+
+
+@pytest.mark.parametrize("count", [10_000, 200_000])
+def test_large_counts_are_close(count: int) -> None:
+    """Tests that large numbers of distinct values are estimated within a few standard errors"""
+    sketch = HyperLogLog()
+    for value_hash in random_hashes(count, seed=count):
+        sketch.add(value_hash)
+
+    assert abs(sketch.count() - count) < count * 0.05
+
+
+def test_merge_counts_union() -> None:
+    """Tests that merging sketches counts values seen by either sketch once"""
+    hashes = random_hashes(20_000, seed=1)
+    first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for value_hash in hashes[:15_000]:
+        first.add(value_hash)
+    for value_hash in hashes[5_000:]:
+        second.add(value_hash)
+    for value_hash in hashes:
+        union.add(value_hash)
+
+    first.merge(second)
+
+    assert first.registers == union.registers
+
+
+def test_serialization_round_trip() -> None:
+    """Tests that a sketch can be loaded from its serialized registers"""
+    sketch = HyperLogLog(precision=10)
+    for value_hash in random_hashes(500, seed=2):
+        sketch.add(value_hash)
+
+    loaded = HyperLogLog.from_bytes(sketch.to_bytes())
+
+    assert len(sketch.to_bytes()) == 1024
+    assert loaded.precision == 10
+    assert loaded.count() == sketch.count()
+
+
+def test_sparse_sketches_are_exact_and_small() -> None:
+    """Tests that a sketch keeps its hashes, counting them exactly, until it has more than its sparse limit, and then
+    switches to registers"""
+    sketch = HyperLogLog()
+    hashes = random_hashes(sketch.max_sparse_hashes + 1, seed=3)
+    for value_hash in hashes[:-1]:
+        sketch.add(value_hash)
+
+    assert sketch.count() == sketch.max_sparse_hashes == 128
+    assert len(sketch.to_bytes()) == 1 + 8 * 128
+    loaded = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert (loaded.precision, loaded.hashes) == (12, set(hashes[:-1]))
+
+    assert sketch.add(hashes[-1])
+
+    assert sketch.hashes is None
+    assert len(sketch.to_bytes()) == 4096
+    assert abs(sketch.count() - len(hashes)) <= 2
+
+
+def test_merge_sparse_and_dense_sketches() -> None:
+    """Tests that sparse sketches merge with each other and with sketches that have switched to registers"""
+    hashes = random_hashes(1_000, seed=4)
+    sparse, other_sparse, dense, union = HyperLogLog(), HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for value_hash in hashes[:10]:
+        sparse.add(value_hash)
+    for value_hash in hashes[5:15]:
+        other_sparse.add(value_hash)
+    for value_hash in hashes[10:]:
+        dense.add(value_hash)
+    for value_hash in hashes:
+        union.add(value_hash)
+
+    sparse.merge(other_sparse)
+    assert sparse.count() == 15
+    merged_into_sparse = HyperLogLog.from_bytes(sparse.to_bytes())
+    merged_into_sparse.merge(dense)
+    dense.merge(sparse)
+
+    assert merged_into_sparse.registers == dense.registers == union.registers
+
+
+def test_merge_requires_same_precision() -> None:
+    """Tests that sketches with different precisions can't be merged"""
+    with pytest.raises(ValueError, match="same precision"):
+        HyperLogLog(precision=10).merge(HyperLogLog(precision=12))
@@ -0,0 +1,378 @@
+import asyncio
+import csv
+import io
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+from uuid import UUID, uuid4
+
+import pytest
+from httpx import AsyncClient
+from sqlmodel import col, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core import db
+from shortlinks.models import Shortlink
+from shortlinks.slugs import (
+    ID_BLOCK_SIZE,
+    CompactSlugCodec,
+    compact_id,
+    compact_number,
+    encode_number,
+    get_slug_codec,
+)
+from stats import imports
+from stats.imports import (
+    ImportRowParser,
+    create_import,
+    ends_in_quoted_field,
+    get_import,
+    load_import,
+    merge_import,
+    run_import,
+)
+from stats.models import ImportRejection, ImportStatus, ShortlinkStat
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunked(data: bytes, size: int = 7) -> AsyncIterator[bytes]:
+    """Streams bytes in small chunks, so lines are split across them"""
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def interrupted(data: bytes, lines: int) -> AsyncIterator[bytes]:
+    """Streams the first lines of the input and then fails, like a connection dropping part way through"""
+    for line in data.splitlines(keepends=True)[:lines]:
+        yield line
+    raise ConnectionError("input interrupted")
+
+
+async def rejections(job_id: UUID, session: AsyncSession) -> dict[int, str]:
+    """Gets the reasons an import's rejected rows were rejected, keyed by line"""
+    rows = await session.exec(select(ImportRejection).where(col(ImportRejection.job_id) == job_id))
+    return {rejection.line: rejection.reason for rejection in rows}
+
+
+async def test_import_merges_valid_rows_and_rejects_the_rest(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests importing shortlinks with their stats, and that each invalid row is kept with why it was rejected"""
+    imported, duplicated = uuid4(), uuid4()
+    data = (
+        "id,long_url,created_at,visits,last_visit\n"
+        f"{imported},https://example.com/a,2020-01-02T03:04:05Z,12,2024-05-06T07:08:09+02:00\n"
+        f"{uuid4()},https://example.com/b,,,\n"
+        f"{uuid4()},ftp://example.com/c,,,\n"
+        "not-a-uuid,https://example.com/d,,,\n"
+        f"{duplicated},https://example.com/e,,,\n"
+        f"{duplicated},https://example.com/f,,,\n"
+        f"{shortlink.id},https://example.com/g,,,\n"
+        f"{uuid4()},https://example.com/h,yesterday,,\n"
+        f"{uuid4()},https://example.com/i,,-1,\n"
+        f"{uuid4()},https://example.com/j\n"
+        "\n"
+        f"{uuid4()},https://example.com/k,2020-01-02 03:04:05,0,\n"
+    ).encode()
+    job = await create_import("links.csv", session)
+
+    job = await run_import(job, chunked(data), session)
+
+    assert job.status == ImportStatus.DONE
+    assert (job.loaded_lines, job.merged_rows, job.imported_rows, job.rejected_rows) == (12, 11, 4, 7)
+    assert await rejections(job.id, session) == {
+        4: "invalid long_url",
+        5: "invalid id",
+        7: "duplicate of an earlier row",
+        8: "shortlink already exists",
+        9: "invalid created_at",
+        10: "invalid visits",
+        11: "expected 5 fields, got 2",
+    }
+    created = await session.get(Shortlink, imported, populate_existing=True)
+    assert created and created.long_url == "https://example.com/a"
+    assert created.created_at == datetime(2020, 1, 2, 3, 4, 5, tzinfo=UTC)
+    stat = await session.get(ShortlinkStat, imported)
+    assert stat and stat.visits == 12
+    assert stat.last_visit == datetime(2024, 5, 6, 5, 8, 9, tzinfo=UTC)
+    # Only shortlinks with visits get stats
+    assert len((await session.exec(select(ShortlinkStat))).all()) == 1
+    existing = await session.get(Shortlink, shortlink.id, populate_existing=True)
+    assert existing and existing.long_url == shortlink.long_url
+
+
+async def test_import_by_slug(session: AsyncSession) -> None:
+    """Tests importing shortlinks by slug, moving the sequence past compact slugs it hasn't reached, and rejecting
+    slugs that may have been generated for new shortlinks or that no shortlink could have"""
+    legacy_id = uuid4()
+    (generated_id,) = await CompactSlugCodec().new_ids(1, session)
+    ahead_id = compact_id((compact_number(generated_id) or 0) + 5 * ID_BLOCK_SIZE)
+    data = (
+        "slug,long_url\n"
+        f"{get_slug_codec().encode(legacy_id)},https://example.com/legacy\n"
+        f"{encode_number(compact_number(generated_id) or 0)},https://example.com/generated\n"
+        "no spaces allowed,https://example.com/invalid\n"
+        f"{encode_number(123)},https://example.com/too-short\n"
+        f"{encode_number(compact_number(ahead_id) or 0)},https://example.com/ahead\n"
+    ).encode()
+    job = await create_import("legacy.csv", session)
+
+    job = await run_import(job, chunked(data), session)
+
+    assert job.imported_rows == 2
+    assert await session.get(Shortlink, legacy_id)
+    assert await session.get(Shortlink, ahead_id)
+    assert await rejections(job.id, session) == {
+        3: "slug may have been generated for a new shortlink",
+        4: "invalid slug",
+        5: "invalid slug",
+    }
+    (next_id,) = await CompactSlugCodec().new_ids(1, session)
+    assert (compact_number(next_id) or 0) > (compact_number(ahead_id) or 0)
+
+
+async def test_import_rows_spanning_lines(session: AsyncSession) -> None:
+    """Tests that quoted fields can span lines, with rows numbered by the line they start on, and that a quote
+    that's never closed rejects the rest of the input"""
+    multiline_id, after_id, unclosed_id = uuid4(), uuid4(), uuid4()
+    data = (
+        "id,long_url,created_at\n"
+        f'{multiline_id},"https://example.com/\nsplit",""\n'
+        f'{after_id},"https://example.com/""after""",\n'
+        f"{uuid4()},https://example.com/plain,\n"
+        f'{unclosed_id},"https://example.com/unclosed\n'
+        f"{uuid4()},https://example.com/swallowed,\n"
+    ).encode()
+    job = await create_import("links.csv", session)
+
+    job = await run_import(job, chunked(data), session)
+
+    assert (job.loaded_lines, job.imported_rows) == (6, 3)
+    assert await rejections(job.id, session) == {6: "invalid CSV"}
+    multiline = await session.get(Shortlink, multiline_id)
+    assert multiline and multiline.long_url == "https://example.com/split"
+    escaped = await session.get(Shortlink, after_id)
+    assert escaped and escaped.long_url == "https://example.com/%22after%22"
+    assert not await session.get(Shortlink, unclosed_id)
+
+
+async def test_import_validates_urls_like_shortening(session: AsyncSession) -> None:
+    """Tests that long URLs are validated and normalised the same way as when a URL is shortened"""
+    normalised_id = uuid4()
+    data = (
+        "id,long_url\n"
+        f"{normalised_id},https://EXAMPLE.com\n"
+        f"{uuid4()},https://exa mple.com/\n"
+        f"{uuid4()},example.com/no-scheme\n"
+    ).encode()
+    job = await create_import("links.csv", session)
+
+    job = await run_import(job, chunked(data), session)
+
+    assert job.imported_rows == 1
+    assert await rejections(job.id, session) == {3: "invalid long_url", 4: "invalid long_url"}
+    normalised = await session.get(Shortlink, normalised_id)
+    assert normalised and normalised.long_url == "https://example.com/"
+
+
+async def test_import_rejects_shortlinks_created_while_merging(session: AsyncSession) -> None:
+    """Tests that a row whose shortlink is created by another transaction while its batch is merged is rejected,
+    without its stats being attached to the other shortlink"""
+    raced_id, imported_id = uuid4(), uuid4()
+    data = (
+        "id,long_url,created_at,visits\n"
+        f"{raced_id},https://example.com/raced,,5\n"
+        f"{imported_id},https://example.com/imported,,3\n"
+    ).encode()
+    job = await create_import("links.csv", session)
+    job = await load_import(job, chunked(data), session)
+
+    async with db.async_session() as other:
+        other.add(Shortlink(id=raced_id, long_url="https://example.com/other"))
+        await other.flush()
+        merging = asyncio.create_task(merge_import(job, session))
+        # The merge can't see the uncommitted shortlink, so it waits on it to insert its own
+        async with db.async_session() as observer:
+            while not await observer.scalar(
+                text("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+            ):
+                await asyncio.sleep(0.01)
+        await other.commit()
+    job = await merging
+
+    assert (job.merged_rows, job.imported_rows, job.rejected_rows) == (2, 1, 1)
+    assert await rejections(job.id, session) == {2: "shortlink already exists"}
+    raced = await session.get(Shortlink, raced_id, populate_existing=True)
+    assert raced and raced.long_url == "https://example.com/other"
+    assert not await session.get(ShortlinkStat, raced_id)
+    stat = await session.get(ShortlinkStat, imported_id)
+    assert stat and stat.visits == 3
+
+
+def test_ends_in_quoted_field() -> None:
+    """Tests telling whether CSV text stops inside a quoted field"""
+    assert not ends_in_quoted_field('a,"b",c')
+    assert ends_in_quoted_field('a,"b\nc')
+    assert not ends_in_quoted_field('a,"b""c"')
+    assert ends_in_quoted_field('a,"b""')
+    assert not ends_in_quoted_field('a,b"c')
+    assert ends_in_quoted_field('"')
+
+
+async def test_import_resumes_after_interruption(session: AsyncSession) -> None:
+    """Tests that an import interrupted while loading skips the lines it already loaded when it's resumed"""
+    ids = [uuid4() for _ in range(10)]
+    data = ("id,long_url\n" + "".join(f"{i},https://example.com/{i}\n" for i in ids)).encode()
+    job = await create_import("links.csv", session)
+
+    with pytest.raises(ConnectionError):
+        await load_import(job, interrupted(data, 8), session, batch_size=3)
+    job = await get_import(job.id, session)
+    assert job and (job.status, job.loaded_lines) == (ImportStatus.LOADING, 6)
+
+    job = await load_import(job, chunked(data), session, batch_size=3)
+    assert (job.status, job.loaded_lines) == (ImportStatus.MERGING, 10)
+    job = await merge_import(job, session, batch_size=4)
+
+    assert (job.status, job.merged_rows, job.imported_rows, job.rejected_rows) == (ImportStatus.DONE, 10, 10, 0)
+    shortlinks = await session.exec(select(Shortlink.id))
+    assert sorted(shortlinks) == sorted(ids)
+
+
+async def test_import_reloads_rows_lost_in_a_crash(session: AsyncSession, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that an import whose staged rows were emptied by a database crash part way through merging goes back
+    to loading, and loads again from the first row that wasn't merged"""
+    ids = [uuid4() for _ in range(6)]
+    data = (
+        "id,long_url\n"
+        + "".join(f"{i},https://example.com/{i}\n" for i in ids[:3])
+        + f'{ids[3]},"https://example.com/{ids[3]}\n"\n'
+        + "".join(f"{i},https://example.com/{i}\n" for i in ids[4:])
+    ).encode()
+    job = await create_import("links.csv", session)
+    job = await load_import(job, chunked(data), session)
+    merged_batches = 0
+
+    async def crash_after_first_batch(session: AsyncSession) -> None:
+        nonlocal merged_batches
+        merged_batches += 1
+        if merged_batches > 1:
+            raise ConnectionError("database crashed")
+
+    monkeypatch.setattr(imports, "use_job_statement_timeout", crash_after_first_batch)
+    with pytest.raises(ConnectionError):
+        await merge_import(job, session, batch_size=4)
+    monkeypatch.undo()
+    await session.rollback()
+    # A crash empties unlogged tables, as if they had been truncated
+    connection = await session.connection()
+    await connection.execute(text("TRUNCATE importstagingrow"))
+    await session.commit()
+
+    job = await get_import(job.id, session)
+    assert job and (job.status, job.loaded_lines, job.staged_rows, job.merged_rows) == (ImportStatus.LOADING, 5, 4, 4)
+    job = await run_import(job, chunked(data), session)
+
+    assert (job.status, job.staged_rows, job.merged_rows, job.imported_rows) == (ImportStatus.DONE, 6, 6, 6)
+    shortlinks = await session.exec(select(Shortlink.id))
+    assert sorted(shortlinks) == sorted(ids)
+
+
+async def test_import_resume_needs_input_until_loaded(session: AsyncSession) -> None:
+    """Tests that an import that hasn't finished loading can't be resumed without its input"""
+    job = await create_import("links.csv", session)
+
+    with pytest.raises(ValueError, match="input is needed"):
+        await run_import(job, None, session)
+
+
+@pytest.mark.parametrize(
+    "header",
+    ["", "long_url", "id,slug,long_url", "id,long_url,colour"],
+)
+async def test_import_rejects_invalid_header(session: AsyncSession, header: str) -> None:
+    """Tests that an input without a header naming known columns isn't loaded"""
+    job = await create_import("links.csv", session)
+
+    with pytest.raises(ValueError):
+        await load_import(job, chunked(f"{header}\n{uuid4()},https://example.com\n".encode()), session)
+
+
+async def test_import_row_parser() -> None:
+    """Tests parsing rows, with the values that can't be parsed rejected"""
+    job_id, shortlink_id = uuid4(), uuid4()
+    parser = ImportRowParser(job_id, [" id", "long_url ", "visits"])
+
+    assert parser.parse(2, [str(shortlink_id), "https://example.com", " 3 "]) == (
+        job_id,
+        2,
+        str(shortlink_id),
+        shortlink_id,
+        "https://example.com",
+        None,
+        3,
+        None,
+        None,
+    )
+    assert parser.parse(3, [str(shortlink_id), "https://example.com", "\uff13"])[-1] == "invalid visits"
+    assert parser.parse(4, [str(shortlink_id), "https://example.com", str(2**31)])[-1] == "invalid visits"
+    assert parser.parse(5, ["", "https://example.com", ""])[-1] == "invalid id"
+
+
+async def test_admin_imports_disabled_without_key(client: AsyncClient) -> None:
+    """Tests that the admin endpoints don't exist until an admin API key is configured"""
+    response = await client.post("/admin/imports", content=b"id,long_url\n")
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", "Basic {key}"])
+async def test_admin_imports_require_key(client: AsyncClient, admin_api_key: str, authorization: str | None) -> None:
+    """Tests that the admin endpoints reject requests without the admin API key"""
+    headers = {"Authorization": authorization.format(key=admin_api_key)} if authorization else {}
+    response = await client.get(f"/admin/imports/{uuid4()}", headers=headers)
+
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
+
+
+async def test_admin_import(client: AsyncClient, session: AsyncSession, admin_api_key: str) -> None:
+    """Tests importing over the admin endpoints, merging in the background and downloading the rejections"""
+    headers = {"Authorization": f"Bearer {admin_api_key}"}
+    data = f"id,long_url\n{uuid4()},https://example.com/a\n{uuid4()},not a url\n".encode()
+
+    response = await client.post(
+        "/admin/imports", params={"source": "legacy.csv"}, content=chunked(data), headers=headers
+    )
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.json()["status"] == "merging"
+
+    response = await client.get(f"/admin/imports/{job_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json() | {"source": "legacy.csv", "status": "done", "imported_rows": 1} == response.json()
+
+    response = await client.get(f"/admin/imports/{job_id}/rejections", headers=headers)
+    assert response.status_code == 200
+    assert list(csv.reader(io.StringIO(response.text))) == [
+        ["line", "identifier", "long_url", "reason"],
+        ["3", data.decode().splitlines()[2].split(",")[0], "not a url", "invalid long_url"],
+    ]
+
+    response = await client.post(f"/admin/imports/{job_id}", headers=headers)
+    assert response.status_code == 202
+    assert response.json()["status"] == "done"
+
+
+async def test_admin_import_errors(client: AsyncClient, session: AsyncSession, admin_api_key: str) -> None:
+    """Tests that an invalid import body is a validation error, and unknown imports aren't found"""
+    headers = {"Authorization": f"Bearer {admin_api_key}"}
+
+    response = await client.post("/admin/imports", content=b"name,url\n", headers=headers)
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body"]
+
+    job = await create_import("links.csv", session)
+    response = await client.post(f"/admin/imports/{job.id}", headers=headers)
+    assert response.status_code == 422
+
+    for path in (f"/admin/imports/{uuid4()}", f"/admin/imports/{uuid4()}/rejections"):
+        response = await client.get(path, headers=headers)
+        assert response.status_code == 404
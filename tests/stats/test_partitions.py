@@ -0,0 +1,74 @@
+from datetime import date
+
+import pytest
+from sqlmodel import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.db import get_session_context, try_job_lock
+from stats.partitions import (
+    PARTITION_JOB,
+    create_partitions,
+    drop_partitions,
+    is_partition_name,
+    list_partitions,
+    partition_name,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_create_partitions(session: AsyncSession) -> None:
+    """Tests that a partition is created for each day, skipping days that already have one"""
+    assert await create_partitions(date(2026, 1, 1), 2, session) == ["visitevent_p20260101", "visitevent_p20260102"]
+    assert await create_partitions(date(2026, 1, 2), 2, session) == ["visitevent_p20260103"]
+
+    partitions = await list_partitions(session)
+
+    assert list(partitions) == [date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 3)]
+
+
+async def test_drop_partitions(session: AsyncSession) -> None:
+    """Tests that only partitions holding days before the cutoff are dropped"""
+    await create_partitions(date(2026, 1, 1), 3, session)
+
+    dropped = await drop_partitions(date(2026, 1, 3), session)
+    partitions = await list_partitions(session)
+
+    assert dropped == ["visitevent_p20260101", "visitevent_p20260102"]
+    assert partitions == {date(2026, 1, 3): "visitevent_p20260103"}
+
+
+async def test_drop_detached_partitions(session: AsyncSession) -> None:
+    """Tests that partitions left detached by a drop that was interrupted are dropped too"""
+    await create_partitions(date(2026, 1, 1), 2, session)
+    await super(AsyncSession, session).execute(text("ALTER TABLE visitevent DETACH PARTITION visitevent_p20260101"))
+    await session.commit()
+
+    dropped = await drop_partitions(date(2026, 1, 3), session)
+    tables = await super(AsyncSession, session).execute(
+        text("SELECT count(*) FROM pg_class WHERE relkind = 'r' AND relname LIKE 'visitevent\\_p%'")
+    )
+
+    assert dropped == ["visitevent_p20260101", "visitevent_p20260102"]
+    assert tables.scalar_one() == 0
+
+
+async def test_partitions_left_to_worker_holding_lock(session: AsyncSession) -> None:
+    """Tests that partitions aren't created or dropped while another worker is maintaining them"""
+    await create_partitions(date(2026, 1, 1), 1, session)
+
+    async with get_session_context() as other_session:
+        assert await try_job_lock(PARTITION_JOB, other_session)
+
+        assert await create_partitions(date(2026, 1, 2), 1, session) == []
+        assert await drop_partitions(date(2026, 1, 2), session) == []
+
+    assert list(await list_partitions(session)) == [date(2026, 1, 1)]
+    assert await drop_partitions(date(2026, 1, 2), session) == ["visitevent_p20260101"]
+
+
+def test_partition_names() -> None:
+    """Tests that partition names are recognised so migrations can ignore them"""
+    assert is_partition_name(partition_name(date(2026, 1, 1)))
+    assert not is_partition_name("visitevent")
+    assert not is_partition_name("shortlinkstat")
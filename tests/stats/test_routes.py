@@ -4,8 +4,10 @@ from uuid import uuid4
 import pytest
 import shortuuid
 from httpx import AsyncClient
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from shortlinks.models import Shortlink
+from stats.service import StatsService, VisitCount
 
 pytestmark = pytest.mark.anyio
 
@@ -36,6 +38,39 @@ async def test_top_stats_by_last_visit(client: AsyncClient) -> None:
     ]
 
 
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_top_stats_by_unique_visitors(client: AsyncClient) -> None:
+    """Tests sorting the top stats by unique visitors"""
+    params = {"metric": "unique_visitors", "limit": 3}
+    response = await client.get("/stats", params=params)
+    data = response.json()
+
+    assert response.status_code == 200
+    expected = sorted((min(i, (i * 37) % 100) for i in range(100)), reverse=True)[:3]
+    assert [d["unique_visitors"] for d in data] == expected
+
+
+async def test_top_stats_trending(client: AsyncClient, session: AsyncSession, shortlink_list: list[Shortlink]) -> None:
+    """Tests sorting the top stats by visits within a recent window"""
+    now = datetime.now(UTC)
+    for i, shortlink in enumerate(shortlink_list[:3]):
+        await StatsService.record_visits({shortlink.id: VisitCount(i + 1, now)}, session)
+    params = {"metric": "trending", "window": 60}
+    response = await client.get("/stats", params=params)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [d["slug"] for d in data] == [s.slug for s in reversed(shortlink_list[:3])]
+
+
+@pytest.mark.parametrize("window", [0, 61])
+async def test_top_stats_invalid_trending_window(client: AsyncClient, window: int) -> None:
+    """Tests that trending windows longer than the summaries are kept for are rejected"""
+    response = await client.get("/stats", params={"metric": "trending", "window": window})
+
+    assert response.status_code == 422
+
+
 @pytest.mark.usefixtures("shortlink_list_with_stats")
 async def test_top_stats_with_limit(client: AsyncClient) -> None:
     """Tests getting more than the default limit for top stats"""
@@ -96,6 +131,7 @@ async def test_get_stats_for_slug(client: AsyncClient, shortlink_with_stats: Sho
         "short_url": f"http://test/{shortlink_with_stats.slug}",
         "long_url": "https://www.example.com/very/long/url",
         "visits": 10,
+        "unique_visitors": 4,
         "last_visit": "2025-01-01T12:00:00Z",
     }
 
@@ -111,6 +147,7 @@ async def test_get_stats_for_slug_without_stats(client: AsyncClient, shortlink:
         "short_url": shortlink.short_url,
         "long_url": shortlink.long_url,
         "visits": 0,
+        "unique_visitors": 0,
         "last_visit": None,
     }
 
@@ -132,3 +169,168 @@ async def test_get_stats_for_invalid_slug(client: AsyncClient) -> None:
 
     assert response.status_code == 404
     assert data == {"detail": "Not Found"}
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_top_stats_age_header(client: AsyncClient) -> None:
+    """Tests that the top stats report how stale they are"""
+    response = await client.get("/stats")
+
+    assert response.status_code == 200
+    assert float(response.headers["x-stats-age"]) >= 0
+
+
+async def test_get_timeseries_for_slug(client: AsyncClient, session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests getting the hourly visits to a shortlink, including hours without visits"""
+    await StatsService.record_visit(shortlink.id, datetime(2026, 1, 1, 12, 30, tzinfo=UTC), session)
+    params = {"from": "2026-01-01T11:00:00", "to": "2026-01-01T14:00:00Z"}
+    response = await client.get(f"/stats/{shortlink.slug}/timeseries", params=params)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data == {
+        "slug": shortlink.slug,
+        "granularity": "hour",
+        "buckets": [
+            {"bucket_start": "2026-01-01T11:00:00Z", "visits": 0},
+            {"bucket_start": "2026-01-01T12:00:00Z", "visits": 1},
+            {"bucket_start": "2026-01-01T13:00:00Z", "visits": 0},
+        ],
+    }
+
+
+async def test_get_timeseries_for_slug_defaults(client: AsyncClient, shortlink: Shortlink) -> None:
+    """Tests the timeseries covers the last 7 days by default"""
+    params = {"granularity": "day"}
+    response = await client.get(f"/stats/{shortlink.slug}/timeseries", params=params)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["granularity"] == "day"
+    assert len(data["buckets"]) == 8
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"from": "2026-01-02T00:00:00Z", "to": "2026-01-01T00:00:00Z"},
+        {"from": "2020-01-01T00:00:00Z", "to": "2026-01-01T00:00:00Z"},
+        {"granularity": "minute"},
+    ],
+)
+async def test_get_timeseries_for_slug_invalid_range(
+    client: AsyncClient, shortlink: Shortlink, params: dict[str, str]
+) -> None:
+    """Tests that backwards, oversized, or unknown ranges are rejected"""
+    response = await client.get(f"/stats/{shortlink.slug}/timeseries", params=params)
+
+    assert response.status_code == 422
+
+
+async def test_get_timeseries_for_slug_does_not_exist(client: AsyncClient) -> None:
+    """Tests getting the timeseries for a slug that does not exist returns an error"""
+    slug = shortuuid.encode(uuid4())
+    response = await client.get(f"/stats/{slug}/timeseries")
+    data = response.json()
+
+    assert response.status_code == 404
+    assert data == {"detail": "Not Found"}
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_top_stats_cache_headers(client: AsyncClient) -> None:
+    """Tests that the top stats can be cached and revalidated by clients and CDNs"""
+    response = await client.get("/stats")
+
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, max-age=5, stale-while-revalidate=30"
+    assert response.headers["age"] == "0"
+    assert response.headers["etag"].startswith('"')
+
+    not_modified = await client.get("/stats", headers={"If-None-Match": response.headers["etag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == response.headers["etag"]
+
+    other_limit = await client.get("/stats", params={"limit": 5}, headers={"If-None-Match": response.headers["etag"]})
+    assert other_limit.status_code == 200
+    assert other_limit.headers["etag"] != response.headers["etag"]
+
+
+async def test_get_stats_for_slug_cache_headers(client: AsyncClient, shortlink_with_stats: Shortlink) -> None:
+    """Tests that a shortlink's stats can be cached and revalidated by clients and CDNs"""
+    response = await client.get(f"/stats/{shortlink_with_stats.slug}")
+
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, max-age=5, stale-while-revalidate=30"
+    not_modified = await client.get(
+        f"/stats/{shortlink_with_stats.slug}", headers={"If-None-Match": f"W/{response.headers['etag']}"}
+    )
+    assert not_modified.status_code == 304
+    changed = await client.get(f"/stats/{shortlink_with_stats.slug}", headers={"If-None-Match": '"outdated"'})
+    assert changed.status_code == 200
+    assert changed.json() == response.json()
+
+
+async def test_get_stats_for_slug_is_cached(
+    client: AsyncClient, session: AsyncSession, shortlink_with_stats: Shortlink
+) -> None:
+    """Tests that a shortlink's stats are served from the cache until they are stale"""
+    response = await client.get(f"/stats/{shortlink_with_stats.slug}")
+    await StatsService.record_visit(shortlink_with_stats.id, datetime.now(UTC), session)
+    cached = await client.get(f"/stats/{shortlink_with_stats.slug}")
+
+    assert cached.json()["visits"] == response.json()["visits"] == 10
+    assert cached.headers["etag"] == response.headers["etag"]
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_list_stats(client: AsyncClient, admin_headers: dict[str, str]) -> None:
+    """Tests paging through every shortlink's stats by following the cursors"""
+    slugs: list[str] = []
+    params: dict[str, str | int] = {"sort": "unique_visitors", "limit": 30}
+    while True:
+        response = await client.get("/stats/list", params=params, headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        slugs += [item["slug"] for item in data["items"]]
+        if data["next_cursor"] is None:
+            break
+        params["cursor"] = data["next_cursor"]
+
+    assert len(slugs) == len(set(slugs)) == 100
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_list_stats_with_filters(client: AsyncClient, admin_headers: dict[str, str]) -> None:
+    """Tests filtering the listed stats, with timestamps without a timezone treated as UTC"""
+    params = {"min_visits": 90, "last_visit_after": "2024-12-28T12:00:00", "sort": "last_visit"}
+    response = await client.get("/stats/list", params=params, headers=admin_headers)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [item["visits"] for item in data["items"]] == list(range(90, 96))
+    assert data["next_cursor"] is None
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+@pytest.mark.parametrize("cursor", ["not a cursor", "sort"])
+async def test_list_stats_invalid_cursor(client: AsyncClient, admin_headers: dict[str, str], cursor: str) -> None:
+    """Tests that a cursor that isn't valid, or is for a different sort, is rejected"""
+    if cursor == "sort":
+        first_page = await client.get("/stats/list", params={"limit": 1}, headers=admin_headers)
+        cursor = first_page.json()["next_cursor"]
+    response = await client.get("/stats/list", params={"cursor": cursor, "sort": "last_visit"}, headers=admin_headers)
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["query", "cursor"]
+
+
+@pytest.mark.usefixtures("admin_api_key")
+async def test_list_stats_requires_admin_key(client: AsyncClient) -> None:
+    """Tests that every shortlink's stats, which include their long URLs, are only listed with the admin API key"""
+    response = await client.get("/stats/list")
+    assert response.status_code == 401
+
+    response = await client.get("/stats/list", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
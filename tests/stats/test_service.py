@@ -1,11 +1,24 @@
-from datetime import UTC, datetime
+from datetime import UTC, datetime, timedelta
+from uuid import uuid4
 
 import pytest
+from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from core.db import get_session_context, try_job_lock
 from shortlinks.models import Shortlink
-from stats.models import ShortlinkStat
-from stats.service import StatsService
+from stats.models import BucketGranularity, ShortlinkStat, ShortlinkVisitBucket, TrendingMinute
+from stats.service import (
+    ShortlinkWithStats,
+    StatMetric,
+    StatsCursor,
+    StatsFilters,
+    StatsService,
+    StatsSort,
+    VisitBucket,
+    VisitCount,
+    minute_start,
+)
 
 pytestmark = pytest.mark.anyio
 
@@ -30,3 +43,321 @@ async def test_record_subsequent_visit(session: AsyncSession, shortlink_with_sta
     assert stats
     assert stats.visits == 11
     assert stats.last_visit != last_visit
+
+
+async def test_record_visits(session: AsyncSession, shortlink_list_with_stats: list[Shortlink]) -> None:
+    """Tests recording visits to multiple shortlinks at once"""
+    last_visit = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+    first, second = shortlink_list_with_stats[:2]
+    await StatsService.record_visits(
+        {first.id: VisitCount(5, last_visit), second.id: VisitCount(2, last_visit)},
+        session,
+    )
+
+    for shortlink, expected_visits in ((first, 5), (second, 3)):
+        stats = await session.get(ShortlinkStat, shortlink.id)
+        assert stats
+        await session.refresh(stats)
+        assert stats.visits == expected_visits
+        assert stats.last_visit == last_visit
+
+
+async def test_record_visit_in_new_session(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests recording a visit without using the caller's session"""
+    last_visit = datetime(2025, 1, 1, 12, 0, tzinfo=UTC)
+    await StatsService.record_visit_in_new_session(shortlink.id, last_visit)
+
+    stats = await session.get(ShortlinkStat, shortlink.id)
+    assert stats
+    assert stats.visits == 1
+    assert stats.last_visit == last_visit
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+async def test_get_top_stats(session: AsyncSession) -> None:
+    """Tests getting the top shortlinks with their stats in a single query"""
+    stats = await StatsService.get_top_stats(StatMetric.VISITS, 3, session)
+    assert [s.visits for s in stats] == [99, 98, 97]
+    assert all(s.short_url == f"http://test/{s.slug}" for s in stats)
+
+
+@pytest.mark.usefixtures("shortlink_list_with_stats")
+@pytest.mark.parametrize("sort", list(StatsSort))
+async def test_get_stats_page(session: AsyncSession, sort: StatsSort) -> None:
+    """Tests that paging through the stats returns every shortlink once, in the same order as sorting them all"""
+    everything, cursor = await StatsService.get_stats_page(sort, 1000, session)
+    assert cursor is None
+    assert len(everything) == 100
+
+    pages: list[ShortlinkWithStats] = []
+    while True:
+        page, cursor = await StatsService.get_stats_page(sort, 7, session, cursor)
+        pages += page
+        if cursor is None:
+            break
+        assert len(page) == 7
+
+    assert [s.slug for s in pages] == [s.slug for s in everything]
+    values = [getattr(s, sort.value) for s in pages]
+    assert values == sorted(values, reverse=True)
+
+
+async def test_get_stats_page_filters(session: AsyncSession, shortlink_list_with_stats: list[Shortlink]) -> None:
+    """Tests that only shortlinks meeting every filter are paged through"""
+    start_dt = datetime(2025, 1, 1, 12, 0, tzinfo=UTC)
+    filters = StatsFilters(
+        min_visits=10,
+        last_visit_after=start_dt - timedelta(hours=50),
+        last_visit_before=start_dt - timedelta(hours=20),
+    )
+    first, cursor = await StatsService.get_stats_page(StatsSort.VISITS, 20, session, filters=filters)
+    second, last_cursor = await StatsService.get_stats_page(StatsSort.VISITS, 20, session, cursor, filters)
+
+    assert [s.visits for s in first + second] == list(range(49, 20, -1))
+    assert last_cursor is None
+
+    created_after = min(s.created_at for s in shortlink_list_with_stats)
+    page, _ = await StatsService.get_stats_page(
+        StatsSort.VISITS, 100, session, filters=StatsFilters(created_after=created_after)
+    )
+    assert len(page) == sum(s.created_at > created_after for s in shortlink_list_with_stats)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        StatsCursor(StatsSort.VISITS, 5, uuid4()),
+        StatsCursor(StatsSort.LAST_VISIT, datetime(2025, 1, 1, tzinfo=UTC), uuid4()),
+    ],
+)
+async def test_stats_cursor_round_trip(cursor: StatsCursor) -> None:
+    """Tests that cursors decode to what they were encoded from"""
+    encoded = cursor.encode()
+    assert "=" not in encoded
+    assert StatsCursor.decode(encoded) == cursor
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "WyJ2aXNpdHMiLCI1Iiwi"])
+async def test_stats_cursor_invalid(cursor: str) -> None:
+    """Tests that decoding something that isn't a cursor raises a ValueError"""
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        StatsCursor.decode(cursor)
+
+
+async def test_get_stats_for_slug(session: AsyncSession, shortlink_with_stats: Shortlink) -> None:
+    """Tests getting a shortlink and its stats by slug"""
+    stats = await StatsService.get_stats_for_slug(shortlink_with_stats.slug, session)
+    assert stats == ShortlinkWithStats(
+        slug=shortlink_with_stats.slug,
+        short_url=shortlink_with_stats.short_url,
+        long_url=shortlink_with_stats.long_url,
+        visits=10,
+        unique_visitors=4,
+        last_visit=datetime(2025, 1, 1, 12, 0, tzinfo=UTC),
+    )
+
+
+async def test_get_stats_for_slug_without_stats(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests getting a shortlink by slug that does not have any stats yet"""
+    stats = await StatsService.get_stats_for_slug(shortlink.slug, session)
+    assert stats
+    assert stats.visits == 0
+    assert stats.last_visit is None
+
+
+async def test_get_stats_for_slug_falls_back_to_primary(
+    session: AsyncSession, replica_session: AsyncSession, shortlink: Shortlink
+) -> None:
+    """Tests that stats for a shortlink the read replica does not have yet are loaded from the primary"""
+    assert not await StatsService.get_stats_for_slug(shortlink.slug, replica_session)
+    stats = await StatsService.get_stats_for_slug(shortlink.slug, replica_session, session)
+    assert stats
+    assert stats.slug == shortlink.slug
+
+
+async def test_record_visits_rolls_up_buckets(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests recording visits adds them to the hourly and daily buckets they fall in"""
+    first_visit = datetime(2026, 1, 1, 12, 15, tzinfo=UTC)
+    visit_count = VisitCount.single(first_visit)
+    visit_count.add(VisitCount.single(first_visit + timedelta(minutes=30)))
+    visit_count.add(VisitCount.single(first_visit + timedelta(hours=1)))
+    await StatsService.record_visits({shortlink.id: visit_count}, session)
+    await StatsService.record_visit(shortlink.id, first_visit, session)
+
+    hourly = await StatsService.get_visit_timeseries(
+        shortlink.id, BucketGranularity.HOUR, first_visit, datetime(2026, 1, 1, 15, tzinfo=UTC), session
+    )
+    daily = await StatsService.get_visit_timeseries(
+        shortlink.id, BucketGranularity.DAY, first_visit, first_visit + timedelta(days=1), session
+    )
+
+    assert hourly == [
+        VisitBucket(bucket_start=datetime(2026, 1, 1, 12, tzinfo=UTC), visits=3),
+        VisitBucket(bucket_start=datetime(2026, 1, 1, 13, tzinfo=UTC), visits=1),
+        VisitBucket(bucket_start=datetime(2026, 1, 1, 14, tzinfo=UTC), visits=0),
+    ]
+    assert daily == [
+        VisitBucket(bucket_start=datetime(2026, 1, 1, tzinfo=UTC), visits=4),
+        VisitBucket(bucket_start=datetime(2026, 1, 2, tzinfo=UTC), visits=0),
+    ]
+
+
+async def test_prune_visit_buckets(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests pruning old hourly buckets leaves newer buckets and the daily totals intact"""
+    old_visit = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+    new_visit = datetime(2026, 1, 2, 12, 0, tzinfo=UTC)
+    visit_count = VisitCount.single(old_visit)
+    visit_count.add(VisitCount.single(new_visit))
+    await StatsService.record_visits({shortlink.id: visit_count}, session)
+
+    pruned = await StatsService.prune_visit_buckets(BucketGranularity.HOUR, new_visit, session)
+    buckets = await session.exec(select(ShortlinkVisitBucket).where(ShortlinkVisitBucket.shortlink_id == shortlink.id))
+
+    assert pruned == 1
+    assert sorted((bucket.granularity, bucket.bucket_start) for bucket in buckets) == [
+        (BucketGranularity.DAY, datetime(2026, 1, 1, tzinfo=UTC)),
+        (BucketGranularity.DAY, datetime(2026, 1, 2, tzinfo=UTC)),
+        (BucketGranularity.HOUR, new_visit),
+    ]
+
+
+async def test_prune_visit_buckets_in_batches(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that pruning deletes every expired bucket however many batches it takes"""
+    first_visit = datetime(2026, 1, 1, tzinfo=UTC)
+    visit_count = VisitCount(0, first_visit)
+    for hour in range(5):
+        visit_count.add(VisitCount.single(first_visit + timedelta(hours=hour)))
+    await StatsService.record_visits({shortlink.id: visit_count}, session)
+
+    pruned = await StatsService.prune_visit_buckets(
+        BucketGranularity.HOUR, datetime(2026, 1, 2, tzinfo=UTC), session, 2
+    )
+
+    assert pruned == 5
+    assert not (
+        await session.exec(select(ShortlinkVisitBucket).where(ShortlinkVisitBucket.granularity == "hour"))
+    ).all()
+
+
+async def test_prune_visit_buckets_one_worker_at_a_time(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that a worker leaves pruning to another one that's already pruning"""
+    visited_at = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+    await StatsService.record_visits({shortlink.id: VisitCount.single(visited_at)}, session)
+    before = visited_at + timedelta(days=1)
+
+    async with get_session_context() as other_worker:
+        assert await try_job_lock("prune visit buckets", other_worker)
+        assert await StatsService.prune_visit_buckets(BucketGranularity.HOUR, before, session) == 0
+    assert await StatsService.prune_visit_buckets(BucketGranularity.HOUR, before, session) == 1
+
+
+async def test_record_visits_counts_unique_visitors(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that visitor hashes are merged into the visitor sketch across flushes"""
+    visited_at = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+    for visitor_hashes in ([1 << 60, 2 << 60, 1 << 60], [2 << 60, 3 << 60]):
+        visit_count = VisitCount(0, visited_at)
+        for visitor_hash in visitor_hashes:
+            visit_count.add(VisitCount.single(visited_at, visitor_hash))
+        await StatsService.record_visits({shortlink.id: visit_count}, session)
+
+    stats = await StatsService.get_stats_for_slug(shortlink.slug, session)
+
+    assert stats
+    assert stats.visits == 5
+    assert stats.unique_visitors == 3
+    # A few visitors are kept as a sparse sketch of their hashes rather than as registers
+    stat = await session.get(ShortlinkStat, shortlink.id)
+    assert stat and stat.visitor_sketch and len(stat.visitor_sketch) == 1 + 3 * 8
+
+
+async def test_record_visits_skips_unchanged_sketches(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that a sketch that returning visitors leave as it was isn't written again, unless its estimate was
+    capped by the number of visits"""
+    visited_at = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+    # Two visitors counted with a single visit, so the estimate is capped at one
+    visit_count = VisitCount(1, visited_at, visitor_hashes={1 << 60, 2 << 60})
+    await StatsService.record_visits({shortlink.id: visit_count}, session)
+    await StatsService.record_visits({shortlink.id: VisitCount(1, visited_at, visitor_hashes={1 << 60})}, session)
+
+    stats = await session.get(ShortlinkStat, shortlink.id)
+    assert stats and stats.unique_visitors == 2
+
+    stats.unique_visitors = 0
+    await session.commit()
+    await StatsService.record_visits({shortlink.id: VisitCount(1, visited_at, visitor_hashes={2 << 60})}, session)
+
+    await session.refresh(stats)
+    assert stats.unique_visitors == 0
+
+
+async def test_record_visits_without_visitors(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that visits from unknown visitors don't create a visitor sketch"""
+    await StatsService.record_visit(shortlink.id, datetime(2026, 1, 1, 12, 0, tzinfo=UTC), session)
+
+    stats = await session.get(ShortlinkStat, shortlink.id)
+
+    assert stats
+    assert stats.unique_visitors == 0
+    assert stats.visitor_sketch is None
+
+
+async def test_get_trending_stats(session: AsyncSession, shortlink_list: list[Shortlink]) -> None:
+    """Tests that trending shortlinks are ranked by their visits within the window, merged across flushes"""
+    now = datetime.now(UTC)
+    first, second, third = shortlink_list[:3]
+    await StatsService.record_visits({first.id: VisitCount(3, now), second.id: VisitCount(5, now)}, session)
+    await StatsService.record_visits({first.id: VisitCount(4, now)}, session)
+    await StatsService.record_visits({third.id: VisitCount(100, now - timedelta(minutes=10))}, session)
+
+    recent = await StatsService.get_top_stats(StatMetric.TRENDING, 10, session, window=5)
+    hourly = await StatsService.get_top_stats(StatMetric.TRENDING, 10, session, window=60)
+
+    assert [stats.slug for stats in recent] == [first.slug, second.slug]
+    assert [stats.slug for stats in hourly] == [third.slug, first.slug, second.slug]
+
+
+async def test_trending_visits_ranked_in_their_minute(session: AsyncSession, shortlink_list: list[Shortlink]) -> None:
+    """Tests that buffered visits are ranked in the minute each happened, not the minute of the latest one"""
+    now = datetime.now(UTC)
+    first, second = shortlink_list[:2]
+    old_visits = VisitCount(0, now)
+    for _ in range(10):
+        old_visits.add(VisitCount.single(now - timedelta(minutes=30)))
+    old_visits.add(VisitCount.single(now))
+    await StatsService.record_visits({first.id: old_visits, second.id: VisitCount(2, now)}, session)
+
+    recent = await StatsService.get_trending_stats(5, 10, session)
+
+    assert [stats.slug for stats in recent] == [second.slug, first.slug]
+
+
+async def test_compact_trending_summaries(session: AsyncSession, shortlink_list: list[Shortlink]) -> None:
+    """Tests that each flush adds its own trending summaries, which are merged into one per finished minute"""
+    now = datetime.now(UTC)
+    earlier = now - timedelta(minutes=10)
+    first, second = shortlink_list[:2]
+    for visits in (
+        {first.id: VisitCount(3, earlier)},
+        {second.id: VisitCount(5, earlier)},
+        {first.id: VisitCount(4, now)},
+    ):
+        await StatsService.record_visits(visits, session)
+    before = await StatsService.get_trending_stats(60, 10, session)
+
+    assert await StatsService.compact_trending_summaries(now - timedelta(minutes=2), session) == 1
+    assert await StatsService.compact_trending_summaries(now - timedelta(minutes=2), session) == 0
+
+    rows = (await session.exec(select(TrendingMinute.minute_start))).all()
+    assert sorted(rows) == [minute_start(earlier), minute_start(now)]
+    assert await StatsService.get_trending_stats(60, 10, session) == before
+    assert [stats.slug for stats in before] == [first.slug, second.slug]
+
+
+async def test_prune_trending_summaries(session: AsyncSession, shortlink: Shortlink) -> None:
+    """Tests that only trending summaries for minutes before the cutoff are pruned"""
+    now = datetime.now(UTC)
+    await StatsService.record_visits({shortlink.id: VisitCount(1, now - timedelta(hours=2))}, session)
+    await StatsService.record_visits({shortlink.id: VisitCount(1, now)}, session)
+
+    assert await StatsService.prune_trending_summaries(now - timedelta(hours=1), session) == 1
+    assert len(await StatsService.get_trending_stats(60, 10, session)) == 1
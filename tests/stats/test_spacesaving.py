@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+from uuid import UUID, uuid4
+
+import pytest
+
+from stats.spacesaving import SpaceSaving
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_counts_are_exact_under_capacity() -> None:
+    """Tests that keys are counted exactly while the summary has room for them"""
+    keys = [uuid4() for _ in range(3)]
+    summary = SpaceSaving(capacity=3)
+    summary.add(keys[0], 5)
+    summary.add(keys[1])
+    summary.add(keys[0])
+    summary.add(keys[2], 2)
+
+    assert summary.top(3) == [(keys[0], 6), (keys[2], 2), (keys[1], 1)]
+    assert summary.floor == 1
+
+
+async def test_heavy_hitters_survive_eviction() -> None:
+    """Tests that frequent keys are kept with counts that are never underestimated in a long tail of rare keys"""
+    generator = random.Random(1)
+    heavy = [uuid4() for _ in range(5)]
+    rare = [uuid4() for _ in range(5000)]
+    stream = heavy * 200 + [generator.choice(rare) for _ in range(5000)]
+    generator.shuffle(stream)
+    summary = SpaceSaving(capacity=50)
+    for key in stream:
+        summary.add(key)
+
+    exact = Counter(stream)
+    top = summary.top(5)
+
+    assert {key for key, _ in top} == set(heavy)
+    for key, count in top:
+        assert exact[key] <= count <= exact[key] + summary.errors[key]
+
+
+async def test_evicts_least_counted_key() -> None:
+    """Tests that a new key always replaces a least counted key, however the counts have grown since they were
+    added"""
+    generator = random.Random(2)
+    keys = [uuid4() for _ in range(500)]
+    summary = SpaceSaving(capacity=20)
+    for _ in range(5000):
+        least = min(summary.counts.values(), default=0)
+        key = generator.choice(keys)
+        evicted = len(summary) == summary.capacity and key not in summary.counts
+        summary.add(key, generator.randint(1, 5))
+
+        assert len(summary) <= summary.capacity
+        assert summary.floor == (min(summary.counts.values()) if len(summary) == summary.capacity else 0)
+        if evicted:
+            assert summary.errors[key] == least
+
+
+async def test_merge_adds_counts() -> None:
+    """Tests that merging summaries adds the counts of keys in both and keeps the most counted keys"""
+    shared, first_only, second_only = uuid4(), uuid4(), uuid4()
+    first = SpaceSaving(capacity=2)
+    first.add(shared, 3)
+    first.add(first_only, 1)
+    second = SpaceSaving(capacity=2)
+    second.add(shared, 2)
+    second.add(second_only, 4)
+
+    first.merge(second)
+
+    # Both summaries were full, so a key missing from one may have been counted up to its floor
+    assert first.counts == {shared: 5, second_only: 5}
+    assert first.errors[second_only] == 1
+
+
+async def test_serialization_round_trip() -> None:
+    """Tests that a summary can be loaded from its serialized form"""
+    summary = SpaceSaving(capacity=10)
+    for i in range(20):
+        summary.add(UUID(int=i), i)
+
+    loaded = SpaceSaving.from_bytes(summary.to_bytes())
+
+    assert loaded.capacity == 10
+    assert loaded.counts == summary.counts
+    assert loaded.errors == summary.errors
+
+
+async def test_capacity_must_be_positive() -> None:
+    """Tests that a summary must be able to count at least one key"""
+    with pytest.raises(ValueError, match="at least 1"):
+        SpaceSaving(capacity=0)